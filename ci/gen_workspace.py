@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+import argparse
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import yaml
+
+sys.path.append('.')
+
+from pkilib import log
+from pkilib import ssl
+from pkilib import synthetic
+
+
+# Various default values used as CLI arguments
+_d_cfgfile = './config/pki.yml'
+_d_templates = './templates'
+_d_size = 10000
+_d_seed = 0
+_d_ca_type = ssl.CA_AUTOSIGN
+_d_revoked_ratio = synthetic.REVOKED_RATIO
+_d_history = synthetic.HISTORY
+_d_domain = synthetic.DOMAIN
+
+
+def info(message):
+    print('[+] {0}'.format(message))
+
+
+def error(message):
+    print('[E] {0}'.format(message))
+    sys.exit(1)
+
+
+def gen_ca_certificate(ca):
+    """ gen_ca_certificate: Generate a small self-signed key and certificate
+                            for the CA, so CRLs can be generated
+    """
+    cmd = [
+        'openssl', 'req', '-x509', '-new', '-nodes',
+        '-config', ca.ca_data['cfg'], '-extensions', 'ca_reqext',
+        '-newkey', 'ec', '-pkeyopt', 'ec_paramgen_curve:prime256v1',
+        '-keyout', ca.ca_data['key'], '-out', ca.ca_data['crt'],
+        '-days', str(ca.ca_data['days']),
+    ]
+    subprocess.check_call(cmd, stdout=subprocess.DEVNULL,
+                          stderr=subprocess.DEVNULL)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Generate a CA workspace with synthetic certificates')
+    parser.add_argument('-f', dest='cfgfile', action='store',
+                        type=str, default=_d_cfgfile,
+                        help='Configuration file to use ({0})'.format(
+                            _d_cfgfile
+                        ))
+    parser.add_argument('-t', dest='templates', action='store',
+                        type=str, default=_d_templates,
+                        help='Directory containing the templates')
+    parser.add_argument('-w', dest='workspace', action='store',
+                        type=str, required=True,
+                        help='Location where to create the workspace')
+    parser.add_argument('-n', dest='size', action='store',
+                        type=int, default=_d_size,
+                        help='Number of certificates ({0})'.format(_d_size))
+    parser.add_argument('-s', dest='seed', action='store',
+                        type=int, default=_d_seed,
+                        help='Seed for the generator ({0})'.format(_d_seed))
+    parser.add_argument('-j', dest='workers', action='store',
+                        type=int, default=None,
+                        help='Number of processes writing certificates')
+    parser.add_argument('--ca-type', dest='ca_type', action='store',
+                        default=_d_ca_type,
+                        choices=[ssl.CA_ROOT, ssl.CA_INTERMEDIARY,
+                                 ssl.CA_AUTOSIGN],
+                        help='Type of CA to generate ({0})'.format(
+                            _d_ca_type
+                        ))
+    parser.add_argument('--hosts', dest='hosts', action='store',
+                        type=int, default=None,
+                        help='Number of hosts (a third of the certificates)')
+    parser.add_argument('--revoked', dest='revoked_ratio', action='store',
+                        type=float, default=_d_revoked_ratio,
+                        help='Fraction of revoked certificates ({0})'.format(
+                            _d_revoked_ratio
+                        ))
+    parser.add_argument('--history', dest='history', action='store',
+                        type=float, default=_d_history,
+                        help='Validity periods of history ({0})'.format(
+                            _d_history
+                        ))
+    parser.add_argument('--domain', dest='domain', action='store',
+                        type=str, default=_d_domain,
+                        help='Domain of the hosts ({0})'.format(_d_domain))
+    parser.add_argument('--now', dest='now', action='store',
+                        type=int, default=None,
+                        help='Generation time in seconds since the epoch')
+    parser.add_argument('--no-ca-cert', dest='ca_cert', action='store_false',
+                        default=True,
+                        help='Do not generate a key and certificate for '
+                        'the CA')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    log.LOGGER = logging.getLogger('gen_workspace')
+
+    config = yaml.safe_load(open(args.cfgfile, 'r').read())
+    config['common']['workspace'] = os.path.abspath(args.workspace)
+
+    if not os.path.exists(args.workspace):
+        os.makedirs(args.workspace)
+    templates = '{0}/templates'.format(args.workspace)
+    if not os.path.exists(templates):
+        shutil.copytree(args.templates, templates)
+
+    ca = ssl.OpenSSL(config, args.ca_type)
+    if not ca.setup_ca_structure():
+        error('Failed to setup CA structure for {0}'.format(
+            ca.ca_data['name']
+        ))
+
+    start = time.time()
+    records = synthetic.populate(
+        ca, args.size, seed=args.seed, hosts=args.hosts, now=args.now,
+        workers=args.workers, revoked_ratio=args.revoked_ratio,
+        history=args.history, domain=args.domain,
+    )
+    if not records:
+        error('Failed to generate certificates')
+
+    statuses = {}
+    for record in records:
+        statuses[record['status']] = statuses.get(record['status'], 0) + 1
+    info('Generated {0} certificates in {1:.1f}s ({2})'.format(
+        len(records), time.time() - start,
+        ', '.join(['{0}={1}'.format(status, statuses[status])
+                   for status in sorted(statuses)])
+    ))
+
+    if args.ca_cert:
+        gen_ca_certificate(ca)
+        info('Generated CA certificate {0}'.format(ca.ca_data['crt']))
@@ -20,14 +20,19 @@ def error(message):
 class PKIAPIThread(threading.Thread):
     _proc = None
 
-    def __init__(self, basedir):
+    def __init__(self, basedir, workspace=None, debug=True, extra_args=''):
         cfg = '{0}/config/pki.yml'.format(basedir)
         logging = '{0}/config/logging.yml'.format(basedir)
-        workspace = '{0}/workspace'.format(basedir)
-        self._cmd = '{0}/scripts/pkiapi -d -f {1} -l {2} -w {3}'.format(
+        if workspace is None:
+            workspace = '{0}/workspace'.format(basedir)
+        self._cmd = '{0}/scripts/pkiapi -f {1} -l {2} -w {3}'.format(
             basedir, cfg, logging, workspace
         )
         self._cmd += ' -i 127.0.0.1'
+        if debug:
+            self._cmd += ' -d'
+        if extra_args:
+            self._cmd += ' {0}'.format(extra_args)
         threading.Thread.__init__(self)
         self.setDaemon(True)
         self.start()
@@ -38,6 +43,12 @@ class PKIAPIThread(threading.Thread):
         self._proc = subprocess.Popen(cmd)
         self._proc.wait()
 
+    @property
+    def pid(self):
+        if not self._proc:
+            return None
+        return self._proc.pid
+
     def stop(self):
         if not self._proc:
             return
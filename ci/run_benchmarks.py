@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+import yaml
+
+sys.path.append('.')
+
+from pkilib import benchmark
+from pkilib import indexfile
+from pkilib import log
+from pkilib import ssl
+from pkilib import synthetic
+from pkilib.server import checks
+from pkilib.server import tokens
+
+
+# Various default values used as CLI arguments
+_d_cfgfile = './config/pki.yml'
+_d_templates = './templates'
+_d_sizes = '1000,10000,100000'
+_d_repeat = benchmark.REPEAT
+_d_threshold = benchmark.THRESHOLD
+_d_certs = 50
+_d_renders = 1000
+
+
+# Base values used for synthetic certificate data
+SUBJECT = '/C=NL/ST=Province/L=City/O=Test/OU=Autosign/CN={0}'
+NOTAFTER = '250720010135Z'
+
+
+def info(message):
+    print('[+] {0}'.format(message))
+
+
+def error(message):
+    print('[E] {0}'.format(message))
+    sys.exit(1)
+
+
+def fqdn(i):
+    return 'host{0}.rack{1}.example.com'.format(i, i % 100)
+
+
+def serial(i):
+    return '{0:06X}'.format(i + 1)
+
+
+def db_line(i):
+    status = 'V'
+    revoked = ''
+    if i % 10 == 0:
+        status = 'R'
+        revoked = '160720010135Z'
+    return '\t'.join([status, NOTAFTER, revoked, serial(i), 'unknown',
+                      SUBJECT.format(fqdn(i))])
+
+
+class Workspace:
+    """ Workspace:  Synthetic autosign CA workspace used by the benchmarks
+    """
+    def __init__(self, cfgfile, templates):
+        self.basedir = tempfile.mkdtemp(prefix='pkibench-')
+        shutil.copytree(templates, '{0}/templates'.format(self.basedir))
+
+        config = yaml.safe_load(open(cfgfile, 'r').read())
+        config['common']['workspace'] = self.basedir
+        self.ca = ssl.OpenSSL(config, ssl.CA_AUTOSIGN)
+        for directory in ['certs', 'db']:
+            os.makedirs('{0}/{1}'.format(self.ca.ca_data['basedir'],
+                                         directory))
+
+    def populate(self, size, certs):
+        """ populate:   Write a database with size synthetic entries, and
+                        certificates for the first certs entries
+        """
+        records = synthetic.gen_records(size, subject={'O': 'Test'})
+        lines = [synthetic.db_line(record) for record in records]
+        open(self.ca.ca_data['db'], 'w').write('\n'.join(lines) + '\n')
+
+        certsdir = self.ca.ca_data['certsdir']
+        for fname in os.listdir(certsdir):
+            os.unlink('{0}/{1}'.format(certsdir, fname))
+        synthetic.write_certificates((certsdir, {'CN': 'Test CA'},
+                                      records[:certs]))
+
+    def cleanup(self):
+        shutil.rmtree(self.basedir)
+
+
+def bench_parse_subject(ws, size, args):
+    subjects = [SUBJECT.format(fqdn(i)) for i in range(size)]
+
+    def run():
+        for subject in subjects:
+            ssl.OpenSSL.parse_subject(subject)
+    return run, size
+
+
+def bench_parse_db_line(ws, size, args):
+    lines = [db_line(i) for i in range(size)]
+
+    def run():
+        for line in lines:
+            ws.ca.parse_db_line(line)
+    return run, size
+
+
+def bench_update_cert_db(ws, size, args):
+    ws.populate(size, args.certs)
+    return ws.ca.update_cert_db, size
+
+
+def bench_index_records(ws, size, args):
+    ws.populate(size, 0)
+    reader = indexfile.IndexReader(ws.ca.ca_data['db'])
+
+    def run():
+        for record in reader.records(offset=0):
+            pass
+    return run, size
+
+
+def bench_index_fields(ws, size, args):
+    ws.populate(size, 0)
+    reader = indexfile.IndexReader(ws.ca.ca_data['db'])
+
+    def run():
+        for fields in reader.fields(['status', 'serial'], offset=0):
+            pass
+    return run, size
+
+
+def store_data(size):
+    token = 'a' * 64
+    return dict([(fqdn(i), token) for i in range(size)])
+
+
+def bench_tokenstore_load(ws, size, args):
+    store = tokens.TokenStore('{0}/tokens.json'.format(ws.basedir))
+    store._store = store_data(size)
+    store.save()
+    return store.load, size
+
+
+def bench_tokenstore_save(ws, size, args):
+    store = tokens.TokenStore('{0}/tokens.json'.format(ws.basedir))
+    store._store = store_data(size)
+    return store.save, size
+
+
+def bench_tokenstore_validate(ws, size, args):
+    store = tokens.TokenStore('{0}/tokens.json'.format(ws.basedir))
+    store._store = store_data(size)
+    token = 'a' * 64
+
+    def run():
+        for i in range(size):
+            store.validate(fqdn(i), token)
+    return run, size
+
+
+def bench_valid_fqdn(ws, size, args):
+    names = [fqdn(i) for i in range(size)]
+
+    def run():
+        for name in names:
+            checks.valid_fqdn(name)
+    return run, size
+
+
+def bench_gen_server_cfg(ws, size, args):
+    renders = min(size, args.renders)
+    names = ['host{0}.example.com'.format(i) for i in range(renders)]
+
+    def run():
+        for name in names:
+            ws.ca.gen_server_cfg(name)
+    return run, renders
+
+
+BENCHMARKS = [
+    ('parse_subject', bench_parse_subject),
+    ('parse_db_line', bench_parse_db_line),
+    ('update_cert_db', bench_update_cert_db),
+    ('index_records', bench_index_records),
+    ('index_fields', bench_index_fields),
+    ('tokenstore_load', bench_tokenstore_load),
+    ('tokenstore_save', bench_tokenstore_save),
+    ('tokenstore_validate', bench_tokenstore_validate),
+    ('valid_fqdn', bench_valid_fqdn),
+    ('gen_server_cfg', bench_gen_server_cfg),
+]
+
+
+def run_benchmarks(args):
+    sizes = [int(size) for size in args.sizes.split(',')]
+    selected = args.benchmarks or [name for name, func in BENCHMARKS]
+
+    ws = Workspace(args.cfgfile, args.templates)
+    results = {}
+    try:
+        for name, func in BENCHMARKS:
+            if name not in selected:
+                continue
+            for size in sizes:
+                run, ops = func(ws, size, args)
+                key = '{0}/{1}'.format(name, size)
+                results[key] = benchmark.measure(run, ops=ops,
+                                                 repeat=args.repeat)
+                results[key]['size'] = size
+                info('{0}: {1:.3g}s per op ({2} ops)'.format(
+                    key, results[key]['per_op'], ops
+                ))
+    finally:
+        ws.cleanup()
+    return results
+
+
+def show_comparison(old, new, threshold):
+    rows = benchmark.compare(old, new, threshold=threshold)
+    print(benchmark.format_table(
+        ['benchmark', 'old (s/op)', 'new (s/op)', 'ratio', 'regression'],
+        rows
+    ))
+    regressions = [row[0] for row in rows if row[4]]
+    if regressions:
+        error('{0} regression(s) found: {1}'.format(
+            len(regressions), ', '.join(regressions)
+        ))
+    info('No regressions found')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Run the pkilib micro benchmarks')
+    parser.add_argument('-f', dest='cfgfile', action='store',
+                        type=str, default=_d_cfgfile,
+                        help='Configuration file to use ({0})'.format(
+                            _d_cfgfile
+                        ))
+    parser.add_argument('-t', dest='templates', action='store',
+                        type=str, default=_d_templates,
+                        help='Directory containing the templates')
+    parser.add_argument('-s', dest='sizes', action='store',
+                        type=str, default=_d_sizes,
+                        help='Comma-separated dataset sizes ({0})'.format(
+                            _d_sizes
+                        ))
+    parser.add_argument('-r', dest='repeat', action='store',
+                        type=int, default=_d_repeat,
+                        help='Number of runs per benchmark ({0})'.format(
+                            _d_repeat
+                        ))
+    parser.add_argument('-b', dest='benchmarks', action='append',
+                        choices=[name for name, func in BENCHMARKS],
+                        help='Only run this benchmark')
+    parser.add_argument('-o', dest='output', action='store', type=str,
+                        help='Write the results to this json file')
+    parser.add_argument('--baseline', dest='baseline', action='store',
+                        type=str, help='Compare the results with this file')
+    parser.add_argument('--compare', dest='compare', action='store',
+                        nargs=2, metavar=('OLD', 'NEW'),
+                        help='Compare two result files without running')
+    parser.add_argument('--threshold', dest='threshold', action='store',
+                        type=float, default=_d_threshold,
+                        help='Allowed slowdown before flagging ({0})'.format(
+                            _d_threshold
+                        ))
+    parser.add_argument('--certs', dest='certs', action='store',
+                        type=int, default=_d_certs,
+                        help='Certificates on disk for update_cert_db')
+    parser.add_argument('--renders', dest='renders', action='store',
+                        type=int, default=_d_renders,
+                        help='Maximum number of templates to render')
+    args = parser.parse_args()
+
+    # Only display warnings from pkilib
+    logging.basicConfig(level=logging.WARNING)
+    log.LOGGER = logging.getLogger('benchmark')
+
+    if args.compare:
+        old = benchmark.load_results(args.compare[0])
+        new = benchmark.load_results(args.compare[1])
+        if old is None or new is None:
+            error('Failed to load results')
+        show_comparison(old, new, args.threshold)
+        sys.exit(0)
+
+    results = run_benchmarks(args)
+
+    if args.output:
+        if not benchmark.save_results(args.output, results):
+            error('Failed to write {0}'.format(args.output))
+        info('Wrote results to {0}'.format(args.output))
+
+    if args.baseline:
+        old = benchmark.load_results(args.baseline)
+        if old is None:
+            error('Failed to load {0}'.format(args.baseline))
+        show_comparison(old, results, args.threshold)
@@ -0,0 +1,373 @@
+#!/usr/bin/env python
+
+import argparse
+import datetime
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.append('.')
+
+from pkilib import benchmark
+from pkilib import log
+from pkilib import utils
+
+try:
+    from cryptography import x509
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.hazmat.primitives.asymmetric import padding
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+    HAS_CRYPTOGRAPHY = True
+except ImportError:
+    HAS_CRYPTOGRAPHY = False
+
+
+# Various default values used as CLI arguments
+_d_keys = 'rsa2048,rsa3072,rsa4096,prime256v1,secp384r1'
+_d_hashes = 'sha256,sha384,sha512'
+_d_iterations = 3
+_d_repeat = benchmark.REPEAT
+
+# Operations measured for every combination of parameters
+OPERATIONS = ['keygen', 'csr', 'sign', 'crl', 'verify']
+
+# Number of certificates issued before the crl is generated
+REVOKED = 10
+
+# Minimal configuration used by openssl ca
+CA_CONFIG = """
+[ ca ]
+default_ca              = bench_ca
+
+[ bench_ca ]
+dir                     = {0}
+database                = $dir/index.txt
+serial                  = $dir/serial
+crlnumber               = $dir/crlnumber
+certificate             = $dir/ca.pem
+private_key             = $dir/ca.key
+new_certs_dir           = $dir/certs
+policy                  = policy_any
+default_days            = 365
+default_crl_days        = 7
+default_md              = {1}
+unique_subject          = no
+
+[ policy_any ]
+commonName              = supplied
+"""
+
+
+def info(message):
+    print('[+] {0}'.format(message))
+
+
+def error(message):
+    print('[E] {0}'.format(message))
+    sys.exit(1)
+
+
+def parse_key(name):
+    """ parse_key:  Convert a key name into a (type, parameter) tuple, eg
+                    rsa4096 into ('rsa', 4096) and prime256v1 into
+                    ('ec', 'prime256v1')
+    """
+    if name.startswith('rsa'):
+        return ('rsa', int(name[3:]))
+    return ('ec', name)
+
+
+class OpenSSLBackend:
+    """ OpenSSLBackend: Performs the operations by running the openssl
+                        binary through pkilib.utils.run, like pkilib does
+    """
+    name = 'openssl'
+
+    def __init__(self, workdir, key, digest):
+        self.workdir = workdir
+        self.key_type, self.key_param = key
+        self.digest = digest
+        self.cfg = '{0}/ca.cfg'.format(workdir)
+        self._seq = 0
+
+        os.makedirs('{0}/certs'.format(workdir))
+        open(self.cfg, 'w').write(CA_CONFIG.format(workdir, digest))
+        open('{0}/index.txt'.format(workdir), 'w').close()
+        open('{0}/serial'.format(workdir), 'w').write('01\n')
+        open('{0}/crlnumber'.format(workdir), 'w').write('01\n')
+
+        self.keygen(self.path('ca.key'))
+        utils.run([
+            'openssl', 'req', '-x509', '-new', '-key', self.path('ca.key'),
+            '-subj', '/CN=Benchmark CA', '-days', '3650',
+            '-{0}'.format(digest), '-out', self.path('ca.pem'),
+        ])
+        self.keygen(self.path('leaf.key'))
+        self.csr(self.path('leaf.csr'))
+        for serial in range(1, REVOKED + 1):
+            self.sign()
+            utils.run([
+                'openssl', 'ca', '-config', self.cfg, '-revoke',
+                '{0}/certs/{1:02X}.pem'.format(workdir, serial),
+            ])
+        self.sign(self.path('leaf.pem'))
+        for fname in ['ca.pem', 'leaf.csr', 'leaf.pem']:
+            if not os.path.exists(self.path(fname)):
+                raise RuntimeError('openssl failed to create {0}'.format(
+                    fname
+                ))
+
+    def path(self, fname):
+        return '{0}/{1}'.format(self.workdir, fname)
+
+    def tmpfile(self, suffix):
+        self._seq += 1
+        return self.path('tmp-{0}.{1}'.format(self._seq, suffix))
+
+    def keygen(self, fname=None):
+        if self.key_type == 'rsa':
+            options = ['-algorithm', 'RSA',
+                       '-pkeyopt', 'rsa_keygen_bits:{0}'.format(
+                           self.key_param
+                       )]
+        else:
+            options = ['-algorithm', 'EC',
+                       '-pkeyopt', 'ec_paramgen_curve:{0}'.format(
+                           self.key_param
+                       )]
+        utils.run(['openssl', 'genpkey'] + options +
+                  ['-out', fname or self.tmpfile('key')])
+
+    def csr(self, fname=None):
+        utils.run([
+            'openssl', 'req', '-new', '-key', self.path('leaf.key'),
+            '-subj', '/CN=bench.example.com', '-{0}'.format(self.digest),
+            '-out', fname or self.tmpfile('csr'),
+        ])
+
+    def sign(self, fname=None):
+        utils.run([
+            'openssl', 'ca', '-batch', '-notext', '-config', self.cfg,
+            '-md', self.digest, '-in', self.path('leaf.csr'),
+            '-out', fname or self.tmpfile('pem'),
+        ])
+
+    def crl(self):
+        utils.run([
+            'openssl', 'ca', '-gencrl', '-config', self.cfg,
+            '-md', self.digest, '-out', self.tmpfile('crl'),
+        ])
+
+    def verify(self):
+        utils.run([
+            'openssl', 'verify', '-CAfile', self.path('ca.pem'),
+            self.path('leaf.pem'),
+        ])
+
+
+class CryptographyBackend:
+    """ CryptographyBackend:    Performs the operations in-process using the
+                                cryptography package
+    """
+    name = 'cryptography'
+
+    def __init__(self, workdir, key, digest):
+        self.key_type, self.key_param = key
+        self.hash = getattr(hashes, digest.upper())
+        self.backend = default_backend()
+
+        self.ca_key = self.keygen()
+        self.ca_name = x509.Name([
+            x509.NameAttribute(NameOID.COMMON_NAME, 'Benchmark CA'),
+        ])
+        self.ca_cert = self.build_certificate(self.ca_name,
+                                              self.ca_key.public_key(), 1)
+        self.leaf_key = self.keygen()
+        self.leaf_csr = self.csr()
+        self.leaf_cert = self.sign()
+        self.revoked = [self.sign() for _ in range(REVOKED)]
+
+    def keygen(self):
+        if self.key_type == 'rsa':
+            return rsa.generate_private_key(
+                public_exponent=65537, key_size=self.key_param,
+                backend=self.backend
+            )
+        curve = {'prime256v1': ec.SECP256R1, 'secp384r1': ec.SECP384R1,
+                 'secp521r1': ec.SECP521R1}[self.key_param]
+        return ec.generate_private_key(curve(), backend=self.backend)
+
+    def csr(self):
+        builder = x509.CertificateSigningRequestBuilder().subject_name(
+            x509.Name([
+                x509.NameAttribute(NameOID.COMMON_NAME, 'bench.example.com'),
+            ])
+        )
+        return builder.sign(self.leaf_key, self.hash(), self.backend)
+
+    def build_certificate(self, subject, public_key, serial):
+        now = datetime.datetime.utcnow()
+        builder = x509.CertificateBuilder().subject_name(
+            subject
+        ).issuer_name(
+            self.ca_name
+        ).public_key(
+            public_key
+        ).serial_number(
+            serial
+        ).not_valid_before(
+            now
+        ).not_valid_after(
+            now + datetime.timedelta(days=365)
+        )
+        return builder.sign(self.ca_key, self.hash(), self.backend)
+
+    def sign(self):
+        return self.build_certificate(self.leaf_csr.subject,
+                                      self.leaf_csr.public_key(),
+                                      x509.random_serial_number())
+
+    def crl(self):
+        now = datetime.datetime.utcnow()
+        builder = x509.CertificateRevocationListBuilder().issuer_name(
+            self.ca_name
+        ).last_update(
+            now
+        ).next_update(
+            now + datetime.timedelta(days=7)
+        )
+        for cert in self.revoked:
+            builder = builder.add_revoked_certificate(
+                x509.RevokedCertificateBuilder().serial_number(
+                    cert.serial_number
+                ).revocation_date(now).build(self.backend)
+            )
+        return builder.sign(self.ca_key, self.hash(), self.backend)
+
+    def verify(self):
+        public_key = self.ca_cert.public_key()
+        cert = self.leaf_cert
+        if self.key_type == 'rsa':
+            public_key.verify(cert.signature, cert.tbs_certificate_bytes,
+                              padding.PKCS1v15(),
+                              cert.signature_hash_algorithm)
+        else:
+            public_key.verify(cert.signature, cert.tbs_certificate_bytes,
+                              ec.ECDSA(cert.signature_hash_algorithm))
+
+
+BACKENDS = [OpenSSLBackend]
+if HAS_CRYPTOGRAPHY:
+    BACKENDS.append(CryptographyBackend)
+
+
+def run_benchmarks(args):
+    keys = args.keys.split(',')
+    digests = args.hashes.split(',')
+    backends = [backend for backend in BACKENDS
+                if not args.backends or backend.name in args.backends]
+    operations = args.operations or OPERATIONS
+
+    results = {}
+    for backend in backends:
+        for key in keys:
+            for digest in digests:
+                workdir = tempfile.mkdtemp(prefix='pkicrypto-')
+                try:
+                    impl = backend(workdir, parse_key(key), digest)
+                    for operation in operations:
+                        # Key generation does not depend on the hash
+                        if operation == 'keygen' and digest != digests[0]:
+                            continue
+                        func = getattr(impl, operation)
+
+                        def run():
+                            for _ in range(args.iterations):
+                                func()
+                        name = '{0}/{1}/{2}/{3}'.format(
+                            backend.name, key,
+                            '-' if operation == 'keygen' else digest,
+                            operation
+                        )
+                        results[name] = benchmark.measure(
+                            run, ops=args.iterations, repeat=args.repeat
+                        )
+                        info('{0}: {1:.2f}ms per op'.format(
+                            name, results[name]['per_op'] * 1000
+                        ))
+                finally:
+                    shutil.rmtree(workdir)
+    return results
+
+
+def show_results(results):
+    """ show_results:   Display the results as a table, together with the
+                        cost relative to the first key and hash of the same
+                        backend and operation
+    """
+    baselines = {}
+    rows = []
+    for name in sorted(results, key=lambda name: (
+            name.split('/')[0], OPERATIONS.index(name.split('/')[3]))):
+        backend, key, digest, operation = name.split('/')
+        per_op = results[name]['per_op']
+        baseline = baselines.setdefault((backend, operation), per_op)
+        rows.append((backend, operation, key, digest, per_op * 1000,
+                     results[name]['ops_per_sec'], per_op / baseline))
+    print(benchmark.format_table(
+        ['backend', 'operation', 'key', 'hash', 'ms/op', 'ops/s',
+         'relative'],
+        rows
+    ))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark the cost of the crypto parameters')
+    parser.add_argument('-k', dest='keys', action='store',
+                        type=str, default=_d_keys,
+                        help='Comma-separated key types ({0})'.format(_d_keys))
+    parser.add_argument('-H', dest='hashes', action='store',
+                        type=str, default=_d_hashes,
+                        help='Comma-separated hashes ({0})'.format(_d_hashes))
+    parser.add_argument('-b', dest='backends', action='append',
+                        choices=[backend.name for backend in BACKENDS],
+                        help='Only use this backend')
+    parser.add_argument('-O', dest='operations', action='append',
+                        choices=OPERATIONS,
+                        help='Only measure this operation')
+    parser.add_argument('-n', dest='iterations', action='store',
+                        type=int, default=_d_iterations,
+                        help='Operations per run ({0})'.format(_d_iterations))
+    parser.add_argument('-r', dest='repeat', action='store',
+                        type=int, default=_d_repeat,
+                        help='Number of runs per benchmark ({0})'.format(
+                            _d_repeat
+                        ))
+    parser.add_argument('-o', dest='output', action='store', type=str,
+                        help='Write the results to this json file')
+    args = parser.parse_args()
+
+    # Only display warnings from pkilib
+    logging.basicConfig(level=logging.WARNING)
+    log.LOGGER = logging.getLogger('benchmark')
+
+    if not HAS_CRYPTOGRAPHY:
+        info('cryptography is not installed, skipping the in-process backend')
+
+    try:
+        results = run_benchmarks(args)
+    except RuntimeError as err:
+        error(err)
+    print('')
+    show_results(results)
+
+    if args.output:
+        if not benchmark.save_results(args.output, results):
+            error('Failed to write {0}'.format(args.output))
+        info('Wrote results to {0}'.format(args.output))
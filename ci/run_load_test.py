@@ -0,0 +1,516 @@
+#!/usr/bin/env python
+
+import argparse
+import hashlib
+import http.client
+import http.server
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import yaml
+
+sys.path.append('.')
+sys.path.append('./ci')
+
+from pkilib import benchmark
+from run_api_and_client import PKIAPIThread
+
+
+# Various default values used as CLI arguments
+_d_workspace = './workspace'
+_d_clients = 10
+_d_rate = 5.0
+_d_duration = 60
+_d_timeout = 120
+_d_startup = 30
+_d_interval = 1.0
+
+# Ports used by pkiapi and the validator api of the clients
+API_PORT = 4392
+VALIDATOR_PORT = 4393
+
+# Routes exercised by the simulated clients
+ROUTES = ['/v1/token', '/v1/sign', '/v1/revoke']
+
+
+def info(message):
+    print('[+] {0}'.format(message))
+
+
+def error(message):
+    print('[E] {0}'.format(message))
+    sys.exit(1)
+
+
+def client_address(idx):
+    """ client_address: Loopback address used as source address and fqdn of
+                        a simulated client. Every client gets its own
+                        address, so the source ip checks of pkiapi pass
+                        without permissive mode. The last octet has two
+                        digits at least, since valid_fqdn rejects a name
+                        ending in a single character label
+    """
+    return '127.1.{0}.{1}'.format(idx // 200, idx % 200 + 10)
+
+
+def wait_for_port(host, port, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return True
+        except socket.error:
+            time.sleep(0.1)
+    return False
+
+
+class ValidatorHandler(http.server.BaseHTTPRequestHandler):
+    """ ValidatorHandler:   Serves the initial token of the client whose
+                            address the request was sent to
+    """
+    def do_GET(self):
+        if self.path != '/v1/validate':
+            self.send_error(404)
+            return
+        address = self.connection.getsockname()[0]
+        token = self.server.tokens.get(address)
+        if token is None:
+            self.send_error(404)
+            return
+        body = token.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StandinValidator(threading.Thread):
+    """ StandinValidator:   Single validator api answering for all simulated
+                            clients, in place of one pkiclient per host
+    """
+    def __init__(self, port=VALIDATOR_PORT):
+        self.server = http.server.ThreadingHTTPServer(('', port),
+                                                      ValidatorHandler)
+        self.server.daemon_threads = True
+        self.server.tokens = {}
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.start()
+
+    def register(self, address):
+        token = hashlib.sha256(os.urandom(32)).hexdigest()
+        self.server.tokens[address] = token
+        return token
+
+    def run(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+
+
+class Results:
+    """ Results:    Thread-safe collection of the latencies and status codes
+                    per route
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.statuses = {}
+
+    def record(self, route, status, duration):
+        with self._lock:
+            self.latencies.setdefault(route, []).append(duration)
+            statuses = self.statuses.setdefault(route, {})
+            statuses[status] = statuses.get(status, 0) + 1
+
+    def errors(self, route):
+        return sum([count for status, count in self.statuses[route].items()
+                    if status is None or status >= 400])
+
+    def summary(self, elapsed):
+        summary = {}
+        for route in sorted(self.latencies):
+            stats = benchmark.summarize(self.latencies[route])
+            stats['errors'] = self.errors(route)
+            stats['throughput'] = stats['count'] / elapsed
+            stats['statuses'] = dict([
+                (str(status), count)
+                for status, count in self.statuses[route].items()
+            ])
+            summary[route] = stats
+        return summary
+
+
+class ResourceMonitor(threading.Thread):
+    """ ResourceMonitor:    Samples the cpu and memory usage of pkiapi from
+                            /proc. The cpu time includes the openssl
+                            processes started by pkiapi
+    """
+    def __init__(self, pid, interval=_d_interval):
+        self._pid = pid
+        self._interval = interval
+        self._done = threading.Event()
+        self._tick = os.sysconf('SC_CLK_TCK')
+        self.samples = []
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+    def sample(self):
+        try:
+            stat = open('/proc/{0}/stat'.format(self._pid)).read()
+            status = open('/proc/{0}/status'.format(self._pid)).read()
+        except EnvironmentError:
+            return None
+
+        # The command name can contain spaces, so split after it
+        fields = stat[stat.rindex(')') + 2:].split()
+        cpu = sum([int(value) for value in fields[11:15]]) / self._tick
+        sample = {'time': time.time(), 'cpu': cpu}
+        for line in status.split('\n'):
+            if line.startswith('VmRSS:'):
+                sample['rss'] = int(line.split()[1]) * 1024
+            elif line.startswith('Threads:'):
+                sample['threads'] = int(line.split()[1])
+        return sample
+
+    def run(self):
+        while not self._done.is_set():
+            sample = self.sample()
+            if sample:
+                self.samples.append(sample)
+            self._done.wait(self._interval)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        sample = self.sample()
+        if sample:
+            self.samples.append(sample)
+
+    def summary(self):
+        if len(self.samples) < 2:
+            return None
+        first = self.samples[0]
+        last = self.samples[-1]
+        cpu = last['cpu'] - first['cpu']
+        return {
+            'cpu_seconds': cpu,
+            'cpu_percent': 100.0 * cpu / max(last['time'] - first['time'],
+                                             1e-9),
+            'peak_rss': max([sample.get('rss', 0)
+                             for sample in self.samples]),
+            'peak_threads': max([sample.get('threads', 0)
+                                 for sample in self.samples]),
+        }
+
+
+class SimulatedClient(threading.Thread):
+    """ SimulatedClient:    Bootstraps a token, and then repeatedly requests
+                            and revokes a certificate at a fixed interval
+    """
+    def __init__(self, idx, args, validator, results, start_time, keydir):
+        self.address = client_address(idx)
+        self._options = args
+        self._validator = validator
+        self._results = results
+        self._interval = args.clients / args.rate
+        self._next = start_time + idx / args.rate
+        self._deadline = start_time + args.duration
+        self._keydir = keydir
+        self.token = None
+        self.csr = None
+        self.iterations = 0
+        self.late = 0
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+    def request(self, method, route, payload):
+        conn = http.client.HTTPConnection(
+            '127.0.0.1', API_PORT, timeout=self._options.timeout,
+            source_address=(self.address, 0)
+        )
+        status = None
+        body = None
+        started = time.time()
+        try:
+            conn.request(method, route, body=json.dumps(payload),
+                         headers={'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            status = response.status
+            body = response.read().decode('utf-8')
+        except (socket.error, http.client.HTTPException):
+            pass
+        finally:
+            conn.close()
+        self._results.record(route, status, time.time() - started)
+        return status, body
+
+    def bootstrap(self):
+        payload = {
+            'fqdn': self.address,
+            'token': self._validator.register(self.address),
+        }
+        status, body = self.request('POST', '/v1/token', payload)
+        if status != 200:
+            return False
+        cfg = yaml.safe_load(body)
+        self.token = cfg['api']['token']
+
+        subject = '/C={0}/ST={1}/L={2}/O={3}/OU={4}/CN={5}'.format(
+            cfg['certs']['country'], cfg['certs']['province'],
+            cfg['certs']['city'], cfg['certs']['organization'],
+            cfg['certs']['unit'], self.address
+        )
+        key = '{0}/{1}.key'.format(self._keydir, self.address)
+        cmd = [
+            'openssl', 'req', '-new', '-nodes', '-subj', subject,
+            '-newkey', 'ec', '-pkeyopt', 'ec_paramgen_curve:prime256v1',
+            '-keyout', key,
+        ]
+        self.csr = subprocess.check_output(cmd, stderr=subprocess.DEVNULL)
+        self.csr = self.csr.decode('utf-8')
+        return True
+
+    def iteration(self):
+        payload = {
+            'fqdn': self.address,
+            'token': self.token,
+            'csr': self.csr,
+        }
+        status, body = self.request('POST', '/v1/sign', payload)
+        if status != 200 or self._options.no_revoke:
+            return
+        payload = {
+            'fqdn': self.address,
+            'token': self.token,
+        }
+        self.request('DELETE', '/v1/revoke', payload)
+
+    def run(self):
+        if not self.bootstrap():
+            return
+        while True:
+            now = time.time()
+            if self._next > now:
+                time.sleep(self._next - now)
+            elif now - self._next > self._interval:
+                # Do not burst to catch up, but count the missed slot
+                self.late += 1
+                self._next = now
+            if self._next >= self._deadline:
+                break
+            self.iteration()
+            self.iterations += 1
+            self._next += self._interval
+
+
+def scrape_metrics():
+    """ scrape_metrics: Fetch the openssl counters from the /metrics
+                        endpoint of pkiapi
+    """
+    conn = http.client.HTTPConnection('127.0.0.1', API_PORT, timeout=10)
+    try:
+        conn.request('GET', '/metrics')
+        data = conn.getresponse().read().decode('utf-8')
+    except (socket.error, http.client.HTTPException):
+        return {}
+    finally:
+        conn.close()
+
+    metrics = {}
+    for line in data.split('\n'):
+        if not line.startswith('pki_openssl_duration_seconds_'):
+            continue
+        name, value = line.rsplit(' ', 1)
+        metrics[name] = float(value)
+    return metrics
+
+
+def openssl_usage(before, after):
+    usage = {}
+    for name in after:
+        if not name.startswith('pki_openssl_duration_seconds_count'):
+            continue
+        operation = name.split('"')[1]
+        total = name.replace('_count', '_sum')
+        count = after[name] - before.get(name, 0)
+        if count:
+            usage[operation] = {
+                'count': int(count),
+                'seconds': after[total] - before.get(total, 0),
+            }
+    return usage
+
+
+def show_report(summary, resources, openssl, elapsed, args):
+    rows = []
+    for route in ROUTES:
+        if route not in summary:
+            continue
+        stats = summary[route]
+        rows.append((
+            route, stats['count'], stats['errors'],
+            100.0 * stats['errors'] / stats['count'],
+            stats['throughput'], stats['p50'] * 1000,
+            stats['p95'] * 1000, stats['p99'] * 1000,
+            stats['max'] * 1000,
+        ))
+    print(benchmark.format_table(
+        ['route', 'requests', 'errors', 'error %', 'req/s', 'p50 (ms)',
+         'p95 (ms)', 'p99 (ms)', 'max (ms)'],
+        rows
+    ))
+    print('')
+
+    for route in ROUTES:
+        if route in summary:
+            info('{0} status codes: {1}'.format(route, ', '.join([
+                '{0}={1}'.format(status, count) for status, count in
+                sorted(summary[route]['statuses'].items())
+            ])))
+
+    if openssl:
+        info('openssl: {0}'.format(', '.join([
+            '{0}={1} ({2:.3f}s avg)'.format(
+                operation, usage['count'], usage['seconds'] / usage['count']
+            ) for operation, usage in sorted(openssl.items())
+        ])))
+
+    if resources:
+        info('pkiapi: {0:.1f} cpu seconds ({1:.0f}%), peak rss {2:.1f} MiB, '
+             '{3} threads'.format(
+                 resources['cpu_seconds'], resources['cpu_percent'],
+                 resources['peak_rss'] / 1048576.0,
+                 resources['peak_threads']))
+
+    if '/v1/sign' in summary:
+        info('Signed {0:.2f} certificates per second (target {1:.2f})'.format(
+            summary['/v1/sign']['count'] / elapsed, args.rate
+        ))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Run a load test against a local pkiapi')
+    parser.add_argument('-w', dest='workspace', action='store',
+                        type=str, default=_d_workspace,
+                        help='Initialized workspace to use ({0})'.format(
+                            _d_workspace
+                        ))
+    parser.add_argument('-c', dest='clients', action='store',
+                        type=int, default=_d_clients,
+                        help='Number of simulated clients ({0})'.format(
+                            _d_clients
+                        ))
+    parser.add_argument('-r', dest='rate', action='store',
+                        type=float, default=_d_rate,
+                        help='Target signing requests per second ({0})'.format(
+                            _d_rate
+                        ))
+    parser.add_argument('-d', dest='duration', action='store',
+                        type=float, default=_d_duration,
+                        help='Duration of the test in seconds ({0})'.format(
+                            _d_duration
+                        ))
+    parser.add_argument('-o', dest='output', action='store', type=str,
+                        help='Write the results to this json file')
+    parser.add_argument('--timeout', dest='timeout', action='store',
+                        type=float, default=_d_timeout,
+                        help='Timeout of a single request ({0})'.format(
+                            _d_timeout
+                        ))
+    parser.add_argument('--no-revoke', dest='no_revoke', action='store_true',
+                        default=False,
+                        help='Do not revoke the issued certificates')
+    parser.add_argument('--api-args', dest='api_args', action='store',
+                        type=str, default='',
+                        help='Extra arguments passed to pkiapi')
+    parser.add_argument('--debug', dest='debug', action='store_true',
+                        default=False, help='Run pkiapi with debugging')
+    args = parser.parse_args()
+
+    if args.clients < 1 or args.rate <= 0:
+        error('Need at least one client and a positive rate')
+
+    basedir = os.getcwd()
+    workspace = os.path.abspath(args.workspace)
+    if not os.path.exists(workspace):
+        error('{0} does not exist'.format(workspace))
+
+    info('Starting stand-in validator on port {0}'.format(VALIDATOR_PORT))
+    validator = StandinValidator()
+
+    info('Starting pkiapi')
+    pkiapi = PKIAPIThread(basedir, workspace=workspace, debug=args.debug,
+                          extra_args=args.api_args)
+    if not wait_for_port('127.0.0.1', API_PORT, _d_startup):
+        pkiapi.stop()
+        error('pkiapi did not start within {0}s'.format(_d_startup))
+
+    keydir = tempfile.mkdtemp(prefix='pkiload-')
+    results = Results()
+    monitor = ResourceMonitor(pkiapi.pid)
+    before = scrape_metrics()
+
+    info('Running {0} clients at {1} signing requests/s for {2}s'.format(
+        args.clients, args.rate, args.duration
+    ))
+    monitor.start()
+    start_time = time.time() + 1.0
+    clients = [SimulatedClient(idx, args, validator, results, start_time,
+                               keydir)
+               for idx in range(args.clients)]
+    random.shuffle(clients)
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.time() - start_time
+    monitor.stop()
+    after = scrape_metrics()
+
+    pkiapi.stop()
+    validator.stop()
+    shutil.rmtree(keydir)
+
+    bootstrapped = len([client for client in clients if client.token])
+    if bootstrapped < len(clients):
+        info('{0} of {1} clients failed to bootstrap'.format(
+            len(clients) - bootstrapped, len(clients)
+        ))
+    late = sum([client.late for client in clients])
+    if late:
+        info('Clients missed {0} scheduled requests'.format(late))
+
+    summary = results.summary(elapsed)
+    resources = monitor.summary()
+    openssl = openssl_usage(before, after)
+    show_report(summary, resources, openssl, elapsed, args)
+
+    if args.output:
+        data = {
+            'config': {
+                'clients': args.clients,
+                'rate': args.rate,
+                'duration': args.duration,
+            },
+            'elapsed': elapsed,
+            'routes': summary,
+            'server': resources,
+            'openssl': openssl,
+        }
+        if not benchmark.save_results(args.output, data):
+            error('Failed to write {0}'.format(args.output))
+        info('Wrote results to {0}'.format(args.output))
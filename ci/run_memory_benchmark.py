@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+import argparse
+import hashlib
+import logging
+import sys
+
+sys.path.append('.')
+
+from pkilib import benchmark
+from pkilib import log
+from pkilib import records
+from pkilib import synthetic
+
+
+# Various default values used as CLI arguments
+_d_sizes = '1000,10000,100000'
+_d_ratio = 5.0
+
+
+# Base values used for synthetic certificate data
+SUBJECT = {
+    'C': 'NL',
+    'ST': 'Province',
+    'L': 'City',
+    'O': 'Test',
+    'OU': 'Autosign',
+}
+
+
+def info(message):
+    print('[+] {0}'.format(message))
+
+
+def error(message):
+    print('[E] {0}'.format(message))
+    sys.exit(1)
+
+
+def fingerprint(serial):
+    digest = hashlib.sha1(serial.encode('utf-8')).hexdigest().upper()
+    return ':'.join([digest[i:i + 2] for i in range(0, len(digest), 2)])
+
+
+def parse_subject(raw_subject):
+    """ parse_subject:  Parse a subject the way CertificateDB did before
+                        CertRecord was introduced
+    """
+    if raw_subject.startswith('/'):
+        raw_subject = raw_subject[1:]
+    subject = {}
+    for field in raw_subject.split('/'):
+        k, v = field.split('=')
+        subject[k] = v
+    return subject
+
+
+def dict_db(lines):
+    """ dict_db:    Build the certificate database the way
+                    CertificateDB.refresh() did before CertRecord was
+                    introduced, with a dictionary per certificate and per
+                    subject. The path of the certificate is left out, so
+                    the comparison is conservative
+    """
+    data = {}
+    for line in lines:
+        line = line.strip()
+        t = line.split('\t')
+        subject = parse_subject(t[5])
+        if not subject['CN'] in data:
+            data[subject['CN']] = []
+        data[subject['CN']].append({
+            'status': t[0],
+            'notbefore': t[1],
+            'notafter': t[2],
+            'serial': t[3],
+            'subject': subject,
+        })
+    for certs in data.values():
+        for cert in certs:
+            cert['fingerprint'] = fingerprint(cert['serial'])
+    return data
+
+
+def record_db(lines):
+    """ record_db:  Build the certificate database using CertRecord
+    """
+    data = {}
+    for line in lines:
+        record = records.CertRecord.from_line(line)
+        record.fingerprint = fingerprint(record['serial'])
+        data.setdefault(record.cn, []).append(record)
+    return data
+
+
+def run_benchmark(sizes, ratio):
+    rows = []
+    failed = []
+    for size in sizes:
+        lines = [synthetic.db_line(record) + '\n' for record in
+                 synthetic.gen_records(size, subject=SUBJECT)]
+        old = benchmark.measure_memory(lambda: dict_db(lines))
+        new = benchmark.measure_memory(lambda: record_db(lines))
+        reduction = old['bytes'] / float(max(1, new['bytes']))
+        rows.append([
+            str(size),
+            '{0:.1f}'.format(old['bytes'] / 1048576.0),
+            '{0:.1f}'.format(new['bytes'] / 1048576.0),
+            '{0:.0f}'.format(old['bytes'] / float(size)),
+            '{0:.0f}'.format(new['bytes'] / float(size)),
+            '{0:.2f}x'.format(reduction),
+        ])
+        if reduction < ratio:
+            failed.append(str(size))
+    print(benchmark.format_table(
+        ['size', 'dicts (MB)', 'records (MB)', 'dicts (B/cert)',
+         'records (B/cert)', 'reduction'],
+        rows
+    ))
+    return failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compare the memory used by the certificate database')
+    parser.add_argument('-s', dest='sizes', action='store',
+                        type=str, default=_d_sizes,
+                        help='Comma-separated dataset sizes ({0})'.format(
+                            _d_sizes
+                        ))
+    parser.add_argument('--ratio', dest='ratio', action='store',
+                        type=float, default=_d_ratio,
+                        help='Minimum memory reduction ({0})'.format(
+                            _d_ratio
+                        ))
+    args = parser.parse_args()
+
+    # Only display warnings from pkilib
+    logging.basicConfig(level=logging.WARNING)
+    log.LOGGER = logging.getLogger('benchmark')
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    failed = run_benchmark(sizes, args.ratio)
+    if failed:
+        error('Less than {0}x reduction for size(s) {1}'.format(
+            args.ratio, ', '.join(failed)
+        ))
+    info('Memory reduced at least {0}x for all sizes'.format(args.ratio))
@@ -0,0 +1,278 @@
+"""
+.. module:: benchmark
+   :platform: Unix, VMS
+   :synopsis: Helpers to time code, store the results and compare runs
+
+.. moduleauthor:: Lex van Roon <r3boot@r3blog.nl>
+"""
+import gc
+import json
+import math
+import os
+import platform
+import time
+import tracemalloc
+
+import pkilib.log as log
+
+
+# Default number of times a benchmark is repeated
+REPEAT = 3
+
+# Default fraction by which a benchmark may slow down before it is flagged
+THRESHOLD = 0.1
+
+
+def percentile(values, pct):
+    """Calculate a percentile of a list of values, using linear
+    interpolation between the closest ranks. It will return None if values
+    is empty.
+
+    >>> percentile([1, 2, 3, 4], 50)
+    2.5
+
+    :param values:  List containing the values
+    :type  values:  list
+    :param pct:     Percentile to calculate, between 0 and 100
+    :type  pct:     float
+    :returns:       The percentile or None
+    :rtype:         float, None
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = (len(values) - 1) * pct / 100.0
+    lower = int(math.floor(rank))
+    upper = int(math.ceil(rank))
+    if lower == upper:
+        return float(values[lower])
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+def summarize(values):
+    """Calculate the statistics for a list of timings
+
+    :param values:  List containing the timings in seconds
+    :type  values:  list
+    :returns:       Dictionary containing the statistics or None
+    :rtype:         dict, None
+    """
+    if not values:
+        return None
+    mean = sum(values) / len(values)
+    variance = sum([(value - mean) ** 2 for value in values]) / len(values)
+    return {
+        'count': len(values),
+        'min': min(values),
+        'max': max(values),
+        'mean': mean,
+        'stdev': math.sqrt(variance),
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+    }
+
+
+def measure(func, ops=1, repeat=REPEAT):
+    """Time func a number of times. Every call of func is expected to
+    perform ops operations, which is used to calculate the time spent per
+    operation.
+
+    >>> measure(lambda: [parse_subject(s) for s in subjects], ops=1000)
+    {'ops': 1000, 'repeat': 3, 'min': 0.0021, 'median': 0.0022, ...}
+
+    :param func:    Function to time
+    :type  func:    function
+    :param ops:     Number of operations performed by one call of func
+    :type  ops:     int
+    :param repeat:  Number of times to call func
+    :type  repeat:  int
+    :returns:       Dictionary containing the timings
+    :rtype:         dict
+    """
+    timings = []
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    stats = summarize(timings)
+    median = stats['p50']
+    return {
+        'ops': ops,
+        'repeat': len(timings),
+        'min': stats['min'],
+        'max': stats['max'],
+        'median': median,
+        'per_op': median / max(1, ops),
+        'ops_per_sec': ops / median if median > 0 else None,
+    }
+
+
+def measure_memory(func):
+    """Measure the memory allocated by func which is still in use when it
+    returns, which is the size of the result of func and everything it
+    references. Python objects are tracked using tracemalloc.
+
+    >>> measure_memory(lambda: [parse_db_line(l) for l in lines])
+    {'bytes': 183400000, 'peak': 183500000}
+
+    :param func:    Function building the data to measure
+    :type  func:    function
+    :returns:       Dictionary containing the retained and peak bytes
+    :rtype:         dict
+    """
+    gc.collect()
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        result = func()
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+    del result
+    return {
+        'bytes': current - before,
+        'peak': peak - before,
+    }
+
+
+def environment():
+    """Describe the environment the benchmarks are running in
+
+    :returns:   Dictionary describing the environment
+    :rtype:     dict
+    """
+    return {
+        'created': int(time.time()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'hostname': platform.node(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def save_results(fname, results):
+    """Write a set of benchmark results to disk as json, together with a
+    description of the environment. It will return False if the file cannot
+    be written.
+
+    :param fname:   Path to the file to write
+    :type  fname:   str
+    :param results: Dictionary containing the results per benchmark
+    :type  results: dict
+    :returns:       True if the results were written, else False
+    :rtype:         bool
+    """
+    data = {
+        'environment': environment(),
+        'results': results,
+    }
+    try:
+        open(fname, 'w').write(json.dumps(data, indent=4, sort_keys=True))
+    except EnvironmentError as err:
+        log.warning('Failed to write {0}: {1}'.format(fname, err))
+        return False
+    return True
+
+
+def load_results(fname):
+    """Read a set of benchmark results written by save_results. It will
+    return None if the file cannot be read or parsed.
+
+    :param fname:   Path to the file to read
+    :type  fname:   str
+    :returns:       Dictionary containing the results per benchmark or None
+    :rtype:         dict, None
+    """
+    try:
+        data = json.loads(open(fname, 'r').read())
+    except EnvironmentError as err:
+        log.warning('Failed to read {0}: {1}'.format(fname, err))
+        return None
+    except ValueError:
+        log.warning('{0} does not contain json data'.format(fname))
+        return None
+
+    if not isinstance(data, dict) or 'results' not in data:
+        log.warning('{0} does not contain benchmark results'.format(fname))
+        return None
+    return data['results']
+
+
+def compare(old, new, threshold=THRESHOLD, key='per_op'):
+    """Compare two sets of benchmark results. A benchmark is flagged as a
+    regression if it became more than threshold slower. Benchmarks which
+    only exist in one of the sets are skipped.
+
+    >>> compare(load_results('old.json'), load_results('new.json'))
+    [('parse_subject/1000', 2.1e-06, 2.6e-06, 1.24, True)]
+
+    :param old:         Dictionary containing the baseline results
+    :type  old:         dict
+    :param new:         Dictionary containing the new results
+    :type  new:         dict
+    :param threshold:   Fraction by which a benchmark may slow down
+    :type  threshold:   float
+    :param key:         Name of the timing to compare
+    :type  key:         str
+    :returns:           List of (name, old, new, ratio, regressed) tuples
+    :rtype:             list
+    """
+    rows = []
+    for name in sorted(old):
+        if name not in new:
+            continue
+        old_value = old[name].get(key)
+        new_value = new[name].get(key)
+        if not old_value or new_value is None:
+            continue
+        ratio = new_value / old_value
+        rows.append((name, old_value, new_value, ratio,
+                     ratio > 1 + threshold))
+    return rows
+
+
+def format_table(headers, rows):
+    """Format a list of rows as a plain-text table. Floats are displayed
+    with four significant digits.
+
+    >>> print(format_table(['name', 'time'], [('keygen', 0.1234567)]))
+    name    time
+    ------  ------
+    keygen  0.1235
+
+    :param headers: List containing the column headers
+    :type  headers: list
+    :param rows:    List containing a tuple of values per row
+    :type  rows:    list
+    :returns:       The formatted table
+    :rtype:         str
+    """
+    def fmt(value):
+        """Format a single value"""
+        if isinstance(value, bool):
+            return 'yes' if value else 'no'
+        if isinstance(value, float):
+            return '{0:.4g}'.format(value)
+        if value is None:
+            return '-'
+        return str(value)
+
+    cells = [[str(header) for header in headers]]
+    cells.extend([[fmt(value) for value in row] for row in rows])
+    widths = [max([len(row[idx]) for row in cells])
+              for idx in range(len(headers))]
+
+    lines = []
+    for idx, row in enumerate(cells):
+        lines.append('  '.join([value.ljust(widths[col])
+                                for col, value in enumerate(row)]).rstrip())
+        if idx == 0:
+            lines.append('  '.join(['-' * width for width in widths]))
+    return '\n'.join(lines)
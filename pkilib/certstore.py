@@ -0,0 +1,670 @@
+"""
+.. module:: certstore
+   :platform: Unix, VMS
+   :synopsis: Interchangeable backends storing the certificates of a CA
+
+.. moduleauthor:: Lex van Roon <r3boot@r3blog.nl>
+"""
+import bisect
+import os
+import sqlite3
+import threading
+
+from pkilib import indexfile
+from pkilib import log
+from pkilib import records
+
+
+# Names of the available backends, see new_store()
+BACKEND_FLATFILE = 'flatfile'
+BACKEND_SQLITE = 'sqlite'
+BACKEND_MEMORY = 'memory'
+BACKENDS = [BACKEND_FLATFILE, BACKEND_SQLITE, BACKEND_MEMORY]
+
+# Schema used by SQLiteStore. Serials are stored as formatted hexadecimal
+# strings, since random serials do not fit into an sqlite integer
+SQLITE_SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS certs (serial TEXT PRIMARY KEY, '
+    'status TEXT NOT NULL, notafter INTEGER NOT NULL, revoked INTEGER, '
+    'reason TEXT, cn TEXT NOT NULL, subject TEXT NOT NULL, fingerprint TEXT)',
+    'CREATE INDEX IF NOT EXISTS certs_cn ON certs (cn)',
+    'CREATE INDEX IF NOT EXISTS certs_status ON certs (status)',
+    'CREATE INDEX IF NOT EXISTS certs_notafter ON certs (notafter)',
+    'CREATE INDEX IF NOT EXISTS certs_fingerprint ON certs (fingerprint)',
+    'CREATE INDEX IF NOT EXISTS certs_order ON certs (length(serial), serial)',
+]
+
+
+def serial_to_int(serial):
+    """Convert a serial in hexadecimal notation into an integer. Integers
+    are returned as is.
+
+    >>> serial_to_int('0A')
+    10
+
+    :param serial:  Serial to convert
+    :type  serial:  str, int
+    :returns:       The serial or None if it is invalid
+    :rtype:         int, None
+    """
+    if isinstance(serial, int):
+        return serial
+    if not isinstance(serial, str):
+        return None
+    try:
+        return int(serial, 16)
+    except ValueError:
+        return None
+
+
+def normalize_fingerprint(fingerprint):
+    """Convert a fingerprint with or without colons into the format used by
+    openssl, see records.normalize_fingerprint
+
+    :param fingerprint: Fingerprint to convert
+    :type  fingerprint: str
+    :returns:           The fingerprint or None if it is invalid
+    :rtype:             str, None
+    """
+    return records.normalize_fingerprint(fingerprint)
+
+
+def new_store(backend, db=None, path=None, loader=None, lock=None):
+    """Create a certificate store using one of BACKENDS:
+
+    * flatfile: the OpenSSL database in db, kept in memory
+    * sqlite: an sqlite database in path, which mirrors db if it is set
+    * memory: a store which only lives in memory, for use in tests
+
+    >>> store = new_store('sqlite', db='/path/to/index.txt',
+    ...                   path='/path/to/certs.sqlite')
+    >>> store.refresh()
+    True
+
+    It will return None if the backend is unknown or a required path is
+    missing.
+
+    :param backend: Name of the backend
+    :type  backend: str
+    :param db:      Path to the OpenSSL database
+    :type  db:      str
+    :param path:    Path to the sqlite database
+    :type  path:    str
+    :param loader:  Function resolving the details of a record lazily, see
+                    records.CertRecord.set_loader()
+    :type  loader:  function
+    :param lock:    Lock serializing changes to the OpenSSL database with
+                    openssl ca, used by the flatfile backend
+    :type  lock:    threading.Lock
+    :returns:       The store or None
+    :rtype:         CertStore, None
+    """
+    if backend == BACKEND_FLATFILE:
+        if db is None:
+            log.warning('The flatfile backend needs an OpenSSL database')
+            return None
+        return FlatFileStore(db, loader=loader, lock=lock)
+    elif backend == BACKEND_SQLITE:
+        if path is None:
+            log.warning('The sqlite backend needs a path')
+            return None
+        return SQLiteStore(path, db=db, loader=loader)
+    elif backend == BACKEND_MEMORY:
+        return MemoryStore(loader=loader)
+    log.warning('Unknown certificate store backend: {0}'.format(backend))
+    return None
+
+
+class CertStore(object):
+    """Interface implemented by all certificate stores. Certificates are
+    returned as records.CertRecord instances, and serials can be passed as
+    integers or in hexadecimal notation. The details which are not part of
+    the OpenSSL database, like the fingerprint, are resolved on first access
+    by the loader passed to the store.
+
+    :param loader:  Function resolving the details of a record lazily
+    :type  loader:  function
+    """
+    def __init__(self, loader=None):
+        self.loader = loader
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def __iter__(self):
+        return iter(self.list())
+
+    def refresh(self):
+        """Read the certificates which were added or changed by openssl
+        since the last refresh. Stores without a backing OpenSSL database
+        do not need this.
+
+        :returns:   True if the store changed, else False
+        :rtype:     bool
+        """
+        return False
+
+    def get(self, serial):
+        """Lookup a certificate by its serial
+
+        :param serial:  Serial of the certificate
+        :type  serial:  int, str
+        :returns:       The certificate or None if it is not found
+        :rtype:         records.CertRecord, None
+        """
+        raise NotImplementedError
+
+    def by_fingerprint(self, fingerprint):
+        """Lookup a certificate by its SHA1 fingerprint, which may be passed
+        with or without colons
+
+        :param fingerprint: Fingerprint of the certificate
+        :type  fingerprint: str
+        :returns:           The certificate or None if it is not found
+        :rtype:             records.CertRecord, None
+        """
+        raise NotImplementedError
+
+    def by_cn(self, common_name):
+        """Lookup all certificates issued for a CN, ordered by serial
+
+        :param common_name: CN of the certificates
+        :type  common_name: str
+        :returns:           List containing the certificates
+        :rtype:             list
+        """
+        raise NotImplementedError
+
+    def list(self, status=None, expires_before=None, after=None,
+             limit=None):
+        """List the certificates in the store ordered by serial, optionally
+        only those with a status or which expire before a date. Certificates
+        without a valid expiry date never expire before a date.
+
+        :param status:          Only list certificates with this status
+        :type  status:          str
+        :param expires_before:  Only list certificates which expire before
+                                this time, in seconds since the epoch
+        :type  expires_before:  int
+        :param after:           Only list certificates with a higher serial
+        :type  after:           int, str
+        :param limit:           Maximum number of certificates to list
+        :type  limit:           int
+        :returns:               List containing the certificates
+        :rtype:                 list
+        """
+        raise NotImplementedError
+
+    def append(self, record):
+        """Add a certificate to the store. It will return False if a
+        certificate with the same serial is in the store already.
+
+        :param record:  The certificate to add
+        :type  record:  records.CertRecord
+        :returns:       True if the certificate was added, else False
+        :rtype:         bool
+        """
+        raise NotImplementedError
+
+    def revoke(self, serial, revoked, reason=None):
+        """Mark a certificate as revoked. It will return False if the
+        certificate is not found.
+
+        :param serial:  Serial of the certificate
+        :type  serial:  int, str
+        :param revoked: Revocation date in seconds since the epoch
+        :type  revoked: int
+        :param reason:  Revocation reason
+        :type  reason:  str
+        :returns:       True if the certificate was revoked, else False
+        :rtype:         bool
+        """
+        raise NotImplementedError
+
+    def cert_db(self):
+        """Build a dictionary mapping every CN to a list of its certificates,
+        like OpenSSL.cert_db
+
+        :returns:   Dictionary containing the certificates
+        :rtype:     dict
+        """
+        data = {}
+        for record in self.list():
+            data.setdefault(record.cn, []).append(record)
+        return data
+
+
+class MemoryStore(CertStore):
+    """Store which keeps all certificates in memory. Declare a new instance
+    as follows:
+
+    >>> store = MemoryStore()
+    >>> store.append(records.CertRecord.from_line(line))
+    True
+    >>> store.get('0A')
+    <CertRecord 0A V some.host.name>
+
+    :param loader:  Function resolving the details of a record lazily
+    :type  loader:  function
+    """
+    def __init__(self, loader=None):
+        CertStore.__init__(self, loader=loader)
+        self._lock = threading.RLock()
+        self._clear()
+
+    def _clear(self):
+        self._by_serial = {}
+        self._by_cn = {}
+        self._by_fingerprint = None
+        self._serials = []
+
+    def _add(self, record):
+        if self.loader is not None and record.loaded and \
+                record.fingerprint is None:
+            record.set_loader(self.loader)
+        self._by_serial[record.serial] = record
+        self._by_cn.setdefault(record.cn, []).append(record)
+        self._by_fingerprint = None
+        # Serials are issued in order, so this nearly always appends
+        if not self._serials or record.serial > self._serials[-1]:
+            self._serials.append(record.serial)
+        else:
+            bisect.insort(self._serials, record.serial)
+
+    def __len__(self):
+        return len(self._by_serial)
+
+    def get(self, serial):
+        return self._by_serial.get(serial_to_int(serial))
+
+    def by_fingerprint(self, fingerprint):
+        fingerprint = normalize_fingerprint(fingerprint)
+        if fingerprint is None:
+            return None
+        with self._lock:
+            if self._by_fingerprint is None:
+                # Resolves the fingerprint of every record once
+                self._by_fingerprint = dict([
+                    (record.fingerprint, record)
+                    for record in list(self._by_serial.values())
+                    if record.fingerprint is not None
+                ])
+            return self._by_fingerprint.get(fingerprint)
+
+    def by_cn(self, common_name):
+        return list(self._by_cn.get(common_name, []))
+
+    def list(self, status=None, expires_before=None, after=None,
+             limit=None):
+        serials = self._serials
+        start = 0
+        if after is not None:
+            after = serial_to_int(after)
+            if after is None:
+                return []
+            start = bisect.bisect_right(serials, after)
+        certs = []
+        for serial in serials[start:]:
+            if limit is not None and len(certs) == limit:
+                break
+            record = self._by_serial[serial]
+            if status is not None and record.status != status:
+                continue
+            if expires_before is not None and \
+                    (record.notafter is None or
+                     record.notafter >= expires_before):
+                continue
+            certs.append(record)
+        return certs
+
+    def append(self, record):
+        with self._lock:
+            if record.serial in self._by_serial:
+                log.warning('Serial {0} is in the store already'.format(
+                    record['serial']))
+                return False
+            self._add(record)
+        return True
+
+    def revoke(self, serial, revoked, reason=None):
+        record = self.get(serial)
+        if record is None:
+            log.warning('Serial {0} is not in the store'.format(serial))
+            return False
+        record.mark_revoked(revoked, reason)
+        return True
+
+    def cert_db(self):
+        return dict([(cn, list(certs)) for cn, certs in self._by_cn.items()])
+
+
+class FlatFileStore(MemoryStore):
+    """Store backed by the OpenSSL database of a CA, which is kept in memory.
+    Refreshing only parses the lines which openssl appended since the last
+    refresh, unless the database was rewritten. Fingerprints which were
+    resolved already are kept when the database is rewritten. Since openssl
+    ca rewrites the database as well, the store only changes it while
+    holding lock, which should be the lock serializing the openssl ca
+    commands. Declare a new instance as follows:
+
+    >>> store = FlatFileStore('/path/to/index.txt')
+    >>> store.refresh()
+    True
+
+    :param db:      Path to the OpenSSL database
+    :type  db:      str
+    :param loader:  Function resolving the details of a record lazily
+    :type  loader:  function
+    :param lock:    Lock serializing changes to the database
+    :type  lock:    threading.Lock
+    """
+    def __init__(self, db, loader=None, lock=None):
+        MemoryStore.__init__(self, loader=loader)
+        self.db = db
+        self.lock = lock
+        if lock is None:
+            self.lock = threading.Lock()
+        self._reader = indexfile.IndexReader(db)
+
+    def refresh(self):
+        if not os.path.exists(self.db):
+            log.warning('{0} does not exist'.format(self.db))
+            return False
+        with self._lock:
+            changed = False
+            previous = {}
+            if self._reader.changed() or not self._by_serial:
+                changed = len(self._by_serial) > 0
+                previous = self._by_serial
+                self._clear()
+                offset = 0
+            else:
+                offset = None
+            for record in self._reader.records(offset=offset):
+                if record.serial in self._by_serial:
+                    log.warning('Serial {0} occurs more than once'.format(
+                        record['serial']))
+                    continue
+                old = previous.get(record.serial)
+                if old is not None and old.loaded and \
+                        old.notafter == record.notafter and \
+                        old.raw_subject == record.raw_subject:
+                    record.fingerprint = old.fingerprint
+                self._add(record)
+                changed = True
+        return changed
+
+    def append(self, record):
+        self.refresh()
+        with self._lock:
+            if record.serial in self._by_serial:
+                log.warning('Serial {0} is in the store already'.format(
+                    record['serial']))
+                return False
+            try:
+                with self.lock, open(self.db, 'a') as fdesc:
+                    fdesc.write(record.to_line() + '\n')
+            except EnvironmentError as err:
+                log.warning('Failed to update {0}: {1}'.format(self.db, err))
+                return False
+        self.refresh()
+        return True
+
+    def revoke(self, serial, revoked, reason=None):
+        self.refresh()
+        with self._lock:
+            record = self.get(serial)
+            if record is None:
+                log.warning('Serial {0} is not in the store'.format(serial))
+                return False
+            with self.lock:
+                lines = []
+                for line in self._reader.lines(offset=0):
+                    current = records.CertRecord.from_line(line)
+                    if current is not None and \
+                            current.serial == record.serial:
+                        current.mark_revoked(revoked, reason)
+                        line = current.to_line()
+                    lines.append(line + '\n')
+                if not indexfile.rewrite(self.db, lines):
+                    return False
+        self.refresh()
+        return True
+
+
+class SQLiteStore(CertStore):
+    """Store backed by an sqlite database, which keeps memory usage flat for
+    large CAs and indexes certificates by serial, CN, status, expiry and
+    fingerprint. If db is set, the store mirrors the OpenSSL database, which
+    remains authoritative: refresh() imports the lines which openssl appended
+    and, if the database was rewritten, synchronizes the whole store. Such a
+    store cannot be changed with append() or revoke(), since the changes
+    would be lost on the next synchronization.
+    Fingerprints which were resolved by the loader are stored as well, and
+    certificates whose fingerprint cannot be resolved are only tried once.
+    Declare a new instance as follows:
+
+    >>> store = SQLiteStore('/path/to/certs.sqlite', db='/path/to/index.txt')
+    >>> store.refresh()
+    True
+    >>> store.by_cn('some.host.name')
+    [<CertRecord 0A V some.host.name>]
+
+    :param path:    Path to the sqlite database
+    :type  path:    str
+    :param db:      Path to the OpenSSL database to mirror
+    :type  db:      str
+    :param loader:  Function resolving the details of a record lazily
+    :type  loader:  function
+    """
+    def __init__(self, path, db=None, loader=None):
+        CertStore.__init__(self, loader=loader)
+        self.path = path
+        self.db = db
+        self._reader = None
+        if db is not None:
+            self._reader = indexfile.IndexReader(db)
+        self._unresolved = set()
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            for statement in SQLITE_SCHEMA:
+                self._conn.execute(statement)
+
+    def close(self):
+        """Close the connection to the sqlite database"""
+        with self._lock:
+            self._conn.close()
+
+    def _record(self, row):
+        status, notafter, revoked, reason, serial, subject, fingerprint = row
+        interned = records.intern_subject(subject)
+        if interned is None:
+            log.warning('Serial {0} has an invalid subject'.format(serial))
+            return None
+        record = records.CertRecord(status, notafter, revoked, reason,
+                                    int(serial, 16), interned[0],
+                                    interned[1])
+        if fingerprint is not None:
+            record.fingerprint = fingerprint
+        elif self.loader is not None:
+            record.set_loader(self._load)
+        return record
+
+    def _load(self, record):
+        details = self.loader(record)
+        if details and details.get('fp'):
+            with self._lock, self._conn:
+                self._conn.execute(
+                    'UPDATE certs SET fingerprint = ? WHERE serial = ?',
+                    (normalize_fingerprint(details['fp']), record['serial'])
+                )
+        return details
+
+    def _select(self, where='', params=(), limit=None):
+        query = 'SELECT status, notafter, revoked, reason, serial, subject, ' \
+            'fingerprint FROM certs {0} ORDER BY length(serial), serial'
+        if limit is not None:
+            query += ' LIMIT ?'
+            params = tuple(params) + (limit,)
+        with self._lock:
+            rows = self._conn.execute(query.format(where), params).fetchall()
+        certs = []
+        for row in rows:
+            record = self._record(row)
+            if record is not None:
+                certs.append(record)
+        return certs
+
+    @staticmethod
+    def _row(record):
+        return (record['serial'], record.status, record.notafter,
+                record.revoked, record.reason, record.cn, record.raw_subject)
+
+    def __len__(self):
+        with self._lock:
+            cursor = self._conn.execute('SELECT count(*) FROM certs')
+            return cursor.fetchone()[0]
+
+    def refresh(self):
+        if self._reader is None:
+            return False
+        if not os.path.exists(self.db):
+            log.warning('{0} does not exist'.format(self.db))
+            return False
+        with self._lock:
+            full = self._reader.changed() or self._reader.offset == 0
+            serials = set()
+            rows = []
+            for record in self._reader.records(offset=0 if full else None):
+                if record.notafter is None:
+                    log.warning('Serial {0} has an invalid expiry '
+                                'date'.format(record['serial']))
+                    continue
+                serials.add(record['serial'])
+                rows.append(self._row(record))
+            self._unresolved.difference_update(serials)
+            if not rows and not full:
+                return False
+            with self._conn:
+                # The fingerprint is kept, unless the certificate for the
+                # serial was replaced
+                self._conn.executemany(
+                    'INSERT INTO certs (serial, status, notafter, revoked, '
+                    'reason, cn, subject) VALUES (?, ?, ?, ?, ?, ?, ?) '
+                    'ON CONFLICT (serial) DO UPDATE SET '
+                    'status = excluded.status, '
+                    'notafter = excluded.notafter, '
+                    'revoked = excluded.revoked, '
+                    'reason = excluded.reason, '
+                    'fingerprint = CASE WHEN certs.subject = excluded.subject '
+                    'AND certs.notafter = excluded.notafter '
+                    'THEN certs.fingerprint END, '
+                    'cn = excluded.cn, subject = excluded.subject', rows
+                )
+                if full:
+                    stale = [(serial,) for (serial,) in self._conn.execute(
+                        'SELECT serial FROM certs').fetchall()
+                        if serial not in serials]
+                    self._conn.executemany(
+                        'DELETE FROM certs WHERE serial = ?', stale)
+        return True
+
+    def get(self, serial):
+        serial = serial_to_int(serial)
+        if serial is None:
+            return None
+        certs = self._select('WHERE serial = ?',
+                             (records.format_serial(serial),))
+        if not certs:
+            return None
+        return certs[0]
+
+    def by_fingerprint(self, fingerprint):
+        fingerprint = normalize_fingerprint(fingerprint)
+        if fingerprint is None:
+            return None
+        certs = self._select('WHERE fingerprint = ?', (fingerprint,))
+        if not certs and self.loader is not None:
+            # Resolve the fingerprints which are not known yet. The ones
+            # which cannot be resolved are skipped during later lookups
+            for record in self._select('WHERE fingerprint IS NULL'):
+                if record['serial'] in self._unresolved:
+                    continue
+                if record.fingerprint == fingerprint:
+                    return record
+                if record.fingerprint is None:
+                    self._unresolved.add(record['serial'])
+        if not certs:
+            return None
+        return certs[0]
+
+    def by_cn(self, common_name):
+        return self._select('WHERE cn = ?', (common_name,))
+
+    def list(self, status=None, expires_before=None, after=None,
+             limit=None):
+        clauses = []
+        params = []
+        if status is not None:
+            clauses.append('status = ?')
+            params.append(status)
+        if expires_before is not None:
+            clauses.append('notafter < ?')
+            params.append(expires_before)
+        if after is not None:
+            after = serial_to_int(after)
+            if after is None:
+                return []
+            after = records.format_serial(after)
+            clauses.append('(length(serial) > ? OR '
+                           '(length(serial) = ? AND serial > ?))')
+            params.extend([len(after), len(after), after])
+        where = ''
+        if clauses:
+            where = 'WHERE {0}'.format(' AND '.join(clauses))
+        return self._select(where, tuple(params), limit=limit)
+
+    def _mirrored(self):
+        if self.db is not None:
+            log.warning('{0} mirrors {1} and cannot be changed'.format(
+                self.path, self.db))
+            return True
+        return False
+
+    def append(self, record):
+        if self._mirrored():
+            return False
+        fingerprint = None
+        if record.loaded:
+            fingerprint = record.fingerprint
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    'INSERT INTO certs (serial, status, notafter, revoked, '
+                    'reason, cn, subject, fingerprint) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    self._row(record) + (fingerprint,)
+                )
+        except sqlite3.IntegrityError:
+            log.warning('Serial {0} is in the store already'.format(
+                record['serial']))
+            return False
+        return True
+
+    def revoke(self, serial, revoked, reason=None):
+        if self._mirrored():
+            return False
+        serial = serial_to_int(serial)
+        if serial is None:
+            return False
+        serial = records.format_serial(serial)
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                'UPDATE certs SET status = ?, revoked = ?, reason = ? '
+                'WHERE serial = ?', ('R', revoked, reason, serial)
+            )
+        if cursor.rowcount == 0:
+            log.warning('Serial {0} is not in the store'.format(serial))
+            return False
+        return True
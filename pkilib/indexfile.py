@@ -0,0 +1,320 @@
+"""
+.. module:: indexfile
+   :platform: Unix, VMS
+   :synopsis: Streaming parser for the OpenSSL database
+
+.. moduleauthor:: Lex van Roon <r3boot@r3blog.nl>
+"""
+import mmap
+import os
+import threading
+import time
+import zlib
+
+from pkilib import log
+from pkilib import records
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on VMS, where DatabaseLock only serializes threads
+    fcntl = None
+
+
+# Names of the fields of a line in the OpenSSL database, in order
+FIELDS = ['status', 'notafter', 'revoked', 'serial', 'fname', 'subject']
+
+# Number of nanoseconds after a read during which a modification may not
+# show in the mtime yet, since filesystems store it with limited precision
+RACY_WINDOW = 2 * 10 ** 9
+
+
+def stat_key(fstat):
+    """Build the key which identifies a version of a file
+
+    :param fstat:   Result of os.stat
+    :type  fstat:   os.stat_result
+    :returns:       Tuple containing the size, mtime and inode
+    :rtype:         tuple
+    """
+    return (fstat.st_size, fstat.st_mtime_ns, fstat.st_ino)
+
+
+def rewrite(path, lines):
+    """Replace the contents of the OpenSSL database atomically. The new
+    contents are written to a temporary file which is synced to disk before
+    it is renamed over the database, so a crash never leaves a truncated
+    database behind. The caller must make sure openssl ca does not run at
+    the same time.
+
+    :param path:    Path to the OpenSSL database
+    :type  path:    str
+    :param lines:   Lines of the database, including their newlines
+    :type  lines:   list
+    :returns:       True if the database was replaced, else False
+    :rtype:         bool
+    """
+    tmpfile = '{0}.new'.format(path)
+    try:
+        with open(tmpfile, 'w') as fdesc:
+            fdesc.write(''.join(lines))
+            fdesc.flush()
+            os.fsync(fdesc.fileno())
+        os.rename(tmpfile, path)
+    except EnvironmentError as err:
+        log.warning('Failed to update {0}: {1}'.format(path, err))
+        return False
+    return True
+
+
+class DatabaseLock(object):
+    """Lock serializing changes to the OpenSSL database, both between the
+    threads of this process and between all processes using the same
+    database. The latter uses flock on a lock file next to the database,
+    which is only possible on platforms with fcntl; elsewhere only the
+    threads of this process are serialized. It can be used everywhere a
+    threading.Lock is used. Declare a new instance as follows:
+
+    >>> lock = DatabaseLock('/path/to/index.txt')
+    >>> with lock:
+    ...     rewrite('/path/to/index.txt', lines)
+
+    :param db:  Path to the OpenSSL database
+    :type  db:  str
+    """
+    def __init__(self, db):
+        self.path = '{0}.lock'.format(db)
+        self._lock = threading.Lock()
+        self._fd = None
+
+    def _flock(self, blocking):
+        if fcntl is None:
+            return True
+        if self._fd is None:
+            try:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            except OSError as err:
+                log.warning('Failed to open {0}, only serializing threads: '
+                            '{1}'.format(self.path, err))
+                return True
+        flags = fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(self._fd, flags)
+        except BlockingIOError:
+            return False
+        return True
+
+    def acquire(self, blocking=True):
+        """Acquire the lock, waiting for other threads and processes unless
+        blocking is False
+
+        :param blocking:    Wait until the lock is available
+        :type  blocking:    bool
+        :returns:           True if the lock was acquired, else False
+        :rtype:             bool
+        """
+        if not self._lock.acquire(blocking):
+            return False
+        if not self._flock(blocking):
+            self._lock.release()
+            return False
+        return True
+
+    def release(self):
+        """Release the lock"""
+        if fcntl is not None and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._lock.release()
+
+    def locked(self):
+        """Check if the lock is held by a thread of this process
+
+        :returns:   True if the lock is held, else False
+        :rtype:     bool
+        """
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class IndexReader(object):
+    """Class which parses the OpenSSL database one line at a time from a
+    memory map, so the file is never read into a list of lines. Parsing can
+    resume at a byte offset, and offset is advanced past every line which
+    is returned. A trailing line without a newline is still being written,
+    so it is left for the next read. Since openssl ca rewrites the whole
+    database when a certificate is revoked, changed() tells if reading can
+    continue at offset or has to start over. It compares the size, mtime
+    and inode of the database first, and only compares a checksum of the
+    part which was read already when the database grew in place. Declare a
+    new instance as follows:
+
+    >>> reader = IndexReader('/path/to/index.txt')
+    >>> certs = list(reader.records())
+    >>> if reader.changed():
+    ...     certs = list(reader.records(offset=0))
+    ... else:
+    ...     certs.extend(reader.records())
+
+    :param path:    Path to the OpenSSL database
+    :type  path:    str
+    """
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self._checksum = zlib.adler32(b'')
+        self._stat = None
+        self._read_ns = None
+
+    def _open(self, remember=False):
+        """Map the database into memory. Empty files cannot be mapped, and
+        neither can files on platforms without mmap, so these are read
+
+        :param remember:    Remember the size, mtime and inode of the file
+        :type  remember:    bool
+        :returns:           The mapped or read contents or None
+        :rtype:             mmap.mmap, bytes, None
+        """
+        try:
+            fdesc = open(self.path, 'rb')
+        except EnvironmentError as err:
+            log.warning('Failed to open {0}: {1}'.format(self.path, err))
+            return None
+        with fdesc:
+            if remember:
+                self._stat = stat_key(os.fstat(fdesc.fileno()))
+                self._read_ns = time.time_ns()
+            try:
+                return mmap.mmap(fdesc.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, EnvironmentError):
+                return fdesc.read()
+
+    def _lines(self, offset):
+        if offset is None:
+            offset = self.offset
+        elif offset != self.offset:
+            self._checksum = None if offset else zlib.adler32(b'')
+            self.offset = offset
+
+        data = self._open(remember=True)
+        if data is None:
+            return
+        start = offset
+        try:
+            size = len(data)
+            while offset < size:
+                end = data.find(b'\n', offset)
+                if end == -1:
+                    break
+                line = data[offset:end]
+                offset = end + 1
+                self.offset = offset
+                if line.strip():
+                    yield line
+        finally:
+            if self._checksum is not None:
+                view = memoryview(data)
+                self._checksum = zlib.adler32(view[start:self.offset],
+                                              self._checksum)
+                view.release()
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+    def changed(self):
+        """Check if the part of the database before offset changed since it
+        was read, in which case reading has to start over at offset 0
+
+        :returns:   True if the database changed, else False
+        :rtype:     bool
+        """
+        if self.offset == 0:
+            return False
+        if self._checksum is None:
+            return True
+        try:
+            fstat = os.stat(self.path)
+        except OSError:
+            return True
+        if fstat.st_size < self.offset:
+            return True
+
+        key = stat_key(fstat)
+        if self._stat is not None:
+            size, mtime, inode = self._stat
+            if key == self._stat and mtime + RACY_WINDOW < self._read_ns:
+                return False
+            if key != self._stat and \
+                    (inode != fstat.st_ino or fstat.st_size <= size):
+                return True
+
+        data = self._open()
+        if data is None or len(data) < self.offset:
+            return True
+        try:
+            view = memoryview(data)
+            checksum = zlib.adler32(view[:self.offset])
+            view.release()
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+        return checksum != self._checksum
+
+    def lines(self, offset=None):
+        """Generator yielding the lines of the database, without the line
+        ending. Empty lines are skipped.
+
+        :param offset:  Byte offset to start at, defaults to offset
+        :type  offset:  int
+        :returns:       Generator yielding lines
+        :rtype:         generator
+        """
+        for line in self._lines(offset):
+            yield line.decode('utf-8', 'replace')
+
+    def fields(self, names, offset=None):
+        """Generator yielding tuples containing only the requested fields of
+        every line. Only the part of a line up to the last requested field
+        is split, and only the requested fields are decoded. Lines with
+        too few fields are skipped.
+
+        >>> list(reader.fields(['serial', 'status']))
+        [('01', 'V'), ('02', 'R')]
+
+        :param names:   Names of the fields, see FIELDS
+        :type  names:   list
+        :param offset:  Byte offset to start at, defaults to offset
+        :type  offset:  int
+        :returns:       Generator yielding tuples
+        :rtype:         generator
+        """
+        indexes = [FIELDS.index(name) for name in names]
+        last = max(indexes)
+        for line in self._lines(offset):
+            values = line.split(b'\t', last + 1)
+            if len(values) <= last:
+                continue
+            yield tuple([values[idx].decode('utf-8', 'replace').rstrip('\r')
+                         for idx in indexes])
+
+    def records(self, offset=None):
+        """Generator yielding a CertRecord for every line. Lines which cannot
+        be parsed are logged and skipped.
+
+        :param offset:  Byte offset to start at, defaults to offset
+        :type  offset:  int
+        :returns:       Generator yielding records
+        :rtype:         generator
+        """
+        for line in self.lines(offset):
+            record = records.CertRecord.from_line(line)
+            if record is None:
+                log.warning('{0} is an invalid line'.format(line.strip()))
+                continue
+            yield record
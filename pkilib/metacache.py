@@ -0,0 +1,340 @@
+"""
+.. module:: metacache
+   :platform: Unix, VMS
+   :synopsis: Persistent cache for metadata parsed from certificates
+
+.. moduleauthor:: Lex van Roon <r3boot@r3blog.nl>
+"""
+import os
+import struct
+import threading
+
+from pkilib import log
+
+
+# Identifies the file format, increase the version when it changes
+MAGIC = b'PKIMETA1'
+
+# Header containing the magic and the number of entries
+HEADER = struct.Struct('!8sI')
+
+# Fixed part of an entry: size, mtime in ns, inode, SHA1 fingerprint and
+# the lengths of the path, serial and subject which follow it
+ENTRY = struct.Struct('!QqQ20sHHH')
+
+# Fingerprint stored for entries without a fingerprint
+NO_FINGERPRINT = b'\x00' * 20
+
+# Default number of seconds between saves of the cache
+SAVE_INTERVAL = 60
+
+
+def stat_key(fstat):
+    """Convert the result of os.stat into the key used to validate entries.
+    A certificate is only parsed again if any of these change:
+
+    >>> stat_key(os.stat('/path/to/cert.pem'))
+    (1850, 1500000000000000000, 1234567)
+
+    :param fstat:   Result of os.stat
+    :type  fstat:   os.stat_result
+    :returns:       Tuple containing the size, mtime in ns and inode
+    :rtype:         tuple
+    """
+    return (fstat.st_size, fstat.st_mtime_ns, fstat.st_ino)
+
+
+def pack_fingerprint(fingerprint):
+    """Convert a fingerprint in the format used by openssl to raw bytes
+
+    :param fingerprint: Fingerprint to convert
+    :type  fingerprint: str, None
+    :returns:           The digest or NO_FINGERPRINT
+    :rtype:             bytes
+    """
+    if fingerprint is None:
+        return NO_FINGERPRINT
+    try:
+        digest = bytes.fromhex(fingerprint.replace(':', ''))
+    except ValueError:
+        return NO_FINGERPRINT
+    if len(digest) != len(NO_FINGERPRINT):
+        return NO_FINGERPRINT
+    return digest
+
+
+def unpack_fingerprint(digest):
+    """Convert raw bytes into a fingerprint in the format used by openssl
+
+    :param digest:  Digest to convert
+    :type  digest:  bytes
+    :returns:       The fingerprint or None
+    :rtype:         str, None
+    """
+    if digest == NO_FINGERPRINT:
+        return None
+    return ':'.join(['{0:02X}'.format(byte) for byte in digest])
+
+
+class MetadataCache(object):
+    """Class which remembers the serial, subject and fingerprint parsed from
+    every certificate, so they do not have to be parsed again after a
+    restart. Entries are keyed by path and validated against the size,
+    mtime and inode of the file, which costs a single stat. The cache is
+    kept in a compact binary file, which is replaced atomically by save().
+    Declare a new instance as follows:
+
+    >>> cache = MetadataCache('/path/to/meta.cache')
+    >>> cache.load()
+    True
+    >>> cache.get('/path/to/certs/0A.pem')
+    {'serial': '0A', 'subject': '/CN=some.host.name', 'fingerprint': ...}
+
+    :param path:    Path to the cache file
+    :type  path:    str
+    """
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, crt):
+        return crt in self._entries
+
+    def load(self):
+        """Read the cache file from disk. A missing file results in an empty
+        cache. It will return False if the file cannot be read or is not a
+        valid cache, in which case the cache is emptied as well.
+
+        :returns:   True if loading succeeded, False if not
+        :rtype:     bool
+        """
+        with self._lock:
+            self._entries = {}
+            self._dirty = False
+            if not os.path.exists(self.path):
+                log.debug('No metadata cache found at {0}'.format(self.path))
+                return True
+            try:
+                data = open(self.path, 'rb').read()
+            except EnvironmentError as err:
+                log.warning('Failed to read {0}: {1}'.format(self.path, err))
+                return False
+
+            entries = {}
+            try:
+                magic, count = HEADER.unpack_from(data, 0)
+                if magic != MAGIC:
+                    log.warning('{0} is not a metadata cache'.format(
+                        self.path))
+                    return False
+                offset = HEADER.size
+                for _ in range(count):
+                    size, mtime, inode, digest, len_path, len_serial, \
+                        len_subject = ENTRY.unpack_from(data, offset)
+                    offset += ENTRY.size
+                    end = offset + len_path + len_serial + len_subject
+                    if end > len(data):
+                        raise ValueError('truncated entry')
+                    fields = [data[offset:offset + len_path],
+                              data[offset + len_path:end - len_subject],
+                              data[end - len_subject:end]]
+                    offset = end
+                    crt, serial, subject = [
+                        field.decode('utf-8', 'surrogateescape')
+                        for field in fields
+                    ]
+                    entries[crt] = ((size, mtime, inode), serial,
+                                    subject or None, digest)
+            except (struct.error, ValueError) as err:
+                log.warning('{0} is corrupt: {1}'.format(self.path, err))
+                return False
+
+            self._entries = entries
+            return True
+
+    def save(self):
+        """Write the cache to disk if it changed since it was loaded. The
+        file is written next to the cache and renamed over it, so a crash
+        never leaves a partially written cache behind.
+
+        :returns:   True if saving succeeded or was not needed, else False
+        :rtype:     bool
+        """
+        with self._lock:
+            if not self._dirty:
+                return True
+            chunks = [HEADER.pack(MAGIC, len(self._entries))]
+            for crt, entry in self._entries.items():
+                key, serial, subject, digest = entry
+                fields = [value.encode('utf-8', 'surrogateescape')
+                          for value in [crt, serial, subject or '']]
+                chunks.append(ENTRY.pack(
+                    key[0], key[1], key[2], digest,
+                    len(fields[0]), len(fields[1]), len(fields[2])
+                ))
+                chunks.extend(fields)
+
+            tmpfile = '{0}.tmp'.format(self.path)
+            try:
+                with open(tmpfile, 'wb') as fdesc:
+                    fdesc.write(b''.join(chunks))
+                    fdesc.flush()
+                    os.fsync(fdesc.fileno())
+                os.rename(tmpfile, self.path)
+            except EnvironmentError as err:
+                log.warning('Failed to write {0}: {1}'.format(self.path, err))
+                return False
+            self._dirty = False
+            return True
+
+    def get(self, crt, fstat=None):
+        """Lookup the metadata of a certificate. It will return None if the
+        certificate is not cached, or if it changed since it was cached.
+
+        :param crt:     Path to the certificate
+        :type  crt:     str
+        :param fstat:   Result of os.stat for crt, if it is known already
+        :type  fstat:   os.stat_result
+        :returns:       Dictionary containing the metadata or None
+        :rtype:         dict, None
+        """
+        entry = self._entries.get(crt)
+        if entry is not None:
+            if fstat is None:
+                try:
+                    fstat = os.stat(crt)
+                except OSError:
+                    entry = None
+            if entry is not None and entry[0] != stat_key(fstat):
+                entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return {
+            'serial': entry[1],
+            'subject': entry[2],
+            'fingerprint': unpack_fingerprint(entry[3]),
+        }
+
+    def set(self, crt, serial, subject=None, fingerprint=None, fstat=None):
+        """Store the metadata parsed from a certificate. The subject and
+        fingerprint can be None, in which case the values which are cached
+        already for the same version of the certificate are kept.
+
+        :param crt:         Path to the certificate
+        :type  crt:         str
+        :param serial:      Serial of the certificate
+        :type  serial:      str
+        :param subject:     Subject as it was parsed from the certificate
+        :type  subject:     str
+        :param fingerprint: SHA1 fingerprint in the format used by openssl
+        :type  fingerprint: str
+        :param fstat:       Result of os.stat for crt, if it is known already
+        :type  fstat:       os.stat_result
+        :returns:           True if the metadata was stored, else False
+        :rtype:             bool
+        """
+        if fstat is None:
+            try:
+                fstat = os.stat(crt)
+            except OSError as err:
+                log.warning('Failed to stat {0}: {1}'.format(crt, err))
+                return False
+        key = stat_key(fstat)
+        digest = pack_fingerprint(fingerprint)
+        with self._lock:
+            current = self._entries.get(crt)
+            if current is not None and current[0] == key:
+                if subject is None:
+                    subject = current[2]
+                if digest == NO_FINGERPRINT:
+                    digest = current[3]
+            entry = (key, serial or '', subject, digest)
+            if current != entry:
+                self._entries[crt] = entry
+                self._dirty = True
+        return True
+
+    def prune(self, paths):
+        """Remove the entries for all certificates which are not in paths,
+        like certificates which were archived or moved
+
+        :param paths:   Paths of the certificates which still exist
+        :type  paths:   list
+        :returns:       Number of removed entries
+        :rtype:         int
+        """
+        paths = set(paths)
+        with self._lock:
+            stale = [crt for crt in self._entries if crt not in paths]
+            for crt in stale:
+                del self._entries[crt]
+            if stale:
+                self._dirty = True
+        return len(stale)
+
+
+class CacheSaver(object):
+    """Class running MetadataCache.save() periodically in a background
+    thread, so lookups never have to wait for the cache to be written. The
+    cache is saved one last time when the thread is stopped. Declare a new
+    instance as follows:
+
+    >>> saver = CacheSaver(cache, 60)
+    >>> saver.start()
+
+    :param cache:       Cache to save
+    :type  cache:       MetadataCache
+    :param interval:    Number of seconds between saves
+    :type  interval:    float
+    """
+    def __init__(self, cache, interval=SAVE_INTERVAL):
+        self.cache = cache
+        self.interval = interval
+        self.stats = {'runs': 0, 'failed': 0}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        """Save the cache once, which only writes it if it changed
+
+        :returns:   True if saving succeeded or was not needed, else False
+        :rtype:     bool
+        """
+        saved = self.cache.save()
+        self.stats['runs'] += 1
+        if not saved:
+            self.stats['failed'] += 1
+        return saved
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def start(self):
+        """Start the background thread"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread, wait for it to exit and save the
+        cache one last time
+
+        :returns:   True if saving succeeded or was not needed, else False
+        :rtype:     bool
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        return self.run_once()
@@ -0,0 +1,186 @@
+"""
+.. module:: profiling
+   :platform: Unix, VMS
+   :synopsis: Sampled cProfile profiling of requests and code paths
+
+.. moduleauthor:: Lex van Roon <r3boot@r3blog.nl>
+"""
+import cProfile
+import functools
+import glob
+import os
+import random
+import re
+import threading
+import time
+
+import pkilib.log as log
+
+
+# Global variable containing the active profiler. Profiling is disabled
+# when this is None
+PROFILER = None
+
+# Default fraction of calls which are profiled
+SAMPLE_RATE = 0.01
+
+# Default number of profiles which are kept per name
+KEEP = 10
+
+
+def safe_name(name):
+    """Helper function which converts the name of a route or code path into
+    a name which can be used as part of a filename
+
+    >>> safe_name('/v1/jobs/<job_id>')
+    'v1_jobs_job_id'
+
+    :param name:    Name to convert
+    :type  name:    str
+    :returns:       The converted name
+    :rtype:         str
+    """
+    name = re.sub('[^A-Za-z0-9]+', '_', name).strip('_')
+    if not name:
+        return 'index'
+    return name
+
+
+class Profiler(object):
+    """Class which runs a sampled fraction of calls under cProfile and
+    writes the results as pstats files, one set of files per name. Only
+    one call is profiled at a time, calls made while another call is being
+    profiled run without profiling. Declare a new instance as follows:
+
+    >>> profiler = Profiler('/var/tmp/profile', sample_rate=0.05)
+    >>> profiler.call('/v1/sign', sign_certificate)
+
+    :param directory:   Directory in which to store the pstats files
+    :type  directory:   str
+    :param sample_rate: Fraction of calls to profile, between 0 and 1
+    :type  sample_rate: float
+    :param keep:        Number of pstats files to keep per name
+    :type  keep:        int
+    :param paths:       Names of the code paths to profile, or None for all
+    :type  paths:       list
+    """
+    def __init__(self, directory, sample_rate=SAMPLE_RATE, keep=KEEP,
+                 paths=None):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.keep = keep
+        self.paths = paths
+        self._lock = threading.Lock()
+        self._seq = 0
+
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    def wants(self, name):
+        """Check if calls to the code path called name need profiling
+
+        :param name:    Name of the code path
+        :type  name:    str
+        :returns:       True if the code path is profiled, else False
+        :rtype:         bool
+        """
+        return self.paths is None or name in self.paths
+
+    def sample(self):
+        """Decide if the next call is profiled
+
+        :returns:   True if the call needs to be profiled, else False
+        :rtype:     bool
+        """
+        return random.random() < self.sample_rate
+
+    def filename(self, name):
+        """Generate the path of a new pstats file for name
+
+        :param name:    Name of the profiled code path
+        :type  name:    str
+        :returns:       Path to the pstats file
+        :rtype:         str
+        """
+        self._seq += 1
+        return '{0}/{1}-{2}-{3}.pstats'.format(
+            self.directory, safe_name(name), int(time.time() * 1000),
+            self._seq
+        )
+
+    def rotate(self, name):
+        """Remove the oldest pstats files for name, keeping the newest files
+
+        :param name:    Name of the profiled code path
+        :type  name:    str
+        :returns:       Number of removed files
+        :rtype:         int
+        """
+        pattern = '{0}/{1}-*.pstats'.format(self.directory, safe_name(name))
+        files = sorted(glob.glob(pattern), key=os.path.getmtime)
+        removed = 0
+        for fname in files[:max(0, len(files) - self.keep)]:
+            try:
+                os.unlink(fname)
+                removed += 1
+            except EnvironmentError as err:
+                log.warning('Failed to remove {0}: {1}'.format(fname, err))
+        return removed
+
+    def call(self, name, func, *args, **kwargs):
+        """Call func, and profile the call if it is sampled. The profile is
+        written to a new pstats file, after which older files are rotated.
+
+        :param name:    Name under which the profile is stored
+        :type  name:    str
+        :param func:    Function to call
+        :type  func:    function
+        :returns:       The value returned by func
+        :rtype:         object
+        """
+        if not self.sample() or not self._lock.acquire(False):
+            return func(*args, **kwargs)
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.disable()
+                fname = self.filename(name)
+                try:
+                    profile.dump_stats(fname)
+                    self.rotate(name)
+                    log.debug('Wrote profile to {0}'.format(fname))
+                except EnvironmentError as err:
+                    log.warning('Failed to write {0}: {1}'.format(fname, err))
+        finally:
+            self._lock.release()
+
+
+def profiled(name):
+    """Decorator which profiles calls to a code path using the global
+    PROFILER. If profiling is disabled, or name is not selected for
+    profiling, the decorated function is called directly.
+
+    >>> @profiled('update_cert_db')
+    ... def update_cert_db(self):
+    ...     pass
+
+    :param name:    Name of the code path
+    :type  name:    str
+    :returns:       Decorator for the function
+    :rtype:         function
+    """
+    def decorator(func):
+        """Wrap func with a profiling wrapper"""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            """Profile the call if needed"""
+            profiler = PROFILER
+            if profiler is None or not profiler.wants(name):
+                return func(*args, **kwargs)
+            return profiler.call(name, func, *args, **kwargs)
+        return wrapper
+    return decorator
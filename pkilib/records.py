@@ -0,0 +1,417 @@
+"""
+.. module:: records
+   :platform: Unix, VMS
+   :synopsis: Compact in-memory representation of certificate records
+
+.. moduleauthor:: Lex van Roon <r3boot@r3blog.nl>
+"""
+import sys
+
+from pkilib import log
+from pkilib import utils
+
+
+# Keys which can be looked up on a record, for compatibility with the
+# dictionaries which were used before. fp is an alias of fingerprint
+KEYS = ['CN', 'status', 'notafter', 'revoked', 'reason', 'serial', 'subject',
+        'fingerprint', 'fp']
+
+# Subject templates shared between records, see intern_subject()
+_SUBJECTS = {}
+
+# Combinations of status, subject template and filename shared between the
+# records which were not revoked, see CertRecord
+_KINDS = {}
+
+# The serial and expiry date of a record are packed into a single integer,
+# with the expiry date stored in the lowest bits with an offset, so that
+# 0 can be used when there is no expiry date
+_NOTAFTER_BITS = 64
+_NOTAFTER_MASK = (1 << _NOTAFTER_BITS) - 1
+_NOTAFTER_OFFSET = 1 << (_NOTAFTER_BITS - 1)
+
+
+def format_serial(serial):
+    """Format a serial like OpenSSL does, using an even number of
+    uppercase hexadecimal digits
+
+    >>> format_serial(10)
+    '0A'
+
+    :param serial:  Serial number
+    :type  serial:  int
+    :returns:       Formatted serial
+    :rtype:         str
+    """
+    value = '{0:X}'.format(serial)
+    if len(value) % 2:
+        value = '0' + value
+    return value
+
+
+def normalize_fingerprint(fingerprint):
+    """Convert a fingerprint with or without colons into the format used
+    by openssl:
+
+    >>> normalize_fingerprint('4f0b3c')
+    '4F:0B:3C'
+
+    :param fingerprint: Fingerprint to convert
+    :type  fingerprint: str
+    :returns:           The converted fingerprint or None if it is invalid
+    :rtype:             str, None
+    """
+    if not isinstance(fingerprint, str):
+        return None
+    digest = fingerprint.replace(':', '').upper()
+    if len(digest) == 0 or len(digest) % 2 != 0:
+        return None
+    try:
+        int(digest, 16)
+    except ValueError:
+        return None
+    return ':'.join([digest[i:i + 2] for i in range(0, len(digest), 2)])
+
+
+def intern_subject(raw_subject):
+    """Split a subject into its CN and a template containing the other
+    components, in which the value of the CN is replaced by None. Templates
+    and their components are interned, so all records of a CA share a
+    single template:
+
+    >>> intern_subject('/C=NL/O=Test/CN=some.host.name')
+    ('some.host.name', (('C', 'NL'), ('O', 'Test'), ('CN', None)))
+
+    :param raw_subject: OpenSSL subject to split
+    :type  raw_subject: str
+    :returns:           Tuple containing the CN and template, or None
+    :rtype:             tuple, None
+    """
+    if not isinstance(raw_subject, str) or not raw_subject.startswith('/'):
+        return None
+
+    common_name = None
+    pairs = []
+    for field in raw_subject.strip()[1:].split('/'):
+        if field.count('=') != 1:
+            return None
+        key, value = field.split('=')
+        if key == 'CN':
+            common_name = sys.intern(value)
+            value = None
+        else:
+            value = sys.intern(value)
+        pairs.append((sys.intern(key), value))
+    if common_name is None:
+        return None
+
+    template = tuple(pairs)
+    return common_name, _SUBJECTS.setdefault(template, template)
+
+
+class CertRecord(object):
+    """Class representing a single certificate from the OpenSSL database.
+    Records use __slots__, store the serial, the dates and the fingerprint
+    as integers, and share the subject components with all other records of
+    the CA. The status, subject template and filename are kept in a single
+    tuple, which is shared between all records that were not revoked; only
+    revoked certificates get their own tuple, which holds the revocation
+    details as well. The serial and expiry date are packed into a single
+    integer. The fingerprint can be resolved lazily, see set_loader(). For
+    compatibility with code using the dictionaries that were used before,
+    the fields can also be looked up by key, which returns the serial as a
+    hexadecimal string:
+
+    >>> record = CertRecord.from_line(line)
+    >>> record.serial, record['serial']
+    (10, '0A')
+    >>> record['subject']
+    {'C': 'NL', 'O': 'Test', 'CN': 'some.host.name'}
+
+    :param status:      Status of the certificate
+    :type  status:      str
+    :param notafter:    Expiry date in seconds since the epoch
+    :type  notafter:    int
+    :param revoked:     Revocation date in seconds since the epoch
+    :type  revoked:     int
+    :param reason:      Revocation reason
+    :type  reason:      str
+    :param serial:      Serial of the certificate
+    :type  serial:      int
+    :param cn:          Common name of the certificate
+    :type  cn:          str
+    :param template:    Subject template as returned by intern_subject()
+    :type  template:    tuple
+    :param fname:       Filename field of the OpenSSL database
+    :type  fname:       str
+    """
+    __slots__ = ['_kind', '_stamp', 'cn', '_fingerprint']
+
+    def __init__(self, status, notafter, revoked, reason, serial, cn,
+                 template, fname='unknown'):
+        if revoked is not None or reason is not None:
+            self._kind = (status, template, fname, revoked, reason)
+        else:
+            kind = (status, template, fname)
+            self._kind = _KINDS.setdefault(kind, kind)
+        stamp = 0
+        if notafter is not None:
+            stamp = notafter + _NOTAFTER_OFFSET
+        self._stamp = (serial << _NOTAFTER_BITS) | stamp
+        self.cn = cn
+        self._fingerprint = None
+
+    @classmethod
+    def from_line(cls, line):
+        """Parse a line of the OpenSSL database into a record. It will
+        return None if the line cannot be parsed.
+
+        :param line:    Line to parse
+        :type  line:    str
+        :returns:       The record or None
+        :rtype:         CertRecord, None
+        """
+        fields = line.rstrip('\r\n').split('\t')
+        if len(fields) != 6:
+            return None
+        status, notafter, revoked, serial, fname, raw_subject = fields
+        subject = intern_subject(raw_subject)
+        if subject is None:
+            return None
+        try:
+            serial = int(serial, 16)
+        except ValueError:
+            return None
+
+        reason = None
+        if ',' in revoked:
+            revoked, reason = revoked.split(',', 1)
+            reason = sys.intern(reason)
+        return cls(sys.intern(status), utils.asn1_to_epoch(notafter),
+                   utils.asn1_to_epoch(revoked) if revoked else None,
+                   reason, serial, subject[0], subject[1], sys.intern(fname))
+
+    @property
+    def serial(self):
+        """Serial of the certificate
+
+        :returns:   The serial
+        :rtype:     int
+        """
+        return self._stamp >> _NOTAFTER_BITS
+
+    @property
+    def notafter(self):
+        """Expiry date of the certificate
+
+        :returns:   Seconds since the epoch or None
+        :rtype:     int, None
+        """
+        stamp = self._stamp & _NOTAFTER_MASK
+        if stamp == 0:
+            return None
+        return stamp - _NOTAFTER_OFFSET
+
+    @property
+    def status(self):
+        """Status of the certificate
+
+        :returns:   One of V, R or E
+        :rtype:     str
+        """
+        return self._kind[0]
+
+    @property
+    def template(self):
+        """Subject template as returned by intern_subject()
+
+        :returns:   The template
+        :rtype:     tuple
+        """
+        return self._kind[1]
+
+    @property
+    def fname(self):
+        """Filename field of the OpenSSL database
+
+        :returns:   The filename, which openssl sets to unknown
+        :rtype:     str
+        """
+        return self._kind[2]
+
+    @property
+    def revoked(self):
+        """Revocation date of the certificate
+
+        :returns:   Seconds since the epoch or None
+        :rtype:     int, None
+        """
+        if len(self._kind) > 3:
+            return self._kind[3]
+        return None
+
+    @property
+    def reason(self):
+        """Revocation reason of the certificate
+
+        :returns:   The reason or None
+        :rtype:     str, None
+        """
+        if len(self._kind) > 3:
+            return self._kind[4]
+        return None
+
+    def mark_revoked(self, revoked, reason=None):
+        """Change the status of the certificate into revoked
+
+        :param revoked: Revocation date in seconds since the epoch
+        :type  revoked: int
+        :param reason:  Revocation reason
+        :type  reason:  str
+        """
+        if reason is not None:
+            reason = sys.intern(reason)
+        self._kind = ('R', self.template, self.fname, revoked, reason)
+
+    @property
+    def raw_subject(self):
+        """Subject of the certificate in the notation used by OpenSSL
+
+        :returns:   The subject, like /C=NL/O=Test/CN=some.host.name
+        :rtype:     str
+        """
+        return ''.join(['/{0}={1}'.format(key,
+                                          self.cn if value is None else value)
+                        for key, value in self.template])
+
+    def to_line(self):
+        """Format the record as a line of the OpenSSL database, without the
+        line ending. An expiry date which could not be parsed is left empty.
+
+        :returns:   Line for the OpenSSL database
+        :rtype:     str
+        """
+        revoked = ''
+        if self.revoked is not None:
+            revoked = utils.epoch_to_asn1(self.revoked)
+            if self.reason is not None:
+                revoked = '{0},{1}'.format(revoked, self.reason)
+        notafter = ''
+        if self.notafter is not None:
+            notafter = utils.epoch_to_asn1(self.notafter)
+        return '\t'.join([self.status, notafter, revoked, self['serial'],
+                          self.fname, self.raw_subject])
+
+    @property
+    def subject(self):
+        """Subject of the certificate
+
+        :returns:   Dictionary containing the subject components
+        :rtype:     dict
+        """
+        return dict([(key, self.cn if value is None else value)
+                     for key, value in self.template])
+
+    def set_loader(self, loader):
+        """Resolve the details which are not part of the OpenSSL database
+        on first access, instead of when the record is created. The loader
+        is called with the record as its only argument, and should return a
+        dictionary like OpenSSL.parse_certificate() does, or None. It is
+        called at most once, after which the result is memoized:
+
+        >>> record.set_loader(lambda record: {'fp': '4F:0B:...:9A'})
+        >>> record.fingerprint
+        '4F:0B:...:9A'
+
+        :param loader:  Function returning the details of the certificate
+        :type  loader:  function
+        """
+        # The loader is kept in the fingerprint slot until it is called, so
+        # deferring the details does not cost any memory
+        self._fingerprint = loader
+
+    @property
+    def loaded(self):
+        """Flag indicating if the details of the certificate were resolved
+
+        :returns:   False if the loader was not called yet, else True
+        :rtype:     bool
+        """
+        return not callable(self._fingerprint)
+
+    def load(self):
+        """Call the loader set by set_loader() if this was not done yet"""
+        loader = self._fingerprint
+        if not callable(loader):
+            return
+        self._fingerprint = None
+        details = loader(self)
+        if details:
+            self.fingerprint = details.get('fp')
+
+    @property
+    def fingerprint(self):
+        """SHA1 fingerprint of the certificate, in the format used by openssl
+
+        :returns:   The fingerprint or None if it is not known
+        :rtype:     str, None
+        """
+        if callable(self._fingerprint):
+            self.load()
+        if self._fingerprint is None:
+            return None
+        digest = '{0:040X}'.format(self._fingerprint)
+        return ':'.join([digest[i:i + 2] for i in range(0, len(digest), 2)])
+
+    @fingerprint.setter
+    def fingerprint(self, value):
+        if value is None:
+            self._fingerprint = None
+            return
+        try:
+            self._fingerprint = int(value.replace(':', ''), 16)
+        except ValueError:
+            log.warning('{0} is an invalid fingerprint'.format(value))
+            self._fingerprint = None
+
+    def __getitem__(self, key):
+        if key == 'CN':
+            return self.cn
+        elif key == 'serial':
+            return format_serial(self.serial)
+        elif key == 'subject':
+            return self.subject
+        elif key in ['fingerprint', 'fp']:
+            return self.fingerprint
+        elif key in KEYS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in KEYS and self[key] is not None
+
+    def __repr__(self):
+        return '<CertRecord {0} {1} {2}>'.format(self['serial'], self.status,
+                                                 self.cn)
+
+    def get(self, key, default=None):
+        """Lookup a field by key
+
+        :param key:     Name of the field
+        :type  key:     str
+        :param default: Value to return if the field is not set
+        :type  default: any
+        :returns:       Value of the field or default
+        :rtype:         any
+        """
+        if key not in self:
+            return default
+        return self[key]
+
+    def as_dict(self):
+        """Convert the record into a dictionary
+
+        :returns:   Dictionary containing all fields
+        :rtype:     dict
+        """
+        return dict([(key, self[key]) for key in KEYS if key != 'fp'])
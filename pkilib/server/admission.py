@@ -0,0 +1,243 @@
+"""
+.. module:: admission
+   :platform: Unix, VMS
+   :synopsis: Bounded priority queue used for admission control on signing
+
+.. moduleauthor:: Lex van Roon <r3boot@r3blog.nl>
+"""
+import contextlib
+import heapq
+import itertools
+import threading
+import time
+
+import pkilib.log as log
+
+
+# Priorities used for signing requests, lower values are served first
+PRIORITY_URGENT = 0
+PRIORITY_RENEWAL = 1
+PRIORITY_ENROLMENT = 2
+
+
+def signing_priority(certs, urgent, now=None):
+    """Determine the priority of a signing request, based on the
+    certificates which were issued for the same fqdn before. A renewal of a
+    certificate which expires within urgent seconds is urgent, other
+    renewals are served before new enrolments:
+
+    >>> signing_priority(db.cached_certs('some.host.name'), 14 * 86400)
+    1
+
+    :param certs:   Certificates issued for the fqdn, as found in the
+                    OpenSSL database
+    :type  certs:   list
+    :param urgent:  Number of seconds before expiry at which a renewal
+                    becomes urgent
+    :type  urgent:  int
+    :param now:     Current time in seconds since the epoch
+    :type  now:     int
+    :returns:       One of the PRIORITY_* constants
+    :rtype:         int
+    """
+    if now is None:
+        now = time.time()
+    priority = PRIORITY_ENROLMENT
+    for cert in certs or []:
+        if cert['status'] != 'V' or cert['notafter'] is None:
+            continue
+        if cert['notafter'] - now < urgent:
+            return PRIORITY_URGENT
+        priority = PRIORITY_RENEWAL
+    return priority
+
+
+class SigningQueue(object):
+    """Class representing a bounded priority queue in front of the signing
+    process. At most concurrency requests are handled at the same time, and
+    at most max_queue requests can wait for their turn. Waiting requests are
+    served in order of priority, and in order of arrival within the same
+    priority. Declare a new instance as follows:
+
+    >>> queue = SigningQueue(concurrency=1, max_queue=16)
+    >>> with queue.slot(PRIORITY_RENEWAL) as admitted:
+    ...     if admitted:
+    ...         sign()
+
+    :param concurrency: Number of requests handled at the same time
+    :type  concurrency: int
+    :param max_queue:   Maximum number of waiting requests
+    :type  max_queue:   int
+    """
+    def __init__(self, concurrency=1, max_queue=16):
+        self.concurrency = max(1, int(concurrency))
+        self.max_queue = max(0, int(max_queue))
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._active = 0
+        self._stats = {
+            'admitted': 0,
+            'shed': 0,
+            'timeouts': 0,
+            'wait_total': 0.0,
+            'wait_max': 0.0,
+            'service_total': 0.0,
+            'served': 0,
+        }
+
+    @property
+    def depth(self):
+        """Number of requests waiting for a free slot
+
+        :returns:   Number of waiting requests
+        :rtype:     int
+        """
+        return len(self._waiting)
+
+    @property
+    def active(self):
+        """Number of requests currently being handled
+
+        :returns:   Number of active requests
+        :rtype:     int
+        """
+        return self._active
+
+    def full(self):
+        """Check if a new request would have to be refused. Use this to shed
+        requests before any expensive validation is done on them.
+
+        :returns:   True if the queue is full, False if not
+        :rtype:     bool
+        """
+        with self._cond:
+            return self._full()
+
+    def _full(self):
+        """Check if the queue is full, the caller must hold the lock
+
+        :returns:   True if the queue is full, False if not
+        :rtype:     bool
+        """
+        if self._active < self.concurrency and not self._waiting:
+            return False
+        return len(self._waiting) >= self.max_queue
+
+    def acquire(self, priority=PRIORITY_ENROLMENT, timeout=None):
+        """Wait for a free slot. Requests with a lower priority value are
+        served first. This function will return False if the queue is full,
+        or if no slot became available within timeout seconds. Every
+        successful call must be followed by a call to release.
+
+        :param priority:    Priority of the request
+        :type  priority:    int
+        :param timeout:     Maximum number of seconds to wait, or None
+        :type  timeout:     float
+        :returns:           True if a slot was acquired, False if not
+        :rtype:             bool
+        """
+        with self._cond:
+            if self._full():
+                self._stats['shed'] += 1
+                log.warning('Signing queue is full, shedding request')
+                return False
+
+            entry = (priority, next(self._sequence))
+            heapq.heappush(self._waiting, entry)
+            start = time.time()
+            deadline = None
+            if timeout is not None:
+                deadline = start + timeout
+
+            while self._active >= self.concurrency or \
+                    self._waiting[0] != entry:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self._waiting.remove(entry)
+                        heapq.heapify(self._waiting)
+                        self._stats['timeouts'] += 1
+                        self._cond.notify_all()
+                        log.warning('Timeout waiting for a signing slot')
+                        return False
+                self._cond.wait(remaining)
+
+            heapq.heappop(self._waiting)
+            self._active += 1
+            waited = time.time() - start
+            self._stats['admitted'] += 1
+            self._stats['wait_total'] += waited
+            self._stats['wait_max'] = max(self._stats['wait_max'], waited)
+            self._cond.notify_all()
+        return True
+
+    def release(self, duration=None):
+        """Give back a slot acquired with acquire, and wake up the next
+        waiting request.
+
+        :param duration:    Number of seconds the request was handled for
+        :type  duration:    float
+        """
+        with self._cond:
+            self._active -= 1
+            if duration is not None:
+                self._stats['service_total'] += duration
+                self._stats['served'] += 1
+            self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def slot(self, priority=PRIORITY_ENROLMENT, timeout=None):
+        """Context manager around acquire and release. It yields the result
+        of acquire, so the caller can check if it was admitted.
+
+        :param priority:    Priority of the request
+        :type  priority:    int
+        :param timeout:     Maximum number of seconds to wait, or None
+        :type  timeout:     float
+        :returns:           Generator yielding True if admitted, else False
+        :rtype:             generator
+        """
+        admitted = self.acquire(priority, timeout=timeout)
+        start = time.time()
+        try:
+            yield admitted
+        finally:
+            if admitted:
+                self.release(time.time() - start)
+
+    def service_time(self):
+        """Average number of seconds it took to handle a request
+
+        :returns:   Average service time, or None if nothing was served yet
+        :rtype:     float, None
+        """
+        if self._stats['served'] == 0:
+            return None
+        return self._stats['service_total'] / self._stats['served']
+
+    def stats(self):
+        """Return a dictionary with the current state of the queue, which can
+        be used for monitoring.
+
+        :returns:   Dictionary containing the queue statistics
+        :rtype:     dict
+        """
+        with self._cond:
+            admitted = self._stats['admitted']
+            wait_avg = 0.0
+            if admitted:
+                wait_avg = self._stats['wait_total'] / admitted
+            return {
+                'depth': len(self._waiting),
+                'active': self._active,
+                'concurrency': self.concurrency,
+                'max_queue': self.max_queue,
+                'admitted': admitted,
+                'shed': self._stats['shed'],
+                'timeouts': self._stats['timeouts'],
+                'wait_avg': wait_avg,
+                'wait_max': self._stats['wait_max'],
+                'service_avg': self.service_time() or 0.0,
+            }
@@ -0,0 +1,353 @@
+"""
+.. module:: archive
+   :platform: Unix, VMS
+   :synopsis: Archival and compaction of the OpenSSL database
+
+.. moduleauthor:: Lex van Roon <r3boot@r3blog.nl>
+"""
+import glob
+import io
+import os
+import tarfile
+import threading
+import time
+
+import pkilib.log as log
+import pkilib.utils as utils
+import pkilib.server.certindex as certindex
+from pkilib import indexfile
+
+
+# Name of the archive index within the archive directory
+ARCHIVE_INDEX = 'index.txt'
+
+# Format of the names of the archive segments
+SEGMENT_NAME = 'segment-{0:06d}.tar.gz'
+
+# Default number of days a certificate is kept in the database after expiry
+GRACE_DAYS = 30
+
+
+def archivable(cert, cutoff):
+    """Check if a certificate can be moved to the archive. Revoked
+    certificates are never archived, since they have to stay on the CRL.
+
+    :param cert:    Certificate details as returned by parse_index_line
+    :type  cert:    dict
+    :param cutoff:  Only archive certificates which expired before this time
+    :type  cutoff:  int
+    :returns:       True if the certificate can be archived, else False
+    :rtype:         bool
+    """
+    if cert['status'] not in [certindex.STATUS_VALID,
+                              certindex.STATUS_EXPIRED]:
+        return False
+    return cert['notafter'] is not None and cert['notafter'] < cutoff
+
+
+class Archive(object):
+    """Class representing the archive of a CA. The archive consists of
+    compressed segments containing the certificates, and an index with a
+    line for every archived certificate containing the serial, fingerprint,
+    segment and the original line from the OpenSSL database. Declare a new
+    instance as follows:
+
+    >>> archive = Archive('/path/to/ca/archive')
+    >>> archive.load()
+    True
+    >>> archive.lookup('0A')['segment']
+    'segment-000001.tar.gz'
+
+    :param directory:   Directory containing the archive
+    :type  directory:   str
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.index = '{0}/{1}'.format(directory, ARCHIVE_INDEX)
+        self._key = None
+        self._by_serial = {}
+        self._by_fingerprint = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        self.load()
+        return len(self._by_serial)
+
+    def __contains__(self, serial):
+        return serial in self._by_serial
+
+    def load(self):
+        """Read the archive index if it changed since it was last read
+
+        :returns:   True if the index was read, else False
+        :rtype:     bool
+        """
+        try:
+            fstat = os.stat(self.index)
+        except OSError:
+            return False
+        key = (fstat.st_mtime_ns, fstat.st_size, fstat.st_ino)
+        if key == self._key:
+            return False
+
+        by_serial = {}
+        by_fingerprint = {}
+        for line in open(self.index, 'r'):
+            fields = line.rstrip('\r\n').split('\t', 3)
+            if len(fields) != 4:
+                continue
+            serial, fingerprint, segment, db_line = fields
+            cert = certindex.parse_index_line(db_line)
+            if cert is None or serial in by_serial:
+                continue
+            cert['fingerprint'] = fingerprint or None
+            cert['segment'] = segment
+            by_serial[serial] = cert
+            if fingerprint:
+                by_fingerprint[fingerprint] = serial
+        with self._lock:
+            self._by_serial = by_serial
+            self._by_fingerprint = by_fingerprint
+            self._key = key
+        return True
+
+    def lookup(self, serial):
+        """Lookup an archived certificate by its serial
+
+        :param serial:  Serial of the certificate in hexadecimal notation
+        :type  serial:  str
+        :returns:       Certificate details or None if it is not archived
+        :rtype:         dict, None
+        """
+        if not isinstance(serial, str):
+            return None
+        self.load()
+        return self._by_serial.get(serial.upper())
+
+    def by_fingerprint(self, fingerprint):
+        """Lookup an archived certificate by its SHA1 fingerprint
+
+        :param fingerprint: Fingerprint of the certificate
+        :type  fingerprint: str
+        :returns:           Certificate details or None if it is not found
+        :rtype:             dict, None
+        """
+        self.load()
+        fingerprint = certindex.normalize_fingerprint(fingerprint)
+        if fingerprint not in self._by_fingerprint:
+            return None
+        return self._by_serial.get(self._by_fingerprint[fingerprint])
+
+    def certificate(self, serial):
+        """Read an archived certificate from its segment
+
+        :param serial:  Serial of the certificate in hexadecimal notation
+        :type  serial:  str
+        :returns:       The PEM encoded certificate or None
+        :rtype:         str, None
+        """
+        cert = self.lookup(serial)
+        if cert is None:
+            return None
+        segment = '{0}/{1}'.format(self.directory, cert['segment'])
+        try:
+            with tarfile.open(segment, 'r:gz') as tar:
+                member = tar.extractfile('{0}.pem'.format(cert['serial']))
+                return member.read().decode('utf-8')
+        except (EnvironmentError, KeyError, tarfile.TarError) as err:
+            log.warning('Failed to read {0} from {1}: {2}'.format(
+                cert['serial'], segment, err
+            ))
+            return None
+
+    def next_segment(self):
+        """Determine the name of the next segment, which is numbered one
+        higher than the highest existing segment, so it never overwrites
+        one if segments were removed
+
+        :returns:   Name of the segment
+        :rtype:     str
+        """
+        highest = 0
+        for path in glob.glob('{0}/segment-*.tar.gz'.format(self.directory)):
+            number = os.path.basename(path)[len('segment-'):-len('.tar.gz')]
+            if number.isdigit():
+                highest = max(highest, int(number))
+        return SEGMENT_NAME.format(highest + 1)
+
+    def write_segment(self, certs, certsdir):
+        """Write a new segment containing the certificates, and add them to
+        the archive index. The segment is written under a temporary name
+        first, so a partial segment is never referenced.
+
+        :param certs:       List of tuples containing the certificate
+                            details and the original database line
+        :type  certs:       list
+        :param certsdir:    Directory containing the certificates
+        :type  certsdir:    str
+        :returns:           Name of the segment
+        :rtype:             str
+        """
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        segment = self.next_segment()
+        path = '{0}/{1}'.format(self.directory, segment)
+
+        lines = []
+        with tarfile.open('{0}.tmp'.format(path), 'w:gz') as tar:
+            for cert, line in certs:
+                fingerprint = ''
+                crt = utils.cert_path(certsdir, cert['serial'])
+                if os.path.exists(crt):
+                    data = open(crt, 'rb').read()
+                    fingerprint = certindex.pem_fingerprint(
+                        data.decode('utf-8')) or ''
+                    info = tarfile.TarInfo('{0}.pem'.format(cert['serial']))
+                    info.size = len(data)
+                    info.mtime = int(os.path.getmtime(crt))
+                    tar.addfile(info, io.BytesIO(data))
+                lines.append('\t'.join([cert['serial'], fingerprint, segment,
+                                        line.rstrip('\r\n')]) + '\n')
+        os.rename('{0}.tmp'.format(path), path)
+
+        with open(self.index, 'a') as fdesc:
+            fdesc.write(''.join(lines))
+            fdesc.flush()
+            os.fsync(fdesc.fileno())
+        return segment
+
+
+def compact(db, certsdir, archive, now=None, grace=GRACE_DAYS,
+            dry_run=False):
+    """Move certificates which expired more than grace days ago from the
+    OpenSSL database and the certificate directory into a new segment of
+    the archive. The caller must make sure openssl ca does not run at the
+    same time. Certificates are removed from the database only after the
+    segment and the archive index have been written, and their files only
+    after the database has been replaced.
+
+    >>> compact('/path/to/index.txt', '/path/to/certs', archive)
+    1234
+
+    :param db:          Path to the OpenSSL database
+    :type  db:          str
+    :param certsdir:    Directory containing the certificates
+    :type  certsdir:    str
+    :param archive:     Archive to add the certificates to
+    :type  archive:     Archive
+    :param now:         Current time in seconds since the epoch
+    :type  now:         int
+    :param grace:       Number of days to keep expired certificates
+    :type  grace:       int
+    :param dry_run:     Only count the certificates which would be archived
+    :type  dry_run:     bool
+    :returns:           Number of archived certificates or None on errors
+    :rtype:             int, None
+    """
+    if now is None:
+        now = time.time()
+    cutoff = now - grace * 86400
+
+    try:
+        lines = open(db, 'r').readlines()
+    except EnvironmentError as err:
+        log.warning('Failed to read {0}: {1}'.format(db, err))
+        return None
+
+    archive.load()
+    keep = []
+    moved = []
+    for line in lines:
+        cert = certindex.parse_index_line(line)
+        if cert is not None and archivable(cert, cutoff):
+            moved.append((cert, line))
+        else:
+            keep.append(line)
+    if dry_run or not moved:
+        return len(moved)
+
+    # A previous run could have been interrupted after updating the index
+    new = [(cert, line) for cert, line in moved
+           if cert['serial'] not in archive]
+    if new:
+        segment = archive.write_segment(new, certsdir)
+        log.info('Archived {0} certificates in {1}'.format(len(new),
+                                                            segment))
+
+    if not indexfile.rewrite(db, keep):
+        return None
+
+    for cert, line in moved:
+        crt = utils.cert_path(certsdir, cert['serial'])
+        if os.path.exists(crt):
+            os.unlink(crt)
+    return len(moved)
+
+
+class Compactor(object):
+    """Class running compact() periodically in a background thread. The
+    lock is held while compacting, which should be the lock serializing
+    openssl ca commands. Declare a new instance as follows:
+
+    >>> compactor = Compactor(db, certsdir, archive, 86400, lock=ca_lock)
+    >>> compactor.start()
+
+    :param db:          Path to the OpenSSL database
+    :type  db:          str
+    :param certsdir:    Directory containing the certificates
+    :type  certsdir:    str
+    :param archive:     Archive to add the certificates to
+    :type  archive:     Archive
+    :param interval:    Number of seconds between runs
+    :type  interval:    float
+    :param grace:       Number of days to keep expired certificates
+    :type  grace:       int
+    :param lock:        Lock to hold while compacting
+    :type  lock:        threading.Lock
+    """
+    def __init__(self, db, certsdir, archive, interval, grace=GRACE_DAYS,
+                 lock=None):
+        self.db = db
+        self.certsdir = certsdir
+        self.archive = archive
+        self.interval = interval
+        self.grace = grace
+        self.stats = {'runs': 0, 'archived': 0}
+        self._lock = lock or threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        """Compact the database once
+
+        :returns:   Number of archived certificates or None on errors
+        :rtype:     int, None
+        """
+        with self._lock:
+            archived = compact(self.db, self.certsdir, self.archive,
+                               grace=self.grace)
+        self.stats['runs'] += 1
+        if archived:
+            self.stats['archived'] += archived
+        return archived
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except EnvironmentError as err:
+                log.warning('Failed to compact {0}: {1}'.format(self.db, err))
+
+    def start(self):
+        """Start the background thread"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread and wait for it to exit"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,455 @@
+"""
+.. module:: certindex
+   :platform: Unix, VMS
+   :synopsis: In-memory index of the certificates issued by a CA
+
+.. moduleauthor:: Lex van Roon <r3boot@r3blog.nl>
+"""
+import base64
+import binascii
+import hashlib
+import json
+import os
+import threading
+import time
+
+import pkilib.log as log
+import pkilib.utils as utils
+from pkilib import certstore
+from pkilib import indexfile
+from pkilib import records
+
+
+# Status flags used in the OpenSSL database
+STATUS_VALID = 'V'
+STATUS_REVOKED = 'R'
+STATUS_EXPIRED = 'E'
+STATUSES = [STATUS_VALID, STATUS_REVOKED, STATUS_EXPIRED]
+
+# Default and maximum number of certificates returned by a single query
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+PEM_BEGIN = '-----BEGIN CERTIFICATE-----'
+PEM_END = '-----END CERTIFICATE-----'
+
+
+def pem_fingerprint(pem):
+    """Calculate the SHA1 fingerprint of a PEM encoded certificate, in the
+    same format as openssl x509 -fingerprint uses:
+
+    >>> pem_fingerprint(open('/path/to/cert.pem').read())
+    '4F:0B:3C:...:9A'
+
+    :param pem: PEM encoded certificate
+    :type  pem: str
+    :returns:   The fingerprint or None if pem is not a certificate
+    :rtype:     str, None
+    """
+    if not isinstance(pem, str) or PEM_BEGIN not in pem:
+        return None
+    body = pem.split(PEM_BEGIN, 1)[1].split(PEM_END, 1)[0]
+    try:
+        der = base64.b64decode(''.join(body.split()), validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    digest = hashlib.sha1(der).hexdigest().upper()
+    return ':'.join([digest[i:i + 2] for i in range(0, len(digest), 2)])
+
+
+def normalize_fingerprint(fingerprint):
+    """Convert a fingerprint with or without colons into the format used by
+    openssl, see records.normalize_fingerprint
+
+    :param fingerprint: Fingerprint to convert
+    :type  fingerprint: str
+    :returns:           The fingerprint or None if it is invalid
+    :rtype:             str, None
+    """
+    return records.normalize_fingerprint(fingerprint)
+
+
+def serial_key(serial):
+    """Format a serial in hexadecimal notation the way the index stores it
+
+    >>> serial_key('a')
+    '0A'
+
+    :param serial:  Serial in hexadecimal notation
+    :type  serial:  str
+    :returns:       The formatted serial or None if it is invalid
+    :rtype:         str, None
+    """
+    if not isinstance(serial, str):
+        return None
+    try:
+        return records.format_serial(int(serial, 16))
+    except ValueError:
+        return None
+
+
+def record_to_cert(record):
+    """Convert a record parsed from the OpenSSL database into a dictionary
+
+    :param record:  Record as returned by CertRecord.from_line
+    :type  record:  pkilib.records.CertRecord
+    :returns:       Dictionary containing the fields or None if the status
+                    of the record is invalid
+    :rtype:         dict, None
+    """
+    if record.status not in STATUSES:
+        return None
+    return {
+        'status': record.status,
+        'notafter': record.notafter,
+        'revoked': record.revoked,
+        'reason': record.reason,
+        'serial': record['serial'],
+        'fqdn': record.cn,
+        'subject': record.subject,
+        'fingerprint': None,
+    }
+
+
+def parse_index_line(line):
+    """Parse a line of the OpenSSL database into a dictionary. The fields of
+    a line are the status, expiry date, revocation date (optionally followed
+    by a reason), serial, filename and subject:
+
+    >>> parse_index_line('R\\t250720010135Z\\t160720010135Z\\t0A\\tunknown'
+    ...                  '\\t/CN=some.host.name')
+    {'status': 'R', 'notafter': 1752973295, 'revoked': 1468976495, ...}
+
+    :param line:    Line to parse
+    :type  line:    str
+    :returns:       Dictionary containing the fields or None
+    :rtype:         dict, None
+    """
+    record = records.CertRecord.from_line(line)
+    if record is None:
+        return None
+    return record_to_cert(record)
+
+
+def effective_status(cert, now=None):
+    """Determine the status of a certificate. A certificate marked as valid
+    whose expiry date has passed is reported as expired, since the database
+    is only updated when openssl ca -updatedb runs.
+
+    :param cert:    Certificate details as returned by parse_index_line, or
+                    a pkilib.records.CertRecord
+    :type  cert:    dict
+    :param now:     Current time in seconds since the epoch
+    :type  now:     int
+    :returns:       One of STATUSES
+    :rtype:         str
+    """
+    if now is None:
+        now = time.time()
+    if cert['status'] == STATUS_VALID and cert['notafter'] is not None and \
+            cert['notafter'] < now:
+        return STATUS_EXPIRED
+    return cert['status']
+
+
+def as_dict(cert, now=None):
+    """Return the public details of a certificate as a dictionary, which
+    can be serialized to json
+
+    :param cert:    Certificate details as returned by parse_index_line
+    :type  cert:    dict
+    :returns:       Dictionary containing the details
+    :rtype:         dict
+    """
+    return {
+        'serial': cert['serial'],
+        'fqdn': cert['fqdn'],
+        'subject': cert['subject'],
+        'status': effective_status(cert, now=now),
+        'notafter': cert['notafter'],
+        'revoked': cert['revoked'],
+        'reason': cert['reason'],
+        'fingerprint': cert['fingerprint'],
+    }
+
+
+def json_stream(certs, next_serial=None):
+    """Generator which serializes a page of certificates to json one
+    certificate at a time, so large pages never need to be built in memory
+    as a single string
+
+    :param certs:       Certificates to serialize
+    :type  certs:       list
+    :param next_serial: Serial to pass to retrieve the next page, if any
+    :type  next_serial: str
+    :returns:           Generator yielding parts of the json document
+    :rtype:             generator
+    """
+    now = time.time()
+    yield '{"certs": ['
+    for idx, cert in enumerate(certs):
+        if idx > 0:
+            yield ', '
+        yield json.dumps(as_dict(cert, now=now))
+    yield '], "next": {0}}}\n'.format(json.dumps(next_serial))
+
+
+class CertIndex(object):
+    """Class which answers lookups of the certificates issued by a CA from a
+    certificate store, by default a certstore.FlatFileStore which keeps the
+    OpenSSL database in memory. The store is only refreshed when the size,
+    mtime or inode of the database changed, and generation is increased
+    every time the store changed. Fingerprints are calculated in-process
+    from the certificates in certs_dir when they are first needed, and not
+    at all for certificates found in the metadata cache; the store is given
+    a loader doing this unless it has one already. Declare a new instance
+    as follows:
+
+    >>> index = CertIndex('/path/to/index.txt', '/path/to/certs')
+    >>> index.refresh()
+    True
+    >>> index.get('0A')['fqdn']
+    'some.host.name'
+
+    :param db:          Path to the OpenSSL database
+    :type  db:          str
+    :param certs_dir:   Directory containing the issued certificates
+    :type  certs_dir:   str
+    :param metadata:    Cache containing the fingerprints of certificates
+    :type  metadata:    pkilib.metacache.MetadataCache
+    :param store:       Store containing the certificates of the database
+    :type  store:       pkilib.certstore.CertStore
+    """
+    def __init__(self, db, certs_dir, metadata=None, store=None):
+        self.db = db
+        self.certs_dir = certs_dir
+        self.metadata = metadata
+        if store is None:
+            store = certstore.FlatFileStore(db)
+        if store.loader is None:
+            store.loader = self._load
+        self.store = store
+        self.generation = 0
+        self._key = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.store)
+
+    def __iter__(self):
+        return iter(self.certs())
+
+    def certs(self, fingerprints=True):
+        """Return the details of all certificates in the store. Resolving
+        the fingerprints can read every certificate which was not looked up
+        yet, so callers which do not need them can skip this, in which case
+        the fingerprint of every certificate is None.
+
+        :param fingerprints:    Resolve the fingerprints of the certificates
+        :type  fingerprints:    bool
+        :returns:               List containing the certificate details
+        :rtype:                 list
+        """
+        certs = []
+        for record in self.store.list():
+            cert = self._cert(record, fingerprint=fingerprints)
+            if cert is not None:
+                certs.append(cert)
+        return certs
+
+    def _fingerprint(self, serial):
+        crt = utils.cert_path(self.certs_dir, serial)
+        fstat = None
+        if self.metadata is not None:
+            try:
+                fstat = os.stat(crt)
+            except OSError:
+                return None
+            cached = self.metadata.get(crt, fstat=fstat)
+            if cached is not None and cached['fingerprint'] is not None:
+                return cached['fingerprint']
+        try:
+            fingerprint = pem_fingerprint(open(crt, 'r').read())
+        except EnvironmentError:
+            return None
+        if self.metadata is not None:
+            self.metadata.set(crt, serial, fingerprint=fingerprint,
+                              fstat=fstat)
+        return fingerprint
+
+    def _load(self, record):
+        """Loader passed to the store, which resolves the fingerprint of a
+        record from its certificate
+
+        :param record:  Record to resolve the fingerprint for
+        :type  record:  pkilib.records.CertRecord
+        :returns:       Dictionary containing the fingerprint or None
+        :rtype:         dict, None
+        """
+        fingerprint = self._fingerprint(record['serial'])
+        if fingerprint is None:
+            return None
+        return {'fp': fingerprint}
+
+    def _cert(self, record, fingerprint=True):
+        if record is None:
+            return None
+        cert = record_to_cert(record)
+        if cert is not None and fingerprint:
+            cert['fingerprint'] = record.fingerprint
+        return cert
+
+    def refresh(self):
+        """Refresh the store if the database changed since the last refresh
+
+        :returns:   True if the store changed, else False
+        :rtype:     bool
+        """
+        try:
+            fstat = os.stat(self.db)
+        except OSError:
+            log.warning('{0} does not exist'.format(self.db))
+            return False
+        key = indexfile.stat_key(fstat)
+        if key == self._key:
+            return False
+
+        with self._lock:
+            if key == self._key:
+                return False
+            changed = self.store.refresh()
+            self._key = key
+            if changed:
+                self.generation += 1
+        return changed
+
+    def get(self, serial):
+        """Lookup a certificate by its serial
+
+        :param serial:  Serial of the certificate in hexadecimal notation
+        :type  serial:  str
+        :returns:       Certificate details or None if it is not found
+        :rtype:         dict, None
+        """
+        if serial_key(serial) is None:
+            return None
+        return self._cert(self.store.get(serial))
+
+    def by_fingerprint(self, fingerprint):
+        """Lookup a certificate by its SHA1 fingerprint, which may be passed
+        with or without colons
+
+        :param fingerprint: Fingerprint of the certificate
+        :type  fingerprint: str
+        :returns:           Certificate details or None if it is not found
+        :rtype:             dict, None
+        """
+        return self._cert(self.store.by_fingerprint(fingerprint))
+
+    def by_fqdn(self, fqdn):
+        """Lookup all certificates issued for fqdn, in the order in which
+        they were issued
+
+        :param fqdn:    Fully-Qualified Domain-Name of the certificates
+        :type  fqdn:    str
+        :returns:       List containing the certificate details
+        :rtype:         list
+        """
+        return [cert for cert in map(self._cert, self.store.by_cn(fqdn))
+                if cert is not None]
+
+    def certificate(self, serial):
+        """Read the PEM encoded certificate with the given serial
+
+        :param serial:  Serial of the certificate in hexadecimal notation
+        :type  serial:  str
+        :returns:       The certificate or None if it is not found
+        :rtype:         str, None
+        """
+        cert = self.get(serial)
+        if cert is None:
+            return None
+        crt = utils.cert_path(self.certs_dir, cert['serial'])
+        try:
+            return open(crt, 'r').read()
+        except EnvironmentError:
+            return None
+
+    def _records(self, fqdn, status, expires_before, after):
+        """Generator yielding the records of the store which can match a
+        query, in the order in which they were issued. The store is asked
+        for one page at a time.
+        """
+        if fqdn is not None:
+            for record in self.store.by_cn(fqdn):
+                if after is None or record.serial > after:
+                    yield record
+            return
+        while True:
+            page = self.store.list(status=status,
+                                   expires_before=expires_before,
+                                   after=after, limit=MAX_PAGE_SIZE)
+            for record in page:
+                yield record
+            if len(page) < MAX_PAGE_SIZE:
+                return
+            after = page[-1].serial
+
+    def query(self, fqdn=None, status=None, expires_before=None, after=None,
+              limit=PAGE_SIZE):
+        """Find certificates matching all of the given filters, in the order
+        in which they were issued. Pass the returned serial as after to
+        retrieve the next page.
+
+        >>> certs, next_serial = index.query(fqdn='some.host.name')
+
+        :param fqdn:            Only return certificates for this fqdn
+        :type  fqdn:            str
+        :param status:          Only return certificates with this status
+        :type  status:          str
+        :param expires_before:  Only return certificates which expire before
+                                this time, in seconds since the epoch
+        :type  expires_before:  int
+        :param after:           Only return certificates issued after the
+                                certificate with this serial
+        :type  after:           str
+        :param limit:           Maximum number of certificates to return
+        :type  limit:           int
+        :returns:               Tuple containing the certificates and the
+                                serial to use for the next page or None
+        :rtype:                 tuple
+        """
+        if after is not None:
+            record = None
+            if serial_key(after) is not None:
+                record = self.store.get(after)
+            if record is None:
+                return [], None
+            after = record.serial
+
+        # Certificates which expired are still marked valid in the store
+        # until openssl ca -updatedb runs, so only these can be filtered
+        # on by the store
+        store_status = None
+        if status in [STATUS_VALID, STATUS_REVOKED]:
+            store_status = status
+
+        now = time.time()
+        certs = []
+        for record in self._records(fqdn, store_status, expires_before,
+                                    after):
+            if status is not None and \
+                    effective_status(record, now=now) != status:
+                continue
+            if expires_before is not None and \
+                    (record.notafter is None or
+                     record.notafter >= expires_before):
+                continue
+            # Fingerprints are only resolved for the returned certificates
+            cert = self._cert(record)
+            if cert is None:
+                continue
+            if len(certs) == limit:
+                return certs, certs[-1]['serial']
+            certs.append(cert)
+        return certs, None
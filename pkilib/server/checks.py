@@ -8,6 +8,8 @@
 
 import re
 import socket
+import threading
+import time
 
 import pkilib.log as log
 
@@ -15,6 +17,24 @@ import pkilib.log as log
 # Global flag indicting permissive mode
 PERMISSIVE_MODE = False
 
+# Number of seconds a DNS lookup is cached, set to 0 to disable caching
+DNS_TTL = 60
+
+# Maximum number of fqdns kept in the DNS cache
+DNS_CACHE_SIZE = 1024
+
+# Cache of DNS lookups, mapping a fqdn onto (expiry, ips), in the order in
+# which they were added
+DNS_CACHE = {}
+DNS_LOCK = threading.Lock()
+
+# Number of DNS lookups served from cache and from the resolver
+DNS_STATS = {
+    'hits': 0,
+    'misses': 0,
+    'errors': 0,
+}
+
 
 def valid_fqdn(fqdn=None):
     """Check if fqdn is valid according to RFC 1123. This means that fqdn can
@@ -41,6 +61,70 @@ def valid_fqdn(fqdn=None):
     return result is not None
 
 
+def resolve(fqdn):
+    """Lookup the ip addresses for fqdn. Results are cached for DNS_TTL
+    seconds, and the number of cache hits and misses is counted in
+    DNS_STATS. Failed lookups are not cached, and at most DNS_CACHE_SIZE
+    fqdns are cached. This function will return None if fqdn cannot be
+    resolved.
+
+    >>> resolve('localhost')
+    ['::1', '127.0.0.1']
+
+    :param fqdn:    Fully-Qualified Domain-Name to resolve
+    :type  fqdn:    str
+    :returns:       List containing the ip addresses of fqdn or None
+    :rtype:         list, None
+    """
+    now = time.time()
+    with DNS_LOCK:
+        cached = DNS_CACHE.get(fqdn)
+        if cached and cached[0] > now:
+            DNS_STATS['hits'] += 1
+            return cached[1]
+        if cached:
+            del DNS_CACHE[fqdn]
+        DNS_STATS['misses'] += 1
+
+    # Names which are not valid for IDNA, like a label longer than 63
+    # characters, raise a UnicodeError instead of a gaierror
+    try:
+        socket_data = socket.getaddrinfo(fqdn, 80)
+    except (socket.gaierror, UnicodeError, OSError) as err:
+        log.warning('Failed to resolve PTR for {0}: {1}'.format(fqdn, err))
+        with DNS_LOCK:
+            DNS_STATS['errors'] += 1
+        return None
+
+    # Parse socket_data and assemble a list of ip addresses for fqdn
+    ips = []
+    for item in socket_data:
+        ipaddr = item[4][0]
+        if ipaddr not in ips:
+            ips.append(ipaddr)
+
+    if DNS_TTL > 0:
+        with DNS_LOCK:
+            if len(DNS_CACHE) >= DNS_CACHE_SIZE:
+                prune_dns_cache(now)
+            DNS_CACHE[fqdn] = (now + DNS_TTL, ips)
+    return ips
+
+
+def prune_dns_cache(now):
+    """Remove the expired lookups from DNS_CACHE, and the oldest ones if
+    it is still full. The caller must hold DNS_LOCK.
+
+    :param now: Current time in seconds since the epoch
+    :type  now: float
+    """
+    for fqdn in [fqdn for fqdn, cached in DNS_CACHE.items()
+                 if cached[0] <= now]:
+        del DNS_CACHE[fqdn]
+    while len(DNS_CACHE) >= DNS_CACHE_SIZE:
+        del DNS_CACHE[next(iter(DNS_CACHE))]
+
+
 def owns_fqdn(srcip=None, fqdn=None):
     """Check if a fqdn is owned by srcip. It does this by performing a DNS
     lookup for the PTR records of fqdn, and matches srcip against these. If
@@ -65,19 +149,10 @@ def owns_fqdn(srcip=None, fqdn=None):
         return False
 
     # Get the PTR entries for fqdn
-    try:
-        socket_data = socket.getaddrinfo(fqdn, 80)
-    except socket.gaierror as err:
-        log.warning('Failed to resolve PTR for {0}: {1}'.format(fqdn, err))
+    ips = resolve(fqdn)
+    if ips is None:
         return False
 
-    # Parse socket_data and assemble a list of ip addresses for fqdn
-    ips = []
-    for item in socket_data:
-        ipaddr = item[4][0]
-        if ipaddr not in ips:
-            ips.append(ipaddr)
-
     # Check if srcip is one of the ip addresses of fqdn. Return True if
     # permissive mode is enabled
     if srcip not in ips:
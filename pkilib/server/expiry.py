@@ -0,0 +1,297 @@
+"""
+.. module:: expiry
+   :platform: Unix, VMS
+   :synopsis: Scheduler firing events when certificates approach expiry
+
+.. moduleauthor:: Lex van Roon <r3boot@r3blog.nl>
+"""
+import heapq
+import threading
+import time
+
+import pkilib.log as log
+import pkilib.server.certindex as certindex
+from pkilib import indexfile
+
+
+# Default thresholds, in days before the expiry date, at which an event is
+# fired for a valid certificate. An event is always fired at expiry itself
+THRESHOLDS = [30, 7, 1]
+
+# Number of seconds the scheduler sleeps when there is nothing scheduled
+IDLE_INTERVAL = 3600
+
+
+class ExpiryEvent(object):
+    """Class representing a certificate crossing one of the thresholds
+
+    :param cert:        Certificate details from the certificate index
+    :type  cert:        dict
+    :param threshold:   Number of seconds before expiry of the threshold,
+                        which is 0 when the certificate expired
+    :type  threshold:   int
+    """
+    def __init__(self, cert, threshold):
+        self.serial = cert['serial']
+        self.fqdn = cert['fqdn']
+        self.status = cert['status']
+        self.notafter = cert['notafter']
+        self.threshold = threshold
+
+    @property
+    def expired(self):
+        """Flag indicating if this event is fired at expiry
+
+        :returns:   True if the certificate expired, else False
+        :rtype:     bool
+        """
+        return self.threshold == 0
+
+    def __repr__(self):
+        return '<ExpiryEvent {0} {1} -{2}s>'.format(self.serial, self.fqdn,
+                                                    self.threshold)
+
+
+def schedule(cert, thresholds, now):
+    """Determine the events to fire for a certificate, as a list of tuples
+    containing the time at which to fire and the threshold. Revoked
+    certificates only get an event at expiry, which is used to prune them
+    from the CRL. Of the thresholds which already passed, only the most
+    recent one is returned, so a restart does not replay every warning.
+
+    >>> schedule({'status': 'V', 'notafter': 1000000}, [86400], 0)
+    [(913600, 86400), (1000000, 0)]
+
+    :param cert:        Certificate details from the certificate index
+    :type  cert:        dict
+    :param thresholds:  Thresholds in seconds before expiry
+    :type  thresholds:  list
+    :param now:         Current time in seconds since the epoch
+    :type  now:         int
+    :returns:           List containing the events
+    :rtype:             list
+    """
+    if cert['notafter'] is None:
+        return []
+    if cert['status'] == certindex.STATUS_VALID:
+        thresholds = sorted(set(list(thresholds) + [0]), reverse=True)
+    elif cert['status'] == certindex.STATUS_REVOKED:
+        thresholds = [0]
+    else:
+        return []
+
+    events = []
+    for threshold in thresholds:
+        fire_at = cert['notafter'] - threshold
+        if fire_at <= now and events and events[-1][0] <= now:
+            events.pop()
+        events.append((fire_at, threshold))
+    return events
+
+
+def prune_revoked(db, now=None):
+    """Mark revoked certificates which have expired as expired in the
+    OpenSSL database, so they are no longer listed on the CRL. The database
+    is replaced atomically. The caller must make sure openssl ca does not
+    run at the same time.
+
+    :param db:  Path to the OpenSSL database
+    :type  db:  str
+    :param now: Current time in seconds since the epoch
+    :type  now: int
+    :returns:   Number of pruned certificates or None if db cannot be read
+                or written
+    :rtype:     int, None
+    """
+    if now is None:
+        now = time.time()
+    try:
+        lines = open(db, 'r').readlines()
+    except EnvironmentError as err:
+        log.warning('Failed to read {0}: {1}'.format(db, err))
+        return None
+
+    pruned = 0
+    output = []
+    for line in lines:
+        cert = certindex.parse_index_line(line)
+        if cert is not None and cert['status'] == certindex.STATUS_REVOKED \
+                and cert['notafter'] is not None and cert['notafter'] < now:
+            fields = line.rstrip('\r\n').split('\t')
+            fields[0] = certindex.STATUS_EXPIRED
+            fields[2] = ''
+            line = '\t'.join(fields) + '\n'
+            pruned += 1
+        output.append(line)
+
+    if pruned == 0:
+        return 0
+    if not indexfile.rewrite(db, output):
+        return None
+    log.info('Pruned {0} expired certificates from {1}'.format(pruned, db))
+    return pruned
+
+
+class ExpiryScheduler(object):
+    """Class which keeps a min-heap of the moments at which certificates in
+    a certificate index cross a threshold. A background thread sleeps until
+    the first of these moments and then passes the due events to the
+    registered hooks. The heap is rebuilt when the index changed, which is
+    checked every time the thread wakes up. Call notify() to wake it up
+    after changing the database. Declare a new instance as follows:
+
+    >>> scheduler = ExpiryScheduler(index, thresholds=[30, 7, 1])
+    >>> scheduler.add_hook(lambda events: print(events))
+    >>> scheduler.start()
+
+    :param index:       Index containing the certificates
+    :type  index:       CertIndex
+    :param thresholds:  Days before expiry at which events are fired
+    :type  thresholds:  list
+    """
+    def __init__(self, index, thresholds=THRESHOLDS):
+        self.index = index
+        self.thresholds = [int(days * 86400) for days in thresholds]
+        self.stats = {'events': 0, 'expired': 0, 'rebuilds': 0}
+        self._hooks = []
+        self._heap = []
+        self._certs = {}
+        self._fired = set()
+        self._stale = True
+        self._generation = None
+        self._running = False
+        self._thread = None
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def add_hook(self, hook):
+        """Register a function which is called with the list of events that
+        are due each time the scheduler wakes up
+
+        :param hook:    Function to call
+        :type  hook:    function
+        """
+        self._hooks.append(hook)
+
+    def rebuild(self, now=None):
+        """Rebuild the heap using the certificates in the index. Events
+        which already fired are not scheduled again.
+
+        :param now: Current time in seconds since the epoch
+        :type  now: int
+        """
+        if now is None:
+            now = time.time()
+        self.index.refresh()
+        heap = []
+        certs = {}
+        fired = set()
+        # Scheduling only needs the status and expiry date, so the
+        # fingerprints are not resolved
+        for cert in self.index.certs(fingerprints=False):
+            for fire_at, threshold in schedule(cert, self.thresholds, now):
+                key = (cert['serial'], cert['status'], threshold)
+                if key in self._fired:
+                    fired.add(key)
+                    continue
+                heap.append((fire_at, cert['serial'], threshold))
+                certs[cert['serial']] = cert
+        heapq.heapify(heap)
+        with self._cond:
+            self._generation = self.index.generation
+            self._heap = heap
+            self._certs = certs
+            self._fired = fired
+            self.stats['rebuilds'] += 1
+
+    def next_deadline(self):
+        """Return the moment at which the next event is due
+
+        :returns:   Seconds since the epoch or None if nothing is scheduled
+        :rtype:     float, None
+        """
+        with self._cond:
+            if not self._heap:
+                return None
+            return self._heap[0][0]
+
+    def run_pending(self, now=None):
+        """Pop all events which are due and pass them to the hooks
+
+        :param now: Current time in seconds since the epoch
+        :type  now: int
+        :returns:   List containing the events which were fired
+        :rtype:     list
+        """
+        if now is None:
+            now = time.time()
+        events = []
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now:
+                fire_at, serial, threshold = heapq.heappop(self._heap)
+                cert = self._certs[serial]
+                self._fired.add((serial, cert['status'], threshold))
+                events.append(ExpiryEvent(cert, threshold))
+            self.stats['events'] += len(events)
+            self.stats['expired'] += len([event for event in events
+                                          if event.expired])
+        if not events:
+            return events
+
+        for hook in self._hooks:
+            try:
+                hook(events)
+            except Exception as err:
+                log.warning('Expiry hook {0} failed: {1}'.format(
+                    getattr(hook, '__name__', hook), err
+                ))
+        return events
+
+    def notify(self):
+        """Wake up the background thread, so it rebuilds the heap if the
+        certificate index has changed
+        """
+        with self._cond:
+            self._stale = True
+            self._cond.notify()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                if not self._running:
+                    return
+                self._stale = False
+            self.index.refresh()
+            if self.index.generation != self._generation:
+                self.rebuild()
+            self.run_pending()
+
+            with self._cond:
+                if not self._running or self._stale:
+                    continue
+                timeout = IDLE_INTERVAL
+                if self._heap:
+                    timeout = min(timeout, self._heap[0][0] - time.time())
+                if timeout > 0:
+                    self._cond.wait(timeout)
+
+    def start(self):
+        """Start the background thread"""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread and wait for it to exit"""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,306 @@
+"""
+.. module:: filecache
+   :platform: Unix, VMS
+   :synopsis: In-memory cache for files served over HTTP
+
+.. moduleauthor:: Lex van Roon <r3boot@r3blog.nl>
+"""
+import calendar
+import email.utils
+import gzip
+import hashlib
+import os
+import stat
+import threading
+import time
+
+import pkilib.log as log
+import pkilib.utils as utils
+
+
+# Default number of seconds clients may cache a downloaded file
+MAX_AGE = 300
+
+# Compression level used for gzip encoded responses
+GZIP_LEVEL = 6
+
+# Files smaller than this are never compressed
+GZIP_MIN_SIZE = 256
+
+
+def crl_next_update(path):
+    """Determine when the CRL in path should be replaced by a newer one,
+    according to its nextUpdate field:
+
+    >>> crl_next_update('/path/to/ca.crl')
+    1792375861
+
+    :param path:    Path to a PEM encoded CRL
+    :type  path:    str
+    :returns:       Seconds since the epoch or None if it cannot be read
+    :rtype:         int, None
+    """
+    output = utils.run(['openssl', 'crl', '-in', os.path.abspath(path),
+                        '-noout', '-nextupdate'])
+    if not output or not output.startswith('nextUpdate='):
+        log.warning('Failed to read nextUpdate from {0}'.format(path))
+        return None
+    try:
+        next_update = time.strptime(output.strip().split('=', 1)[1],
+                                    '%b %d %H:%M:%S %Y %Z')
+    except ValueError:
+        log.warning('Invalid nextUpdate in {0}'.format(path))
+        return None
+    return calendar.timegm(next_update)
+
+
+def parse_http_date(value):
+    """Convert a date as used in HTTP headers to seconds since the epoch:
+
+    >>> parse_http_date('Sun, 06 Nov 1994 08:49:37 GMT')
+    784111777
+
+    :param value:   Date to convert
+    :type  value:   str
+    :returns:       Seconds since the epoch or None if value is invalid
+    :rtype:         int, None
+    """
+    if not isinstance(value, str):
+        return None
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is None:
+        return None
+    return email.utils.mktime_tz(parsed)
+
+
+class CachedFile(object):
+    """Class representing the contents of a single file together with the
+    validators sent to clients. The gzip encoded contents are generated the
+    first time they are needed.
+
+    :param path:        Path to the file
+    :type  path:        str
+    :param data:        Contents of the file
+    :type  data:        bytes
+    :param fstat:       Result of os.stat for the file
+    :type  fstat:       os.stat_result
+    :param expires:     Time after which the contents are outdated
+    :type  expires:     int, None
+    """
+    def __init__(self, path, data, fstat, expires=None):
+        self.path = path
+        self.data = data
+        self.key = (fstat.st_mtime_ns, fstat.st_size, fstat.st_ino)
+        self.mtime = int(fstat.st_mtime)
+        self.expires = expires
+        self.etag = '"{0}"'.format(hashlib.sha1(data).hexdigest())
+        self._gzip = None
+
+    @property
+    def gzip_data(self):
+        """Contents of the file using gzip encoding
+
+        :returns:   The compressed contents
+        :rtype:     bytes
+        """
+        if self._gzip is None:
+            self._gzip = gzip.compress(self.data, compresslevel=GZIP_LEVEL,
+                                       mtime=0)
+        return self._gzip
+
+    def max_age(self, default=MAX_AGE, now=None):
+        """Determine the number of seconds clients may cache this file. This
+        is never beyond the moment the contents are outdated.
+
+        :param default: Number of seconds used for files without expiry
+        :type  default: int
+        :param now:     Current time in seconds since the epoch
+        :type  now:     int
+        :returns:       Number of seconds
+        :rtype:         int
+        """
+        if self.expires is None:
+            return default
+        if now is None:
+            now = time.time()
+        return int(max(0, min(default, self.expires - now)))
+
+    def not_modified(self, if_none_match=None, if_modified_since=None):
+        """Check if the client already has the current contents, based on
+        the If-None-Match and If-Modified-Since request headers. Like in
+        RFC 7232, If-Modified-Since is ignored if If-None-Match is sent.
+
+        :param if_none_match:       Value of If-None-Match
+        :type  if_none_match:       str
+        :param if_modified_since:   Value of If-Modified-Since
+        :type  if_modified_since:   str
+        :returns:                   True if the client has the contents
+        :rtype:                     bool
+        """
+        if if_none_match:
+            if if_none_match.strip() == '*':
+                return True
+            for etag in if_none_match.split(','):
+                etag = etag.strip()
+                if etag.startswith('W/'):
+                    etag = etag[2:]
+                if etag in [self.etag, self.gzip_etag]:
+                    return True
+            return False
+        since = parse_http_date(if_modified_since)
+        return since is not None and self.mtime <= since
+
+    @property
+    def gzip_etag(self):
+        """ETag used for the gzip encoded contents
+
+        :returns:   The ETag
+        :rtype:     str
+        """
+        return '{0}-gz"'.format(self.etag[:-1])
+
+
+class FileCache(object):
+    """Class which keeps files served over HTTP in memory. Every lookup
+    compares the size, mtime and inode of the file with the cached copy,
+    and reads the file again if one of them changed. Responses carry an
+    ETag, Last-Modified and Cache-Control header, and conditional requests
+    are answered with a 304. Declare a new instance as follows:
+
+    >>> cache = FileCache(max_age=300, use_gzip=True)
+    >>> status, headers, body = cache.response(
+    ...     '/var/www/crl', 'ca.crl', 'application/x-pkcs7-crl',
+    ...     bottle.request.headers, expires=crl_next_update)
+
+    :param max_age:     Default number of seconds clients may cache a file
+    :type  max_age:     int
+    :param use_gzip:    Compress responses for clients that accept it
+    :type  use_gzip:    bool
+    """
+    def __init__(self, max_age=MAX_AGE, use_gzip=False):
+        self.max_age = max_age
+        self.use_gzip = use_gzip
+        self.stats = {'hits': 0, 'misses': 0, 'not_modified': 0}
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._files)
+
+    @staticmethod
+    def resolve(root, fname):
+        """Determine the path of fname within root. Names which point
+        outside of root are refused:
+
+        >>> FileCache.resolve('/var/www', 'index.html')
+        '/var/www/index.html'
+        >>> FileCache.resolve('/var/www', '../etc/passwd')
+        None
+
+        :param root:    Directory containing the files
+        :type  root:    str
+        :param fname:   Name of the file
+        :type  fname:   str
+        :returns:       Absolute path to the file or None
+        :rtype:         str, None
+        """
+        root = os.path.abspath(root) + os.sep
+        path = os.path.abspath(os.path.join(root, fname.strip('/\\')))
+        if not path.startswith(root):
+            log.warning('Refusing to serve {0}'.format(fname))
+            return None
+        return path
+
+    def get(self, path, expires=None):
+        """Return the cached copy of a file, reading it from disk if it is
+        not cached yet or has changed since it was read.
+
+        :param path:        Path to the file
+        :type  path:        str
+        :param expires:     Function called with the path when the file is
+                            read, returning the time after which its
+                            contents are outdated or None
+        :type  expires:     function
+        :returns:           The cached file or None if it does not exist
+        :rtype:             CachedFile, None
+        """
+        try:
+            fstat = os.stat(path)
+        except OSError:
+            return None
+        if not stat.S_ISREG(fstat.st_mode):
+            return None
+
+        key = (fstat.st_mtime_ns, fstat.st_size, fstat.st_ino)
+        cached = self._files.get(path)
+        if cached is not None and cached.key == key:
+            with self._lock:
+                self.stats['hits'] += 1
+            return cached
+
+        try:
+            data = open(path, 'rb').read()
+        except EnvironmentError as err:
+            log.warning('Failed to read {0}: {1}'.format(path, err))
+            return None
+        cached = CachedFile(path, data, fstat)
+        if expires is not None:
+            cached.expires = expires(path)
+        with self._lock:
+            self.stats['misses'] += 1
+            self._files[path] = cached
+        return cached
+
+    def response(self, root, fname, mimetype, headers, expires=None):
+        """Build the response for a request for fname within root.
+
+        :param root:        Directory containing the files
+        :type  root:        str
+        :param fname:       Name of the requested file
+        :type  fname:       str
+        :param mimetype:    Content-Type of the file
+        :type  mimetype:    str
+        :param headers:     Request headers
+        :type  headers:     dict
+        :param expires:     Function determining when the file is outdated,
+                            see get()
+        :type  expires:     function
+        :returns:           Tuple containing the status code, response
+                            headers and body
+        :rtype:             tuple
+        """
+        path = self.resolve(root, fname)
+        if path is None:
+            return 403, {}, 'Access denied'
+        cached = self.get(path, expires=expires)
+        if cached is None:
+            return 404, {}, 'File does not exist'
+
+        max_age = cached.max_age(default=self.max_age)
+        use_gzip = self.use_gzip and len(cached.data) >= GZIP_MIN_SIZE and \
+            'gzip' in headers.get('Accept-Encoding', '')
+        response_headers = {
+            'Content-Type': mimetype,
+            'ETag': cached.gzip_etag if use_gzip else cached.etag,
+            'Last-Modified': email.utils.formatdate(cached.mtime,
+                                                    usegmt=True),
+            'Cache-Control': 'public, max-age={0}'.format(max_age),
+        }
+        if max_age == 0:
+            response_headers['Cache-Control'] = 'no-cache'
+        if self.use_gzip:
+            response_headers['Vary'] = 'Accept-Encoding'
+
+        if cached.not_modified(headers.get('If-None-Match'),
+                               headers.get('If-Modified-Since')):
+            with self._lock:
+                self.stats['not_modified'] += 1
+            del response_headers['Content-Type']
+            return 304, response_headers, ''
+
+        body = cached.data
+        if use_gzip:
+            body = cached.gzip_data
+            response_headers['Content-Encoding'] = 'gzip'
+        response_headers['Content-Length'] = str(len(body))
+        return 200, response_headers, body
@@ -0,0 +1,326 @@
+"""
+.. module:: idempotency
+   :platform: Unix, VMS
+   :synopsis: Lookup of issued certificates by public key and subject
+
+.. moduleauthor:: Lex van Roon <r3boot@r3blog.nl>
+"""
+import base64
+import binascii
+import hashlib
+import re
+import struct
+import threading
+import time
+
+import pkilib.utils as utils
+from pkilib.server import certindex
+
+
+# Matches a single PEM encoded block and its label
+PEM_BLOCK = re.compile(
+    r'-----BEGIN ([A-Z ]+)-----(.*?)-----END \1-----', re.DOTALL
+)
+
+# Labels used for certificate signing requests
+CSR_LABELS = ['CERTIFICATE REQUEST', 'NEW CERTIFICATE REQUEST']
+
+# DER tags which are needed to find the fields
+TAG_SET = 0x31
+TAG_VERSION = 0xa0
+TAG_UTCTIME = 0x17
+TAG_GENERALIZEDTIME = 0x18
+
+
+def pem_to_der(pem, labels):
+    """Decode the first PEM block with one of the given labels
+
+    :param pem:     PEM encoded data
+    :type  pem:     str
+    :param labels:  Labels which are accepted
+    :type  labels:  list
+    :returns:       The DER encoded data or None
+    :rtype:         bytes, None
+    """
+    if not isinstance(pem, str):
+        return None
+    for match in PEM_BLOCK.finditer(pem):
+        if match.group(1) not in labels:
+            continue
+        try:
+            return base64.b64decode(''.join(match.group(2).split()),
+                                    validate=True)
+        except (binascii.Error, ValueError):
+            return None
+    return None
+
+
+def der_element(data, offset):
+    """Read the header of the DER element starting at offset
+
+    :param data:    DER encoded data
+    :type  data:    bytes
+    :param offset:  Offset of the element
+    :type  offset:  int
+    :returns:       Tuple containing the tag and the start and end offsets
+                    of the contents
+    :rtype:         tuple
+    :raises:        ValueError if the element is invalid
+    """
+    if offset + 2 > len(data):
+        raise ValueError('truncated element')
+    tag = data[offset]
+    length = data[offset + 1]
+    start = offset + 2
+    if length & 0x80:
+        size = length & 0x7f
+        if size == 0 or size > 4:
+            raise ValueError('unsupported length')
+        length = int.from_bytes(data[start:start + size], 'big')
+        start += size
+    end = start + length
+    if end > len(data):
+        raise ValueError('truncated element')
+    return tag, start, end
+
+
+def der_children(data, start, end):
+    """Read the headers of all elements between start and end
+
+    :param data:    DER encoded data
+    :type  data:    bytes
+    :param start:   Offset of the first element
+    :type  start:   int
+    :param end:     Offset at which the last element ends
+    :type  end:     int
+    :returns:       List of tuples as returned by der_element
+    :rtype:         list
+    """
+    children = []
+    while start < end:
+        child = der_element(data, start)
+        children.append(child)
+        start = child[2]
+    if start != end:
+        raise ValueError('element exceeds its parent')
+    return children
+
+
+def issued_key(data, subject, spki):
+    """Calculate the key for a subject and public key. The order and string
+    types of the subject fields are ignored, since openssl ca may change
+    them when it signs a request.
+
+    :param data:    DER encoded certificate or request
+    :type  data:    bytes
+    :param subject: Header of the subject, as returned by der_element
+    :type  subject: tuple
+    :param spki:    Header of the public key, as returned by der_element
+    :type  spki:    tuple
+    :returns:       SHA256 hexdigest identifying the subject and public key
+    :rtype:         str
+    """
+    fields = []
+    for tag, start, end in der_children(data, subject[1], subject[2]):
+        if tag != TAG_SET:
+            raise ValueError('invalid subject')
+        for tag, start, end in der_children(data, start, end):
+            oid, value = der_children(data, start, end)
+            fields.append((data[oid[1]:oid[2]], data[value[1]:value[2]]))
+
+    digest = hashlib.sha256()
+    for oid, value in sorted(fields):
+        digest.update(struct.pack('!HH', len(oid), len(value)))
+        digest.update(oid + value)
+    digest.update(b'\x00' * 4)
+    digest.update(data[spki[1]:spki[2]])
+    return digest.hexdigest()
+
+
+def csr_key(pem):
+    """Calculate the key for a PEM encoded certificate signing request,
+    which matches the key of the certificates signed for it:
+
+    >>> csr_key(open('/path/to/host.csr').read())
+    '9c1185a5c5e9fc54612808977ee8f548b2258d31...'
+
+    :param pem: PEM encoded certificate signing request
+    :type  pem: str
+    :returns:   The key or None if pem is not a valid request
+    :rtype:     str, None
+    """
+    data = pem_to_der(pem, CSR_LABELS)
+    if data is None:
+        return None
+    try:
+        tag, start, end = der_element(data, 0)
+        tag, start, end = der_children(data, start, end)[0]
+        children = der_children(data, start, end)
+        return issued_key(data, children[1], children[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def parse_time(data, element):
+    """Convert a DER encoded UTCTime or GeneralizedTime into seconds since
+    the epoch
+
+    :param data:    DER encoded data
+    :type  data:    bytes
+    :param element: Header of the time, as returned by der_element
+    :type  element: tuple
+    :returns:       Seconds since the epoch or None
+    :rtype:         int, None
+    """
+    if element[0] not in [TAG_UTCTIME, TAG_GENERALIZEDTIME]:
+        return None
+    return utils.asn1_to_epoch(
+        data[element[1]:element[2]].decode('ascii', 'replace')
+    )
+
+
+def cert_details(pem):
+    """Read the key and validity of a PEM encoded certificate
+
+    >>> cert_details(open('/path/to/cert.pem').read())
+    {'key': '9c1185a5c5e9fc54...', 'notbefore': 1500000000, ...}
+
+    :param pem: PEM encoded certificate
+    :type  pem: str
+    :returns:   Dictionary containing the key, notbefore and notafter, or
+                None if pem is not a valid certificate
+    :rtype:     dict, None
+    """
+    data = pem_to_der(pem, ['CERTIFICATE'])
+    if data is None:
+        return None
+    try:
+        tag, start, end = der_element(data, 0)
+        tag, start, end = der_children(data, start, end)[0]
+        children = der_children(data, start, end)
+        if children[0][0] == TAG_VERSION:
+            children = children[1:]
+        validity = der_children(data, children[3][1], children[3][2])
+        return {
+            'key': issued_key(data, children[4], children[5]),
+            'notbefore': parse_time(data, validity[0]),
+            'notafter': parse_time(data, validity[1]),
+        }
+    except (IndexError, ValueError):
+        return None
+
+
+class IssuedIndex(object):
+    """Class which finds the valid certificates which were issued for a
+    certificate signing request, so a request which is submitted again can
+    be answered without signing it again. Certificates are identified by
+    their subject and public key, which are read from the certificates of
+    the fqdn in the request the first time they are needed. Declare a new
+    instance as follows:
+
+    >>> issued = IssuedIndex(index)
+    >>> issued.lookup('some.host.name', csr_key(csr))
+    {'serial': '0A', 'fqdn': 'some.host.name', 'notbefore': ..., ...}
+
+    :param index:   Index containing the certificates issued by the CA
+    :type  index:   pkilib.server.certindex.CertIndex
+    """
+    def __init__(self, index):
+        self.index = index
+        self.stats = {'hits': 0, 'misses': 0}
+        self._details = {}
+        self._signing = {}
+        self._lock = threading.Lock()
+
+    def details(self, serial):
+        """Lookup the key and validity of the certificate with the given
+        serial. Since an issued certificate never changes, it is only read
+        once.
+
+        :param serial:  Serial of the certificate in hexadecimal notation
+        :type  serial:  str
+        :returns:       Dictionary as returned by cert_details, or None
+        :rtype:         dict, None
+        """
+        if serial not in self._details:
+            details = cert_details(self.index.certificate(serial))
+            if details is None:
+                return None
+            self._details[serial] = details
+        return self._details[serial]
+
+    def lookup(self, fqdn, key, now=None):
+        """Find the most recently issued valid certificate for fqdn which
+        matches the key of a certificate signing request
+
+        :param fqdn:    Fully-Qualified Domain-Name of the request
+        :type  fqdn:    str
+        :param key:     Key of the request, as returned by csr_key
+        :type  key:     str
+        :param now:     Current time in seconds since the epoch
+        :type  now:     int
+        :returns:       Certificate details including notbefore, or None
+        :rtype:         dict, None
+        """
+        if now is None:
+            now = time.time()
+        found = None
+        if key is not None:
+            self.index.refresh()
+            certs = []
+            after = None
+            while True:
+                page, after = self.index.query(
+                    fqdn=fqdn, status=certindex.STATUS_VALID, after=after,
+                    limit=certindex.MAX_PAGE_SIZE,
+                )
+                certs.extend(page)
+                if after is None:
+                    break
+            for cert in reversed(certs):
+                details = self.details(cert['serial'])
+                if details is None or details['key'] != key:
+                    continue
+                if details['notafter'] is None or details['notafter'] <= now:
+                    continue
+                found = dict(cert)
+                found['notbefore'] = details['notbefore']
+                break
+        self.stats['hits' if found else 'misses'] += 1
+        return found
+
+    def acquire(self, key, timeout=None):
+        """Wait until no other request with the same key is being signed,
+        so a request which is submitted again while the first one is still
+        being signed finds its certificate instead of signing it twice
+
+        :param key:     Key of the request, as returned by csr_key
+        :type  key:     str
+        :param timeout: Maximum number of seconds to wait
+        :type  timeout: float
+        :returns:       True if the key was acquired, else False
+        :rtype:         bool
+        """
+        with self._lock:
+            entry = self._signing.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        if entry[0].acquire(timeout=-1 if timeout is None else timeout):
+            return True
+        self._forget(key)
+        return False
+
+    def release(self, key):
+        """Release a key acquired with acquire
+
+        :param key:     Key of the request, as returned by csr_key
+        :type  key:     str
+        """
+        self._signing[key][0].release()
+        self._forget(key)
+
+    def _forget(self, key):
+        with self._lock:
+            entry = self._signing[key]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._signing[key]
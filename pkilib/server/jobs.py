@@ -0,0 +1,257 @@
+"""
+.. module:: jobs
+   :platform: Unix, VMS
+   :synopsis: In-memory store for asynchronously running jobs
+
+.. moduleauthor:: Lex van Roon <r3boot@r3blog.nl>
+"""
+import threading
+import time
+
+import pkilib.log as log
+import pkilib.utils as utils
+
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+# Number of seconds a finished job is kept around for clients to collect it
+JOB_TTL = 3600
+
+# Maximum number of jobs which are queued or running at the same time
+MAX_PENDING = 16
+
+
+class Job(object):
+    """Class representing a single job. The result attribute contains the
+    value returned by the function which was run for this job.
+
+    :param job_id:  Unique identifier for this job
+    :type  job_id:  str
+    :param name:    Descriptive name for this job
+    :type  name:    str
+    """
+    def __init__(self, job_id, name):
+        self.job_id = job_id
+        self.name = name
+        self.state = JOB_QUEUED
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+
+    @property
+    def pending(self):
+        """Flag indicating if this job has not finished yet
+
+        :returns:   True if the job is queued or running, else False
+        :rtype:     bool
+        """
+        return self.state in [JOB_QUEUED, JOB_RUNNING]
+
+    def as_dict(self):
+        """Return the public details of this job as a dictionary
+
+        :returns:   Dictionary containing the job details
+        :rtype:     dict
+        """
+        return {
+            'job': self.job_id,
+            'name': self.name,
+            'state': self.state,
+            'error': self.error,
+            'created': self.created,
+            'finished': self.finished,
+        }
+
+
+class JobStore(object):
+    """Class representing a store of jobs which run in background threads.
+    Clients can wait for a job to finish using a long poll. Declare a new
+    instance as follows:
+
+    >>> store = JobStore()
+    >>> job = store.submit('some.host.name', sign, csr, crt)
+    >>> store.wait(job.job_id, timeout=30).state
+    'done'
+
+    :param ttl:         Number of seconds to keep finished jobs
+    :type  ttl:         int
+    :param max_pending: Maximum number of jobs which are queued or running
+    :type  max_pending: int
+    """
+    def __init__(self, ttl=JOB_TTL, max_pending=MAX_PENDING):
+        self._ttl = ttl
+        self.max_pending = max(1, int(max_pending))
+        self._jobs = {}
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    @property
+    def pending(self):
+        """Number of jobs which are queued or running
+
+        :returns:   Number of pending jobs
+        :rtype:     int
+        """
+        with self._cond:
+            return self._pending()
+
+    def _pending(self):
+        """Count the pending jobs, the caller must hold the lock
+
+        :returns:   Number of pending jobs
+        :rtype:     int
+        """
+        return len([job for job in self._jobs.values() if job.pending])
+
+    def full(self):
+        """Check if a new job would be refused
+
+        :returns:   True if max_pending jobs are pending, else False
+        :rtype:     bool
+        """
+        return self.pending >= self.max_pending
+
+    def expire(self):
+        """Remove all finished jobs which are older than the ttl
+
+        :returns:   Number of removed jobs
+        :rtype:     int
+        """
+        now = time.time()
+        removed = 0
+        with self._cond:
+            for job_id in list(self._jobs.keys()):
+                job = self._jobs[job_id]
+                if job.pending or now - job.finished < self._ttl:
+                    continue
+                del self._jobs[job_id]
+                removed += 1
+        return removed
+
+    def new(self, name):
+        """Register a new job in the queued state. It will return None if
+        max_pending jobs are pending already.
+
+        :param name:    Descriptive name for the job
+        :type  name:    str
+        :returns:       The newly created job or None
+        :rtype:         Job, None
+        """
+        self.expire()
+        job = Job(utils.gentoken(), name)
+        with self._cond:
+            pending = self._pending()
+            if pending >= self.max_pending:
+                log.warning('{0} jobs are pending, refusing job for '
+                            '{1}'.format(pending, name))
+                return None
+            self._jobs[job.job_id] = job
+        return job
+
+    def get(self, job_id):
+        """Lookup a job by its identifier. It will return None if the job is
+        unknown.
+
+        :param job_id:  Identifier of the job
+        :type  job_id:  str
+        :returns:       The job or None
+        :rtype:         Job, None
+        """
+        if not isinstance(job_id, str):
+            log.warning('job_id needs to be a string')
+            return None
+        return self._jobs.get(job_id)
+
+    def update(self, job_id, state, result=None, error=None):
+        """Update the state of a job, and wake up all clients waiting on it
+
+        :param job_id:  Identifier of the job
+        :type  job_id:  str
+        :param state:   New state of the job
+        :type  state:   str
+        :param result:  Result of the job
+        :type  result:  object
+        :param error:   Description of the error if the job failed
+        :type  error:   str
+        :returns:       True if the job was updated, False if it is unknown
+        :rtype:         bool
+        """
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                log.warning('Unknown job {0}'.format(job_id))
+                return False
+            job.state = state
+            job.result = result
+            job.error = error
+            if not job.pending:
+                job.finished = time.time()
+            self._cond.notify_all()
+        return True
+
+    def wait(self, job_id, timeout=0):
+        """Wait at most timeout seconds for a job to finish, and return it.
+        It will return None if the job is unknown.
+
+        :param job_id:  Identifier of the job
+        :type  job_id:  str
+        :param timeout: Maximum number of seconds to wait
+        :type  timeout: float
+        :returns:       The job or None
+        :rtype:         Job, None
+        """
+        deadline = time.time() + max(0, timeout)
+        with self._cond:
+            job = self.get(job_id)
+            while job is not None and job.pending:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+        return job
+
+    def run(self, job_id, func, *args):
+        """Run func for a job and store its result. The job fails if func
+        raises an exception or returns False or None.
+
+        :param job_id:  Identifier of the job
+        :type  job_id:  str
+        :param func:    Function to run
+        :type  func:    function
+        """
+        self.update(job_id, JOB_RUNNING)
+        try:
+            result = func(*args)
+        except Exception as err:
+            log.warning('Job {0} failed: {1}'.format(job_id, err))
+            self.update(job_id, JOB_FAILED, error=str(err))
+            return
+        if result is False or result is None:
+            self.update(job_id, JOB_FAILED, error='Job did not succeed')
+        else:
+            self.update(job_id, JOB_DONE, result=result)
+
+    def submit(self, name, func, *args):
+        """Create a new job and run func with args in a background thread
+
+        :param name:    Descriptive name for the job
+        :type  name:    str
+        :param func:    Function to run
+        :type  func:    function
+        :returns:       The newly created job or None, see new()
+        :rtype:         Job, None
+        """
+        job = self.new(name)
+        if job is None:
+            return None
+        thread = threading.Thread(target=self.run,
+                                  args=(job.job_id, func) + args)
+        thread.daemon = True
+        thread.start()
+        return job
@@ -0,0 +1,291 @@
+"""
+.. module:: metrics
+   :platform: Unix, VMS
+   :synopsis: Lightweight metrics exposed in the Prometheus text format
+
+.. moduleauthor:: Lex van Roon <r3boot@r3blog.nl>
+"""
+import threading
+
+import pkilib.log as log
+
+
+# Default histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+           30.0, 60.0)
+
+
+def format_labels(labels):
+    """Helper function which formats a sorted tuple of label pairs into the
+    Prometheus label notation.
+
+    >>> format_labels((('method', 'get'), ('route', '/')))
+    '{method="get",route="/"}'
+
+    :param labels:  Tuple containing (name, value) tuples
+    :type  labels:  tuple
+    :returns:       String containing the formatted labels
+    :rtype:         str
+    """
+    if not labels:
+        return ''
+    fields = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+        fields.append('{0}="{1}"'.format(name, value))
+    return '{{{0}}}'.format(','.join(fields))
+
+
+def format_value(value):
+    """Helper function which formats a sample value. Integral values are
+    displayed without a fraction.
+
+    :param value:   Value to format
+    :type  value:   int, float
+    :returns:       String containing the formatted value
+    :rtype:         str
+    """
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric(object):
+    """Base class for all metrics. Samples are stored per set of labels.
+    Updating a metric only takes a lock and a dictionary update, so metrics
+    can be kept enabled at all times.
+
+    :param name:        Name of the metric
+    :type  name:        str
+    :param description: Help text for the metric
+    :type  description: str
+    """
+    metric_type = 'untyped'
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._lock = threading.Lock()
+        self._values = {}
+        self._functions = {}
+
+    @staticmethod
+    def _key(labels):
+        """Convert a dictionary of labels into a hashable key
+
+        :param labels:  Dictionary containing the labels
+        :type  labels:  dict
+        :returns:       Sorted tuple of (name, value) tuples
+        :rtype:         tuple
+        """
+        return tuple(sorted(labels.items()))
+
+    def value(self, **labels):
+        """Return the current value of this metric for a set of labels
+
+        :returns:   Current value, or None if it was never set
+        :rtype:     int, float, None
+        """
+        return self._values.get(self._key(labels))
+
+    def set_function(self, function, **labels):
+        """Register a function which returns the value of this metric for a
+        set of labels. It is only called when the metric is rendered, which
+        allows statistics kept elsewhere to be exported without any cost.
+
+        :param function:    Function returning the value of the metric
+        :type  function:    function
+        """
+        with self._lock:
+            self._functions[self._key(labels)] = function
+
+    def samples(self):
+        """Return all samples for this metric, calling the registered
+        functions. Samples for which the function fails are skipped.
+
+        :returns:   List containing (suffix, labels, value) tuples
+        :rtype:     list
+        """
+        with self._lock:
+            samples = [('', key, value) for key, value in self._values.items()]
+            functions = list(self._functions.items())
+        for key, function in functions:
+            try:
+                value = function()
+            except Exception as err:
+                log.debug('Failed to collect {0}: {1}'.format(self.name, err))
+                continue
+            if value is not None:
+                samples.append(('', key, value))
+        return samples
+
+    def render(self):
+        """Render this metric in the Prometheus text format
+
+        :returns:   List containing the lines for this metric
+        :rtype:     list
+        """
+        lines = [
+            '# HELP {0} {1}'.format(self.name, self.description),
+            '# TYPE {0} {1}'.format(self.name, self.metric_type),
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append('{0}{1}{2} {3}'.format(
+                self.name, suffix, format_labels(labels), format_value(value)
+            ))
+        return lines
+
+
+class Counter(Metric):
+    """Class representing a monotonically increasing counter"""
+    metric_type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """Increase the counter for a set of labels
+
+        :param amount:  Amount to increase the counter with
+        :type  amount:  int, float
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Class representing a value which can go up and down"""
+    metric_type = 'gauge'
+
+    def set(self, value, **labels):
+        """Set the gauge for a set of labels
+
+        :param value:   New value of the gauge
+        :type  value:   int, float
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    """Class representing a histogram of observed values
+
+    :param name:        Name of the metric
+    :type  name:        str
+    :param description: Help text for the metric
+    :type  description: str
+    :param buckets:     Upper bounds of the buckets
+    :type  buckets:     tuple
+    """
+    metric_type = 'histogram'
+
+    def __init__(self, name, description, buckets=BUCKETS):
+        Metric.__init__(self, name, description)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        """Record an observation for a set of labels
+
+        :param value:   Observed value
+        :type  value:   int, float
+        """
+        key = self._key(labels)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            data = self._values[key]
+            for idx, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[0][idx] += 1
+                    break
+            data[1] += 1
+            data[2] += value
+
+    def value(self, **labels):
+        """Return the number and sum of observations for a set of labels
+
+        :returns:   Tuple containing the count and sum, or None
+        :rtype:     tuple, None
+        """
+        data = self._values.get(self._key(labels))
+        if data is None:
+            return None
+        return data[1], data[2]
+
+    def samples(self):
+        """Return the cumulative bucket, sum and count samples
+
+        :returns:   List containing (suffix, labels, value) tuples
+        :rtype:     list
+        """
+        samples = []
+        with self._lock:
+            for key, data in self._values.items():
+                cumulative = 0
+                for idx, bound in enumerate(self.buckets):
+                    cumulative += data[0][idx]
+                    labels = key + (('le', format_value(bound)),)
+                    samples.append(('_bucket', labels, cumulative))
+                samples.append(('_bucket', key + (('le', '+Inf'),), data[1]))
+                samples.append(('_sum', key, data[2]))
+                samples.append(('_count', key, data[1]))
+        return samples
+
+
+class Registry(object):
+    """Class representing a collection of metrics which are rendered
+    together. Declare a new instance as follows:
+
+    >>> registry = Registry()
+    >>> requests = registry.counter('requests_total', 'Number of requests')
+    >>> requests.inc(route='/')
+    >>> registry.render()
+    '# HELP requests_total Number of requests\\n...'
+    """
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        """Add a metric to this registry
+
+        :param metric:  The metric to add
+        :type  metric:  Metric
+        :returns:       The added metric
+        :rtype:         Metric
+        """
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, description):
+        """Create and register a new counter
+
+        :returns:   The new counter
+        :rtype:     Counter
+        """
+        return self.register(Counter(name, description))
+
+    def gauge(self, name, description):
+        """Create and register a new gauge
+
+        :returns:   The new gauge
+        :rtype:     Gauge
+        """
+        return self.register(Gauge(name, description))
+
+    def histogram(self, name, description, buckets=BUCKETS):
+        """Create and register a new histogram
+
+        :returns:   The new histogram
+        :rtype:     Histogram
+        """
+        return self.register(Histogram(name, description, buckets=buckets))
+
+    def render(self):
+        """Render all metrics in the Prometheus text format
+
+        :returns:   String containing all metrics
+        :rtype:     str
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,94 @@
+"""
+.. module:: renewal
+   :platform: Unix, VMS
+   :synopsis: Helpers used to spread certificate renewals and retries in time
+
+.. moduleauthor:: Lex van Roon <r3boot@r3blog.nl>
+"""
+import hashlib
+import random
+
+import pkilib.log as log
+
+
+# Default fractions of the certificate lifetime between which a client is
+# expected to renew its certificate
+RENEW_START = 0.6
+RENEW_END = 0.8
+
+# Default number of seconds a client is told to wait when the API is busy
+RETRY_AFTER = 30
+
+
+def renewal_window(notbefore, notafter, fqdn, start=RENEW_START,
+                   end=RENEW_END):
+    """Calculate the window in which a client should renew the certificate
+    valid between notbefore and notafter. The window is placed between the
+    start and end fractions of the lifetime of the certificate. A per-fqdn
+    offset is added to the start of the window, so hosts which enrolled at
+    the same moment will not all come back at the same moment. This offset
+    is derived from the fqdn, so it stays the same for every renewal of a
+    host. It will return False if the input is invalid.
+
+    >>> renewal_window(0, 1000, 'some.host.name')
+    (675, 800)
+
+    :param notbefore:   Start of the certificate validity in epoch seconds
+    :type  notbefore:   int
+    :param notafter:    End of the certificate validity in epoch seconds
+    :type  notafter:    int
+    :param fqdn:        Fully-Qualified Domain-Name of the certificate
+    :type  fqdn:        str
+    :param start:       Fraction of the lifetime at which the window opens
+    :type  start:       float
+    :param end:         Fraction of the lifetime at which the window closes
+    :type  end:         float
+    :returns:           Tuple containing the start and end of the window
+    :rtype:             tuple, bool
+    """
+    try:
+        notbefore = int(notbefore)
+        notafter = int(notafter)
+    except (TypeError, ValueError):
+        log.warning('notbefore and notafter need to be numbers')
+        return False
+    if notafter <= notbefore:
+        log.warning('notafter needs to be later than notbefore')
+        return False
+    if not isinstance(fqdn, str):
+        log.warning('fqdn needs to be a string')
+        return False
+    if not 0 <= start < end <= 1:
+        log.warning('Invalid renewal window fractions')
+        return False
+
+    lifetime = notafter - notbefore
+    window_start = notbefore + int(lifetime * start)
+    window_end = notbefore + int(lifetime * end)
+
+    # Spread the start of the window over the first half of the window
+    digest = hashlib.sha256(fqdn.encode('utf-8')).hexdigest()
+    spread = int(digest[0:8], 16) / float(0xffffffff)
+    window_start += int((window_end - window_start) * 0.5 * spread)
+
+    return window_start, window_end
+
+
+def retry_after(base=RETRY_AFTER, backlog=0):
+    """Calculate the number of seconds a client should wait before retrying
+    a request which was refused because the API is busy. The delay grows with
+    the number of requests waiting in the backlog, and a random jitter of up
+    to 50% is added so refused clients do not return all at once.
+
+    >>> retry_after(30, backlog=2)
+    107
+
+    :param base:    Number of seconds to wait per waiting request
+    :type  base:    int
+    :param backlog: Number of requests currently waiting
+    :type  backlog: int
+    :returns:       Number of seconds to wait
+    :rtype:         int
+    """
+    delay = base * (1 + max(0, backlog))
+    return int(delay + random.uniform(0, delay * 0.5))
@@ -0,0 +1,252 @@
+"""
+.. module:: revocation
+   :platform: Unix, VMS
+   :synopsis: Revocation of all certificates matching a query
+
+.. moduleauthor:: Lex van Roon <r3boot@r3blog.nl>
+"""
+import calendar
+import time
+
+import pkilib.log as log
+import pkilib.utils as utils
+from pkilib import indexfile
+from pkilib.server import certindex
+from pkilib.server import idempotency
+
+
+# Revocation reasons accepted by openssl ca -crl_reason
+REASONS = [
+    'unspecified', 'keyCompromise', 'CACompromise', 'affiliationChanged',
+    'superseded', 'cessationOfOperation', 'certificateHold',
+]
+
+# Reason used when none is given
+DEFAULT_REASON = 'cessationOfOperation'
+
+
+def parse_date(value):
+    """Convert a date in YYYY-MM-DD format or seconds since the epoch into
+    seconds since the epoch:
+
+    >>> parse_date('2017-07-14')
+    1499990400
+
+    :param value:   Date to convert
+    :type  value:   str, int
+    :returns:       Seconds since the epoch or None if value is invalid
+    :rtype:         int, None
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if not isinstance(value, str):
+        return None
+    if value.isdigit():
+        return int(value)
+    try:
+        return calendar.timegm(time.strptime(value, '%Y-%m-%d'))
+    except ValueError:
+        return None
+
+
+class RevocationQuery(object):
+    """Class describing which certificates to revoke. A certificate matches
+    if it matches all of the given filters. Declare a new instance as
+    follows:
+
+    >>> query = RevocationQuery(fqdn_suffix='dc1.example.com',
+    ...                         issued_before=1500000000)
+    >>> query.matches(index.get('0A'))
+    True
+
+    :param fqdn_suffix:     Only match certificates for this domain and
+                            the hosts within it
+    :type  fqdn_suffix:     str
+    :param issued_before:   Only match certificates issued before this
+                            time, in seconds since the epoch
+    :type  issued_before:   int
+    :param serials:         Only match certificates with these serials
+    :type  serials:         list
+    :param ou:              Only match certificates with this OU
+    :type  ou:              str
+    :param certs_dir:       Directory containing the issued certificates,
+                            needed to filter on issued_before
+    :type  certs_dir:       str
+    """
+    def __init__(self, fqdn_suffix=None, issued_before=None, serials=None,
+                 ou=None, certs_dir=None):
+        if fqdn_suffix is not None:
+            fqdn_suffix = fqdn_suffix.strip('.').lower()
+        self.fqdn_suffix = fqdn_suffix
+        self.issued_before = issued_before
+        self.serials = None
+        if serials is not None:
+            self.serials = set([int(serial, 16) for serial in serials])
+        self.ou = ou
+        self.certs_dir = certs_dir
+
+    @classmethod
+    def from_dict(cls, data, certs_dir=None):
+        """Create a query from a dictionary, as received by the api or
+        built from the command line. It will return None if a filter is
+        invalid, or if no filter is given at all, since that would revoke
+        every certificate.
+
+        :param data:        Dictionary containing the filters
+        :type  data:        dict
+        :param certs_dir:   Directory containing the issued certificates
+        :type  certs_dir:   str
+        :returns:           The query or None
+        :rtype:             RevocationQuery, None
+        """
+        fqdn_suffix = data.get('fqdn_suffix') or None
+        if fqdn_suffix is not None and (
+                not isinstance(fqdn_suffix, str) or
+                not fqdn_suffix.strip('.')):
+            log.warning('Invalid fqdn_suffix: {0}'.format(fqdn_suffix))
+            return None
+
+        issued_before = data.get('issued_before')
+        if issued_before is not None:
+            issued_before = parse_date(issued_before)
+            if issued_before is None:
+                log.warning('Invalid issued_before: {0}'.format(
+                    data.get('issued_before')
+                ))
+                return None
+
+        serials = data.get('serials')
+        if serials is not None:
+            if isinstance(serials, str):
+                serials = [serial for serial in serials.split(',') if serial]
+            if not isinstance(serials, list) or not serials:
+                log.warning('serials needs to be a list of serials')
+                return None
+            for serial in serials:
+                try:
+                    int(serial, 16)
+                except (TypeError, ValueError):
+                    log.warning('Invalid serial: {0}'.format(serial))
+                    return None
+
+        ou = data.get('ou') or None
+        if ou is not None and not isinstance(ou, str):
+            log.warning('Invalid ou: {0}'.format(ou))
+            return None
+
+        if fqdn_suffix is None and issued_before is None and \
+                serials is None and ou is None:
+            log.warning('Refusing to revoke without a query')
+            return None
+        return cls(fqdn_suffix=fqdn_suffix, issued_before=issued_before,
+                   serials=serials, ou=ou, certs_dir=certs_dir)
+
+    def issued(self, cert):
+        """Read the time at which a certificate was issued from the
+        certificate itself, since the OpenSSL database does not contain it
+
+        :param cert:    Certificate details as returned by parse_index_line
+        :type  cert:    dict
+        :returns:       Seconds since the epoch or None
+        :rtype:         int, None
+        """
+        if self.certs_dir is None:
+            return None
+        crt = utils.cert_path(self.certs_dir, cert['serial'])
+        try:
+            details = idempotency.cert_details(open(crt, 'r').read())
+        except EnvironmentError as err:
+            log.warning('Failed to read {0}: {1}'.format(crt, err))
+            return None
+        if details is None:
+            return None
+        return details['notbefore']
+
+    def matches(self, cert):
+        """Check if a certificate matches all filters of this query. The
+        cheap filters are checked first, so certificates are only read for
+        the ones that are left.
+
+        :param cert:    Certificate details as returned by parse_index_line
+        :type  cert:    dict
+        :returns:       True if the certificate matches, else False
+        :rtype:         bool
+        """
+        if self.serials is not None and \
+                int(cert['serial'], 16) not in self.serials:
+            return False
+        if self.ou is not None and cert['subject'].get('OU') != self.ou:
+            return False
+        if self.fqdn_suffix is not None:
+            fqdn = (cert['fqdn'] or '').lower()
+            if fqdn != self.fqdn_suffix and \
+                    not fqdn.endswith('.' + self.fqdn_suffix):
+                return False
+        if self.issued_before is not None:
+            issued = self.issued(cert)
+            if issued is None or issued >= self.issued_before:
+                return False
+        return True
+
+
+def revoke_matching(db, query, reason=DEFAULT_REASON, now=None,
+                    dry_run=False):
+    """Mark all valid certificates matching query as revoked in the OpenSSL
+    database, in a single pass. The database is replaced atomically. The
+    caller must make sure openssl ca does not run at the same time, and
+    should regenerate the CRL afterwards.
+
+    >>> revoke_matching('/path/to/index.txt',
+    ...                 RevocationQuery(fqdn_suffix='dc1.example.com'))
+    [{'serial': '0A', 'fqdn': 'web1.dc1.example.com', ...}, ...]
+
+    :param db:      Path to the OpenSSL database
+    :type  db:      str
+    :param query:   Query selecting the certificates to revoke
+    :type  query:   RevocationQuery
+    :param reason:  Revocation reason, one of REASONS
+    :type  reason:  str
+    :param now:     Current time in seconds since the epoch
+    :type  now:     int
+    :param dry_run: Only return the certificates which would be revoked
+    :type  dry_run: bool
+    :returns:       The revoked certificates or None on errors
+    :rtype:         list, None
+    """
+    if reason not in REASONS:
+        log.warning('Invalid revocation reason: {0}'.format(reason))
+        return None
+    if now is None:
+        now = time.time()
+    try:
+        lines = open(db, 'r').readlines()
+    except EnvironmentError as err:
+        log.warning('Failed to read {0}: {1}'.format(db, err))
+        return None
+
+    revoked = []
+    output = []
+    revoked_at = '{0},{1}'.format(utils.epoch_to_asn1(int(now)), reason)
+    for line in lines:
+        cert = certindex.parse_index_line(line)
+        if cert is not None and \
+                certindex.effective_status(cert, now=now) == \
+                certindex.STATUS_VALID and query.matches(cert):
+            fields = line.rstrip('\r\n').split('\t')
+            fields[0] = certindex.STATUS_REVOKED
+            fields[2] = revoked_at
+            line = '\t'.join(fields) + '\n'
+            cert['status'] = certindex.STATUS_REVOKED
+            cert['revoked'] = int(now)
+            cert['reason'] = reason
+            revoked.append(cert)
+        output.append(line)
+
+    if not revoked or dry_run:
+        return revoked
+    if not indexfile.rewrite(db, output):
+        return None
+    log.info('Revoked {0} certificates in {1}'.format(len(revoked), db))
+    return revoked
@@ -0,0 +1,550 @@
+"""
+.. module:: snapshot
+   :platform: Unix, VMS
+   :synopsis: Immutable memory-mapped snapshots of the certificate index
+
+.. moduleauthor:: Lex van Roon <r3boot@r3blog.nl>
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+import pkilib.log as log
+import pkilib.utils as utils
+from pkilib.server import certindex
+
+
+# Identifies the file format, increase the version when it changes
+MAGIC = b'PKISNAP1'
+
+# Header containing the magic, the version of the snapshot, the number of
+# certificates, serials and fqdns, followed by the offsets of the
+# positions, serial, fingerprint, fqdn and metadata sections and the length
+# of the metadata
+HEADER = struct.Struct('!8sQIIIQQQQQI')
+
+# Offset and length of a json encoded certificate, in issue order
+POSITION = struct.Struct('!QI')
+
+# Sorted tables mapping a 20 byte key to the position of a certificate
+KEY = struct.Struct('!20sI')
+
+# Sorted table mapping the SHA1 of a fqdn to the index and number of the
+# positions of its certificates in the fqdn positions array
+FQDN = struct.Struct('!20sQI')
+
+# Entry of the fqdn positions array
+FQDN_POSITION = struct.Struct('!I')
+
+# Length of the keys used in the serial and fingerprint tables
+KEY_SIZE = 20
+
+# Number of seconds between the checks of the writer for a changed database
+PUBLISH_INTERVAL = 1.0
+
+
+def serial_key(serial):
+    """Convert a serial into the key used in the serial table
+
+    :param serial:  Serial in hexadecimal notation
+    :type  serial:  str
+    :returns:       The key or None if the serial is invalid
+    :rtype:         bytes, None
+    """
+    try:
+        return int(serial, 16).to_bytes(KEY_SIZE, 'big')
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def fingerprint_key(fingerprint):
+    """Convert a fingerprint with or without colons into the key used in
+    the fingerprint table
+
+    :param fingerprint: Fingerprint of the certificate
+    :type  fingerprint: str
+    :returns:           The key or None if the fingerprint is invalid
+    :rtype:             bytes, None
+    """
+    fingerprint = certindex.normalize_fingerprint(fingerprint)
+    if fingerprint is None:
+        return None
+    digest = bytes.fromhex(fingerprint.replace(':', ''))
+    if len(digest) != KEY_SIZE:
+        return None
+    return digest
+
+
+def fqdn_key(fqdn):
+    """Convert a fqdn into the key used in the fqdn table
+
+    :param fqdn:    Fqdn to convert
+    :type  fqdn:    str
+    :returns:       SHA1 digest of the fqdn
+    :rtype:         bytes
+    """
+    return hashlib.sha1(fqdn.encode('utf-8', 'surrogateescape')).digest()
+
+
+def read_generation(path):
+    """Read the version of the snapshot stored at path
+
+    :param path:    Path to the snapshot
+    :type  path:    str
+    :returns:       The version, or 0 if there is no valid snapshot
+    :rtype:         int
+    """
+    try:
+        with open(path, 'rb') as fdesc:
+            data = fdesc.read(HEADER.size)
+    except EnvironmentError:
+        return 0
+    if len(data) != HEADER.size:
+        return 0
+    header = HEADER.unpack(data)
+    if header[0] != MAGIC:
+        return 0
+    return header[1]
+
+
+def write_snapshot(path, certs, generation, certs_dir):
+    """Write the certificates to a new snapshot. The snapshot is written
+    next to path and renamed over it, so readers either see the previous
+    or the new version, but never a partially written file.
+
+    >>> write_snapshot('/path/to/index.snapshot', list(index), 1,
+    ...                '/path/to/certs')
+    True
+
+    :param path:        Path to the snapshot
+    :type  path:        str
+    :param certs:       Certificates as returned by CertIndex, in issue order
+    :type  certs:       list
+    :param generation:  Version of the snapshot
+    :type  generation:  int
+    :param certs_dir:   Directory containing the issued certificates
+    :type  certs_dir:   str
+    :returns:           True if the snapshot was written, else False
+    :rtype:             bool
+    """
+    data = []
+    positions = []
+    serials = []
+    fingerprints = []
+    fqdns = {}
+    offset = HEADER.size
+    for position, cert in enumerate(certs):
+        record = json.dumps(cert).encode('utf-8')
+        positions.append(POSITION.pack(offset, len(record)))
+        data.append(record)
+        offset += len(record)
+        key = serial_key(cert['serial'])
+        if key is not None:
+            serials.append((key, position))
+        key = fingerprint_key(cert['fingerprint'])
+        if key is not None:
+            fingerprints.append((key, position))
+        if cert['fqdn'] is not None:
+            fqdns.setdefault(fqdn_key(cert['fqdn']), []).append(position)
+
+    sections = [b''.join(positions)]
+    sections.append(b''.join([KEY.pack(key, position)
+                              for key, position in sorted(serials)]))
+    sections.append(b''.join([KEY.pack(key, position)
+                              for key, position in sorted(fingerprints)]))
+    fqdn_table = []
+    fqdn_positions = []
+    for key in sorted(fqdns):
+        fqdn_table.append(FQDN.pack(key, len(fqdn_positions),
+                                    len(fqdns[key])))
+        fqdn_positions.extend(fqdns[key])
+    sections.append(b''.join(fqdn_table) + b''.join(
+        [FQDN_POSITION.pack(position) for position in fqdn_positions]
+    ))
+    sections.append(json.dumps({
+        'certs_dir': certs_dir,
+        'created': int(time.time()),
+    }).encode('utf-8'))
+
+    offsets = []
+    for section in sections:
+        offsets.append(offset)
+        offset += len(section)
+    header = HEADER.pack(MAGIC, generation, len(positions), len(serials),
+                         len(fqdns), offsets[0], offsets[1], offsets[2],
+                         offsets[3], offsets[4], len(sections[4]))
+
+    tmpfile = '{0}.tmp'.format(path)
+    try:
+        with open(tmpfile, 'wb') as fdesc:
+            fdesc.write(header)
+            for chunk in data + sections:
+                fdesc.write(chunk)
+            fdesc.flush()
+            os.fsync(fdesc.fileno())
+        os.rename(tmpfile, path)
+    except EnvironmentError as err:
+        log.warning('Failed to write {0}: {1}'.format(path, err))
+        return False
+    return True
+
+
+class _View(object):
+    """A single mapped version of a snapshot. It is never modified, so
+    lookups which hold a reference to it are unaffected by a refresh."""
+    def __init__(self, fdesc, key):
+        self.key = key
+        self.mm = mmap.mmap(fdesc.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mm) < HEADER.size:
+            raise ValueError('truncated header')
+        magic, self.generation, self.count, num_serials, self.num_fqdns, \
+            self.positions, self.serials, self.fingerprints, self.fqdns, \
+            meta, len_meta = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError('invalid magic')
+        if meta + len_meta != len(self.mm):
+            raise ValueError('invalid size')
+        self.num_serials = num_serials
+        self.num_fingerprints = (self.fqdns - self.fingerprints) // KEY.size
+        self.fqdn_positions = self.fqdns + self.num_fqdns * FQDN.size
+        self.meta = json.loads(self.mm[meta:meta + len_meta].decode('utf-8'))
+
+    def record(self, position):
+        offset, length = POSITION.unpack_from(
+            self.mm, self.positions + position * POSITION.size
+        )
+        return json.loads(self.mm[offset:offset + length].decode('utf-8'))
+
+    def search(self, table, count, entry, key):
+        low = 0
+        high = count
+        while low < high:
+            middle = (low + high) // 2
+            offset = table + middle * entry.size
+            current = self.mm[offset:offset + KEY_SIZE]
+            if current < key:
+                low = middle + 1
+            elif current > key:
+                high = middle
+            else:
+                return entry.unpack_from(self.mm, offset)[1:]
+        return None
+
+    def fqdn_positions_of(self, fqdn):
+        found = self.search(self.fqdns, self.num_fqdns, FQDN, fqdn_key(fqdn))
+        if found is None:
+            return []
+        start, count = found
+        offset = self.fqdn_positions + start * FQDN_POSITION.size
+        return [FQDN_POSITION.unpack_from(self.mm,
+                                          offset + idx * FQDN_POSITION.size)[0]
+                for idx in range(count)]
+
+
+class SnapshotReader(object):
+    """Class which maps a snapshot written by write_snapshot, and offers
+    the same lookups as CertIndex. Certificates are decoded from the mapped
+    file when they are looked up, so every process reading the same
+    snapshot shares a single copy of it through the page cache. refresh()
+    switches to a newer snapshot once it has been renamed into place.
+    Declare a new instance as follows:
+
+    >>> index = SnapshotReader('/path/to/index.snapshot')
+    >>> index.refresh()
+    True
+    >>> index.get('0A')['fqdn']
+    'some.host.name'
+
+    :param path:    Path to the snapshot
+    :type  path:    str
+    """
+    def __init__(self, path):
+        self.path = path
+        self._view = None
+        self._lock = threading.Lock()
+
+    @property
+    def generation(self):
+        """Version of the mapped snapshot, or 0 if none is mapped"""
+        view = self._view
+        if view is None:
+            return 0
+        return view.generation
+
+    @property
+    def certs_dir(self):
+        """Directory containing the issued certificates"""
+        view = self._view
+        if view is None:
+            return None
+        return view.meta['certs_dir']
+
+    def __len__(self):
+        view = self._view
+        if view is None:
+            return 0
+        return view.count
+
+    def __iter__(self):
+        view = self._view
+        if view is None:
+            return iter([])
+        return iter([view.record(position)
+                     for position in range(view.count)])
+
+    def certs(self, fingerprints=True):
+        """Return the details of all certificates in the snapshot. The
+        snapshot contains the fingerprints, so these are always included.
+
+        :param fingerprints:    Ignored, see CertIndex.certs()
+        :type  fingerprints:    bool
+        :returns:               List containing the certificate details
+        :rtype:                 list
+        """
+        return list(self)
+
+    def refresh(self):
+        """Map the snapshot again if it was replaced since the last refresh.
+        The previous version stays mapped until no lookup uses it anymore.
+
+        :returns:   True if a new version was mapped, else False
+        :rtype:     bool
+        """
+        try:
+            fstat = os.stat(self.path)
+        except OSError:
+            log.warning('{0} does not exist'.format(self.path))
+            return False
+        key = (fstat.st_mtime_ns, fstat.st_size, fstat.st_ino)
+        view = self._view
+        if view is not None and view.key == key:
+            return False
+
+        with self._lock:
+            view = self._view
+            if view is not None and view.key == key:
+                return False
+            try:
+                with open(self.path, 'rb') as fdesc:
+                    key = os.fstat(fdesc.fileno())
+                    key = (key.st_mtime_ns, key.st_size, key.st_ino)
+                    view = _View(fdesc, key)
+            except (EnvironmentError, ValueError, struct.error) as err:
+                log.warning('Failed to map {0}: {1}'.format(self.path, err))
+                return False
+            if self._view is not None and \
+                    view.generation == self._view.generation:
+                self._view = view
+                return False
+            self._view = view
+        return True
+
+    def get(self, serial):
+        """Lookup a certificate by its serial
+
+        :param serial:  Serial of the certificate in hexadecimal notation
+        :type  serial:  str
+        :returns:       Certificate details or None if it is not found
+        :rtype:         dict, None
+        """
+        view = self._view
+        key = serial_key(serial) if isinstance(serial, str) else None
+        if view is None or key is None:
+            return None
+        found = view.search(view.serials, view.num_serials, KEY, key)
+        if found is None:
+            return None
+        return view.record(found[0])
+
+    def by_fingerprint(self, fingerprint):
+        """Lookup a certificate by its SHA1 fingerprint, which may be passed
+        with or without colons
+
+        :param fingerprint: Fingerprint of the certificate
+        :type  fingerprint: str
+        :returns:           Certificate details or None if it is not found
+        :rtype:             dict, None
+        """
+        view = self._view
+        key = fingerprint_key(fingerprint)
+        if view is None or key is None:
+            return None
+        found = view.search(view.fingerprints, view.num_fingerprints, KEY,
+                            key)
+        if found is None:
+            return None
+        return view.record(found[0])
+
+    def by_fqdn(self, fqdn):
+        """Lookup all certificates issued for fqdn, in the order in which
+        they were issued
+
+        :param fqdn:    Fully-Qualified Domain-Name of the certificates
+        :type  fqdn:    str
+        :returns:       List containing the certificate details
+        :rtype:         list
+        """
+        view = self._view
+        if view is None:
+            return []
+        certs = [view.record(position)
+                 for position in view.fqdn_positions_of(fqdn)]
+        return [cert for cert in certs if cert['fqdn'] == fqdn]
+
+    def certificate(self, serial):
+        """Read the PEM encoded certificate with the given serial
+
+        :param serial:  Serial of the certificate in hexadecimal notation
+        :type  serial:  str
+        :returns:       The certificate or None if it is not found
+        :rtype:         str, None
+        """
+        cert = self.get(serial)
+        if cert is None:
+            return None
+        crt = utils.cert_path(self.certs_dir, cert['serial'])
+        try:
+            return open(crt, 'r').read()
+        except EnvironmentError:
+            return None
+
+    def query(self, fqdn=None, status=None, expires_before=None, after=None,
+              limit=certindex.PAGE_SIZE):
+        """Find certificates matching all of the given filters, in the order
+        in which they were issued. See CertIndex.query for the parameters.
+
+        :returns:   Tuple containing the certificates and the serial to use
+                    for the next page or None
+        :rtype:     tuple
+        """
+        view = self._view
+        if view is None:
+            return [], None
+        if fqdn is not None:
+            positions = [position for position in
+                         view.fqdn_positions_of(fqdn)
+                         if view.record(position)['fqdn'] == fqdn]
+        else:
+            positions = range(view.count)
+
+        if after is not None:
+            key = serial_key(after)
+            found = None
+            if key is not None:
+                found = view.search(view.serials, view.num_serials, KEY, key)
+            if found is None:
+                return [], None
+            positions = [position for position in positions
+                         if position > found[0]]
+
+        now = time.time()
+        certs = []
+        for position in positions:
+            cert = view.record(position)
+            if status is not None and \
+                    certindex.effective_status(cert, now=now) != status:
+                continue
+            if expires_before is not None and \
+                    (cert['notafter'] is None or
+                     cert['notafter'] >= expires_before):
+                continue
+            if len(certs) == limit:
+                return certs, certs[-1]['serial']
+            certs.append(cert)
+        return certs, None
+
+
+class PublishedCertIndex(certindex.CertIndex):
+    """CertIndex which publishes a snapshot every time it is rebuilt, so
+    other processes can use a SnapshotReader instead of maintaining their
+    own index. The version of the snapshot keeps increasing across
+    restarts. Since the readers sign and revoke certificates as well, the
+    background thread started by start() checks the database every interval
+    seconds and publishes their changes. Declare a new instance as follows:
+
+    >>> index = PublishedCertIndex('/path/to/index.txt', '/path/to/certs',
+    ...                            '/path/to/index.snapshot')
+    >>> index.start()
+
+    :param db:          Path to the OpenSSL database
+    :type  db:          str
+    :param certs_dir:   Directory containing the issued certificates
+    :type  certs_dir:   str
+    :param snapshot:    Path to the snapshot
+    :type  snapshot:    str
+    :param metadata:    Cache containing the fingerprints of certificates
+    :type  metadata:    pkilib.metacache.MetadataCache
+    :param store:       Store containing the certificates of the database
+    :type  store:       pkilib.certstore.CertStore
+    :param interval:    Number of seconds between the checks of the database
+    :type  interval:    float
+    """
+    def __init__(self, db, certs_dir, snapshot, metadata=None, store=None,
+                 interval=PUBLISH_INTERVAL):
+        certindex.CertIndex.__init__(self, db, certs_dir, metadata=metadata,
+                                     store=store)
+        self.snapshot = snapshot
+        self.interval = interval
+        self._published = None
+        self._publish_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def refresh(self):
+        """Read the database again if it changed since the last refresh,
+        and publish a new snapshot if the index was rebuilt
+
+        :returns:   True if the index was rebuilt, else False
+        :rtype:     bool
+        """
+        rebuilt = certindex.CertIndex.refresh(self)
+        if self.generation != self._published:
+            self.publish()
+        return rebuilt
+
+    def publish(self):
+        """Write the current contents of the index to the snapshot
+
+        :returns:   True if the snapshot is up to date, else False
+        :rtype:     bool
+        """
+        with self._publish_lock:
+            generation = self.generation
+            if generation == self._published:
+                return True
+            version = read_generation(self.snapshot) + 1
+            if not write_snapshot(self.snapshot, list(self), version,
+                                  self.certs_dir):
+                return False
+            self._published = generation
+            log.debug('Published version {0} of {1}'.format(
+                version, self.snapshot
+            ))
+        return True
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh()
+            except EnvironmentError as err:
+                log.warning('Failed to publish {0}: {1}'.format(
+                    self.snapshot, err
+                ))
+
+    def start(self):
+        """Start the background thread"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread and wait for it to exit"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,119 @@
+import threading
+import time
+
+import pkilib.server.admission as admission
+import pkilib.utils as utils
+from pkilib import records
+
+
+class test_SigningQueue_creation:
+    def test_minimum_concurrency(self):
+        queue = admission.SigningQueue(concurrency=0)
+        assert queue.concurrency == 1
+
+    def test_empty_queue(self):
+        queue = admission.SigningQueue()
+        assert queue.depth == 0
+        assert queue.active == 0
+        assert queue.full() is False
+
+
+class test_SigningQueue_acquire:
+    def setUp(self):
+        self.queue = admission.SigningQueue(concurrency=1, max_queue=1)
+
+    def test_acquire_release(self):
+        assert self.queue.acquire() is True
+        assert self.queue.active == 1
+        self.queue.release()
+        assert self.queue.active == 0
+
+    def test_timeout(self):
+        assert self.queue.acquire() is True
+        assert self.queue.acquire(timeout=0.05) is False
+        assert self.queue.depth == 0
+        assert self.queue.stats()['timeouts'] == 1
+
+    def test_shed_when_full(self):
+        assert self.queue.acquire() is True
+        waiter = threading.Thread(target=self.queue.acquire)
+        waiter.start()
+        while self.queue.depth == 0:
+            time.sleep(0.01)
+        assert self.queue.full() is True
+        assert self.queue.acquire() is False
+        assert self.queue.stats()['shed'] == 1
+        self.queue.release()
+        waiter.join()
+        assert self.queue.active == 1
+
+    def test_slot(self):
+        with self.queue.slot() as admitted:
+            assert admitted is True
+            assert self.queue.active == 1
+        assert self.queue.active == 0
+        assert self.queue.stats()['service_avg'] >= 0
+
+
+class test_SigningQueue_priority:
+    def test_urgent_served_first(self):
+        queue = admission.SigningQueue(concurrency=1, max_queue=4)
+        order = []
+
+        def worker(priority):
+            with queue.slot(priority):
+                order.append(priority)
+
+        assert queue.acquire() is True
+        threads = []
+        for priority in [admission.PRIORITY_ENROLMENT,
+                         admission.PRIORITY_RENEWAL,
+                         admission.PRIORITY_URGENT]:
+            thread = threading.Thread(target=worker, args=(priority,))
+            thread.start()
+            threads.append(thread)
+            while queue.depth < len(threads):
+                time.sleep(0.01)
+        queue.release()
+        for thread in threads:
+            thread.join()
+        assert order == [admission.PRIORITY_URGENT,
+                         admission.PRIORITY_RENEWAL,
+                         admission.PRIORITY_ENROLMENT]
+
+
+class test_signing_priority:
+    def setUp(self):
+        self.now = 1500000000
+        self.urgent = 14 * 86400
+
+    def cert(self, status, days, revoked=''):
+        line = '{0}\t{1}\t{2}\t0A\tunknown\t/C=NL/O=Test/CN=some.host.name'
+        return records.CertRecord.from_line(line.format(
+            status, utils.epoch_to_asn1(self.now + days * 86400), revoked
+        ))
+
+    def test_enrolment(self):
+        assert admission.signing_priority([], self.urgent, now=self.now) == \
+            admission.PRIORITY_ENROLMENT
+        assert admission.signing_priority(None, self.urgent) == \
+            admission.PRIORITY_ENROLMENT
+
+    def test_renewal(self):
+        certs = [self.cert('V', 30)]
+        assert admission.signing_priority(certs, self.urgent,
+                                          now=self.now) == \
+            admission.PRIORITY_RENEWAL
+
+    def test_urgent(self):
+        certs = [self.cert('V', 30), self.cert('V', 3)]
+        assert admission.signing_priority(certs, self.urgent,
+                                          now=self.now) == \
+            admission.PRIORITY_URGENT
+
+    def test_revoked(self):
+        revoked = utils.epoch_to_asn1(self.now - 86400)
+        certs = [self.cert('R', 3, revoked=revoked)]
+        assert admission.signing_priority(certs, self.urgent,
+                                          now=self.now) == \
+            admission.PRIORITY_ENROLMENT
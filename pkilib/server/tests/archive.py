@@ -0,0 +1,224 @@
+import os
+import shutil
+import threading
+
+import pkilib.server.archive as archive
+import pkilib.server.certindex as certindex
+from pkilib import synthetic
+
+TEST_DIR = './workspace/archive'
+TEST_DB = '{0}/index.txt'.format(TEST_DIR)
+TEST_CERTS = '{0}/certs'.format(TEST_DIR)
+TEST_ARCHIVE = '{0}/archive'.format(TEST_DIR)
+
+DAY = 86400
+NOW = 1500000000
+
+
+def write_workspace(size, seed=0):
+    records = synthetic.gen_records(size, seed=seed, now=NOW)
+    open(TEST_DB, 'w').write(
+        '\n'.join([synthetic.db_line(record) for record in records]) + '\n'
+    )
+    synthetic.write_certificates((TEST_CERTS, {'CN': 'Test CA'}, records))
+    return records
+
+
+def archived(records, grace=archive.GRACE_DAYS):
+    return [record for record in records
+            if record['status'] != 'R' and
+            record['notafter'] < NOW - grace * DAY]
+
+
+class test_archivable:
+    def test_expired(self):
+        cert = {'status': 'E', 'notafter': NOW - DAY}
+        assert archive.archivable(cert, NOW) is True
+
+    def test_valid_but_expired(self):
+        cert = {'status': 'V', 'notafter': NOW - DAY}
+        assert archive.archivable(cert, NOW) is True
+
+    def test_within_grace(self):
+        cert = {'status': 'E', 'notafter': NOW - DAY}
+        assert archive.archivable(cert, NOW - 2 * DAY) is False
+
+    def test_revoked(self):
+        cert = {'status': 'R', 'notafter': NOW - DAY}
+        assert archive.archivable(cert, NOW) is False
+
+
+class test_compact:
+    def setUp(self):
+        os.makedirs(TEST_CERTS)
+        self.records = write_workspace(200)
+        self.archive = archive.Archive(TEST_ARCHIVE)
+
+    def tearDown(self):
+        shutil.rmtree(TEST_DIR)
+
+    def test_compact(self):
+        expected = archived(self.records)
+        assert len(expected) > 0
+        assert archive.compact(TEST_DB, TEST_CERTS, self.archive,
+                               now=NOW) == len(expected)
+
+        index = certindex.CertIndex(TEST_DB, TEST_CERTS)
+        index.refresh()
+        assert len(index) == len(self.records) - len(expected)
+        for record in expected:
+            assert index.get(record['serial']) is None
+            assert not os.path.exists('{0}/{1}.pem'.format(
+                TEST_CERTS, record['serial']))
+        assert os.path.exists('{0}/segment-000001.tar.gz'.format(
+            TEST_ARCHIVE))
+
+    def test_keeps_revoked(self):
+        archive.compact(TEST_DB, TEST_CERTS, self.archive, now=NOW)
+        index = certindex.CertIndex(TEST_DB, TEST_CERTS)
+        index.refresh()
+        revoked = [record for record in self.records
+                   if record['status'] == 'R']
+        assert len(revoked) > 0
+        for record in revoked:
+            assert index.get(record['serial']) is not None
+
+    def test_grace(self):
+        expected = archived(self.records, grace=0)
+        assert archive.compact(TEST_DB, TEST_CERTS, self.archive, now=NOW,
+                               grace=0) == len(expected)
+
+    def test_dry_run(self):
+        before = open(TEST_DB).read()
+        assert archive.compact(TEST_DB, TEST_CERTS, self.archive, now=NOW,
+                               dry_run=True) == len(archived(self.records))
+        assert open(TEST_DB).read() == before
+        assert not os.path.exists(TEST_ARCHIVE)
+
+    def test_nothing_to_archive(self):
+        archive.compact(TEST_DB, TEST_CERTS, self.archive, now=NOW)
+        assert archive.compact(TEST_DB, TEST_CERTS, self.archive,
+                               now=NOW) == 0
+        assert self.archive.next_segment() == 'segment-000002.tar.gz'
+
+    def test_failed_rewrite(self):
+        os.makedirs('{0}.new'.format(TEST_DB))
+        before = open(TEST_DB).read()
+        assert archive.compact(TEST_DB, TEST_CERTS, self.archive,
+                               now=NOW) is None
+        assert open(TEST_DB).read() == before
+        for record in archived(self.records):
+            assert os.path.exists('{0}/{1}.pem'.format(
+                TEST_CERTS, record['serial']))
+
+    def test_nonexisting_db(self):
+        assert archive.compact('{0}/unknown'.format(TEST_DIR), TEST_CERTS,
+                               self.archive, now=NOW) is None
+
+    def test_interrupted(self):
+        expected = archived(self.records)
+        lines = open(TEST_DB).readlines()
+        archive.compact(TEST_DB, TEST_CERTS, self.archive, now=NOW)
+        open(TEST_DB, 'w').write(''.join(lines))
+        assert archive.compact(TEST_DB, TEST_CERTS, self.archive,
+                               now=NOW) == len(expected)
+        assert self.archive.next_segment() == 'segment-000002.tar.gz'
+        assert len(open(self.archive.index).readlines()) == len(expected)
+
+
+class test_Archive:
+    def setUp(self):
+        os.makedirs(TEST_CERTS)
+        self.records = write_workspace(200)
+        self.expected = archived(self.records)
+        self.pems = dict([
+            (record['serial'], open('{0}/{1}.pem'.format(
+                TEST_CERTS, record['serial'])).read())
+            for record in self.expected
+        ])
+        archive.compact(TEST_DB, TEST_CERTS, archive.Archive(TEST_ARCHIVE),
+                        now=NOW)
+        self.archive = archive.Archive(TEST_ARCHIVE)
+
+    def tearDown(self):
+        shutil.rmtree(TEST_DIR)
+
+    def test_load(self):
+        assert self.archive.load() is True
+        assert len(self.archive) == len(self.expected)
+        assert self.archive.load() is False
+
+    def test_load_nonexisting(self):
+        assert archive.Archive(TEST_DIR + '/unknown').load() is False
+
+    def test_lookup(self):
+        record = self.expected[0]
+        cert = self.archive.lookup(record['serial'].lower())
+        assert cert['fqdn'] == record['fqdn']
+        assert cert['notafter'] == record['notafter']
+        assert cert['segment'] == 'segment-000001.tar.gz'
+
+    def test_lookup_unknown(self):
+        assert self.archive.lookup('FFFFFF') is None
+        assert self.archive.lookup(None) is None
+
+    def test_by_fingerprint(self):
+        record = self.expected[-1]
+        fingerprint = certindex.pem_fingerprint(self.pems[record['serial']])
+        cert = self.archive.by_fingerprint(fingerprint.replace(':', ''))
+        assert cert['serial'] == record['serial']
+
+    def test_certificate(self):
+        for record in self.expected[:5]:
+            assert self.archive.certificate(record['serial']) == \
+                self.pems[record['serial']]
+
+    def test_next_segment_after_removal(self):
+        first = '{0}/segment-000001.tar.gz'.format(TEST_ARCHIVE)
+        shutil.copy(first, '{0}/segment-000002.tar.gz'.format(TEST_ARCHIVE))
+        os.unlink(first)
+        assert self.archive.next_segment() == 'segment-000003.tar.gz'
+
+    def test_certificate_missing_segment(self):
+        record = self.expected[0]
+        os.unlink('{0}/segment-000001.tar.gz'.format(TEST_ARCHIVE))
+        assert self.archive.certificate(record['serial']) is None
+
+
+class test_Compactor:
+    def setUp(self):
+        os.makedirs(TEST_CERTS)
+        self.records = write_workspace(50)
+        self.lock = threading.Lock()
+        self.compactor = archive.Compactor(
+            TEST_DB, TEST_CERTS, archive.Archive(TEST_ARCHIVE), 0.05,
+            grace=0, lock=self.lock,
+        )
+
+    def tearDown(self):
+        self.compactor.stop()
+        shutil.rmtree(TEST_DIR)
+
+    def test_run_once(self):
+        assert self.compactor.run_once() > 0
+        assert self.compactor.stats['runs'] == 1
+        assert self.compactor.stats['archived'] > 0
+
+    def test_holds_lock(self):
+        self.lock.acquire()
+        thread = threading.Thread(target=self.compactor.run_once)
+        thread.start()
+        thread.join(0.2)
+        assert thread.is_alive()
+        assert self.compactor.stats['runs'] == 0
+        self.lock.release()
+        thread.join()
+        assert self.compactor.stats['runs'] == 1
+
+    def test_start_stop(self):
+        self.compactor.start()
+        event = threading.Event()
+        while self.compactor.stats['runs'] == 0:
+            event.wait(0.01)
+        self.compactor.stop()
+        assert self.compactor.stats['runs'] > 0
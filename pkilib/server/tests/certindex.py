@@ -0,0 +1,339 @@
+import os
+import shutil
+import subprocess
+import time
+
+import pkilib.server.certindex as certindex
+import pkilib.utils as utils
+from pkilib import certstore
+from pkilib import metacache
+from pkilib import synthetic
+
+TEST_DIR = './workspace/certindex'
+TEST_DB = '{0}/index.txt'.format(TEST_DIR)
+TEST_CERTS = '{0}/certs'.format(TEST_DIR)
+TEST_LINE = 'R\t250720010135Z\t160720010135Z,keyCompromise\t0a\tunknown' + \
+    '\t/C=NL/O=Test/CN=some.host.name'
+
+NOW = 1500000000
+
+
+def write_workspace(size, seed=0):
+    records = synthetic.gen_records(size, seed=seed, now=NOW)
+    open(TEST_DB, 'w').write(
+        '\n'.join([synthetic.db_line(record) for record in records]) + '\n'
+    )
+    synthetic.write_certificates((TEST_CERTS, {'CN': 'Test CA'}, records))
+    return records
+
+
+class test_pem_fingerprint:
+    def setUp(self):
+        os.makedirs(TEST_DIR)
+
+    def tearDown(self):
+        shutil.rmtree(TEST_DIR)
+
+    def test_matches_openssl(self):
+        crt = '{0}/test.pem'.format(TEST_DIR)
+        devnull = subprocess.DEVNULL
+        subprocess.check_call([
+            'openssl', 'req', '-x509', '-new', '-nodes', '-subj', '/CN=Test',
+            '-newkey', 'ec', '-pkeyopt', 'ec_paramgen_curve:prime256v1',
+            '-keyout', '{0}/test.key'.format(TEST_DIR), '-out', crt,
+        ], stdout=devnull, stderr=devnull)
+        output = subprocess.check_output([
+            'openssl', 'x509', '-in', crt, '-noout', '-fingerprint', '-sha1'
+        ]).decode('utf-8')
+        fingerprint = output.strip().split('=', 1)[1]
+        assert certindex.pem_fingerprint(open(crt, 'r').read()) == \
+            fingerprint
+
+    def test_not_a_certificate(self):
+        assert certindex.pem_fingerprint('garbage') is None
+
+    def test_invalid_base64(self):
+        pem = '{0}\n!!!!\n{1}\n'.format(certindex.PEM_BEGIN,
+                                         certindex.PEM_END)
+        assert certindex.pem_fingerprint(pem) is None
+
+    def test_undefined(self):
+        assert certindex.pem_fingerprint(None) is None
+
+
+class test_normalize_fingerprint:
+    def test_without_colons(self):
+        assert certindex.normalize_fingerprint('4f0b3c') == '4F:0B:3C'
+
+    def test_with_colons(self):
+        assert certindex.normalize_fingerprint('4f:0b:3c') == '4F:0B:3C'
+
+    def test_invalid(self):
+        assert certindex.normalize_fingerprint('xyz') is None
+        assert certindex.normalize_fingerprint('abc') is None
+        assert certindex.normalize_fingerprint('') is None
+        assert certindex.normalize_fingerprint(None) is None
+
+
+class test_parse_index_line:
+    def test_revoked(self):
+        cert = certindex.parse_index_line(TEST_LINE)
+        assert cert['status'] == 'R'
+        assert cert['notafter'] == 1752973295
+        assert cert['revoked'] == 1468976495
+        assert cert['reason'] == 'keyCompromise'
+        assert cert['serial'] == '0A'
+        assert cert['fqdn'] == 'some.host.name'
+        assert cert['subject']['O'] == 'Test'
+
+    def test_valid(self):
+        cert = certindex.parse_index_line(
+            'V\t250720010135Z\t\t0B\tunknown\t/CN=some.host.name\n'
+        )
+        assert cert['status'] == 'V'
+        assert cert['revoked'] is None
+        assert cert['reason'] is None
+
+    def test_invalid_fields(self):
+        assert certindex.parse_index_line('V\t250720010135Z') is None
+
+    def test_invalid_status(self):
+        line = TEST_LINE.replace('R\t', 'X\t', 1)
+        assert certindex.parse_index_line(line) is None
+
+    def test_invalid_subject(self):
+        line = TEST_LINE.replace('/C=NL/O=Test/', 'C=NL/O=Test/')
+        assert certindex.parse_index_line(line) is None
+
+
+class test_effective_status:
+    def test_expired(self):
+        cert = certindex.parse_index_line(TEST_LINE.replace('R\t', 'V\t', 1))
+        assert certindex.effective_status(cert, now=1700000000) == 'V'
+        assert certindex.effective_status(cert, now=1800000000) == 'E'
+
+    def test_revoked(self):
+        cert = certindex.parse_index_line(TEST_LINE)
+        assert certindex.effective_status(cert, now=1800000000) == 'R'
+
+
+class test_json_stream:
+    def test_document(self):
+        cert = certindex.parse_index_line(TEST_LINE)
+        document = ''.join(certindex.json_stream([cert, cert], '0A'))
+        data = certindex.json.loads(document)
+        assert len(data['certs']) == 2
+        assert data['certs'][0]['serial'] == '0A'
+        assert data['next'] == '0A'
+
+    def test_empty(self):
+        data = certindex.json.loads(''.join(certindex.json_stream([])))
+        assert data == {'certs': [], 'next': None}
+
+
+class test_CertIndex:
+    def setUp(self):
+        os.makedirs(TEST_CERTS)
+        self.records = write_workspace(100)
+        self.index = certindex.CertIndex(TEST_DB, TEST_CERTS)
+
+    def tearDown(self):
+        shutil.rmtree(TEST_DIR)
+
+    def test_refresh(self):
+        assert self.index.refresh() is True
+        assert len(self.index) == 100
+        assert self.index.refresh() is False
+
+    def test_refresh_nonexisting(self):
+        index = certindex.CertIndex('{0}/unknown'.format(TEST_DIR),
+                                    TEST_CERTS)
+        assert index.refresh() is False
+
+    def test_refresh_on_change(self):
+        self.index.refresh()
+        write_workspace(50, seed=1)
+        os.utime(TEST_DB, (time.time() + 10, time.time() + 10))
+        assert self.index.refresh() is True
+        assert len(self.index) == 50
+
+    def test_certs(self):
+        self.index.refresh()
+        certs = self.index.certs(fingerprints=False)
+        assert [cert['serial'] for cert in certs] == \
+            [cert['serial'] for cert in self.index]
+        assert set([cert['fingerprint'] for cert in certs]) == set([None])
+        assert None not in [cert['fingerprint'] for cert in self.index]
+
+    def test_get(self):
+        self.index.refresh()
+        record = self.records[10]
+        cert = self.index.get(record['serial'].lower())
+        assert cert['fqdn'] == record['fqdn']
+        assert cert['status'] == record['status']
+        assert cert['notafter'] == record['notafter']
+
+    def test_get_unknown(self):
+        self.index.refresh()
+        assert self.index.get('FFFFFF') is None
+        assert self.index.get(None) is None
+
+    def test_by_fingerprint(self):
+        self.index.refresh()
+        record = self.records[20]
+        pem = open('{0}/{1}.pem'.format(TEST_CERTS,
+                                        record['serial'])).read()
+        fingerprint = certindex.pem_fingerprint(pem)
+        cert = self.index.by_fingerprint(fingerprint.replace(':', ''))
+        assert cert['serial'] == record['serial']
+        assert self.index.by_fingerprint('00') is None
+
+    def test_by_fqdn(self):
+        self.index.refresh()
+        fqdn = self.records[0]['fqdn']
+        assert [cert['serial'] for cert in self.index.by_fqdn(fqdn)] == \
+            [record['serial'] for record in self.records
+             if record['fqdn'] == fqdn]
+        assert self.index.by_fqdn('unknown.host.name') == []
+
+    def test_certificate(self):
+        self.index.refresh()
+        pem = self.index.certificate(self.records[0]['serial'])
+        assert pem.startswith(certindex.PEM_BEGIN)
+        assert self.index.certificate('FFFFFF') is None
+
+    def test_sharded(self):
+        record = self.records[0]
+        pem = open('{0}/{1}.pem'.format(TEST_CERTS, record['serial'])).read()
+        utils.shard_certs(TEST_CERTS)
+        self.index.refresh()
+        assert self.index.certificate(record['serial']) == pem
+        cert = self.index.by_fingerprint(certindex.pem_fingerprint(pem))
+        assert cert['serial'] == record['serial']
+
+    def test_metadata(self):
+        record = self.records[0]
+        crt = '{0}/{1}.pem'.format(TEST_CERTS, record['serial'])
+        fingerprint = '01:' * 19 + '01'
+        cache = metacache.MetadataCache('{0}/meta.cache'.format(TEST_DIR))
+        cache.set(crt, record['serial'], None, fingerprint)
+        index = certindex.CertIndex(TEST_DB, TEST_CERTS, metadata=cache)
+        index.refresh()
+        assert index.get(record['serial'])['fingerprint'] == fingerprint
+        assert index.get(self.records[1]['serial'])['fingerprint'] == \
+            certindex.pem_fingerprint(open('{0}/{1}.pem'.format(
+                TEST_CERTS, self.records[1]['serial'])).read())
+        assert cache.hits == 1
+
+    def test_query_all(self):
+        self.index.refresh()
+        certs, next_serial = self.index.query(limit=1000)
+        assert len(certs) == 100
+        assert next_serial is None
+
+    def test_query_pages(self):
+        self.index.refresh()
+        serials = []
+        after = None
+        while True:
+            certs, after = self.index.query(after=after, limit=30)
+            serials.extend([cert['serial'] for cert in certs])
+            if after is None:
+                break
+        assert serials == [record['serial'] for record in self.records]
+
+    def test_query_fqdn(self):
+        self.index.refresh()
+        fqdn = self.records[0]['fqdn']
+        expected = [record['serial'] for record in self.records
+                    if record['fqdn'] == fqdn]
+        certs, next_serial = self.index.query(fqdn=fqdn, limit=1)
+        assert [cert['serial'] for cert in certs] == expected[:1]
+        certs, next_serial = self.index.query(fqdn=fqdn, after=next_serial)
+        assert [cert['serial'] for cert in certs] == expected[1:]
+
+    def test_query_status(self):
+        self.index.refresh()
+        certs, next_serial = self.index.query(status='R', limit=1000)
+        assert len(certs) > 0
+        for cert in certs:
+            assert cert['status'] == 'R'
+
+    def test_query_expires_before(self):
+        self.index.refresh()
+        certs, next_serial = self.index.query(expires_before=NOW,
+                                              limit=1000)
+        assert len(certs) > 0
+        for cert in certs:
+            assert cert['notafter'] < NOW
+
+    def test_query_unknown_after(self):
+        self.index.refresh()
+        assert self.index.query(after='FFFFFF') == ([], None)
+
+    def test_refresh_appended(self):
+        self.index.refresh()
+        first = self.index.store.get(self.records[0]['serial'])
+        record = dict(self.records[-1], serial='FFFF', fqdn='new.host.name',
+                      subject={'CN': 'new.host.name'})
+        open(TEST_DB, 'a').write(synthetic.db_line(record) + '\n')
+        assert self.index.refresh() is True
+        assert len(self.index) == 101
+        assert self.index.get('ffff')['fqdn'] == 'new.host.name'
+        assert self.index.store.get(self.records[0]['serial']) is first
+        assert self.index.query(after=self.records[-1]['serial']) == \
+            ([self.index.get('FFFF')], None)
+
+    def test_refresh_rewritten(self):
+        self.index.refresh()
+        serial = [record['serial'] for record in self.records
+                  if record['status'] == 'V'][0]
+        lines = open(TEST_DB).readlines()
+        tmpfile = '{0}.new'.format(TEST_DB)
+        open(tmpfile, 'w').write(''.join([
+            line.replace('V\t', 'R\t', 1) if '\t{0}\t'.format(serial) in line
+            else line for line in lines
+        ]))
+        os.rename(tmpfile, TEST_DB)
+        assert self.index.refresh() is True
+        assert len(self.index) == 100
+        assert self.index.get(serial)['status'] == 'R'
+
+
+class test_CertIndex_sqlite:
+    def setUp(self):
+        os.makedirs(TEST_CERTS)
+        self.records = write_workspace(50)
+        self.store = certstore.SQLiteStore('{0}/certs.sqlite'.format(
+            TEST_DIR), db=TEST_DB)
+        self.index = certindex.CertIndex(TEST_DB, TEST_CERTS,
+                                         store=self.store)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(TEST_DIR)
+
+    def test_refresh(self):
+        assert self.index.refresh() is True
+        assert len(self.index) == 50
+        assert self.index.refresh() is False
+
+    def test_by_fingerprint(self):
+        self.index.refresh()
+        record = self.records[20]
+        pem = open('{0}/{1}.pem'.format(TEST_CERTS,
+                                        record['serial'])).read()
+        cert = self.index.by_fingerprint(certindex.pem_fingerprint(pem))
+        assert cert['serial'] == record['serial']
+        assert cert['fqdn'] == record['fqdn']
+
+    def test_query_pages(self):
+        self.index.refresh()
+        serials = []
+        after = None
+        while True:
+            certs, after = self.index.query(after=after, limit=15)
+            serials.extend([cert['serial'] for cert in certs])
+            if after is None:
+                break
+        assert serials == [record['serial'] for record in self.records]
@@ -1,3 +1,5 @@
+import time
+
 import nose
 
 import pkilib.server.checks as checks
@@ -78,4 +80,58 @@ class test_owns_fqdn:
     def test_owned_fqdn(self):
         assert checks.owns_fqdn(LOCALHOST_PTR, LOCALHOST_A) is True
 
+    def test_long_label(self):
+        fqdn = '{0}.example.com'.format('a' * 64)
+        assert checks.valid_fqdn(fqdn) is True
+        assert checks.owns_fqdn(LOCALHOST_PTR, fqdn) is False
+
+
+class test_resolve:
+    def setUp(self):
+        checks.DNS_CACHE.clear()
 
+    def test_resolve_localhost(self):
+        assert LOCALHOST_PTR in checks.resolve(LOCALHOST_A)
+
+    def test_nonexisting_fqdn(self):
+        assert checks.resolve('some.random.host') is None
+
+    def test_nonexisting_fqdn_not_cached(self):
+        checks.resolve('some.random.host')
+        assert 'some.random.host' not in checks.DNS_CACHE
+
+    def test_second_lookup_is_cached(self):
+        checks.resolve(LOCALHOST_A)
+        hits = checks.DNS_STATS['hits']
+        checks.resolve(LOCALHOST_A)
+        assert checks.DNS_STATS['hits'] == hits + 1
+
+    def test_expired_lookup_is_refreshed(self):
+        checks.DNS_CACHE[LOCALHOST_A] = (0, ['192.0.2.1'])
+        assert LOCALHOST_PTR in checks.resolve(LOCALHOST_A)
+        assert checks.DNS_CACHE[LOCALHOST_A][0] > 0
+
+    def test_expired_lookup_is_removed(self):
+        checks.DNS_CACHE['some.random.host'] = (0, ['192.0.2.1'])
+        assert checks.resolve('some.random.host') is None
+        assert 'some.random.host' not in checks.DNS_CACHE
+
+    def test_long_label(self):
+        assert checks.resolve('{0}.example.com'.format('a' * 64)) is None
+
+    def test_cache_size(self):
+        old_value = checks.DNS_CACHE_SIZE
+        checks.DNS_CACHE_SIZE = 2
+        try:
+            checks.DNS_CACHE['expired.host'] = (0, [])
+            checks.DNS_CACHE['cached.host'] = (time.time() + 60, [])
+            checks.resolve(LOCALHOST_A)
+            assert sorted(checks.DNS_CACHE) == sorted(['cached.host',
+                                                       LOCALHOST_A])
+            checks.DNS_CACHE['other.host'] = (time.time() + 60, [])
+            checks.DNS_CACHE.pop(LOCALHOST_A)
+            checks.resolve(LOCALHOST_A)
+            assert sorted(checks.DNS_CACHE) == sorted(['other.host',
+                                                       LOCALHOST_A])
+        finally:
+            checks.DNS_CACHE_SIZE = old_value
@@ -0,0 +1,179 @@
+import os
+import shutil
+import threading
+import time
+
+import pkilib.server.certindex as certindex
+import pkilib.server.expiry as expiry
+from pkilib import synthetic
+
+TEST_DIR = './workspace/expiry'
+TEST_DB = '{0}/index.txt'.format(TEST_DIR)
+TEST_CERTS = '{0}/certs'.format(TEST_DIR)
+
+DAY = 86400
+NOW = 1500000000
+
+
+def cert(status='V', notafter=NOW + 10 * DAY, serial='0A'):
+    return {
+        'status': status,
+        'notafter': notafter,
+        'serial': serial,
+        'fqdn': 'some.host.name',
+    }
+
+
+def write_db(certs):
+    lines = []
+    for item in certs:
+        revoked = ''
+        if item['status'] == 'R':
+            revoked = synthetic.asn1_time(item['notafter'] - 100 * DAY)
+        lines.append('\t'.join([
+            item['status'], synthetic.asn1_time(item['notafter']), revoked,
+            item['serial'], 'unknown', '/CN={0}'.format(item['fqdn'])
+        ]))
+    open(TEST_DB, 'w').write('\n'.join(lines) + '\n')
+    os.utime(TEST_DB, (time.time() + len(certs), time.time() + len(certs)))
+
+
+class test_schedule:
+    def test_future(self):
+        events = expiry.schedule(cert(), [7 * DAY, 1 * DAY], NOW)
+        assert events == [(NOW + 3 * DAY, 7 * DAY), (NOW + 9 * DAY, DAY),
+                          (NOW + 10 * DAY, 0)]
+
+    def test_only_latest_passed_threshold(self):
+        events = expiry.schedule(cert(), [30 * DAY, 14 * DAY, DAY], NOW)
+        assert events == [(NOW - 4 * DAY, 14 * DAY), (NOW + 9 * DAY, DAY),
+                          (NOW + 10 * DAY, 0)]
+
+    def test_expired(self):
+        events = expiry.schedule(cert(notafter=NOW - DAY), [DAY], NOW)
+        assert events == [(NOW - DAY, 0)]
+
+    def test_revoked(self):
+        events = expiry.schedule(cert(status='R'), [DAY], NOW)
+        assert events == [(NOW + 10 * DAY, 0)]
+
+    def test_already_expired_status(self):
+        assert expiry.schedule(cert(status='E'), [DAY], NOW) == []
+
+    def test_unknown_expiry(self):
+        assert expiry.schedule(cert(notafter=None), [DAY], NOW) == []
+
+
+class test_prune_revoked:
+    def setUp(self):
+        os.makedirs(TEST_DIR)
+
+    def tearDown(self):
+        shutil.rmtree(TEST_DIR)
+
+    def test_prune(self):
+        write_db([cert(status='R', notafter=NOW - DAY, serial='01'),
+                  cert(status='R', notafter=NOW + DAY, serial='02'),
+                  cert(status='V', notafter=NOW - DAY, serial='03')])
+        assert expiry.prune_revoked(TEST_DB, now=NOW) == 1
+        lines = open(TEST_DB, 'r').read().strip().split('\n')
+        assert lines[0].split('\t')[0] == 'E'
+        assert lines[0].split('\t')[2] == ''
+        assert lines[1].split('\t')[0] == 'R'
+        assert lines[2].split('\t')[0] == 'V'
+
+    def test_nothing_to_prune(self):
+        write_db([cert(status='R', notafter=NOW + DAY)])
+        before = os.stat(TEST_DB)
+        assert expiry.prune_revoked(TEST_DB, now=NOW) == 0
+        assert os.stat(TEST_DB).st_ino == before.st_ino
+
+    def test_nonexisting(self):
+        assert expiry.prune_revoked('{0}/unknown'.format(TEST_DIR)) is None
+
+
+class test_ExpiryScheduler:
+    def setUp(self):
+        os.makedirs(TEST_CERTS)
+        self.now = int(time.time())
+        write_db([
+            cert(notafter=self.now + 10 * DAY, serial='01'),
+            cert(notafter=self.now + 2 * DAY, serial='02'),
+            cert(status='R', notafter=self.now - DAY, serial='03'),
+            cert(status='E', notafter=self.now - DAY, serial='04'),
+        ])
+        self.index = certindex.CertIndex(TEST_DB, TEST_CERTS)
+        self.scheduler = expiry.ExpiryScheduler(self.index, thresholds=[7, 1])
+        self.fired = []
+        self.scheduler.add_hook(self.fired.extend)
+
+    def tearDown(self):
+        self.scheduler.stop()
+        shutil.rmtree(TEST_DIR)
+
+    def test_rebuild(self):
+        self.scheduler.rebuild(now=self.now)
+        # 01: 7d, 1d, expiry; 02: 7d (passed), 1d, expiry; 03: expiry
+        assert len(self.scheduler) == 7
+        assert self.scheduler.next_deadline() <= self.now
+
+    def test_rebuild_without_fingerprints(self):
+        calls = []
+        loader = self.index.store.loader
+        self.index.store.loader = lambda record: calls.append(record) or \
+            loader(record)
+        self.scheduler.rebuild(now=self.now)
+        assert len(self.scheduler) == 7
+        assert calls == []
+
+    def test_run_pending(self):
+        self.scheduler.rebuild(now=self.now)
+        events = self.scheduler.run_pending(now=self.now)
+        assert sorted([(event.serial, event.threshold)
+                       for event in events]) == [('02', 7 * DAY), ('03', 0)]
+        assert self.fired == events
+        assert self.scheduler.stats['events'] == 2
+        assert self.scheduler.stats['expired'] == 1
+        assert self.scheduler.run_pending(now=self.now) == []
+
+    def test_fired_events_survive_rebuild(self):
+        self.scheduler.rebuild(now=self.now)
+        self.scheduler.run_pending(now=self.now)
+        self.scheduler.rebuild(now=self.now)
+        assert self.scheduler.run_pending(now=self.now) == []
+
+    def test_events_in_order(self):
+        self.scheduler.rebuild(now=self.now)
+        events = self.scheduler.run_pending(now=self.now + 20 * DAY)
+        assert [event.serial for event in events] == \
+            ['02', '03', '02', '02', '01', '01', '01']
+        assert events[-1].expired is True
+
+    def test_failing_hook(self):
+        def broken(events):
+            raise ValueError('broken')
+        self.scheduler.add_hook(broken)
+        self.scheduler.rebuild(now=self.now)
+        assert len(self.scheduler.run_pending(now=self.now)) == 2
+
+    def test_background_thread(self):
+        fired = threading.Event()
+        self.scheduler.add_hook(lambda events: fired.set())
+        self.scheduler.start()
+        assert fired.wait(5) is True
+        assert len(self.fired) == 2
+
+    def test_notify_after_change(self):
+        write_db([cert(notafter=self.now + 10 * DAY, serial='01')])
+        self.scheduler.start()
+        time.sleep(0.2)
+        assert self.fired == []
+        write_db([cert(notafter=self.now - 10, serial='01'),
+                  cert(notafter=self.now + 10 * DAY, serial='02')])
+        self.scheduler.notify()
+        for _ in range(50):
+            if self.fired:
+                break
+            time.sleep(0.1)
+        assert [event.serial for event in self.fired] == ['01']
+        assert self.fired[0].expired is True
@@ -0,0 +1,218 @@
+import email.utils
+import gzip
+import os
+import shutil
+import subprocess
+import time
+
+import pkilib.server.filecache as filecache
+
+TEST_DIR = './workspace/filecache'
+TEST_FILE = 'index.html'
+TEST_DATA = b'<html>' + b'x' * 1024 + b'</html>\n'
+
+
+def write(fname, data):
+    path = '{0}/{1}'.format(TEST_DIR, fname)
+    open(path, 'wb').write(data)
+    return path
+
+
+class test_parse_http_date:
+    def test_rfc1123(self):
+        assert filecache.parse_http_date(
+            'Sun, 06 Nov 1994 08:49:37 GMT') == 784111777
+
+    def test_invalid(self):
+        assert filecache.parse_http_date('yesterday') is None
+
+    def test_undefined(self):
+        assert filecache.parse_http_date(None) is None
+
+
+class test_crl_next_update:
+    def setUp(self):
+        os.makedirs(TEST_DIR)
+
+    def tearDown(self):
+        shutil.rmtree(TEST_DIR)
+
+    def test_crl(self):
+        key = '{0}/ca.key'.format(TEST_DIR)
+        crt = '{0}/ca.pem'.format(TEST_DIR)
+        crl = '{0}/ca.crl'.format(TEST_DIR)
+        cfg = write('ca.cfg', (
+            '[ ca ]\ndefault_ca = test_ca\n'
+            '[ test_ca ]\ndatabase = {0}/index.txt\n'
+            'crlnumber = {0}/crlnumber\ndefault_md = sha256\n'
+            'default_crl_days = 7\n'
+        ).format(TEST_DIR).encode('utf-8'))
+        write('index.txt', b'')
+        write('crlnumber', b'01\n')
+        devnull = subprocess.DEVNULL
+        subprocess.check_call([
+            'openssl', 'req', '-x509', '-new', '-nodes', '-subj', '/CN=Test',
+            '-newkey', 'ec', '-pkeyopt', 'ec_paramgen_curve:prime256v1',
+            '-keyout', key, '-out', crt,
+        ], stdout=devnull, stderr=devnull)
+        subprocess.check_call([
+            'openssl', 'ca', '-gencrl', '-config', cfg, '-keyfile', key,
+            '-cert', crt, '-out', crl,
+        ], stdout=devnull, stderr=devnull)
+        next_update = filecache.crl_next_update(crl)
+        assert abs(next_update - (time.time() + 7 * 86400)) < 120
+
+    def test_not_a_crl(self):
+        path = write('ca.crl', b'garbage')
+        assert filecache.crl_next_update(path) is None
+
+
+class test_CachedFile:
+    def setUp(self):
+        os.makedirs(TEST_DIR)
+        path = write(TEST_FILE, TEST_DATA)
+        self.cached = filecache.CachedFile(path, TEST_DATA, os.stat(path))
+
+    def tearDown(self):
+        shutil.rmtree(TEST_DIR)
+
+    def test_etag(self):
+        assert self.cached.etag.startswith('"')
+        assert self.cached.etag.endswith('"')
+        assert self.cached.gzip_etag.endswith('-gz"')
+
+    def test_gzip_data(self):
+        assert gzip.decompress(self.cached.gzip_data) == TEST_DATA
+
+    def test_max_age(self):
+        assert self.cached.max_age(default=300) == 300
+
+    def test_max_age_expires(self):
+        self.cached.expires = 1100
+        assert self.cached.max_age(default=300, now=1000) == 100
+        assert self.cached.max_age(default=60, now=1000) == 60
+        assert self.cached.max_age(default=300, now=1200) == 0
+
+    def test_if_none_match(self):
+        assert self.cached.not_modified(self.cached.etag) is True
+        assert self.cached.not_modified('"other", ' + self.cached.etag)
+        assert self.cached.not_modified('W/' + self.cached.etag) is True
+        assert self.cached.not_modified(self.cached.gzip_etag) is True
+        assert self.cached.not_modified('*') is True
+        assert self.cached.not_modified('"other"') is False
+
+    def test_if_modified_since(self):
+        since = email.utils.formatdate(self.cached.mtime, usegmt=True)
+        assert self.cached.not_modified(if_modified_since=since) is True
+        since = email.utils.formatdate(self.cached.mtime - 10, usegmt=True)
+        assert self.cached.not_modified(if_modified_since=since) is False
+
+    def test_if_none_match_wins(self):
+        since = email.utils.formatdate(self.cached.mtime, usegmt=True)
+        assert self.cached.not_modified('"other"', since) is False
+
+    def test_no_conditions(self):
+        assert self.cached.not_modified() is False
+
+
+class test_FileCache:
+    def setUp(self):
+        os.makedirs(TEST_DIR)
+        self.path = write(TEST_FILE, TEST_DATA)
+        self.cache = filecache.FileCache(max_age=60)
+
+    def tearDown(self):
+        shutil.rmtree(TEST_DIR)
+
+    def test_resolve(self):
+        assert filecache.FileCache.resolve(TEST_DIR, TEST_FILE) == \
+            os.path.abspath(self.path)
+
+    def test_resolve_outside_root(self):
+        assert filecache.FileCache.resolve(TEST_DIR, '../etc') is None
+        assert filecache.FileCache.resolve(TEST_DIR, '..') is None
+
+    def test_get(self):
+        cached = self.cache.get(self.path)
+        assert cached.data == TEST_DATA
+        assert self.cache.get(self.path) is cached
+        assert self.cache.stats['misses'] == 1
+        assert self.cache.stats['hits'] == 1
+
+    def test_get_nonexisting(self):
+        assert self.cache.get('{0}/unknown'.format(TEST_DIR)) is None
+        assert len(self.cache) == 0
+
+    def test_get_directory(self):
+        assert self.cache.get(TEST_DIR) is None
+
+    def test_refresh_on_change(self):
+        cached = self.cache.get(self.path)
+        write(TEST_FILE, b'changed')
+        os.utime(self.path, (time.time() + 10, time.time() + 10))
+        refreshed = self.cache.get(self.path)
+        assert refreshed is not cached
+        assert refreshed.data == b'changed'
+        assert refreshed.etag != cached.etag
+
+    def test_expires(self):
+        cached = self.cache.get(self.path, expires=lambda path: 12345)
+        assert cached.expires == 12345
+
+    def test_response(self):
+        status, headers, body = self.cache.response(
+            TEST_DIR, TEST_FILE, 'text/html', {}
+        )
+        assert status == 200
+        assert body == TEST_DATA
+        assert headers['Content-Type'] == 'text/html'
+        assert headers['Cache-Control'] == 'public, max-age=60'
+        assert headers['Content-Length'] == str(len(TEST_DATA))
+        assert 'ETag' in headers
+        assert 'Last-Modified' in headers
+        assert 'Content-Encoding' not in headers
+
+    def test_response_not_found(self):
+        assert self.cache.response(TEST_DIR, 'unknown', 'text/html',
+                                   {})[0] == 404
+
+    def test_response_outside_root(self):
+        assert self.cache.response(TEST_DIR, '../../etc/passwd',
+                                   'text/html', {})[0] == 403
+
+    def test_response_not_modified(self):
+        etag = self.cache.response(TEST_DIR, TEST_FILE, 'text/html',
+                                   {})[1]['ETag']
+        status, headers, body = self.cache.response(
+            TEST_DIR, TEST_FILE, 'text/html', {'If-None-Match': etag}
+        )
+        assert status == 304
+        assert body == ''
+        assert headers['ETag'] == etag
+        assert self.cache.stats['not_modified'] == 1
+
+    def test_response_expired(self):
+        status, headers, body = self.cache.response(
+            TEST_DIR, TEST_FILE, 'text/html', {},
+            expires=lambda path: time.time() - 10
+        )
+        assert headers['Cache-Control'] == 'no-cache'
+
+    def test_response_gzip(self):
+        cache = filecache.FileCache(use_gzip=True)
+        status, headers, body = cache.response(
+            TEST_DIR, TEST_FILE, 'text/html',
+            {'Accept-Encoding': 'gzip, deflate'}
+        )
+        assert headers['Content-Encoding'] == 'gzip'
+        assert headers['Vary'] == 'Accept-Encoding'
+        assert headers['ETag'].endswith('-gz"')
+        assert gzip.decompress(body) == TEST_DATA
+
+    def test_response_gzip_not_accepted(self):
+        cache = filecache.FileCache(use_gzip=True)
+        status, headers, body = cache.response(
+            TEST_DIR, TEST_FILE, 'text/html', {}
+        )
+        assert 'Content-Encoding' not in headers
+        assert body == TEST_DATA
@@ -0,0 +1,150 @@
+import os
+import shutil
+import subprocess
+import time
+
+import pkilib.server.certindex as certindex
+import pkilib.server.idempotency as idempotency
+import pkilib.utils as utils
+
+TEST_DIR = './workspace/idempotency'
+TEST_DB = '{0}/index.txt'.format(TEST_DIR)
+TEST_CERTS = '{0}/certs'.format(TEST_DIR)
+TEST_FQDN = 'some.host.name'
+TEST_SUBJECT = '/C=NL/O=Test/CN={0}'.format(TEST_FQDN)
+
+DEVNULL = subprocess.DEVNULL
+
+
+def openssl(*args):
+    subprocess.check_call(('openssl',) + args, stdout=DEVNULL,
+                          stderr=DEVNULL)
+
+
+def new_csr(name, subject=TEST_SUBJECT):
+    csr = '{0}/{1}.csr'.format(TEST_DIR, name)
+    openssl('req', '-new', '-nodes', '-subj', subject, '-newkey', 'ec',
+            '-pkeyopt', 'ec_paramgen_curve:prime256v1',
+            '-keyout', '{0}/{1}.key'.format(TEST_DIR, name), '-out', csr)
+    return open(csr, 'r').read()
+
+
+def sign_csr(name, serial, days=30):
+    crt = '{0}/{1:02X}.pem'.format(TEST_CERTS, serial)
+    openssl('x509', '-req', '-in', '{0}/{1}.csr'.format(TEST_DIR, name),
+            '-CA', '{0}/ca.pem'.format(TEST_DIR),
+            '-CAkey', '{0}/ca.key'.format(TEST_DIR),
+            '-set_serial', str(serial), '-days', str(days), '-out', crt)
+    details = idempotency.cert_details(open(crt, 'r').read())
+    open(TEST_DB, 'a').write('V\t{0}\t\t{1:02X}\tunknown\t{2}\n'.format(
+        utils.epoch_to_asn1(details['notafter']), serial, TEST_SUBJECT
+    ))
+    return details
+
+
+class test_csr_key:
+    def setUp(self):
+        os.makedirs(TEST_CERTS)
+        openssl('req', '-x509', '-new', '-nodes', '-subj', '/CN=Test CA',
+                '-newkey', 'ec', '-pkeyopt', 'ec_paramgen_curve:prime256v1',
+                '-keyout', '{0}/ca.key'.format(TEST_DIR),
+                '-out', '{0}/ca.pem'.format(TEST_DIR))
+
+    def tearDown(self):
+        shutil.rmtree(TEST_DIR)
+
+    def test_matches_certificate(self):
+        csr = new_csr('host')
+        details = sign_csr('host', 10)
+        assert idempotency.csr_key(csr) == details['key']
+        assert details['notafter'] - details['notbefore'] == 30 * 86400
+
+    def test_other_key(self):
+        new_csr('host')
+        details = sign_csr('host', 10)
+        assert idempotency.csr_key(new_csr('other')) != details['key']
+
+    def test_other_subject(self):
+        csr = new_csr('host')
+        key = '{0}/host.key'.format(TEST_DIR)
+        other = '{0}/other.csr'.format(TEST_DIR)
+        openssl('req', '-new', '-key', key, '-subj', '/CN=other.host.name',
+                '-out', other)
+        assert idempotency.csr_key(csr) != \
+            idempotency.csr_key(open(other, 'r').read())
+
+    def test_invalid(self):
+        assert idempotency.csr_key('garbage') is None
+        assert idempotency.csr_key(None) is None
+        assert idempotency.csr_key(
+            '-----BEGIN CERTIFICATE REQUEST-----\nMAA=\n'
+            '-----END CERTIFICATE REQUEST-----\n'
+        ) is None
+        assert idempotency.cert_details('garbage') is None
+
+    def test_certificate_is_not_a_csr(self):
+        new_csr('host')
+        sign_csr('host', 10)
+        pem = open('{0}/0A.pem'.format(TEST_CERTS), 'r').read()
+        assert idempotency.csr_key(pem) is None
+
+
+class test_IssuedIndex:
+    def setUp(self):
+        os.makedirs(TEST_CERTS)
+        openssl('req', '-x509', '-new', '-nodes', '-subj', '/CN=Test CA',
+                '-newkey', 'ec', '-pkeyopt', 'ec_paramgen_curve:prime256v1',
+                '-keyout', '{0}/ca.key'.format(TEST_DIR),
+                '-out', '{0}/ca.pem'.format(TEST_DIR))
+        open(TEST_DB, 'w').write('')
+        self.csr = new_csr('host')
+        self.key = idempotency.csr_key(self.csr)
+        self.index = certindex.CertIndex(TEST_DB, TEST_CERTS)
+        self.issued = idempotency.IssuedIndex(self.index)
+
+    def tearDown(self):
+        shutil.rmtree(TEST_DIR)
+
+    def test_lookup(self):
+        assert self.issued.lookup(TEST_FQDN, self.key) is None
+        sign_csr('host', 10)
+        cert = self.issued.lookup(TEST_FQDN, self.key)
+        assert cert['serial'] == '0A'
+        assert cert['notbefore'] is not None
+        assert self.issued.stats == {'hits': 1, 'misses': 1}
+
+    def test_lookup_latest(self):
+        sign_csr('host', 10)
+        sign_csr('host', 11)
+        assert self.issued.lookup(TEST_FQDN, self.key)['serial'] == '0B'
+
+    def test_lookup_other_fqdn(self):
+        sign_csr('host', 10)
+        assert self.issued.lookup('other.host.name', self.key) is None
+
+    def test_lookup_revoked(self):
+        sign_csr('host', 10)
+        content = open(TEST_DB, 'r').read()
+        open(TEST_DB, 'w').write('R' + content[1:].replace(
+            '\t\t', '\t{0}\t'.format(utils.epoch_to_asn1(int(time.time())))
+        ))
+        assert self.issued.lookup(TEST_FQDN, self.key) is None
+
+    def test_lookup_expired(self):
+        details = sign_csr('host', 10)
+        now = details['notafter'] + 1
+        assert self.issued.lookup(TEST_FQDN, self.key, now=now) is None
+
+    def test_lookup_without_key(self):
+        sign_csr('host', 10)
+        assert self.issued.lookup(TEST_FQDN, None) is None
+
+    def test_acquire(self):
+        assert self.issued.acquire(self.key) is True
+        assert self.issued.acquire(self.key, timeout=0.01) is False
+        assert self.issued.acquire('other', timeout=0.01) is True
+        self.issued.release('other')
+        self.issued.release(self.key)
+        assert self.issued.acquire(self.key, timeout=0.01) is True
+        self.issued.release(self.key)
+        assert self.issued._signing == {}
@@ -0,0 +1,120 @@
+import threading
+import time
+
+import pkilib.server.jobs as jobs
+
+TEST_HOST = 'some.host.name'
+
+
+def succeeds(value):
+    return value
+
+
+def fails():
+    return False
+
+
+def raises():
+    raise ValueError('broken')
+
+
+class test_JobStore_new:
+    def setUp(self):
+        self.store = jobs.JobStore()
+
+    def test_new_job_is_queued(self):
+        job = self.store.new(TEST_HOST)
+        assert job.state == jobs.JOB_QUEUED
+        assert job.pending is True
+        assert len(job.job_id) == 64
+
+    def test_get_job(self):
+        job = self.store.new(TEST_HOST)
+        assert self.store.get(job.job_id) is job
+
+    def test_get_unknown_job(self):
+        assert self.store.get('unknown') is None
+
+    def test_get_integer_job(self):
+        assert self.store.get(12345) is None
+
+    def test_update_unknown_job(self):
+        assert self.store.update('unknown', jobs.JOB_DONE) is False
+
+    def test_max_pending(self):
+        store = jobs.JobStore(max_pending=2)
+        first = store.new(TEST_HOST)
+        store.new(TEST_HOST)
+        assert store.full() is True
+        assert store.new(TEST_HOST) is None
+        store.run(first.job_id, succeeds, True)
+        assert store.pending == 1
+        assert store.new(TEST_HOST) is not None
+
+
+class test_JobStore_run:
+    def setUp(self):
+        self.store = jobs.JobStore()
+        self.job = self.store.new(TEST_HOST)
+
+    def test_successful_job(self):
+        self.store.run(self.job.job_id, succeeds, 'certificate')
+        assert self.job.state == jobs.JOB_DONE
+        assert self.job.result == 'certificate'
+        assert self.job.finished is not None
+
+    def test_failing_job(self):
+        self.store.run(self.job.job_id, fails)
+        assert self.job.state == jobs.JOB_FAILED
+
+    def test_job_without_result(self):
+        self.store.run(self.job.job_id, succeeds, None)
+        assert self.job.state == jobs.JOB_FAILED
+
+    def test_raising_job(self):
+        self.store.run(self.job.job_id, raises)
+        assert self.job.state == jobs.JOB_FAILED
+        assert self.job.error == 'broken'
+
+
+class test_JobStore_wait:
+    def setUp(self):
+        self.store = jobs.JobStore()
+
+    def test_wait_unknown_job(self):
+        assert self.store.wait('unknown', timeout=0.01) is None
+
+    def test_wait_times_out(self):
+        job = self.store.new(TEST_HOST)
+        assert self.store.wait(job.job_id, timeout=0.05).pending is True
+
+    def test_submit_when_full(self):
+        store = jobs.JobStore(max_pending=1)
+        event = threading.Event()
+        job = store.submit(TEST_HOST, event.wait)
+        assert store.submit(TEST_HOST, succeeds, True) is None
+        event.set()
+        assert store.wait(job.job_id, timeout=5).state == jobs.JOB_DONE
+
+    def test_wait_for_submitted_job(self):
+        event = threading.Event()
+        job = self.store.submit(TEST_HOST, event.wait)
+        assert self.store.wait(job.job_id, timeout=0.05).pending is True
+        event.set()
+        assert self.store.wait(job.job_id, timeout=5).state == jobs.JOB_DONE
+
+
+class test_JobStore_expire:
+    def test_expires_finished_jobs(self):
+        store = jobs.JobStore(ttl=0)
+        job = store.new(TEST_HOST)
+        store.run(job.job_id, succeeds, True)
+        time.sleep(0.01)
+        assert store.expire() == 1
+        assert store.get(job.job_id) is None
+
+    def test_keeps_pending_jobs(self):
+        store = jobs.JobStore(ttl=0)
+        store.new(TEST_HOST)
+        assert store.expire() == 0
+        assert len(store) == 1
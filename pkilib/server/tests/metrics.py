@@ -0,0 +1,101 @@
+import pkilib.server.metrics as metrics
+
+
+class test_format_labels:
+    def test_no_labels(self):
+        assert metrics.format_labels(()) == ''
+
+    def test_multiple_labels(self):
+        labels = (('method', 'get'), ('route', '/'))
+        assert metrics.format_labels(labels) == '{method="get",route="/"}'
+
+    def test_escape_quotes(self):
+        labels = (('path', 'a"b'),)
+        assert metrics.format_labels(labels) == '{path="a\\"b"}'
+
+
+class test_Counter:
+    def setUp(self):
+        self.counter = metrics.Counter('requests_total', 'Requests')
+
+    def test_unset_counter(self):
+        assert self.counter.value(route='/') is None
+
+    def test_inc(self):
+        self.counter.inc(route='/')
+        self.counter.inc(route='/')
+        assert self.counter.value(route='/') == 2
+
+    def test_inc_amount(self):
+        self.counter.inc(5)
+        assert self.counter.value() == 5
+
+    def test_render(self):
+        self.counter.inc(route='/')
+        lines = self.counter.render()
+        assert lines[0] == '# HELP requests_total Requests'
+        assert lines[1] == '# TYPE requests_total counter'
+        assert lines[2] == 'requests_total{route="/"} 1'
+
+
+class test_Gauge:
+    def setUp(self):
+        self.gauge = metrics.Gauge('tokens', 'Tokens')
+
+    def test_set(self):
+        self.gauge.set(3)
+        self.gauge.set(2)
+        assert self.gauge.value() == 2
+
+    def test_function(self):
+        self.gauge.set_function(lambda: 42)
+        assert self.gauge.render()[2] == 'tokens 42'
+
+    def test_failing_function(self):
+        self.gauge.set_function(lambda: 1 / 0)
+        assert len(self.gauge.render()) == 2
+
+    def test_function_returns_none(self):
+        self.gauge.set_function(lambda: None)
+        assert len(self.gauge.render()) == 2
+
+
+class test_Histogram:
+    def setUp(self):
+        self.histogram = metrics.Histogram('duration', 'Duration',
+                                           buckets=(0.1, 1))
+
+    def test_observe(self):
+        self.histogram.observe(0.05, op='x509')
+        self.histogram.observe(0.5, op='x509')
+        self.histogram.observe(5, op='x509')
+        assert self.histogram.value(op='x509') == (3, 5.55)
+
+    def test_render_is_cumulative(self):
+        self.histogram.observe(0.05)
+        self.histogram.observe(0.5)
+        self.histogram.observe(5)
+        lines = self.histogram.render()
+        assert 'duration_bucket{le="0.1"} 1' in lines
+        assert 'duration_bucket{le="1"} 2' in lines
+        assert 'duration_bucket{le="+Inf"} 3' in lines
+        assert 'duration_count 3' in lines
+
+
+class test_Registry:
+    def test_render(self):
+        registry = metrics.Registry()
+        registry.counter('a_total', 'A').inc()
+        registry.gauge('b', 'B').set(1.5)
+        output = registry.render()
+        assert output.endswith('\n')
+        assert 'a_total 1\n' in output
+        assert 'b 1.5\n' in output
+
+
+class test_Counter_function:
+    def test_function(self):
+        stats = {'hits': 3}
+        counter = metrics.Counter('dns_total', 'DNS lookups')
+        counter.set_function(lambda: stats['hits'], result='hit')
+        assert counter.render()[2] == 'dns_total{result="hit"} 3'
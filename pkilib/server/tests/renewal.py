@@ -0,0 +1,50 @@
+import pkilib.server.renewal as renewal
+
+TEST_HOST = 'some.host.name'
+
+
+class test_renewal_window:
+    def test_undefined_dates(self):
+        assert renewal.renewal_window(None, None, TEST_HOST) is False
+
+    def test_string_dates(self):
+        assert renewal.renewal_window('abc', 'def', TEST_HOST) is False
+
+    def test_notafter_before_notbefore(self):
+        assert renewal.renewal_window(1000, 0, TEST_HOST) is False
+
+    def test_integer_fqdn(self):
+        assert renewal.renewal_window(0, 1000, 12345) is False
+
+    def test_invalid_fractions(self):
+        assert renewal.renewal_window(0, 1000, TEST_HOST, 0.8, 0.6) is False
+
+    def test_window_within_lifetime(self):
+        start, end = renewal.renewal_window(0, 1000, TEST_HOST)
+        assert 600 <= start < end
+        assert end == 800
+
+    def test_window_is_stable(self):
+        assert renewal.renewal_window(0, 1000, TEST_HOST) == \
+            renewal.renewal_window(0, 1000, TEST_HOST)
+
+    def test_window_spreads_hosts(self):
+        starts = set()
+        for i in range(10):
+            fqdn = 'host{0}.host.name'.format(i)
+            starts.add(renewal.renewal_window(0, 100000, fqdn)[0])
+        assert len(starts) > 1
+
+
+class test_retry_after:
+    def test_returns_integer(self):
+        assert isinstance(renewal.retry_after(30), int) is True
+
+    def test_minimum_delay(self):
+        assert renewal.retry_after(30) >= 30
+
+    def test_maximum_jitter(self):
+        assert renewal.retry_after(30) <= 45
+
+    def test_grows_with_backlog(self):
+        assert renewal.retry_after(30, backlog=3) >= 120
@@ -0,0 +1,167 @@
+import os
+import shutil
+
+import pkilib.server.certindex as certindex
+import pkilib.server.revocation as revocation
+from pkilib import synthetic
+
+TEST_DIR = './workspace/revocation'
+TEST_DB = '{0}/index.txt'.format(TEST_DIR)
+TEST_CERTS = '{0}/certs'.format(TEST_DIR)
+
+NOW = 1500000000
+
+
+def write_workspace(records):
+    open(TEST_DB, 'w').write(
+        '\n'.join([synthetic.db_line(record) for record in records]) + '\n'
+    )
+    synthetic.write_certificates((TEST_CERTS, {'CN': 'Test CA'}, records))
+
+
+def read_db():
+    return [certindex.parse_index_line(line) for line in open(TEST_DB)]
+
+
+class test_parse_date:
+    def test_date(self):
+        assert revocation.parse_date('2017-07-14') == 1499990400
+
+    def test_epoch(self):
+        assert revocation.parse_date(1499990400) == 1499990400
+        assert revocation.parse_date('1499990400') == 1499990400
+
+    def test_invalid(self):
+        assert revocation.parse_date('14-07-2017') is None
+        assert revocation.parse_date(None) is None
+        assert revocation.parse_date(True) is None
+
+
+class test_RevocationQuery:
+    def test_from_dict(self):
+        query = revocation.RevocationQuery.from_dict({
+            'fqdn_suffix': '.DC1.example.com',
+            'issued_before': '2017-07-14',
+            'serials': '0a,0B',
+            'ou': 'Ops',
+        })
+        assert query.fqdn_suffix == 'dc1.example.com'
+        assert query.issued_before == 1499990400
+        assert query.serials == set([10, 11])
+        assert query.ou == 'Ops'
+
+    def test_from_dict_empty(self):
+        assert revocation.RevocationQuery.from_dict({}) is None
+        assert revocation.RevocationQuery.from_dict({'fqdn_suffix': ''}) \
+            is None
+
+    def test_from_dict_invalid(self):
+        for data in [{'fqdn_suffix': '.'}, {'fqdn_suffix': 1},
+                     {'issued_before': 'yesterday'}, {'serials': []},
+                     {'serials': ['xyz']}, {'serials': 10}, {'ou': 1}]:
+            assert revocation.RevocationQuery.from_dict(data) is None
+
+    def test_fqdn_suffix(self):
+        query = revocation.RevocationQuery(fqdn_suffix='dc1.example.com')
+        for fqdn, wanted in [('dc1.example.com', True),
+                             ('web1.dc1.example.com', True),
+                             ('WEB1.DC1.example.com', True),
+                             ('web1.xdc1.example.com', False),
+                             ('web1.dc2.example.com', False)]:
+            cert = {'serial': '0A', 'fqdn': fqdn, 'subject': {'CN': fqdn}}
+            assert query.matches(cert) is wanted
+
+    def test_serials_and_ou(self):
+        query = revocation.RevocationQuery(serials=['0a'], ou='Ops')
+        cert = {'serial': '0A', 'fqdn': 'host', 'subject': {'OU': 'Ops'}}
+        assert query.matches(cert) is True
+        cert['serial'] = '0B'
+        assert query.matches(cert) is False
+        cert['serial'] = '000A'
+        cert['subject']['OU'] = 'Dev'
+        assert query.matches(cert) is False
+
+
+class test_revoke_matching:
+    def setUp(self):
+        os.makedirs(TEST_CERTS)
+        self.records = synthetic.gen_records(40, now=NOW)
+        self.dc1 = []
+        for record in self.records[-10:]:
+            self.dc1.append(record['serial'])
+            record['fqdn'] = 'web{0}.dc1.example.com'.format(
+                record['serial'])
+            record['subject'] = {'OU': 'Ops', 'CN': record['fqdn']}
+        write_workspace(self.records)
+        self.valid = [record['serial'] for record in self.records
+                      if record['status'] == 'V' and
+                      record['notafter'] > NOW]
+
+    def tearDown(self):
+        shutil.rmtree(TEST_DIR)
+
+    def revoke(self, **kwargs):
+        query = revocation.RevocationQuery(certs_dir=TEST_CERTS, **kwargs)
+        return revocation.revoke_matching(TEST_DB, query, now=NOW)
+
+    def test_fqdn_suffix(self):
+        wanted = self.dc1
+        revoked = self.revoke(fqdn_suffix='dc1.example.com')
+        assert [cert['serial'] for cert in revoked] == wanted
+        certs = dict([(cert['serial'], cert) for cert in read_db()])
+        for serial in wanted:
+            assert certs[serial]['status'] == 'R'
+            assert certs[serial]['revoked'] == NOW
+            assert certs[serial]['reason'] == revocation.DEFAULT_REASON
+        assert len(certs) == 40
+
+    def test_only_valid(self):
+        revoked = self.revoke(serials=[record['serial']
+                                       for record in self.records])
+        assert [cert['serial'] for cert in revoked] == self.valid
+        assert self.revoke(serials=self.valid) == []
+
+    def test_issued_before(self):
+        cutoff = sorted([record['notbefore'] for record in self.records
+                         if record['serial'] in self.valid])[2]
+        revoked = self.revoke(issued_before=cutoff)
+        assert len(revoked) == 2
+        for cert in revoked:
+            record = [record for record in self.records
+                      if record['serial'] == cert['serial']][0]
+            assert record['notbefore'] < cutoff
+
+    def test_issued_before_missing_certificate(self):
+        for serial in self.valid:
+            os.unlink('{0}/{1}.pem'.format(TEST_CERTS, serial))
+        assert self.revoke(issued_before=NOW * 2) == []
+
+    def test_ou(self):
+        revoked = self.revoke(ou='Ops')
+        assert [cert['serial'] for cert in revoked] == self.dc1
+
+    def test_reason(self):
+        query = revocation.RevocationQuery(serials=self.valid[:1])
+        revoked = revocation.revoke_matching(TEST_DB, query, now=NOW,
+                                             reason='keyCompromise')
+        assert revoked[0]['reason'] == 'keyCompromise'
+        assert read_db()[int(self.valid[0], 16) - 1]['reason'] == \
+            'keyCompromise'
+
+    def test_invalid_reason(self):
+        query = revocation.RevocationQuery(serials=self.valid[:1])
+        assert revocation.revoke_matching(TEST_DB, query,
+                                          reason='bored') is None
+
+    def test_dry_run(self):
+        content = open(TEST_DB).read()
+        query = revocation.RevocationQuery(ou='Ops')
+        revoked = revocation.revoke_matching(TEST_DB, query, now=NOW,
+                                             dry_run=True)
+        assert len(revoked) == 10
+        assert open(TEST_DB).read() == content
+
+    def test_nonexisting(self):
+        query = revocation.RevocationQuery(ou='Ops')
+        assert revocation.revoke_matching('{0}/unknown'.format(TEST_DIR),
+                                          query) is None
@@ -0,0 +1,223 @@
+import os
+import shutil
+import time
+
+import pkilib.server.certindex as certindex
+import pkilib.server.snapshot as snapshot
+from pkilib import synthetic
+
+TEST_DIR = './workspace/snapshot'
+TEST_DB = '{0}/index.txt'.format(TEST_DIR)
+TEST_CERTS = '{0}/certs'.format(TEST_DIR)
+TEST_SNAPSHOT = '{0}/index.snapshot'.format(TEST_DIR)
+
+NOW = 1500000000
+
+
+def write_workspace(size, seed=0):
+    records = synthetic.gen_records(size, seed=seed, now=NOW)
+    open(TEST_DB, 'w').write(
+        '\n'.join([synthetic.db_line(record) for record in records]) + '\n'
+    )
+    synthetic.write_certificates((TEST_CERTS, {'CN': 'Test CA'}, records))
+    os.utime(TEST_DB, (time.time() + seed, time.time() + seed))
+    return records
+
+
+class test_keys:
+    def test_serial_key(self):
+        assert snapshot.serial_key('0a') == snapshot.serial_key('000A')
+        assert len(snapshot.serial_key('0A')) == snapshot.KEY_SIZE
+        assert snapshot.serial_key('xyz') is None
+        assert snapshot.serial_key('FF' * 21) is None
+
+    def test_fingerprint_key(self):
+        assert snapshot.fingerprint_key('01' * 20) == b'\x01' * 20
+        assert snapshot.fingerprint_key('01:' * 19 + '01') == b'\x01' * 20
+        assert snapshot.fingerprint_key('0101') is None
+        assert snapshot.fingerprint_key(None) is None
+
+
+class test_write_snapshot:
+    def setUp(self):
+        os.makedirs(TEST_DIR)
+
+    def tearDown(self):
+        shutil.rmtree(TEST_DIR)
+
+    def test_empty(self):
+        assert snapshot.write_snapshot(TEST_SNAPSHOT, [], 3, TEST_CERTS)
+        assert snapshot.read_generation(TEST_SNAPSHOT) == 3
+        assert not os.path.exists('{0}.tmp'.format(TEST_SNAPSHOT))
+        reader = snapshot.SnapshotReader(TEST_SNAPSHOT)
+        assert reader.refresh() is True
+        assert len(reader) == 0
+        assert reader.get('0A') is None
+        assert reader.query() == ([], None)
+
+    def test_read_generation_invalid(self):
+        assert snapshot.read_generation(TEST_SNAPSHOT) == 0
+        open(TEST_SNAPSHOT, 'wb').write(b'garbage')
+        assert snapshot.read_generation(TEST_SNAPSHOT) == 0
+
+    def test_unwritable(self):
+        path = '{0}/unknown/index.snapshot'.format(TEST_DIR)
+        assert snapshot.write_snapshot(path, [], 1, TEST_CERTS) is False
+
+
+class test_SnapshotReader:
+    def setUp(self):
+        os.makedirs(TEST_CERTS)
+        self.records = write_workspace(100)
+        self.index = snapshot.PublishedCertIndex(TEST_DB, TEST_CERTS,
+                                                 TEST_SNAPSHOT)
+        self.index.refresh()
+        self.reader = snapshot.SnapshotReader(TEST_SNAPSHOT)
+        self.reader.refresh()
+
+    def tearDown(self):
+        shutil.rmtree(TEST_DIR)
+
+    def test_refresh(self):
+        assert len(self.reader) == 100
+        assert self.reader.generation == 1
+        assert self.reader.certs_dir == TEST_CERTS
+        assert self.reader.refresh() is False
+
+    def test_refresh_nonexisting(self):
+        reader = snapshot.SnapshotReader('{0}/unknown'.format(TEST_DIR))
+        assert reader.refresh() is False
+        assert len(reader) == 0
+        assert reader.get('0A') is None
+
+    def test_refresh_invalid(self):
+        open(TEST_SNAPSHOT, 'wb').write(b'garbage' * 20)
+        assert self.reader.refresh() is False
+        assert len(self.reader) == 100
+
+    def test_iter(self):
+        assert list(self.reader) == list(self.index)
+
+    def test_certs(self):
+        assert self.reader.certs(fingerprints=False) == list(self.index)
+
+    def test_get(self):
+        for record in self.records[:20]:
+            assert self.reader.get(record['serial'].lower()) == \
+                self.index.get(record['serial'])
+        assert self.reader.get('FFFFFF') is None
+        assert self.reader.get(None) is None
+
+    def test_by_fingerprint(self):
+        cert = self.index.get(self.records[20]['serial'])
+        found = self.reader.by_fingerprint(
+            cert['fingerprint'].replace(':', '').lower()
+        )
+        assert found == cert
+        assert self.reader.by_fingerprint('00' * 20) is None
+        assert self.reader.by_fingerprint('xyz') is None
+
+    def test_by_fqdn(self):
+        fqdn = self.records[0]['fqdn']
+        assert self.reader.by_fqdn(fqdn) == self.index.by_fqdn(fqdn)
+        assert self.reader.by_fqdn('unknown.host') == []
+        reader = snapshot.SnapshotReader('{0}/unknown'.format(TEST_DIR))
+        assert reader.by_fqdn(fqdn) == []
+
+    def test_certificate(self):
+        serial = self.records[0]['serial']
+        assert self.reader.certificate(serial) == \
+            self.index.certificate(serial)
+        assert self.reader.certificate('FFFFFF') is None
+
+    def test_query(self):
+        for kwargs in [{'limit': 1000}, {'status': 'R', 'limit': 1000},
+                       {'expires_before': NOW, 'limit': 1000},
+                       {'fqdn': self.records[0]['fqdn']},
+                       {'fqdn': 'unknown.host'}, {'after': 'FFFFFF'}]:
+            assert self.reader.query(**kwargs) == self.index.query(**kwargs)
+
+    def test_query_pages(self):
+        serials = []
+        after = None
+        while True:
+            certs, after = self.reader.query(after=after, limit=30)
+            serials.extend([cert['serial'] for cert in certs])
+            if after is None:
+                break
+        assert serials == [record['serial'] for record in self.records]
+
+    def test_query_fqdn_pages(self):
+        fqdn = self.records[0]['fqdn']
+        certs, next_serial = self.reader.query(fqdn=fqdn, limit=1)
+        assert certs == self.index.query(fqdn=fqdn, limit=1)[0]
+        assert self.reader.query(fqdn=fqdn, after=next_serial) == \
+            self.index.query(fqdn=fqdn, after=next_serial)
+
+    def test_switch(self):
+        cert = self.reader.get(self.records[0]['serial'])
+        write_workspace(50, seed=1)
+        assert self.index.refresh() is True
+        assert snapshot.read_generation(TEST_SNAPSHOT) == 2
+        assert self.reader.refresh() is True
+        assert self.reader.generation == 2
+        assert len(self.reader) == 50
+        assert list(self.reader) == list(self.index)
+        assert self.reader.get(cert['serial']) == \
+            self.index.get(cert['serial'])
+
+
+class test_PublishedCertIndex:
+    def setUp(self):
+        os.makedirs(TEST_CERTS)
+        self.records = write_workspace(20)
+        self.index = snapshot.PublishedCertIndex(TEST_DB, TEST_CERTS,
+                                                 TEST_SNAPSHOT)
+
+    def tearDown(self):
+        shutil.rmtree(TEST_DIR)
+
+    def test_is_certindex(self):
+        assert isinstance(self.index, certindex.CertIndex)
+
+    def test_publish_once(self):
+        assert self.index.refresh() is True
+        mtime = os.stat(TEST_SNAPSHOT).st_mtime_ns
+        assert self.index.refresh() is False
+        assert self.index.publish() is True
+        assert os.stat(TEST_SNAPSHOT).st_mtime_ns == mtime
+
+    def test_generation_across_restarts(self):
+        self.index.refresh()
+        index = snapshot.PublishedCertIndex(TEST_DB, TEST_CERTS,
+                                            TEST_SNAPSHOT)
+        index.refresh()
+        assert snapshot.read_generation(TEST_SNAPSHOT) == 2
+
+    def test_publish_retried(self):
+        os.makedirs(TEST_SNAPSHOT)
+        assert self.index.refresh() is True
+        os.rmdir(TEST_SNAPSHOT)
+        assert self.index.refresh() is False
+        assert snapshot.read_generation(TEST_SNAPSHOT) == 1
+
+    def test_publish_changes(self):
+        index = snapshot.PublishedCertIndex(TEST_DB, TEST_CERTS,
+                                            TEST_SNAPSHOT, interval=0.01)
+        index.refresh()
+        reader = snapshot.SnapshotReader(TEST_SNAPSHOT)
+        reader.refresh()
+        index.start()
+        try:
+            record = dict(self.records[-1], serial='FFFF',
+                          fqdn='new.host.name',
+                          subject={'CN': 'new.host.name'})
+            open(TEST_DB, 'a').write(synthetic.db_line(record) + '\n')
+            for attempt in range(500):
+                if reader.refresh():
+                    break
+                time.sleep(0.01)
+        finally:
+            index.stop()
+        assert len(reader) == 21
+        assert reader.by_fqdn('new.host.name')[0]['serial'] == 'FFFF'
@@ -0,0 +1,120 @@
+import json
+import os
+import threading
+import time
+
+import pkilib.server.tracing as tracing
+
+TRACE_LOG = './workspace/trace.json'
+
+
+class test_Trace:
+    def test_generated_request_id(self):
+        trace = tracing.Trace('/v1/sign')
+        assert len(trace.request_id) == 16
+
+    def test_given_request_id(self):
+        trace = tracing.Trace('/v1/sign', request_id='abcd')
+        assert trace.request_id == 'abcd'
+
+    def test_span(self):
+        trace = tracing.Trace('/v1/sign')
+        with trace.span('autosign'):
+            time.sleep(0.01)
+        name, offset, duration = trace.spans[0]
+        assert name == 'autosign'
+        assert duration >= 0.01
+
+    def test_span_on_exception(self):
+        trace = tracing.Trace('/v1/sign')
+        try:
+            with trace.span('valid_csr'):
+                raise ValueError('broken')
+        except ValueError:
+            pass
+        assert trace.spans[0][0] == 'valid_csr'
+
+    def test_summary(self):
+        trace = tracing.Trace('/v1/sign')
+        trace.spans = [('valid_token', 0, 0.001), ('autosign', 0.001, 2)]
+        assert trace.summary() == 'valid_token=0.001 autosign=2.000'
+
+    def test_as_dict(self):
+        trace = tracing.Trace('/v1/sign')
+        with trace.span('autosign'):
+            pass
+        trace.finish()
+        data = trace.as_dict()
+        assert data['name'] == '/v1/sign'
+        assert data['spans'][0]['name'] == 'autosign'
+
+
+class test_current_trace:
+    def tearDown(self):
+        tracing.stop()
+
+    def test_no_trace(self):
+        assert tracing.current() is None
+
+    def test_span_without_trace(self):
+        with tracing.span('valid_token'):
+            pass
+
+    def test_span_with_trace(self):
+        trace = tracing.start('/v1/sign')
+        with tracing.span('valid_token'):
+            pass
+        assert tracing.current() is trace
+        assert trace.spans[0][0] == 'valid_token'
+
+    def test_stop(self):
+        trace = tracing.start('/v1/sign')
+        assert tracing.stop() is trace
+        assert trace.duration is not None
+        assert tracing.current() is None
+
+    def test_trace_is_per_thread(self):
+        tracing.start('/v1/sign')
+        found = []
+        thread = threading.Thread(target=lambda: found.append(
+            tracing.current()))
+        thread.start()
+        thread.join()
+        assert found == [None]
+
+
+class test_Tracer:
+    def tearDown(self):
+        if os.path.exists(TRACE_LOG):
+            os.unlink(TRACE_LOG)
+
+    def test_record_none(self):
+        assert tracing.Tracer().record(None) is False
+
+    def test_fast_request(self):
+        tracer = tracing.Tracer(threshold=10)
+        assert tracer.record(tracing.Trace('/v1/sign')) is False
+
+    def test_slow_request(self):
+        tracer = tracing.Tracer(threshold=0)
+        assert tracer.record(tracing.Trace('/v1/sign')) is True
+
+    def test_trace_log(self):
+        tracer = tracing.Tracer(trace_log=TRACE_LOG)
+        tracer.record(tracing.Trace('/v1/sign', request_id='abcd'))
+        tracer.record(tracing.Trace('/v1/revoke'))
+        lines = open(TRACE_LOG, 'r').readlines()
+        assert len(lines) == 2
+        assert json.loads(lines[0])['request_id'] == 'abcd'
+
+    def test_call(self):
+        tracer = tracing.Tracer(trace_log=TRACE_LOG)
+
+        def stage():
+            with tracing.span('autosign'):
+                return 'certificate'
+
+        assert tracer.call('job', 'abcd', stage) == 'certificate'
+        assert tracing.current() is None
+        data = json.loads(open(TRACE_LOG, 'r').read())
+        assert data['spans'][0]['name'] == 'autosign'
@@ -0,0 +1,218 @@
+"""
+.. module:: tracing
+   :platform: Unix, VMS
+   :synopsis: Lightweight per-request tracing of processing stages
+
+.. moduleauthor:: Lex van Roon <r3boot@r3blog.nl>
+"""
+import contextlib
+import json
+import threading
+import time
+
+import pkilib.log as log
+import pkilib.utils as utils
+
+
+# Requests taking longer than this number of seconds are logged as slow
+SLOW_THRESHOLD = 1.0
+
+# Storage for the trace of the request handled by the current thread
+_local = threading.local()
+
+
+class Trace(object):
+    """Class representing the timing record of a single request. Every stage
+    of the request is recorded as a span, containing the offset from the
+    start of the request and the time spent in the stage.
+
+    :param name:        Name of the traced request, eg the route
+    :type  name:        str
+    :param request_id:  Identifier of the request, generated if not given
+    :type  request_id:  str
+    """
+    def __init__(self, name, request_id=None):
+        if not request_id:
+            request_id = utils.gentoken()[0:16]
+        self.name = name
+        self.request_id = request_id
+        self.started = time.time()
+        self.duration = None
+        self.spans = []
+        self.tags = {}
+
+    @contextlib.contextmanager
+    def span(self, name):
+        """Context manager recording the time spent in a stage
+
+        :param name:    Name of the stage
+        :type  name:    str
+        """
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.spans.append((name, started - self.started,
+                               time.time() - started))
+
+    def finish(self):
+        """Mark this trace as finished
+
+        :returns:   Number of seconds spent in the request
+        :rtype:     float
+        """
+        if self.duration is None:
+            self.duration = time.time() - self.started
+        return self.duration
+
+    def summary(self):
+        """Return a single line overview of the time spent per stage
+
+        >>> trace.summary()
+        'valid_srcip=0.002 valid_token=0.001 autosign=8.934'
+
+        :returns:   String containing the stages and their durations
+        :rtype:     str
+        """
+        return ' '.join(['{0}={1:.3f}'.format(name, duration)
+                         for name, offset, duration in self.spans])
+
+    def as_dict(self):
+        """Return this trace as a dictionary
+
+        :returns:   Dictionary containing the trace details
+        :rtype:     dict
+        """
+        return {
+            'request_id': self.request_id,
+            'name': self.name,
+            'started': self.started,
+            'duration': self.duration,
+            'tags': self.tags,
+            'spans': [{'name': name, 'offset': offset, 'duration': duration}
+                      for name, offset, duration in self.spans],
+        }
+
+
+def current():
+    """Return the trace of the request handled by the current thread
+
+    :returns:   The current trace or None
+    :rtype:     Trace, None
+    """
+    return getattr(_local, 'trace', None)
+
+
+def start(name, request_id=None):
+    """Start a new trace for the current thread
+
+    :param name:        Name of the traced request
+    :type  name:        str
+    :param request_id:  Identifier of the request
+    :type  request_id:  str
+    :returns:           The new trace
+    :rtype:             Trace
+    """
+    _local.trace = Trace(name, request_id=request_id)
+    return _local.trace
+
+
+def stop():
+    """Finish the trace of the current thread and detach it
+
+    :returns:   The finished trace or None if no trace was started
+    :rtype:     Trace, None
+    """
+    trace = current()
+    _local.trace = None
+    if trace is not None:
+        trace.finish()
+    return trace
+
+
+@contextlib.contextmanager
+def span(name):
+    """Context manager recording a stage in the trace of the current thread.
+    It does nothing if the current thread is not being traced, so it can be
+    used in code which also runs outside of a request.
+
+    >>> with span('valid_token'):
+    ...     valid_token(store, fqdn, token)
+
+    :param name:    Name of the stage
+    :type  name:    str
+    """
+    trace = current()
+    if trace is None:
+        yield
+        return
+    with trace.span(name):
+        yield
+
+
+class Tracer(object):
+    """Class which handles finished traces. Traces exceeding the slow
+    threshold are logged as a warning, and all traces can optionally be
+    appended to a file as JSON lines. Declare a new instance as follows:
+
+    >>> tracer = Tracer(threshold=1.0, trace_log='/var/log/pki/trace.json')
+    >>> trace = tracing.start('/v1/sign')
+    >>> tracer.record(tracing.stop())
+
+    :param threshold:   Number of seconds after which a request is slow
+    :type  threshold:   float
+    :param trace_log:   Path to a file to which traces are appended
+    :type  trace_log:   str
+    """
+    def __init__(self, threshold=SLOW_THRESHOLD, trace_log=None):
+        self.threshold = threshold
+        self.trace_log = trace_log
+        self._lock = threading.Lock()
+
+    def record(self, trace):
+        """Handle a finished trace
+
+        :param trace:   The finished trace
+        :type  trace:   Trace
+        :returns:       True if the trace was slow, else False
+        :rtype:         bool
+        """
+        if trace is None:
+            return False
+        duration = trace.finish()
+
+        if self.trace_log:
+            line = json.dumps(trace.as_dict(), sort_keys=True)
+            try:
+                with self._lock:
+                    with open(self.trace_log, 'a') as fdesc:
+                        fdesc.write('{0}\n'.format(line))
+            except EnvironmentError as err:
+                log.warning('Failed to write trace: {0}'.format(err))
+
+        if self.threshold is None or duration < self.threshold:
+            return False
+        log.warning('Slow request {0} {1} took {2:.3f}s: {3}'.format(
+            trace.request_id, trace.name, duration, trace.summary()
+        ))
+        return True
+
+    def call(self, name, request_id, func, *args):
+        """Run func within a new trace for the current thread, and record
+        the trace when it finishes. This is used to trace work which is
+        handed off to a background thread.
+
+        :param name:        Name of the trace
+        :type  name:        str
+        :param request_id:  Identifier of the originating request
+        :type  request_id:  str
+        :param func:        Function to run
+        :type  func:        function
+        :returns:           The value returned by func
+        :rtype:             object
+        """
+        start(name, request_id=request_id)
+        try:
+            return func(*args)
+        finally:
+            self.record(stop())
@@ -6,13 +6,14 @@
 .. moduleauthor:: Lex van Roon <r3boot@r3blog.nl>
 """
 
-import glob
 import os
 
 import mako.template
 
+from pkilib import certstore
 from pkilib import utils
 from pkilib import log
+from pkilib import profiling
 
 CA_ROOT = 'root'
 CA_INTERMEDIARY = 'intermediary'
@@ -29,6 +30,7 @@ class OpenSSL(object):
     """
     ca_data = {}
     cert_db = {}
+    _store = None
 
     def __init__(self, config, ca_type):
         if ca_type not in [CA_ROOT, CA_INTERMEDIARY, CA_AUTOSIGN]:
@@ -51,6 +53,8 @@ class OpenSSL(object):
             'crt_idx': '{0}/db/{1}-crt.idx'.format(basedir, ca_name),
             'crl_idx': '{0}/db/{1}-crl.idx'.format(basedir, ca_name),
             'certsdir': '{0}/certs'.format(basedir),
+            'cert_store': certstore.BACKEND_FLATFILE,
+            'cert_store_path': '{0}/db/{1}.sqlite'.format(basedir, ca_name),
             'ca_type': ca_type,
         }
         self.ca_data.update(config['common'])
@@ -112,16 +116,16 @@ class OpenSSL(object):
             return False
 
         status = tokens[0]
-        notbefore = tokens[1]
-        notafter = tokens[2]
+        notafter = tokens[1]
+        revoked = tokens[2]
         serial = tokens[3]
         subject = self.parse_subject(tokens[5])
 
         data = {
             'CN': subject['CN'],
             'status': status,
-            'notbefore': notbefore,
             'notafter': notafter,
+            'revoked': revoked,
             'serial': serial,
             'subject': subject,
         }
@@ -156,10 +160,55 @@ class OpenSSL(object):
                 data['fp'] = line.strip().replace('SHA1 Fingerprint=', '')
         return data
 
+    def load_cert_details(self, record):
+        """Helper function which reads the details of the certificate for a
+        record of the certificate database from disk. It will return None if
+        the certificate does not exist or belongs to a different serial.
+
+        :param record:  Record to read the details for
+        :type  record:  records.CertRecord
+        :returns:       Dictionary containing the certificate details or None
+        :rtype:         dict, None
+        """
+        crt = utils.cert_path(self.ca_data['certsdir'], record['serial'])
+        if not os.path.exists(crt):
+            return None
+        cert_data = self.parse_certificate(crt)
+        if not cert_data or 'serial' not in cert_data:
+            return None
+        try:
+            if int(cert_data['serial'], 16) != record.serial:
+                return None
+        except ValueError:
+            return None
+        return cert_data
+
+    @property
+    def store(self):
+        """Certificate store of this CA, using the backend configured by
+        cert_store. It is created on first use, since the directory
+        structure of the CA might not exist yet before that.
+
+        :returns:   The store or None if the backend is invalid
+        :rtype:     certstore.CertStore, None
+        """
+        if self._store is None:
+            self._store = certstore.new_store(
+                self.ca_data['cert_store'], db=self.ca_data['db'],
+                path=self.ca_data['cert_store_path'],
+                loader=self.load_cert_details,
+            )
+        return self._store
+
+    @profiling.profiled('update_cert_db')
     def update_cert_db(self):
-        """Helper function to update the in-memory certificate database. It
-        will return False if the CA database file or the certificate directory
-        cannot be found.
+        """Helper function to update the in-memory certificate database,
+        which maps every CN to a list of CertRecord instances, from the
+        certificate store. Only the OpenSSL database is read; the
+        fingerprint of a record is read from its certificate when it is
+        first accessed. It will return False if the CA database file or the
+        certificate directory cannot be found, or if the store cannot be
+        used.
 
         :returns:   Flag indicating the status of the database update
         :rtype:     bool
@@ -174,34 +223,14 @@ class OpenSSL(object):
             log.warning('{0} does not exist'.format(certsdir))
             return False
 
-        data = {}
-
-        # Pass 1, read the OpenSSL certificate database
-        for line in open(dbf, 'r').readlines():
-            cert_data = self.parse_db_line(line)
-            common_name = cert_data['CN']
-            if common_name not in data:
-                data[common_name] = []
-            data[common_name].append(cert_data)
-
-        # Pass 2, read certificate details from disk
-        certs = glob.glob('{0}/[0-9A-Z]*.pem'.format(certsdir))
-        for crt in certs:
-            cert_data = self.parse_certificate(crt)
-            common_name = cert_data['subject']['CN']
-            if common_name not in data:
-                continue
-
-            cn_certs = []
-            for db_crt in data[common_name]:
-                if db_crt['serial'] == cert_data['serial']:
-                    db_crt.update(cert_data)
-                cn_certs.append(db_crt)
-            data[common_name] = cn_certs
-
-        self.cert_db = data
+        store = self.store
+        if store is None:
+            return False
+        store.refresh()
+        self.cert_db = store.cert_db()
         return True
 
+    @profiling.profiled('setup_ca_structure')
     def setup_ca_structure(self):
         """Creates the directory structure for this CA and initializes it's
         databases. It will return False for various errors, these include:
@@ -304,6 +333,7 @@ class OpenSSL(object):
             return False
         return cfg_data
 
+    @profiling.profiled('genkey')
     def genkey(self, cfg, name, pwfile=None):
         """Generate a new key and Certificate Signing Request. Cfg is a path
         pointing towards the configuration file which should be used for the
@@ -354,6 +384,7 @@ class OpenSSL(object):
         utils.run(cmdline)
         return os.path.exists(key)
 
+    @profiling.profiled('selfsign')
     def selfsign(self, name, pwfile):
         """Self-sign a certificate. It expects the following conditions to be
         true. If one of them is not met, this function will return False:
@@ -402,6 +433,7 @@ class OpenSSL(object):
         self.update_cert_db()
         return os.path.exists(crt)
 
+    @profiling.profiled('updatecrl')
     def updatecrl(self, pwfile=None):
         """Update the Certificate Revocation List for this CA. It will return
         False if one of the following conditions is met:
@@ -437,6 +469,7 @@ class OpenSSL(object):
         utils.run(cmdline)
         return os.path.exists(crl)
 
+    @profiling.profiled('sign_intermediary')
     def sign_intermediary(self, csr, crt, pwfile, days):
         """Sign an intermediary certificate using this CA. This function will
         return False when:
@@ -488,6 +521,7 @@ class OpenSSL(object):
         self.update_cert_db()
         return os.path.exists(crt)
 
+    @profiling.profiled('sign')
     def sign(self, name):
         """Sign a certificate using this CA. Name must be a valid fqdn. This
         function will return False if one of the following conditions is met:
@@ -533,6 +567,7 @@ class OpenSSL(object):
         self.update_cert_db()
         return os.path.exists(crt)
 
+    @profiling.profiled('updatebundle')
     def updatebundle(self, parent=None):
         """Generate a certificate bundle for this CA. It will use the parents
         certificate bundle if it exists, and else it will use the parents
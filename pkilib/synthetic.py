@@ -0,0 +1,455 @@
+"""
+.. module:: synthetic
+   :platform: Unix, VMS
+   :synopsis: Fabricate CA workspaces filled with synthetic certificates
+
+.. moduleauthor:: Lex van Roon <r3boot@r3blog.nl>
+"""
+import base64
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import time
+
+import pkilib.log as log
+import pkilib.utils as utils
+
+
+# Fraction of the certificates which is revoked
+REVOKED_RATIO = 0.05
+
+# Number of validity periods covered by the issued certificates
+HISTORY = 3
+
+# Domain under which the synthetic hosts live
+DOMAIN = 'example.com'
+
+# Public key used for all synthetic certificates (EC prime256v1, DER)
+PUBLIC_KEY = bytes.fromhex(
+    '3059301306072a8648ce3d020106082a8648ce3d03010703420004e24dd77e4918'
+    '1334a42945966f8eb68b20de5b97fe45e170ef2ac3b12d6f3bf45b17fcefd671f5'
+    '1fc65ab2ca9e0abeb7032a8d138922bafbbe017309b30cf8a1'
+)
+
+# Object identifiers used in the certificates
+OID_ECDSA_SHA256 = '1.2.840.10045.4.3.2'
+OID_SUBJECT = {
+    'C': '2.5.4.6',
+    'ST': '2.5.4.8',
+    'L': '2.5.4.7',
+    'O': '2.5.4.10',
+    'OU': '2.5.4.11',
+    'CN': '2.5.4.3',
+}
+
+# Order in which the fields of a subject are encoded
+SUBJECT_FIELDS = ['C', 'ST', 'L', 'O', 'OU', 'CN']
+
+
+def der(tag, content):
+    """Encode content as a DER TLV using tag
+
+    :param tag:     The DER tag
+    :type  tag:     int
+    :param content: Encoded content
+    :type  content: bytes
+    :returns:       DER encoded value
+    :rtype:         bytes
+    """
+    length = len(content)
+    if length < 0x80:
+        header = bytes([tag, length])
+    else:
+        size = length.to_bytes((length.bit_length() + 7) // 8, 'big')
+        header = bytes([tag, 0x80 | len(size)]) + size
+    return header + content
+
+
+def der_integer(value):
+    """Encode a non-negative integer in DER
+
+    :param value:   Integer to encode
+    :type  value:   int
+    :returns:       DER encoded integer
+    :rtype:         bytes
+    """
+    content = value.to_bytes(value.bit_length() // 8 + 1, 'big')
+    return der(0x02, content)
+
+
+def der_oid(oid):
+    """Encode a dotted object identifier in DER
+
+    :param oid: Object identifier, eg 2.5.4.3
+    :type  oid: str
+    :returns:   DER encoded object identifier
+    :rtype:     bytes
+    """
+    arcs = [int(arc) for arc in oid.split('.')]
+    content = bytearray([arcs[0] * 40 + arcs[1]])
+    for arc in arcs[2:]:
+        chunk = [arc & 0x7f]
+        arc >>= 7
+        while arc:
+            chunk.insert(0, 0x80 | (arc & 0x7f))
+            arc >>= 7
+        content.extend(chunk)
+    return der(0x06, bytes(content))
+
+
+def der_time(epoch):
+    """Encode a time in DER, as UTCTime before 2050 and as GeneralizedTime
+    from 2050 onwards
+
+    :param epoch:   Seconds since the epoch
+    :type  epoch:   int
+    :returns:       DER encoded time
+    :rtype:         bytes
+    """
+    gmtime = time.gmtime(epoch)
+    if gmtime.tm_year < 2050:
+        return der(0x17, time.strftime('%y%m%d%H%M%SZ', gmtime).encode())
+    return der(0x18, time.strftime('%Y%m%d%H%M%SZ', gmtime).encode())
+
+
+def der_name(subject):
+    """Encode a subject dictionary as a DER X.501 Name
+
+    :param subject: Dictionary containing the subject fields
+    :type  subject: dict
+    :returns:       DER encoded name
+    :rtype:         bytes
+    """
+    rdns = b''
+    for field in SUBJECT_FIELDS:
+        if field not in subject:
+            continue
+        tag = 0x13 if field == 'C' else 0x0c
+        value = der(tag, subject[field].encode('utf-8'))
+        rdns += der(0x31, der(0x30, der_oid(OID_SUBJECT[field]) + value))
+    return der(0x30, rdns)
+
+
+def format_subject(subject):
+    """Format a subject dictionary in the OpenSSL database notation
+
+    >>> format_subject({'C': 'NL', 'CN': 'some.host.name'})
+    '/C=NL/CN=some.host.name'
+
+    :param subject: Dictionary containing the subject fields
+    :type  subject: dict
+    :returns:       The formatted subject
+    :rtype:         str
+    """
+    return ''.join(['/{0}={1}'.format(field, subject[field])
+                    for field in SUBJECT_FIELDS if field in subject])
+
+
+def asn1_time(epoch):
+    """Format a time as used in the OpenSSL database
+
+    :param epoch:   Seconds since the epoch
+    :type  epoch:   int
+    :returns:       Date in YYMMDDHHMMSSZ format
+    :rtype:         str
+    """
+    return time.strftime('%y%m%d%H%M%SZ', time.gmtime(epoch))
+
+
+def format_serial(serial):
+    """Format a serial like OpenSSL does, using an even number of
+    uppercase hexadecimal digits
+
+    >>> format_serial(10)
+    '0A'
+
+    :param serial:  Serial number
+    :type  serial:  int
+    :returns:       Formatted serial
+    :rtype:         str
+    """
+    value = '{0:X}'.format(serial)
+    if len(value) % 2:
+        value = '0' + value
+    return value
+
+
+def gen_fqdn(index, domain=DOMAIN):
+    """Generate the name of a synthetic host
+
+    :param index:   Number of the host
+    :type  index:   int
+    :param domain:  Domain of the host
+    :type  domain:  str
+    :returns:       Fully-Qualified Domain-Name of the host
+    :rtype:         str
+    """
+    return 'host{0}.{1}'.format(index, domain)
+
+
+def gen_token(seed, fqdn):
+    """Generate a deterministic token for a synthetic host
+
+    :param seed:    Seed of the workspace
+    :type  seed:    int
+    :param fqdn:    Fully-Qualified Domain-Name of the host
+    :type  fqdn:    str
+    :returns:       Token for the host
+    :rtype:         str
+    """
+    return hashlib.sha256('{0}:{1}'.format(seed, fqdn).encode()).hexdigest()
+
+
+def gen_record(seed, index, hosts, days, now, subject,
+               revoked_ratio=REVOKED_RATIO, history=HISTORY, domain=DOMAIN):
+    """Generate the details of a single synthetic certificate. The result
+    only depends on the seed and index, so records can be generated in any
+    order or in parallel. The serial is assigned later on.
+
+    :param seed:            Seed of the workspace
+    :type  seed:            int
+    :param index:           Number of the certificate
+    :type  index:           int
+    :param hosts:           Number of hosts to spread the certificates over
+    :type  hosts:           int
+    :param days:            Number of days a certificate is valid
+    :type  days:            int
+    :param now:             Time at which the workspace is generated
+    :type  now:             int
+    :param subject:         Dictionary with the default subject fields
+    :type  subject:         dict
+    :param revoked_ratio:   Fraction of the certificates which is revoked
+    :type  revoked_ratio:   float
+    :param history:         Number of validity periods to spread over
+    :type  history:         float
+    :param domain:          Domain of the hosts
+    :type  domain:          str
+    :returns:               Dictionary containing the certificate details
+    :rtype:                 dict
+    """
+    rng = random.Random('{0}:{1}'.format(seed, index))
+    validity = days * 86400
+    notbefore = int(now - rng.uniform(0, validity * history))
+    notafter = notbefore + validity
+
+    fqdn = gen_fqdn(rng.randrange(hosts), domain=domain)
+    cert_subject = dict(subject)
+    cert_subject['CN'] = fqdn
+
+    status = 'V'
+    revoked = None
+    if rng.random() < revoked_ratio:
+        status = 'R'
+        revoked = int(rng.uniform(notbefore, min(now, notafter)))
+    elif notafter < now:
+        status = 'E'
+
+    return {
+        'status': status,
+        'notbefore': notbefore,
+        'notafter': notafter,
+        'revoked': revoked,
+        'serial': None,
+        'fqdn': fqdn,
+        'subject': cert_subject,
+    }
+
+
+def gen_records(size, seed=0, hosts=None, days=365, now=None, subject=None,
+                revoked_ratio=REVOKED_RATIO, history=HISTORY, domain=DOMAIN):
+    """Generate size synthetic certificates. Serials are assigned in the
+    order in which the certificates were issued, like a real CA would.
+
+    >>> records = gen_records(3, seed=42)
+    >>> [record['status'] for record in records]
+    ['E', 'E', 'V']
+
+    :param size:    Number of certificates to generate
+    :type  size:    int
+    :param seed:    Seed used to generate the certificates
+    :type  seed:    int
+    :param hosts:   Number of hosts, defaults to a third of size
+    :type  hosts:   int
+    :param now:     Time of generation, defaults to the start of today
+    :type  now:     int
+    :returns:       List containing the certificate details
+    :rtype:         list
+    """
+    if hosts is None:
+        hosts = max(1, size // HISTORY)
+    if now is None:
+        now = int(time.time()) // 86400 * 86400
+    if subject is None:
+        subject = {}
+
+    records = [gen_record(seed, index, hosts, days, now, subject,
+                          revoked_ratio=revoked_ratio, history=history,
+                          domain=domain)
+               for index in range(size)]
+    records.sort(key=lambda record: record['notbefore'])
+    for serial, record in enumerate(records, 1):
+        record['serial'] = format_serial(serial)
+    return records
+
+
+def db_line(record):
+    """Format a certificate as a line of the OpenSSL database
+
+    :param record:  Dictionary containing the certificate details
+    :type  record:  dict
+    :returns:       Line for the OpenSSL database
+    :rtype:         str
+    """
+    revoked = ''
+    if record['revoked'] is not None:
+        revoked = asn1_time(record['revoked'])
+    return '\t'.join([
+        record['status'], asn1_time(record['notafter']), revoked,
+        record['serial'], 'unknown', format_subject(record['subject']),
+    ])
+
+
+def gen_certificate(record, issuer):
+    """Fabricate a PEM encoded certificate for a record. The certificate is
+    structurally valid and contains the details of the record, but it is
+    not signed by the CA, so it will not pass verification.
+
+    :param record:  Dictionary containing the certificate details
+    :type  record:  dict
+    :param issuer:  Dictionary containing the subject of the issuing CA
+    :type  issuer:  dict
+    :returns:       PEM encoded certificate
+    :rtype:         str
+    """
+    algorithm = der(0x30, der_oid(OID_ECDSA_SHA256))
+    tbs = der(0x30, b''.join([
+        der(0xa0, der_integer(2)),
+        der_integer(int(record['serial'], 16)),
+        algorithm,
+        der_name(issuer),
+        der(0x30, der_time(record['notbefore']) +
+            der_time(record['notafter'])),
+        der_name(record['subject']),
+        PUBLIC_KEY,
+    ]))
+
+    # Placeholder signature, derived from the certificate contents
+    digest = hashlib.sha256(tbs).digest()
+    signature = der(0x30, der_integer(int.from_bytes(digest, 'big')) +
+                    der_integer(int.from_bytes(hashlib.sha256(digest).digest(),
+                                               'big')))
+    cert = der(0x30, tbs + algorithm + der(0x03, b'\x00' + signature))
+
+    data = base64.b64encode(cert).decode('ascii')
+    lines = ['-----BEGIN CERTIFICATE-----']
+    lines.extend([data[idx:idx + 64] for idx in range(0, len(data), 64)])
+    lines.append('-----END CERTIFICATE-----')
+    return '\n'.join(lines) + '\n'
+
+
+def write_certificates(args):
+    """Write the certificates for a chunk of records into certsdir. This is
+    used as the worker function when generating in parallel.
+
+    :param args:    Tuple containing certsdir, issuer and a list of records
+    :type  args:    tuple
+    :returns:       Number of certificates written
+    :rtype:         int
+    """
+    certsdir, issuer, records = args
+    for record in records:
+        fname = '{0}/{1}.pem'.format(certsdir, record['serial'])
+        open(fname, 'w').write(gen_certificate(record, issuer))
+    return len(records)
+
+
+def ca_subject(ca_data):
+    """Build the subject of a CA from its configuration
+
+    :param ca_data: Dictionary containing the CA details
+    :type  ca_data: dict
+    :returns:       Dictionary containing the subject of the CA
+    :rtype:         dict
+    """
+    return {
+        'C': ca_data['country'],
+        'ST': ca_data['province'],
+        'L': ca_data['city'],
+        'O': ca_data['organization'],
+        'OU': ca_data['unit'],
+        'CN': ca_data['cn'],
+    }
+
+
+def populate(ca, size, seed=0, hosts=None, now=None, workers=None,
+             revoked_ratio=REVOKED_RATIO, history=HISTORY, domain=DOMAIN,
+             chunksize=1000):
+    """Fill the structure of a CA, as created by setup_ca_structure, with
+    size synthetic certificates. This writes the OpenSSL database, serial
+    file, a PEM file for every certificate and a token store containing a
+    token for every host. The output only depends on the arguments, so the
+    same seed results in the same workspace.
+
+    >>> ca = ssl.OpenSSL(config, ssl.CA_AUTOSIGN)
+    >>> ca.setup_ca_structure()
+    >>> populate(ca, 100000, seed=42, workers=8)
+
+    :param ca:              CA to fill
+    :type  ca:              pkilib.ssl.OpenSSL
+    :param size:            Number of certificates to generate
+    :type  size:            int
+    :param seed:            Seed used to generate the certificates
+    :type  seed:            int
+    :param workers:         Number of processes writing certificates
+    :type  workers:         int
+    :param chunksize:       Number of certificates per work unit
+    :type  chunksize:       int
+    :returns:               List containing the generated records or False
+    :rtype:                 list, bool
+    """
+    ca_data = ca.ca_data
+    for path in [ca_data['certsdir'], os.path.dirname(ca_data['db'])]:
+        if not os.path.exists(path):
+            log.warning('{0} does not exist'.format(path))
+            return False
+
+    issuer = ca_subject(ca_data)
+    subject = dict(issuer)
+    del subject['CN']
+
+    log.debug('Generating {0} certificate records'.format(size))
+    records = gen_records(size, seed=seed, hosts=hosts,
+                          days=int(ca_data['days']), now=now,
+                          subject=subject, revoked_ratio=revoked_ratio,
+                          history=history, domain=domain)
+
+    lines = [db_line(record) for record in records]
+    open(ca_data['db'], 'w').write(''.join(['{0}\n'.format(line)
+                                            for line in lines]))
+    open(ca_data['db_attr'], 'w').write('unique_subject = no\n')
+    open(ca_data['crt_idx'], 'w').write('{0}\n'.format(
+        format_serial(size + 1)
+    ))
+
+    log.debug('Writing {0} certificates'.format(size))
+    chunks = [(ca_data['certsdir'], issuer, records[idx:idx + chunksize])
+              for idx in range(0, len(records), chunksize)]
+    if workers == 1 or len(chunks) < 2 or utils.C_OSNAME == 'OpenVMS':
+        for chunk in chunks:
+            write_certificates(chunk)
+    else:
+        pool = multiprocessing.Pool(workers)
+        try:
+            pool.map(write_certificates, chunks)
+        finally:
+            pool.close()
+            pool.join()
+
+    token_store = '{0}/tokens.json'.format(ca_data['workspace'])
+    hostnames = sorted(set([record['fqdn'] for record in records]))
+    tokens = dict([(fqdn, gen_token(seed, fqdn)) for fqdn in hostnames])
+    open(token_store, 'w').write(json.dumps(tokens, sort_keys=True))
+
+    return records
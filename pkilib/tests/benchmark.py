@@ -0,0 +1,120 @@
+import json
+import os
+
+from pkilib import benchmark
+
+RESULTS_FILE = './workspace/benchmark.json'
+
+
+class test_percentile:
+    def test_empty_values(self):
+        assert benchmark.percentile([], 50) is None
+
+    def test_single_value(self):
+        assert benchmark.percentile([3], 99) == 3.0
+
+    def test_median(self):
+        assert benchmark.percentile([4, 1, 3, 2], 50) == 2.5
+
+    def test_p99(self):
+        values = list(range(101))
+        assert benchmark.percentile(values, 99) == 99.0
+
+
+class test_summarize:
+    def test_empty_values(self):
+        assert benchmark.summarize([]) is None
+
+    def test_statistics(self):
+        stats = benchmark.summarize([1.0, 2.0, 3.0])
+        assert stats['count'] == 3
+        assert stats['min'] == 1.0
+        assert stats['max'] == 3.0
+        assert stats['mean'] == 2.0
+        assert stats['p50'] == 2.0
+
+
+class test_measure:
+    def test_measure(self):
+        calls = []
+        result = benchmark.measure(lambda: calls.append(1), ops=10, repeat=4)
+        assert len(calls) == 4
+        assert result['ops'] == 10
+        assert result['repeat'] == 4
+        assert result['per_op'] == result['median'] / 10
+
+
+class test_measure_memory:
+    def test_retained(self):
+        result = benchmark.measure_memory(lambda: bytearray(1000000))
+        assert 1000000 <= result['bytes'] < 1100000
+        assert result['peak'] >= result['bytes']
+
+    def test_garbage(self):
+        result = benchmark.measure_memory(lambda: len(bytearray(1000000)))
+        assert result['bytes'] < 10000
+        assert result['peak'] >= 1000000
+
+
+class test_results:
+    def tearDown(self):
+        if os.path.exists(RESULTS_FILE):
+            os.unlink(RESULTS_FILE)
+
+    def test_save_and_load(self):
+        results = {'parse_subject/1000': {'per_op': 0.1}}
+        assert benchmark.save_results(RESULTS_FILE, results) is True
+        assert benchmark.load_results(RESULTS_FILE) == results
+
+    def test_save_invalid_path(self):
+        assert benchmark.save_results('/nonexisting/file.json', {}) is False
+
+    def test_load_nonexisting_file(self):
+        assert benchmark.load_results('/nonexisting/file.json') is None
+
+    def test_load_invalid_json(self):
+        open(RESULTS_FILE, 'w').write('garbage')
+        assert benchmark.load_results(RESULTS_FILE) is None
+
+    def test_load_without_results(self):
+        open(RESULTS_FILE, 'w').write(json.dumps({'other': 1}))
+        assert benchmark.load_results(RESULTS_FILE) is None
+
+
+class test_compare:
+    def setUp(self):
+        self.old = {
+            'a/1000': {'per_op': 1.0},
+            'b/1000': {'per_op': 1.0},
+            'c/1000': {'per_op': 1.0},
+        }
+
+    def test_no_regression(self):
+        new = {'a/1000': {'per_op': 1.05}}
+        assert benchmark.compare(self.old, new) == [
+            ('a/1000', 1.0, 1.05, 1.05, False)
+        ]
+
+    def test_regression(self):
+        new = {'b/1000': {'per_op': 2.0}}
+        assert benchmark.compare(self.old, new)[0][4] is True
+
+    def test_custom_threshold(self):
+        new = {'b/1000': {'per_op': 2.0}}
+        assert benchmark.compare(self.old, new, threshold=1.5)[0][4] is False
+
+    def test_skips_unknown(self):
+        new = {'d/1000': {'per_op': 1.0}}
+        assert benchmark.compare(self.old, new) == []
+
+
+class test_format_table:
+    def test_format_table(self):
+        table = benchmark.format_table(['name', 'time', 'slow'],
+                                       [('keygen', 0.1234567, True),
+                                        ('sign', None, False)])
+        lines = table.split('\n')
+        assert lines[0] == 'name    time    slow'
+        assert lines[1] == '------  ------  ----'
+        assert lines[2] == 'keygen  0.1235  yes'
+        assert lines[3] == 'sign    -       no'
@@ -0,0 +1,373 @@
+import os
+import shutil
+import subprocess
+import sys
+import threading
+
+sys.path.append('.')
+
+from pkilib import certstore
+from pkilib import records
+from pkilib import synthetic
+
+TEST_DIR = './workspace/certstore'
+TEST_DB = '{0}/index.txt'.format(TEST_DIR)
+TEST_SQLITE = '{0}/certs.sqlite'.format(TEST_DIR)
+TEST_FP = '4F:0B:3C:00:11:22:33:44:55:66:77:88:99:AA:BB:CC:DD:EE:FF:01'
+
+NOW = 1500000000
+
+
+def fingerprint(record):
+    return '{0:040X}'.format(record.serial)
+
+
+def loader(record):
+    return {'fp': fingerprint(record)}
+
+
+def write_db(certs, mode='w'):
+    open(TEST_DB, mode).write(''.join([synthetic.db_line(record) + '\n'
+                                       for record in certs]))
+
+
+class test_imports:
+    def test_no_certindex(self):
+        output = subprocess.check_output([
+            sys.executable, '-c',
+            'import sys; import pkilib.certstore; '
+            'print("pkilib.server.certindex" in sys.modules)'
+        ])
+        assert output.strip() == b'False'
+
+
+class test_serial_to_int:
+    def test_hex(self):
+        assert certstore.serial_to_int('0A') == 10
+        assert certstore.serial_to_int(10) == 10
+
+    def test_invalid(self):
+        assert certstore.serial_to_int('xyz') is None
+        assert certstore.serial_to_int(None) is None
+
+
+class test_normalize_fingerprint:
+    def test_without_colons(self):
+        assert certstore.normalize_fingerprint('4f0b3c') == '4F:0B:3C'
+
+    def test_with_colons(self):
+        assert certstore.normalize_fingerprint(TEST_FP) == TEST_FP
+
+    def test_invalid(self):
+        assert certstore.normalize_fingerprint('4f0') is None
+        assert certstore.normalize_fingerprint('xyz0') is None
+        assert certstore.normalize_fingerprint(None) is None
+
+
+class test_new_store:
+    def setUp(self):
+        os.makedirs(TEST_DIR)
+
+    def tearDown(self):
+        shutil.rmtree(TEST_DIR)
+
+    def test_backends(self):
+        store = certstore.new_store('flatfile', db=TEST_DB)
+        assert isinstance(store, certstore.FlatFileStore)
+        store = certstore.new_store('sqlite', path=TEST_SQLITE)
+        assert isinstance(store, certstore.SQLiteStore)
+        store.close()
+        assert isinstance(certstore.new_store('memory'),
+                          certstore.MemoryStore)
+
+    def test_missing_path(self):
+        assert certstore.new_store('flatfile') is None
+        assert certstore.new_store('sqlite', db=TEST_DB) is None
+
+    def test_unknown(self):
+        assert certstore.new_store('unknown', db=TEST_DB) is None
+
+
+class StoreTests:
+    """Tests which are run against every backend"""
+    def setUp(self):
+        os.makedirs(TEST_DIR)
+        self.records = synthetic.gen_records(50, now=NOW)
+        self.store = self.new_store()
+        for record in self.records:
+            line = synthetic.db_line(record)
+            assert self.store.append(records.CertRecord.from_line(line))
+
+    def tearDown(self):
+        if hasattr(self.store, 'close'):
+            self.store.close()
+        shutil.rmtree(TEST_DIR)
+
+    def test_len(self):
+        assert len(self.store) == 50
+
+    def test_get(self):
+        record = self.records[10]
+        cert = self.store.get(record['serial'])
+        assert cert['serial'] == record['serial']
+        assert cert.status == record['status']
+        assert cert.notafter == record['notafter']
+        assert self.store.get(cert.serial)['serial'] == record['serial']
+
+    def test_get_unknown(self):
+        assert self.store.get('FFFFFF') is None
+        assert self.store.get('xyz') is None
+
+    def test_by_cn(self):
+        fqdn = self.records[0]['fqdn']
+        certs = self.store.by_cn(fqdn)
+        wanted = [record['serial'] for record in self.records
+                  if record['fqdn'] == fqdn]
+        assert [cert['serial'] for cert in certs] == wanted
+        assert self.store.by_cn('unknown.host') == []
+
+    def test_by_fingerprint(self):
+        record = self.records[5]
+        cert = self.store.by_fingerprint(
+            '{0:040X}'.format(int(record['serial'], 16)).lower())
+        assert cert['serial'] == record['serial']
+        assert self.store.by_fingerprint('00' * 20) is None
+        assert self.store.by_fingerprint('xyz') is None
+
+    def test_fingerprint_lazy(self):
+        cert = self.store.get(self.records[0]['serial'])
+        assert cert.loaded is False
+        assert cert.fingerprint is not None
+        assert cert.loaded is True
+
+    def test_list(self):
+        certs = self.store.list()
+        assert [cert['serial'] for cert in certs] == \
+            [record['serial'] for record in self.records]
+        assert [cert['serial'] for cert in self.store] == \
+            [cert['serial'] for cert in certs]
+
+    def test_list_status(self):
+        certs = self.store.list(status='V')
+        assert [cert['serial'] for cert in certs] == \
+            [record['serial'] for record in self.records
+             if record['status'] == 'V']
+
+    def test_list_expires_before(self):
+        certs = self.store.list(expires_before=NOW)
+        assert len(certs) == len([record for record in self.records
+                                  if record['notafter'] < NOW])
+        assert certs
+
+    def test_list_after(self):
+        serials = [record['serial'] for record in self.records]
+        certs = self.store.list(after=serials[9], limit=5)
+        assert [cert['serial'] for cert in certs] == serials[10:15]
+        assert self.store.list(after=serials[-1]) == []
+        assert self.store.list(after='xyz') == []
+
+    def test_list_status_limit(self):
+        wanted = [record['serial'] for record in self.records
+                  if record['status'] == 'V'][:3]
+        certs = self.store.list(status='V', limit=3)
+        assert [cert['serial'] for cert in certs] == wanted
+
+    def test_append_duplicate(self):
+        line = synthetic.db_line(self.records[0])
+        assert self.store.append(records.CertRecord.from_line(line)) is False
+        assert len(self.store) == 50
+
+    def test_revoke(self):
+        serial = self.records[-1]['serial']
+        assert self.store.revoke(serial, NOW, 'superseded') is True
+        cert = self.store.get(serial)
+        assert cert.status == 'R'
+        assert cert.revoked == NOW
+        assert cert.reason == 'superseded'
+
+    def test_revoke_unknown(self):
+        assert self.store.revoke('FFFFFF', NOW) is False
+
+    def test_cert_db(self):
+        data = self.store.cert_db()
+        assert sum([len(certs) for certs in data.values()]) == 50
+        fqdn = self.records[0]['fqdn']
+        assert data[fqdn][0]['serial'] == self.records[0]['serial']
+
+
+class test_MemoryStore(StoreTests):
+    def new_store(self):
+        return certstore.MemoryStore(loader=loader)
+
+    def test_list_invalid_notafter(self):
+        line = synthetic.db_line(self.records[0]).split('\t')
+        line[1] = 'garbage'
+        line[3] = synthetic.format_serial(51)
+        record = records.CertRecord.from_line('\t'.join(line))
+        assert record.notafter is None
+        assert self.store.append(record)
+        certs = self.store.list(expires_before=NOW * 2)
+        assert len(certs) == 50
+        assert len(self.store.list()) == 51
+
+
+class test_FlatFileStore(StoreTests):
+    def new_store(self):
+        open(TEST_DB, 'w').write('')
+        return certstore.FlatFileStore(TEST_DB, loader=loader)
+
+    def test_persisted(self):
+        store = certstore.FlatFileStore(TEST_DB)
+        assert store.refresh() is True
+        assert len(store) == 50
+
+    def test_revoke_persisted(self):
+        serial = self.records[0]['serial']
+        self.store.revoke(serial, NOW, 'keyCompromise')
+        store = certstore.FlatFileStore(TEST_DB)
+        store.refresh()
+        assert store.get(serial).reason == 'keyCompromise'
+        assert len(store) == 50
+
+    def test_refresh_append(self):
+        records_new = synthetic.gen_records(60, now=NOW)[50:]
+        for serial, record in enumerate(records_new, 51):
+            record['serial'] = synthetic.format_serial(serial)
+        write_db(records_new, mode='a')
+        assert self.store.refresh() is True
+        assert len(self.store) == 60
+        assert self.store.refresh() is False
+
+    def test_refresh_rewrite(self):
+        write_db(self.records[:10])
+        assert self.store.refresh() is True
+        assert len(self.store) == 10
+
+    def test_refresh_rewrite_fingerprint(self):
+        serial = self.records[0]['serial']
+        fp = self.store.get(serial).fingerprint
+        write_db(self.records[:10])
+        assert self.store.refresh() is True
+        assert self.store.get(serial).loaded is True
+        assert self.store.get(serial).fingerprint == fp
+        assert self.store.get(self.records[1]['serial']).loaded is False
+
+    def test_refresh_nonexisting(self):
+        store = certstore.FlatFileStore('{0}/unknown'.format(TEST_DIR))
+        assert store.refresh() is False
+
+    def test_revoke_lock(self):
+        lock = threading.Lock()
+        store = certstore.FlatFileStore(TEST_DB, lock=lock)
+        store.refresh()
+        serial = self.records[-1]['serial']
+        lock.acquire()
+        thread = threading.Thread(target=store.revoke,
+                                  args=(serial, NOW, 'superseded'))
+        thread.start()
+        thread.join(0.1)
+        assert thread.is_alive()
+        lock.release()
+        thread.join()
+        assert store.get(serial).status == 'R'
+
+
+class test_SQLiteStore(StoreTests):
+    def new_store(self):
+        return certstore.SQLiteStore(TEST_SQLITE, loader=loader)
+
+    def test_persisted(self):
+        store = certstore.SQLiteStore(TEST_SQLITE)
+        assert len(store) == 50
+        store.close()
+
+    def test_fingerprint_persisted(self):
+        cert = self.store.get(self.records[0]['serial'])
+        fp = cert.fingerprint
+        store = certstore.SQLiteStore(TEST_SQLITE)
+        assert store.get(self.records[0]['serial']).fingerprint == fp
+        assert store.get(self.records[1]['serial']).fingerprint is None
+        store.close()
+
+    def test_refresh_without_db(self):
+        assert self.store.refresh() is False
+
+    def test_by_fingerprint_unresolved(self):
+        calls = []
+
+        def unresolved(record):
+            calls.append(record['serial'])
+            return None
+
+        self.store.loader = unresolved
+        assert self.store.by_fingerprint('00' * 20) is None
+        assert len(calls) == 50
+        assert self.store.by_fingerprint('01' * 20) is None
+        assert len(calls) == 50
+
+
+class test_SQLiteStore_mirror:
+    def setUp(self):
+        os.makedirs(TEST_DIR)
+        self.records = synthetic.gen_records(50, now=NOW)
+        write_db(self.records)
+        self.store = certstore.SQLiteStore(TEST_SQLITE, db=TEST_DB,
+                                           loader=loader)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(TEST_DIR)
+
+    def test_refresh(self):
+        assert self.store.refresh() is True
+        assert len(self.store) == 50
+        assert self.store.refresh() is False
+
+    def test_refresh_append(self):
+        self.store.refresh()
+        certs = synthetic.gen_records(60, now=NOW)[50:]
+        for serial, record in enumerate(certs, 51):
+            record['serial'] = synthetic.format_serial(serial)
+        write_db(certs, mode='a')
+        assert self.store.refresh() is True
+        assert len(self.store) == 60
+
+    def test_refresh_rewrite(self):
+        self.store.refresh()
+        serial = self.records[0]['serial']
+        fp = self.store.get(serial).fingerprint
+        self.records[0]['status'] = 'R'
+        self.records[0]['revoked'] = NOW
+        write_db(self.records[:20])
+        assert self.store.refresh() is True
+        assert len(self.store) == 20
+        cert = self.store.get(serial)
+        assert cert.status == 'R'
+        assert cert.revoked == NOW
+        assert cert.fingerprint == fp
+
+    def test_restart(self):
+        self.store.refresh()
+        self.store.close()
+        self.store = certstore.SQLiteStore(TEST_SQLITE, db=TEST_DB)
+        assert len(self.store) == 50
+        self.store.refresh()
+        assert len(self.store) == 50
+
+    def test_append_refused(self):
+        self.store.refresh()
+        content = open(TEST_DB).read()
+        record = records.CertRecord.from_line(
+            'V\t250720010135Z\t\tFFFF\tunknown\t/CN=some.host.name')
+        assert self.store.append(record) is False
+        assert self.store.get('FFFF') is None
+        assert open(TEST_DB).read() == content
+
+    def test_revoke_refused(self):
+        self.store.refresh()
+        content = open(TEST_DB).read()
+        serial = [record['serial'] for record in self.records
+                  if record['status'] == 'V'][0]
+        assert self.store.revoke(serial, NOW) is False
+        assert self.store.get(serial).status == 'V'
+        assert open(TEST_DB).read() == content
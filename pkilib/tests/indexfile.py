@@ -0,0 +1,237 @@
+import os
+import shutil
+import subprocess
+import sys
+import threading
+
+sys.path.append('.')
+
+from pkilib import certstore
+from pkilib import indexfile
+from pkilib import synthetic
+
+TEST_DIR = './workspace/indexfile'
+TEST_DB = '{0}/index.txt'.format(TEST_DIR)
+
+NOW = 1500000000
+
+FCNTL = indexfile.fcntl
+
+
+def write_db(records, mode='w'):
+    lines = [synthetic.db_line(record) + '\n' for record in records]
+    open(TEST_DB, mode).write(''.join(lines))
+
+
+class test_rewrite:
+    def setUp(self):
+        os.makedirs(TEST_DIR)
+        self.records = synthetic.gen_records(10, now=NOW)
+        write_db(self.records)
+
+    def tearDown(self):
+        shutil.rmtree(TEST_DIR)
+
+    def test_rewrite(self):
+        inode = os.stat(TEST_DB).st_ino
+        lines = open(TEST_DB).readlines()[:5]
+        assert indexfile.rewrite(TEST_DB, lines) is True
+        assert open(TEST_DB).readlines() == lines
+        assert not os.path.exists('{0}.new'.format(TEST_DB))
+        assert os.stat(TEST_DB).st_ino != inode
+
+    def test_unwritable(self):
+        path = '{0}/unknown/index.txt'.format(TEST_DIR)
+        assert indexfile.rewrite(path, ['line\n']) is False
+        assert not os.path.exists(path)
+
+
+def try_lock_elsewhere():
+    """Try to acquire the lock on the test database from another process"""
+    output = subprocess.check_output([
+        sys.executable, '-c',
+        'import sys; sys.path.append("."); '
+        'from pkilib import indexfile; '
+        'print(indexfile.DatabaseLock({0!r}).acquire(False))'.format(TEST_DB)
+    ])
+    return output.strip() == b'True'
+
+
+class test_DatabaseLock:
+    def setUp(self):
+        os.makedirs(TEST_DIR)
+        self.records = synthetic.gen_records(10, now=NOW)
+        write_db(self.records)
+        self.lock = indexfile.DatabaseLock(TEST_DB)
+
+    def tearDown(self):
+        indexfile.fcntl = FCNTL
+        shutil.rmtree(TEST_DIR)
+
+    def test_threads(self):
+        with self.lock:
+            assert self.lock.locked() is True
+            result = []
+            thread = threading.Thread(
+                target=lambda: result.append(self.lock.acquire(False)))
+            thread.start()
+            thread.join()
+            assert result == [False]
+        assert self.lock.locked() is False
+        assert self.lock.acquire(False) is True
+        self.lock.release()
+
+    def test_processes(self):
+        assert try_lock_elsewhere() is True
+        with self.lock:
+            assert os.path.exists('{0}.lock'.format(TEST_DB))
+            assert try_lock_elsewhere() is False
+        assert try_lock_elsewhere() is True
+
+    def test_without_fcntl(self):
+        indexfile.fcntl = None
+        with self.lock:
+            assert self.lock.acquire(False) is False
+        assert not os.path.exists('{0}.lock'.format(TEST_DB))
+
+    def test_unwritable(self):
+        lock = indexfile.DatabaseLock('{0}/unknown/index.txt'.format(
+            TEST_DIR))
+        with lock:
+            assert lock.locked() is True
+        assert lock.locked() is False
+
+    def test_store(self):
+        store = certstore.FlatFileStore(TEST_DB, lock=self.lock)
+        store.refresh()
+        serial = [record['serial'] for record in self.records
+                  if record['status'] == 'V'][0]
+        assert store.revoke(serial, NOW, 'superseded') is True
+        assert store.get(serial).status == 'R'
+        assert self.lock.locked() is False
+
+
+class test_IndexReader:
+    def setUp(self):
+        os.makedirs(TEST_DIR)
+        self.records = synthetic.gen_records(100, now=NOW)
+        write_db(self.records[:60])
+        self.reader = indexfile.IndexReader(TEST_DB)
+
+    def tearDown(self):
+        shutil.rmtree(TEST_DIR)
+
+    def test_lines(self):
+        lines = list(self.reader.lines())
+        assert len(lines) == 60
+        assert lines[0] == synthetic.db_line(self.records[0])
+        assert self.reader.offset == os.path.getsize(TEST_DB)
+
+    def test_records(self):
+        certs = list(self.reader.records())
+        assert [cert['serial'] for cert in certs] == \
+            [record['serial'] for record in self.records[:60]]
+        assert certs[0].notafter == self.records[0]['notafter']
+
+    def test_fields(self):
+        fields = list(self.reader.fields(['serial', 'status']))
+        assert fields[0] == (self.records[0]['serial'],
+                             self.records[0]['status'])
+        assert len(fields) == 60
+
+    def test_fields_subject(self):
+        fields = list(self.reader.fields(['subject']))
+        assert fields[0] == (synthetic.format_subject(
+            self.records[0]['subject']),)
+
+    def test_invalid_lines(self):
+        open(TEST_DB, 'a').write('\ngarbage\nV\t250720010135Z\n')
+        assert len(list(self.reader.records())) == 60
+        assert len(list(self.reader.fields(['serial'], offset=0))) == 60
+
+    def test_no_trailing_newline(self):
+        open(TEST_DB, 'w').write(synthetic.db_line(self.records[0]))
+        assert list(self.reader.records()) == []
+        assert self.reader.offset == 0
+        open(TEST_DB, 'a').write('\n')
+        assert len(list(self.reader.records())) == 1
+        assert self.reader.offset == os.path.getsize(TEST_DB)
+
+    def test_partial_line(self):
+        list(self.reader.records())
+        offset = self.reader.offset
+        line = synthetic.db_line(self.records[60])
+        half = len(line) // 2
+        open(TEST_DB, 'a').write(line[:half])
+        assert self.reader.changed() is False
+        assert list(self.reader.records()) == []
+        assert self.reader.offset == offset
+        open(TEST_DB, 'a').write(line[half:] + '\n')
+        assert self.reader.changed() is False
+        certs = list(self.reader.records())
+        assert [cert['serial'] for cert in certs] == \
+            [self.records[60]['serial']]
+        assert self.reader.offset == os.path.getsize(TEST_DB)
+
+    def test_empty(self):
+        open(TEST_DB, 'w').write('')
+        assert list(self.reader.records()) == []
+        assert self.reader.changed() is False
+
+    def test_nonexisting(self):
+        reader = indexfile.IndexReader('{0}/unknown'.format(TEST_DIR))
+        assert list(reader.records()) == []
+
+    def test_tail(self):
+        list(self.reader.records())
+        write_db(self.records[60:], mode='a')
+        assert self.reader.changed() is False
+        certs = list(self.reader.records())
+        assert [cert['serial'] for cert in certs] == \
+            [record['serial'] for record in self.records[60:]]
+        assert list(self.reader.records()) == []
+
+    def test_changed(self):
+        list(self.reader.records())
+        assert self.reader.changed() is False
+        content = open(TEST_DB).read()
+        open(TEST_DB, 'w').write('R' + content[1:])
+        assert self.reader.changed() is True
+        assert len(list(self.reader.records(offset=0))) == 60
+        assert self.reader.changed() is False
+
+    def test_changed_uses_stat(self):
+        past = NOW - 3600
+        os.utime(TEST_DB, (past, past))
+        list(self.reader.records())
+        # The database itself is not read when it did not change
+        self.reader._open = None
+        assert self.reader.changed() is False
+
+    def test_replaced(self):
+        list(self.reader.records())
+        content = open(TEST_DB).read()
+        tmpfile = '{0}.new'.format(TEST_DB)
+        open(tmpfile, 'w').write(content)
+        os.rename(tmpfile, TEST_DB)
+        assert self.reader.changed() is True
+
+    def test_truncated(self):
+        list(self.reader.records())
+        write_db(self.records[:10])
+        assert self.reader.changed() is True
+
+    def test_resume(self):
+        certs = self.reader.records()
+        first = [next(certs) for _ in range(10)]
+        certs.close()
+        rest = list(self.reader.records())
+        assert len(first) + len(rest) == 60
+        assert rest[0]['serial'] == self.records[10]['serial']
+        assert self.reader.changed() is False
+
+    def test_resume_at_offset(self):
+        offset = len(synthetic.db_line(self.records[0])) + 1
+        certs = list(self.reader.records(offset=offset))
+        assert len(certs) == 59
+        assert self.reader.changed() is True
@@ -0,0 +1,181 @@
+import os
+import shutil
+import sys
+import time
+
+sys.path.append('.')
+
+from pkilib import metacache
+
+TEST_DIR = './workspace/metacache'
+TEST_CACHE = '{0}/meta.cache'.format(TEST_DIR)
+TEST_CRT = '{0}/0A.pem'.format(TEST_DIR)
+TEST_SUBJECT = '/C=NL/O=Test/CN=some.host.name'
+TEST_FP = '4F:0B:3C:00:11:22:33:44:55:66:77:88:99:AA:BB:CC:DD:EE:FF:01'
+
+
+class test_fingerprint:
+    def test_roundtrip(self):
+        digest = metacache.pack_fingerprint(TEST_FP)
+        assert len(digest) == 20
+        assert metacache.unpack_fingerprint(digest) == TEST_FP
+
+    def test_invalid(self):
+        assert metacache.pack_fingerprint(None) == metacache.NO_FINGERPRINT
+        assert metacache.pack_fingerprint('xyz') == metacache.NO_FINGERPRINT
+        assert metacache.pack_fingerprint('4F:0B') == metacache.NO_FINGERPRINT
+        assert metacache.unpack_fingerprint(metacache.NO_FINGERPRINT) is None
+
+
+class test_MetadataCache:
+    def setUp(self):
+        os.makedirs(TEST_DIR)
+        open(TEST_CRT, 'w').write('certificate')
+        self.cache = metacache.MetadataCache(TEST_CACHE)
+
+    def tearDown(self):
+        shutil.rmtree(TEST_DIR)
+
+    def test_get(self):
+        assert self.cache.get(TEST_CRT) is None
+        assert self.cache.set(TEST_CRT, '0A', TEST_SUBJECT, TEST_FP) is True
+        assert self.cache.get(TEST_CRT) == {
+            'serial': '0A',
+            'subject': TEST_SUBJECT,
+            'fingerprint': TEST_FP,
+        }
+        assert self.cache.hits == 1
+        assert self.cache.misses == 1
+
+    def test_set_nonexisting(self):
+        crt = '{0}/unknown.pem'.format(TEST_DIR)
+        assert self.cache.set(crt, '0B', TEST_SUBJECT, TEST_FP) is False
+        assert crt not in self.cache
+
+    def test_changed(self):
+        self.cache.set(TEST_CRT, '0A', TEST_SUBJECT, TEST_FP)
+        open(TEST_CRT, 'a').write('changed')
+        assert self.cache.get(TEST_CRT) is None
+
+    def test_touched(self):
+        self.cache.set(TEST_CRT, '0A', TEST_SUBJECT, TEST_FP)
+        os.utime(TEST_CRT, (time.time() + 10, time.time() + 10))
+        assert self.cache.get(TEST_CRT) is None
+
+    def test_replaced(self):
+        self.cache.set(TEST_CRT, '0A', TEST_SUBJECT, TEST_FP)
+        fstat = os.stat(TEST_CRT)
+        os.rename(TEST_CRT, '{0}.old'.format(TEST_CRT))
+        open(TEST_CRT, 'w').write('certificate')
+        os.utime(TEST_CRT, ns=(fstat.st_atime_ns, fstat.st_mtime_ns))
+        assert self.cache.get(TEST_CRT) is None
+
+    def test_removed(self):
+        self.cache.set(TEST_CRT, '0A', TEST_SUBJECT, TEST_FP)
+        os.unlink(TEST_CRT)
+        assert self.cache.get(TEST_CRT) is None
+
+    def test_save_load(self):
+        self.cache.set(TEST_CRT, '0A', TEST_SUBJECT, TEST_FP)
+        crt = '{0}/0B.pem'.format(TEST_DIR)
+        open(crt, 'w').write('other')
+        self.cache.set(crt, '0B')
+        assert self.cache.save() is True
+        assert not os.path.exists('{0}.tmp'.format(TEST_CACHE))
+
+        cache = metacache.MetadataCache(TEST_CACHE)
+        assert cache.load() is True
+        assert len(cache) == 2
+        assert cache.get(TEST_CRT)['fingerprint'] == TEST_FP
+        assert cache.get(crt) == {
+            'serial': '0B',
+            'subject': None,
+            'fingerprint': None,
+        }
+
+    def test_save_unchanged(self):
+        self.cache.set(TEST_CRT, '0A', TEST_SUBJECT, TEST_FP)
+        self.cache.save()
+        mtime = os.stat(TEST_CACHE).st_mtime_ns
+        os.utime(TEST_CACHE, ns=(mtime - 10 ** 9, mtime - 10 ** 9))
+        self.cache.set(TEST_CRT, '0A', TEST_SUBJECT, TEST_FP)
+        assert self.cache.save() is True
+        assert os.stat(TEST_CACHE).st_mtime_ns == mtime - 10 ** 9
+
+    def test_load_nonexisting(self):
+        assert self.cache.load() is True
+        assert len(self.cache) == 0
+
+    def test_load_invalid(self):
+        open(TEST_CACHE, 'wb').write(b'garbage data')
+        assert self.cache.load() is False
+        assert len(self.cache) == 0
+
+    def test_load_truncated(self):
+        self.cache.set(TEST_CRT, '0A', TEST_SUBJECT, TEST_FP)
+        self.cache.save()
+        data = open(TEST_CACHE, 'rb').read()
+        open(TEST_CACHE, 'wb').write(data[:-5])
+        assert self.cache.load() is False
+        assert len(self.cache) == 0
+
+    def test_set_merge(self):
+        self.cache.set(TEST_CRT, '0A', TEST_SUBJECT)
+        self.cache.set(TEST_CRT, '0A', fingerprint=TEST_FP)
+        assert self.cache.get(TEST_CRT)['subject'] == TEST_SUBJECT
+        assert self.cache.get(TEST_CRT)['fingerprint'] == TEST_FP
+
+    def test_set_changed(self):
+        self.cache.set(TEST_CRT, '0A', TEST_SUBJECT, TEST_FP)
+        open(TEST_CRT, 'a').write('changed')
+        self.cache.set(TEST_CRT, '0A')
+        assert self.cache.get(TEST_CRT)['subject'] is None
+        assert self.cache.get(TEST_CRT)['fingerprint'] is None
+
+    def test_prune(self):
+        self.cache.set(TEST_CRT, '0A', TEST_SUBJECT, TEST_FP)
+        assert self.cache.prune([TEST_CRT]) == 0
+        assert self.cache.prune([]) == 1
+        assert TEST_CRT not in self.cache
+
+
+class test_CacheSaver:
+    def setUp(self):
+        os.makedirs(TEST_DIR)
+        open(TEST_CRT, 'w').write('certificate')
+        self.cache = metacache.MetadataCache(TEST_CACHE)
+        self.saver = metacache.CacheSaver(self.cache, 0.05)
+
+    def tearDown(self):
+        self.saver.stop()
+        shutil.rmtree(TEST_DIR)
+
+    def test_run_once(self):
+        self.cache.set(TEST_CRT, '0A', TEST_SUBJECT, TEST_FP)
+        assert self.saver.run_once() is True
+        assert os.path.exists(TEST_CACHE)
+        assert self.saver.stats['runs'] == 1
+
+    def test_failed(self):
+        self.cache.path = '{0}/unknown/meta.cache'.format(TEST_DIR)
+        self.cache.set(TEST_CRT, '0A', TEST_SUBJECT, TEST_FP)
+        assert self.saver.run_once() is False
+        assert self.saver.stats['failed'] == 1
+
+    def test_background(self):
+        self.saver.start()
+        self.cache.set(TEST_CRT, '0A', TEST_SUBJECT, TEST_FP)
+        deadline = time.time() + 5
+        while not os.path.exists(TEST_CACHE) and time.time() < deadline:
+            time.sleep(0.01)
+        assert os.path.exists(TEST_CACHE)
+
+    def test_stop_saves(self):
+        self.saver.interval = 3600
+        self.saver.start()
+        self.cache.set(TEST_CRT, '0A', TEST_SUBJECT, TEST_FP)
+        assert not os.path.exists(TEST_CACHE)
+        assert self.saver.stop() is True
+        cache = metacache.MetadataCache(TEST_CACHE)
+        assert cache.load() is True
+        assert cache.get(TEST_CRT)['fingerprint'] == TEST_FP
@@ -0,0 +1,109 @@
+import glob
+import os
+import pstats
+import shutil
+
+from pkilib import profiling
+
+PROFILE_DIR = './workspace/profile'
+
+
+def work(value):
+    return sum(range(value))
+
+
+class test_safe_name:
+    def test_route(self):
+        assert profiling.safe_name('/v1/jobs/<job_id>') == 'v1_jobs_job_id'
+
+    def test_root(self):
+        assert profiling.safe_name('/') == 'index'
+
+    def test_code_path(self):
+        assert profiling.safe_name('update_cert_db') == 'update_cert_db'
+
+
+class test_Profiler:
+    def setUp(self):
+        self.profiler = profiling.Profiler(PROFILE_DIR, sample_rate=1.0,
+                                           keep=3)
+
+    def tearDown(self):
+        shutil.rmtree(PROFILE_DIR)
+
+    def test_creates_directory(self):
+        assert os.path.isdir(PROFILE_DIR)
+
+    def test_wants_all_paths(self):
+        assert self.profiler.wants('update_cert_db') is True
+
+    def test_wants_selected_paths(self):
+        self.profiler.paths = ['requests']
+        assert self.profiler.wants('requests') is True
+        assert self.profiler.wants('update_cert_db') is False
+
+    def test_call_returns_value(self):
+        assert self.profiler.call('/v1/sign', work, 10) == 45
+
+    def test_call_writes_pstats(self):
+        self.profiler.call('/v1/sign', work, 10)
+        files = glob.glob('{0}/v1_sign-*.pstats'.format(PROFILE_DIR))
+        assert len(files) == 1
+        assert pstats.Stats(files[0]).total_calls > 0
+
+    def test_call_not_sampled(self):
+        self.profiler.sample_rate = 0
+        self.profiler.call('/v1/sign', work, 10)
+        assert glob.glob('{0}/*.pstats'.format(PROFILE_DIR)) == []
+
+    def test_call_while_profiling(self):
+        self.profiler._lock.acquire()
+        try:
+            assert self.profiler.call('/v1/sign', work, 10) == 45
+        finally:
+            self.profiler._lock.release()
+        assert glob.glob('{0}/*.pstats'.format(PROFILE_DIR)) == []
+
+    def test_call_raises(self):
+        try:
+            self.profiler.call('/v1/sign', work, None)
+        except TypeError:
+            pass
+        assert len(glob.glob('{0}/*.pstats'.format(PROFILE_DIR))) == 1
+        assert self.profiler._lock.acquire(False) is True
+
+    def test_rotate(self):
+        for i in range(5):
+            self.profiler.call('/v1/sign', work, 10)
+        self.profiler.call('/v1/sign/other', work, 10)
+        files = glob.glob('{0}/v1_sign-*.pstats'.format(PROFILE_DIR))
+        assert len(files) == 3
+        files = glob.glob('{0}/v1_sign_other-*.pstats'.format(PROFILE_DIR))
+        assert len(files) == 1
+
+
+class test_profiled:
+    def setUp(self):
+        @profiling.profiled('work')
+        def decorated(value):
+            return work(value)
+        self.decorated = decorated
+
+    def tearDown(self):
+        profiling.PROFILER = None
+        if os.path.exists(PROFILE_DIR):
+            shutil.rmtree(PROFILE_DIR)
+
+    def test_disabled(self):
+        assert self.decorated(10) == 45
+
+    def test_enabled(self):
+        profiling.PROFILER = profiling.Profiler(PROFILE_DIR, sample_rate=1.0)
+        assert self.decorated(10) == 45
+        assert len(glob.glob('{0}/work-*.pstats'.format(PROFILE_DIR))) == 1
+
+    def test_path_not_selected(self):
+        profiling.PROFILER = profiling.Profiler(PROFILE_DIR, sample_rate=1.0,
+                                                paths=['other'])
+        assert self.decorated(10) == 45
+        assert glob.glob('{0}/*.pstats'.format(PROFILE_DIR)) == []
@@ -0,0 +1,210 @@
+import sys
+
+sys.path.append('.')
+
+from pkilib import records
+
+TEST_LINE = 'R\t250720010135Z\t160720010135Z,keyCompromise\t0a\tunknown' + \
+    '\t/C=NL/O=Test/CN=some.host.name\n'
+TEST_FP = '4F:0B:3C:00:11:22:33:44:55:66:77:88:99:AA:BB:CC:DD:EE:FF:01'
+
+
+class test_format_serial:
+    def test_even(self):
+        assert records.format_serial(0x1234) == '1234'
+
+    def test_padding(self):
+        assert records.format_serial(10) == '0A'
+        assert records.format_serial(0x100) == '0100'
+
+
+class test_normalize_fingerprint:
+    def test_colons(self):
+        assert records.normalize_fingerprint('4f0b3c') == '4F:0B:3C'
+        assert records.normalize_fingerprint(TEST_FP.lower()) == TEST_FP
+
+    def test_invalid(self):
+        assert records.normalize_fingerprint('4f0') is None
+        assert records.normalize_fingerprint('xyz0') is None
+        assert records.normalize_fingerprint(None) is None
+
+
+class test_intern_subject:
+    def test_split(self):
+        cn, template = records.intern_subject('/C=NL/O=Test/CN=a.host')
+        assert cn == 'a.host'
+        assert template == (('C', 'NL'), ('O', 'Test'), ('CN', None))
+
+    def test_shared_template(self):
+        first = records.intern_subject('/C=NL/O=Test/CN=a.host')
+        second = records.intern_subject('/C=NL/O=Test/CN=b.host')
+        assert first[1] is second[1]
+
+    def test_different_template(self):
+        first = records.intern_subject('/C=NL/O=Test/CN=a.host')
+        second = records.intern_subject('/C=NL/O=Other/CN=a.host')
+        assert first[1] != second[1]
+
+    def test_invalid(self):
+        assert records.intern_subject('C=NL/CN=a.host') is None
+        assert records.intern_subject('/C=NL/O=Test') is None
+        assert records.intern_subject('/C=NL/CN') is None
+        assert records.intern_subject(None) is None
+
+
+class test_CertRecord:
+    def setUp(self):
+        self.record = records.CertRecord.from_line(TEST_LINE)
+
+    def test_from_line(self):
+        assert self.record.status == 'R'
+        assert self.record.notafter == 1752973295
+        assert self.record.revoked == 1468976495
+        assert self.record.reason == 'keyCompromise'
+        assert self.record.serial == 10
+        assert self.record.cn == 'some.host.name'
+
+    def test_valid(self):
+        record = records.CertRecord.from_line(
+            'V\t250720010135Z\t\t0B\tunknown\t/CN=some.host.name'
+        )
+        assert record.status == 'V'
+        assert record.revoked is None
+        assert record.reason is None
+
+    def test_shared_kind(self):
+        first = records.CertRecord.from_line(
+            'V\t250720010135Z\t\t0B\tunknown\t/O=Test/CN=a.host.name'
+        )
+        second = records.CertRecord.from_line(
+            'V\t260720010135Z\t\t0C\tunknown\t/O=Test/CN=b.host.name'
+        )
+        assert first._kind is second._kind
+        assert self.record._kind is not first._kind
+        assert first.fname == 'unknown'
+        assert first.template == (('O', 'Test'), ('CN', None))
+
+    def test_packed_serial(self):
+        serial = (1 << 159) + 10
+        record = records.CertRecord('V', 1752973295, None, None, serial,
+                                    'a.host', (('CN', None),))
+        assert record.serial == serial
+        assert record.notafter == 1752973295
+        record = records.CertRecord('V', -86400, None, None, 0, 'a.host',
+                                    (('CN', None),))
+        assert record.serial == 0
+        assert record.notafter == -86400
+        record = records.CertRecord('V', None, None, None, 11, 'a.host',
+                                    (('CN', None),))
+        assert record.serial == 11
+        assert record.notafter is None
+
+    def test_invalid(self):
+        assert records.CertRecord.from_line('V\t250720010135Z') is None
+        assert records.CertRecord.from_line(
+            TEST_LINE.replace('\t0a\t', '\txx\t')) is None
+        assert records.CertRecord.from_line(
+            TEST_LINE.replace('/C=NL', 'C=NL')) is None
+
+    def test_to_line(self):
+        assert self.record.to_line() == TEST_LINE.strip().replace(
+            '\t0a\t', '\t0A\t')
+        assert records.CertRecord.from_line(
+            self.record.to_line()).reason == 'keyCompromise'
+
+    def test_to_line_fname(self):
+        line = TEST_LINE.replace('\tunknown\t', '\t0A.pem\t')
+        record = records.CertRecord.from_line(line)
+        assert record.fname == '0A.pem'
+        assert record.to_line().split('\t')[4] == '0A.pem'
+
+    def test_to_line_invalid_notafter(self):
+        record = records.CertRecord.from_line(
+            TEST_LINE.replace('250720010135Z', 'garbage'))
+        assert record.notafter is None
+        assert record.to_line().split('\t')[1] == ''
+
+    def test_raw_subject(self):
+        assert self.record.raw_subject == '/C=NL/O=Test/CN=some.host.name'
+
+    def test_mark_revoked(self):
+        record = records.CertRecord.from_line(
+            'V\t250720010135Z\t\t0B\tunknown\t/CN=some.host.name'
+        )
+        record.mark_revoked(1468976495, 'superseded')
+        assert record.status == 'R'
+        assert record.revoked == 1468976495
+        assert record.reason == 'superseded'
+
+    def test_keys(self):
+        assert self.record['serial'] == '0A'
+        assert self.record['CN'] == 'some.host.name'
+        assert self.record['status'] == 'R'
+        assert self.record['notafter'] == 1752973295
+        assert self.record['subject'] == {
+            'C': 'NL', 'O': 'Test', 'CN': 'some.host.name'
+        }
+
+    def test_unknown_key(self):
+        try:
+            self.record['unknown']
+        except KeyError:
+            return
+        assert False
+
+    def test_fingerprint(self):
+        assert self.record['fingerprint'] is None
+        assert 'fp' not in self.record
+        self.record.fingerprint = TEST_FP
+        assert self.record['fingerprint'] == TEST_FP
+        assert self.record['fp'] == TEST_FP
+        assert 'fingerprint' in self.record
+
+    def test_loader(self):
+        calls = []
+
+        def loader(record):
+            calls.append(record)
+            return {'fp': TEST_FP}
+
+        self.record.set_loader(loader)
+        assert self.record.loaded is False
+        assert self.record['serial'] == '0A'
+        assert calls == []
+        assert self.record.fingerprint == TEST_FP
+        assert self.record.fingerprint == TEST_FP
+        assert calls == [self.record]
+        assert self.record.loaded is True
+
+    def test_loader_without_details(self):
+        self.record.set_loader(lambda record: None)
+        assert self.record['fingerprint'] is None
+        assert 'fp' not in self.record
+        assert self.record.loaded is True
+
+    def test_loader_overridden(self):
+        self.record.set_loader(lambda record: {'fp': None})
+        self.record.fingerprint = TEST_FP
+        assert self.record.fingerprint == TEST_FP
+
+    def test_invalid_fingerprint(self):
+        self.record.fingerprint = 'xyz'
+        assert self.record.fingerprint is None
+
+    def test_get(self):
+        assert self.record.get('serial') == '0A'
+        assert self.record.get('fingerprint', 'none') == 'none'
+        assert self.record.get('unknown') is None
+
+    def test_as_dict(self):
+        data = self.record.as_dict()
+        assert data['serial'] == '0A'
+        assert data['reason'] == 'keyCompromise'
+        assert 'fp' not in data
+
+    def test_slots(self):
+        try:
+            self.record.unknown = True
+        except AttributeError:
+            return
+        assert False
@@ -886,6 +886,16 @@ class test_OpenSSL_update_cert_db:
         assert len(self.autosign.cert_db) == 1
         assert 'fp' not in self.autosign.cert_db[TLS_NAME]
 
+    def test_lazy_details(self):
+        assert self.autosign.update_cert_db() is True
+        record = self.autosign.cert_db[TLS_NAME][0]
+        assert record.loaded is False
+        crt = '{0}/{1}.pem'.format(self.autosign.ca_data['certsdir'],
+                                   record['serial'])
+        cert_data = self.autosign.parse_certificate(crt)
+        assert record['fingerprint'] == cert_data['fp']
+        assert record.loaded is True
+
     def test_cn_not_in_data(self):
         open(AUTOSIGN_DB, 'w').write('')
         assert self.autosign.update_cert_db() is True
@@ -898,3 +908,4 @@ class test_OpenSSL_update_cert_db:
         assert self.autosign.update_cert_db() is True
         assert len(self.autosign.cert_db) == 1
         assert self.autosign.cert_db[TLS_NAME][0]['serial'] == '42'
+        assert self.autosign.cert_db[TLS_NAME][0]['fingerprint'] is None
@@ -0,0 +1,144 @@
+import json
+import os
+import shutil
+
+import yaml
+
+import pkilib.log as log
+import pkilib.ssl as ssl
+from pkilib import synthetic
+
+CFG_FILE = './workspace/unittest/config/pki.yml'
+LOG_CFG = './workspace/unittest/config/logging.yml'
+LOG_HANDLER = 'unittest'
+
+NOW = 1500000000
+
+
+class test_format_serial:
+    def test_even_length(self):
+        assert synthetic.format_serial(10) == '0A'
+
+    def test_uppercase(self):
+        assert synthetic.format_serial(0xabc) == '0ABC'
+        assert synthetic.format_serial(0xabcd) == 'ABCD'
+
+
+class test_format_subject:
+    def test_field_order(self):
+        subject = {'CN': 'some.host.name', 'C': 'NL', 'O': 'Test'}
+        assert synthetic.format_subject(subject) == \
+            '/C=NL/O=Test/CN=some.host.name'
+
+
+class test_der_oid:
+    def test_common_name(self):
+        assert synthetic.der_oid('2.5.4.3') == bytes.fromhex('0603550403')
+
+    def test_multibyte_arc(self):
+        assert synthetic.der_oid(synthetic.OID_ECDSA_SHA256) == \
+            bytes.fromhex('06082a8648ce3d040302')
+
+
+class test_gen_records:
+    def test_deterministic(self):
+        first = synthetic.gen_records(100, seed=42, now=NOW)
+        second = synthetic.gen_records(100, seed=42, now=NOW)
+        assert first == second
+
+    def test_seed_changes_output(self):
+        first = synthetic.gen_records(100, seed=1, now=NOW)
+        second = synthetic.gen_records(100, seed=2, now=NOW)
+        assert first != second
+
+    def test_serials_in_issue_order(self):
+        records = synthetic.gen_records(100, now=NOW)
+        serials = [int(record['serial'], 16) for record in records]
+        assert serials == list(range(1, 101))
+        notbefore = [record['notbefore'] for record in records]
+        assert notbefore == sorted(notbefore)
+
+    def test_statuses(self):
+        records = synthetic.gen_records(1000, now=NOW)
+        for record in records:
+            if record['status'] == 'R':
+                assert record['revoked'] is not None
+            elif record['status'] == 'E':
+                assert record['notafter'] < NOW
+            else:
+                assert record['notafter'] >= NOW
+        statuses = set([record['status'] for record in records])
+        assert statuses == set(['V', 'E', 'R'])
+
+    def test_hosts(self):
+        records = synthetic.gen_records(100, hosts=5, now=NOW)
+        assert len(set([record['fqdn'] for record in records])) <= 5
+
+
+class test_db_line:
+    def test_fields(self):
+        record = synthetic.gen_records(1, now=NOW, revoked_ratio=0)[0]
+        fields = synthetic.db_line(record).split('\t')
+        assert len(fields) == 6
+        assert fields[0] == record['status']
+        assert fields[1] == synthetic.asn1_time(record['notafter'])
+        assert fields[2] == ''
+        assert fields[3] == '01'
+        assert fields[5] == '/CN={0}'.format(record['fqdn'])
+
+    def test_revoked(self):
+        record = synthetic.gen_records(1, now=NOW, revoked_ratio=1)[0]
+        fields = synthetic.db_line(record).split('\t')
+        assert fields[0] == 'R'
+        assert fields[2] == synthetic.asn1_time(record['revoked'])
+
+
+class test_gen_certificate:
+    def test_pem(self):
+        record = synthetic.gen_records(1, now=NOW)[0]
+        pem = synthetic.gen_certificate(record, {'CN': 'Test CA'})
+        lines = pem.strip().split('\n')
+        assert lines[0] == '-----BEGIN CERTIFICATE-----'
+        assert lines[-1] == '-----END CERTIFICATE-----'
+        for line in lines[1:-1]:
+            assert len(line) <= 64
+
+
+class test_populate:
+    def setUp(self):
+        log.LOGGER = log.get_handler(LOG_CFG, LOG_HANDLER)
+        config = yaml.load(open(CFG_FILE, 'r').read())
+        self.ca = ssl.OpenSSL(config, ssl.CA_AUTOSIGN)
+        self.token_store = '{0}/tokens.json'.format(
+            self.ca.ca_data['workspace']
+        )
+
+    def tearDown(self):
+        if os.path.exists(self.ca.ca_data['basedir']):
+            shutil.rmtree(self.ca.ca_data['basedir'])
+        if os.path.exists(self.token_store):
+            os.unlink(self.token_store)
+
+    def test_missing_structure(self):
+        assert synthetic.populate(self.ca, 10, now=NOW) is False
+
+    def test_populate(self):
+        assert self.ca.setup_ca_structure() is True
+        records = synthetic.populate(self.ca, 50, seed=42, now=NOW,
+                                     workers=1)
+        assert len(records) == 50
+
+        lines = open(self.ca.ca_data['db'], 'r').read().strip().split('\n')
+        assert len(lines) == 50
+        assert open(self.ca.ca_data['crt_idx'], 'r').read() == '33\n'
+
+        certsdir = self.ca.ca_data['certsdir']
+        for record in records:
+            assert os.path.exists('{0}/{1}.pem'.format(certsdir,
+                                                       record['serial']))
+
+        tokens = json.loads(open(self.token_store, 'r').read())
+        fqdns = set([record['fqdn'] for record in records])
+        assert set(tokens) == fqdns
+        for fqdn in fqdns:
+            assert tokens[fqdn] == synthetic.gen_token(42, fqdn)
@@ -1,13 +1,46 @@
 import nose
 import os
 import shlex
+import shutil
+import subprocess
 import sys
+import threading
+import time
 
 sys.path.append('.')
 
 
 from pkilib import utils
 
+FAKE_DIR = './workspace/fakessl'
+FAKE_OPENSSL = '{0}/openssl'.format(FAKE_DIR)
+CERTS_DIR = './workspace/certs'
+
+# Stand-in for openssl in interactive mode, which echoes every command
+FAKE_SCRIPT = """#!{0}
+import sys
+import time
+
+sys.stdout.write('OpenSSL> ')
+sys.stdout.flush()
+for line in sys.stdin:
+    args = line.split()
+    if args[0] == 'sleep':
+        time.sleep(float(args[1]))
+    elif args[0] == 'exit':
+        sys.exit(1)
+    sys.stdout.write('{{0}}\\n'.format(' '.join(args)))
+    sys.stdout.write('OpenSSL> ')
+    sys.stdout.flush()
+""".format(sys.executable)
+
+
+def write_fake_openssl():
+    if not os.path.exists(FAKE_DIR):
+        os.makedirs(FAKE_DIR)
+    open(FAKE_OPENSSL, 'w').write(FAKE_SCRIPT)
+    os.chmod(FAKE_OPENSSL, 0o755)
+
 
 class test_fhost_unix:
     def test_converts_hostname(self):
@@ -123,6 +156,229 @@ class test_run_vms:
         assert utils.run(shlex.split('uname -s')).strip() == os.uname()[0]
 
 
+class test_SpawnedProcess:
+    def test_capture(self):
+        proc = utils.SpawnedProcess(['uname', '-s'])
+        assert proc.stdout.read().decode('utf-8').strip() == os.uname()[0]
+        assert proc.wait() == 0
+        proc.stdout.close()
+        proc.stderr.close()
+
+    def test_exit_code(self):
+        proc = utils.SpawnedProcess(['false'], capture=False)
+        assert proc.wait() == 1
+
+    def test_nonexisting(self):
+        try:
+            utils.SpawnedProcess(['somerandomunknownfilename'])
+        except OSError:
+            return
+        assert False
+
+    def test_wait_timeout(self):
+        proc = utils.SpawnedProcess(['sleep', '5'], capture=False)
+        try:
+            proc.wait(timeout=0.1)
+            assert False
+        except subprocess.TimeoutExpired:
+            pass
+        proc.kill()
+        assert proc.wait() == -9
+
+
+class test_CommandExecutor:
+    def setUp(self):
+        self.executor = utils.CommandExecutor(max_processes=2, timeout=5)
+
+    def test_execute(self):
+        code, out, err = self.executor.execute(['uname', '-s'])
+        assert code == 0
+        assert out.decode('utf-8').strip() == os.uname()[0]
+        assert err == b''
+
+    def test_large_output(self):
+        cmd = [sys.executable, '-c',
+               'import sys; sys.stdout.write("x" * 1048576); '
+               'sys.stderr.write("y" * 1048576)']
+        code, out, err = self.executor.execute(cmd)
+        assert code == 0
+        assert len(out) == 1048576
+        assert len(err) == 1048576
+
+    def test_fork_fallback(self):
+        executor = utils.CommandExecutor(posix_spawn=False)
+        assert executor.posix_spawn is False
+        code, out, err = executor.execute(['uname', '-s'])
+        assert out.decode('utf-8').strip() == os.uname()[0]
+
+    def test_timeout(self):
+        started = time.time()
+        assert self.executor.execute(['sleep', '5'], timeout=0.2) is None
+        assert time.time() - started < 2
+        assert self.executor.stats['sleep']['timeouts'] == 1
+        assert self.executor.running == 0
+
+    def test_timeout_without_capture(self):
+        assert self.executor.execute(['sleep', '5'], capture=False,
+                                     timeout=0.2) is None
+
+    def test_nonexisting(self):
+        assert self.executor.execute(['somerandomunknownfilename']) is None
+        stats = self.executor.stats['somerandomunknownfilename']
+        assert stats['failures'] == 1
+
+    def test_concurrency(self):
+        results = []
+
+        def worker():
+            results.append(self.executor.execute(['sleep', '0.3']))
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        started = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert time.time() - started >= 0.6
+        assert len(results) == 4
+        assert self.executor.stats['sleep']['queued'] > 0
+
+    def test_no_free_slot(self):
+        executor = utils.CommandExecutor(max_processes=1)
+        thread = threading.Thread(target=executor.execute,
+                                  args=(['sleep', '0.5'],))
+        thread.start()
+        time.sleep(0.1)
+        assert executor.execute(['true'], timeout=0.1) is None
+        thread.join()
+        assert executor.stats['true']['timeouts'] == 1
+
+    def test_stats(self):
+        self.executor.execute(['true'])
+        self.executor.execute(['false'])
+        self.executor.execute(['openssl', 'version'])
+        assert self.executor.stats['true']['count'] == 1
+        assert self.executor.stats['false']['failures'] == 1
+        assert 'openssl version' in self.executor.stats
+
+    def test_run_uses_executor(self):
+        original = utils.EXECUTOR
+        utils.EXECUTOR = self.executor
+        try:
+            assert utils.run('sleep 5', timeout=0.2) is None
+            assert utils.run('uname -s').strip() == os.uname()[0]
+        finally:
+            utils.EXECUTOR = original
+        assert self.executor.stats['uname']['count'] == 1
+
+
+class test_asn1_to_epoch:
+    def test_utctime(self):
+        assert utils.asn1_to_epoch('150720010135Z') == 1437354095
+
+    def test_generalizedtime(self):
+        assert utils.asn1_to_epoch('20500101000000Z') == 2524608000
+
+    def test_invalid_length(self):
+        assert utils.asn1_to_epoch('1507200101Z') is None
+
+    def test_invalid_date(self):
+        assert utils.asn1_to_epoch('151320010135Z') is None
+
+    def test_undefined_input(self):
+        assert utils.asn1_to_epoch(None) is None
+
+
+class test_epoch_to_asn1:
+    def test_utctime(self):
+        assert utils.epoch_to_asn1(1437354095) == '150720010135Z'
+
+    def test_generalizedtime(self):
+        assert utils.epoch_to_asn1(2524608000) == '20500101000000Z'
+
+    def test_roundtrip(self):
+        assert utils.asn1_to_epoch(utils.epoch_to_asn1(1752973295)) == \
+            1752973295
+
+    def test_roundtrip_pivot(self):
+        # 1950-01-01, 1969-12-31 23:59:59, 2049-12-31 23:59:59, 2050-01-01
+        for epoch in [-631152000, -1, 2524607999, 2524608000]:
+            assert utils.asn1_to_epoch(utils.epoch_to_asn1(epoch)) == epoch
+        assert utils.epoch_to_asn1(-631152000) == '500101000000Z'
+        assert utils.epoch_to_asn1(2524607999) == '491231235959Z'
+
+    def test_undefined_input(self):
+        assert utils.epoch_to_asn1(None) is None
+
+
+class test_cert_shard:
+    def test_shard(self):
+        assert utils.cert_shard('0A') == 'd4'
+        assert utils.cert_shard('0a') == 'd4'
+        assert len(utils.cert_shard('FFFF')) == utils.SHARD_WIDTH
+
+
+class test_cert_path:
+    def setUp(self):
+        os.makedirs('{0}/d4'.format(CERTS_DIR))
+
+    def tearDown(self):
+        shutil.rmtree(CERTS_DIR)
+
+    def test_flat(self):
+        assert utils.cert_path(CERTS_DIR, '0a', sharded=False) == \
+            '{0}/0A.pem'.format(CERTS_DIR)
+
+    def test_sharded(self):
+        assert utils.cert_path(CERTS_DIR, '0a', sharded=True) == \
+            '{0}/d4/0A.pem'.format(CERTS_DIR)
+
+    def test_detect(self):
+        assert utils.cert_path(CERTS_DIR, '0A') == \
+            '{0}/0A.pem'.format(CERTS_DIR)
+        open('{0}/d4/0A.pem'.format(CERTS_DIR), 'w').write('crt')
+        assert utils.cert_path(CERTS_DIR, '0A') == \
+            '{0}/d4/0A.pem'.format(CERTS_DIR)
+
+
+class test_shard_certs:
+    def setUp(self):
+        os.makedirs(CERTS_DIR)
+        self.serials = ['{0:02X}'.format(serial) for serial in range(1, 65)]
+        for serial in self.serials:
+            open('{0}/{1}.pem'.format(CERTS_DIR, serial), 'w').write(serial)
+        open('{0}/test-autosign.pem'.format(CERTS_DIR), 'w').write('ca')
+        open('{0}/Root.pem'.format(CERTS_DIR), 'w').write('ca')
+
+    def tearDown(self):
+        shutil.rmtree(CERTS_DIR)
+
+    def test_shard(self):
+        assert utils.shard_certs(CERTS_DIR) == len(self.serials)
+        assert len(utils.cert_files_flat(CERTS_DIR)) == 1
+        assert len(utils.cert_files(CERTS_DIR)) == len(self.serials) + 1
+        for serial in self.serials:
+            crt = utils.cert_path(CERTS_DIR, serial)
+            assert crt == utils.cert_path(CERTS_DIR, serial, sharded=True)
+            assert open(crt).read() == serial
+        assert os.path.exists('{0}/test-autosign.pem'.format(CERTS_DIR))
+
+    def test_shard_new_certificate(self):
+        utils.shard_certs(CERTS_DIR)
+        open('{0}/FF.pem'.format(CERTS_DIR), 'w').write('FF')
+        assert utils.shard_certs(CERTS_DIR) == 1
+        assert os.path.exists(utils.cert_path(CERTS_DIR, 'FF', sharded=True))
+
+    def test_unshard(self):
+        utils.shard_certs(CERTS_DIR)
+        assert utils.shard_certs(CERTS_DIR, sharded=False) == \
+            len(self.serials)
+        assert len(utils.cert_files_sharded(CERTS_DIR)) == 0
+        assert sorted(os.listdir(CERTS_DIR)) == sorted(
+            ['{0}.pem'.format(serial) for serial in self.serials] +
+            ['Root.pem', 'test-autosign.pem']
+        )
+
+
 class test_gentoken:
     def test_generates_token(self):
         assert len(utils.gentoken()) == 64
@@ -148,3 +404,118 @@ class test_mkstemp:
 
     def test_nonexisting_prefix(self):
         assert utils.mkstemp(prefix='/nonexisting/') is False
+
+
+class test_OpenSSLCoprocess:
+    def setUp(self):
+        write_fake_openssl()
+        self.proc = utils.OpenSSLCoprocess(binary=FAKE_OPENSSL, timeout=5)
+
+    def tearDown(self):
+        self.proc.stop()
+        shutil.rmtree(FAKE_DIR)
+
+    def test_execute(self):
+        assert self.proc.start() is True
+        output = self.proc.execute(['x509', '-in', '/some.pem', '-noout'])
+        assert output == 'x509 -in /some.pem -noout\n'
+        assert self.proc.commands == 1
+
+    def test_check(self):
+        assert self.proc.start() is True
+        assert self.proc.check() is True
+
+    def test_timeout(self):
+        assert self.proc.start() is True
+        assert self.proc.execute(['sleep', '2'], timeout=0.2) is None
+        assert self.proc.alive() is False
+
+    def test_crash(self):
+        assert self.proc.start() is True
+        assert self.proc.execute(['exit']) is None
+        assert self.proc.alive() is False
+        assert self.proc.execute(['version']) is None
+
+    def test_no_interactive_mode(self):
+        proc = utils.OpenSSLCoprocess(binary='true', timeout=5)
+        assert proc.start() is False
+
+    def test_nonexisting_binary(self):
+        proc = utils.OpenSSLCoprocess(binary='somerandomunknownfilename')
+        assert proc.start() is False
+
+
+class test_OpenSSLPool:
+    def setUp(self):
+        write_fake_openssl()
+        self.pool = utils.OpenSSLPool(size=2, binary=FAKE_OPENSSL, timeout=5)
+
+    def tearDown(self):
+        utils.OPENSSL_POOL = None
+        self.pool.close()
+        shutil.rmtree(FAKE_DIR)
+
+    def test_start(self):
+        assert self.pool.start() is True
+        assert len(self.pool) == 1
+
+    def test_unsupported(self):
+        pool = utils.OpenSSLPool(binary='true')
+        assert pool.start() is False
+        assert pool.usable(['openssl', 'x509', '-in', '/a.pem',
+                            '-noout']) is False
+
+    def test_usable(self):
+        self.pool.start()
+        assert self.pool.usable(shlex.split(
+            'openssl x509 -in /a.pem -noout -subject')) is True
+        assert self.pool.usable(shlex.split(
+            '/usr/bin/openssl req -in /a.csr -noout -subject')) is True
+
+    def test_not_usable(self):
+        self.pool.start()
+        for cmdline in [
+                'uname -s -r -v',
+                'openssl ca -in /a.csr -noout -batch',
+                'openssl x509 -in /a.pem -out /b.pem',
+                'openssl x509 -in a.pem -noout -subject',
+                'openssl x509 -noout -subject -in',
+                'openssl req -new -in /a.csr -noout',
+                'openssl x509 -in /a.pem -noout -passin pass:x',
+                'openssl x509 -in "/some dir/a.pem" -noout']:
+            assert self.pool.usable(shlex.split(cmdline)) is False
+
+    def test_execute(self):
+        self.pool.start()
+        output = self.pool.execute(['x509', '-in', '/a.pem', '-noout'])
+        assert output == 'x509 -in /a.pem -noout\n'
+        assert self.pool.stats['commands'] == 1
+
+    def test_restart_after_crash(self):
+        self.pool.start()
+        assert self.pool.execute(['exit']) is None
+        assert self.pool.stats['failures'] == 1
+        assert len(self.pool) == 0
+        assert self.pool.execute(['version']) == 'version\n'
+        assert self.pool.stats['started'] == 2
+
+    def test_max_commands(self):
+        self.pool.max_commands = 2
+        self.pool.start()
+        for _ in range(3):
+            assert self.pool.execute(['version']) == 'version\n'
+        assert self.pool.stats['started'] == 2
+
+    def test_health_check(self):
+        self.pool.check_interval = 0
+        self.pool.start()
+        assert self.pool.execute(['version']) == 'version\n'
+        assert self.pool.stats['started'] == 1
+
+    def test_run_uses_pool(self):
+        self.pool.start()
+        utils.OPENSSL_POOL = self.pool
+        output = utils.run('openssl x509 -in /a.pem -noout -serial')
+        assert output == 'x509 -in /a.pem -noout -serial\n'
+        assert utils.run('uname -s').strip() == os.uname()[0]
+        assert self.pool.stats['commands'] == 1
@@ -6,15 +6,62 @@
 .. moduleauthor:: Lex van Roon <r3boot@r3blog.nl>
 """
 
+import glob
 import hashlib
 import os
 import random
+import select
+import selectors
 import shlex
+import signal
 import subprocess
+import threading
 import time
 
+import pkilib.log as log
+
 C_OSNAME = os.uname()[0]
 
+# Default number of child processes which run() may have running at once
+EXEC_MAX_PROCESSES = 16
+
+# Default number of seconds a command run by run() may take. When set to
+# None, commands are allowed to run forever
+EXEC_TIMEOUT = None
+
+# Commands for which the first argument is part of the name used in stats
+EXEC_SUBCOMMANDS = ['openssl']
+
+# Start children using posix_spawn if available, which avoids copying the
+# page tables of a large parent process like fork does
+HAS_POSIX_SPAWN = hasattr(os, 'posix_spawnp')
+
+# Global variable containing the pool of openssl coprocesses used by run().
+# Every openssl command is run in a new process when this is None
+OPENSSL_POOL = None
+
+# Prompt printed by openssl in interactive mode when it waits for a command
+OPENSSL_PROMPT = b'OpenSSL> '
+
+# Default number of seconds a coprocess may spend on a single command
+COPROCESS_TIMEOUT = 30
+
+# Default number of commands after which a coprocess is replaced
+COPROCESS_MAX_COMMANDS = 1000
+
+# Default number of idle seconds after which a coprocess is health checked
+COPROCESS_CHECK_INTERVAL = 60
+
+# openssl commands which can be sent to a coprocess
+COPROCESS_COMMANDS = ['x509', 'req', 'crl']
+
+# Number of days in every month of a non-leap year, indexed by month
+_DAYS_IN_MONTH = [0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+
+# Number of hexadecimal digits of the hash of a serial which are used as the
+# name of its subdirectory in a sharded certificate directory
+SHARD_WIDTH = 2
+
 
 def fpath(name, isdir=False):
     """Helper function which converts a unix path to a vms path, but only
@@ -99,10 +146,11 @@ def fhost(name):
     return name.replace('.', '_')
 
 
-def run(cmd, stdout=False):
-    """Helper function around subprocess.Popen which can run commands. This
-    uses the PATH environment variable used in your shell, so you can choose
-    between specifying full or relative commands.
+def run(cmd, stdout=False, timeout=None):
+    """Helper function which runs commands using the global CommandExecutor.
+    This uses the PATH environment variable used in your shell, so you can
+    choose between specifying full or relative commands. A command which
+    takes longer than timeout seconds is killed.
 
     >>> output = run('uname -s')
     >>> output
@@ -113,6 +161,9 @@ def run(cmd, stdout=False):
     :param cmd:     Command and parameters to run
     :type  cmd:     str
     :param stdout:  When set to true, display stdout instead of capturing it
+    :param timeout: Number of seconds the command may take, defaults to the
+                    timeout of the executor
+    :type  timeout: float
     :returns:       Output of command if stdout=False, else None
     :rtype:         str, None
     """
@@ -126,19 +177,641 @@ def run(cmd, stdout=False):
     else:
         return None
 
-    output = None
-    if stdout:
-        proc = subprocess.Popen(cmd)
-        proc.wait()
-    else:
+    # Inspection commands are sent to a long-lived openssl if possible
+    pool = OPENSSL_POOL
+    if not stdout and pool is not None and pool.usable(cmd):
+        return pool.execute(cmd[1:])
+
+    result = EXECUTOR.execute(cmd, capture=not stdout, timeout=timeout)
+    if stdout or result is None:
+        return None
+    return result[1].decode('utf-8')
+
+
+class SpawnedProcess(object):
+    """Class representing a child process started using posix_spawn. It
+    offers the parts of the subprocess.Popen interface used by
+    CommandExecutor. When capture is set, stdin is read from /dev/null and
+    stdout and stderr are available as pipes:
+
+    >>> proc = SpawnedProcess(['uname', '-s'])
+    >>> proc.stdout.read()
+    b'Linux\n'
+    >>> proc.wait()
+    0
+
+    :param cmd:     Command and parameters to run
+    :type  cmd:     list
+    :param capture: Capture the output of the command
+    :type  capture: bool
+    """
+    def __init__(self, cmd, capture=True):
+        self.args = cmd
+        self.returncode = None
+        self.stdout = None
+        self.stderr = None
+
+        actions = []
+        fds = []
+        if capture:
+            out_r, out_w = os.pipe()
+            err_r, err_w = os.pipe()
+            fds = [out_r, out_w, err_r, err_w]
+            actions = [
+                (os.POSIX_SPAWN_OPEN, 0, os.devnull, os.O_RDONLY, 0),
+                (os.POSIX_SPAWN_DUP2, out_w, 1),
+                (os.POSIX_SPAWN_DUP2, err_w, 2),
+            ]
+
+        try:
+            self.pid = os.posix_spawnp(cmd[0], cmd, os.environ,
+                                       file_actions=actions)
+        except EnvironmentError:
+            for fdesc in fds:
+                os.close(fdesc)
+            raise
+
+        if capture:
+            os.close(out_w)
+            os.close(err_w)
+            self.stdout = os.fdopen(out_r, 'rb', 0)
+            self.stderr = os.fdopen(err_r, 'rb', 0)
+
+    def _status(self, status):
+        if os.WIFSIGNALED(status):
+            self.returncode = -os.WTERMSIG(status)
+        else:
+            self.returncode = os.WEXITSTATUS(status)
+
+    def poll(self):
+        """Check if the child has exited without waiting for it
+
+        :returns:   The exit code of the child or None if it is running
+        :rtype:     int, None
+        """
+        if self.returncode is None:
+            pid, status = os.waitpid(self.pid, os.WNOHANG)
+            if pid != 0:
+                self._status(status)
+        return self.returncode
+
+    def wait(self, timeout=None):
+        """Wait for the child to exit. Like subprocess.Popen, this raises
+        subprocess.TimeoutExpired when the timeout passes before that.
+
+        :param timeout: Number of seconds to wait or None to wait forever
+        :type  timeout: float
+        :returns:       The exit code of the child
+        :rtype:         int
+        """
+        if self.returncode is not None:
+            return self.returncode
+        if timeout is None:
+            self._status(os.waitpid(self.pid, 0)[1])
+            return self.returncode
+
+        deadline = time.time() + timeout
+        delay = 0.0005
+        while self.poll() is None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(self.args, timeout)
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, 0.05)
+        return self.returncode
+
+    def kill(self):
+        """Kill the child using SIGKILL"""
+        if self.returncode is None:
+            try:
+                os.kill(self.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+
+class CommandExecutor(object):
+    """Class which runs commands as child processes. The output of a child
+    is read while it runs, so a child can never block on a full pipe. At
+    most max_processes children run at the same time; callers wait for a
+    free slot. A child which has not finished before its deadline is
+    killed. Timing statistics are kept for every command, which are
+    available in the stats attribute:
+
+    >>> executor = CommandExecutor(max_processes=4, timeout=10)
+    >>> executor.execute(['uname', '-s'])
+    (0, b'Linux\n', b'')
+    >>> executor.stats['uname']['count']
+    1
+
+    :param max_processes:   Maximum number of children running at once
+    :type  max_processes:   int
+    :param timeout:         Default number of seconds a command may take
+    :type  timeout:         float
+    :param posix_spawn:     Use posix_spawn to start children if available
+    :type  posix_spawn:     bool
+    """
+    def __init__(self, max_processes=EXEC_MAX_PROCESSES, timeout=EXEC_TIMEOUT,
+                 posix_spawn=True):
+        self.max_processes = max_processes
+        self.timeout = timeout
+        self.posix_spawn = posix_spawn and HAS_POSIX_SPAWN
+        self.running = 0
+        self.stats = {}
+        self._slots = threading.BoundedSemaphore(max_processes)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def command_name(cmd):
+        """Determine the name under which statistics for a command are
+        kept. This is the name of the binary, followed by the subcommand for
+        binaries listed in EXEC_SUBCOMMANDS:
+
+        >>> CommandExecutor.command_name(['/usr/bin/openssl', 'req', '-new'])
+        'openssl req'
+
+        :param cmd: Command and parameters
+        :type  cmd: list
+        :returns:   Name of the command
+        :rtype:     str
+        """
+        name = os.path.basename(cmd[0])
+        if name in EXEC_SUBCOMMANDS and len(cmd) > 1:
+            name = '{0} {1}'.format(name, cmd[1])
+        return name
+
+    def _spawn(self, cmd, capture):
+        if self.posix_spawn:
+            return SpawnedProcess(cmd, capture=capture)
+        if not capture:
+            return subprocess.Popen(cmd)
+        return subprocess.Popen(cmd, stdin=subprocess.DEVNULL,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+
+    def _collect(self, proc, deadline):
+        """Read stdout and stderr of a child until both are closed. This
+        will return None if the deadline passes before that.
+
+        :param proc:        Child process
+        :type  proc:        SpawnedProcess, subprocess.Popen
+        :param deadline:    Time before which the output has to be read
+        :type  deadline:    float, None
+        :returns:           Tuple containing stdout and stderr or None
+        :rtype:             tuple, None
+        """
+        output = {proc.stdout.fileno(): [], proc.stderr.fileno(): []}
+        selector = selectors.DefaultSelector()
+        for fdesc in output:
+            selector.register(fdesc, selectors.EVENT_READ)
+        try:
+            while selector.get_map():
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return None
+                for key, event in selector.select(remaining):
+                    chunk = os.read(key.fd, 65536)
+                    if chunk:
+                        output[key.fd].append(chunk)
+                    else:
+                        selector.unregister(key.fd)
+        finally:
+            selector.close()
+        return (b''.join(output[proc.stdout.fileno()]),
+                b''.join(output[proc.stderr.fileno()]))
+
+    def _run(self, cmd, capture, deadline):
+        """Start a child and wait until it exits or the deadline passes
+
+        :returns:   Tuple containing the result of the command and a string
+                    describing the outcome, which is either ok, failure or
+                    timeout
+        :rtype:     tuple
+        """
+        try:
+            proc = self._spawn(cmd, capture)
+        except EnvironmentError as err:
+            log.warning('Failed to run {0}: {1}'.format(cmd[0], err))
+            return None, 'failure'
+
+        output = (None, None)
+        try:
+            if capture:
+                output = self._collect(proc, deadline)
+            if output is not None:
+                remaining = None
+                if deadline is not None:
+                    remaining = max(deadline - time.time(), 0)
+                proc.wait(timeout=remaining)
+        except subprocess.TimeoutExpired:
+            output = None
+        finally:
+            if output is None:
+                proc.kill()
+                proc.wait()
+            if capture:
+                proc.stdout.close()
+                proc.stderr.close()
+
+        if output is None:
+            log.warning('{0} did not finish in time, killed pid {1}'.format(
+                cmd[0], proc.pid
+            ))
+            return None, 'timeout'
+        result = (proc.returncode, output[0], output[1])
+        if proc.returncode != 0:
+            return result, 'failure'
+        return result, 'ok'
+
+    def _record(self, name, outcome, duration, queued):
+        with self._lock:
+            stats = self.stats.setdefault(name, {
+                'count': 0, 'failures': 0, 'timeouts': 0,
+                'total': 0.0, 'max': 0.0, 'queued': 0.0,
+            })
+            stats['count'] += 1
+            if outcome == 'failure':
+                stats['failures'] += 1
+            elif outcome == 'timeout':
+                stats['timeouts'] += 1
+            stats['total'] += duration
+            stats['max'] = max(stats['max'], duration)
+            stats['queued'] += queued
+
+    def execute(self, cmd, capture=True, timeout=None):
+        """Run a command and wait for it to finish. When capturing output,
+        stdin of the child is read from /dev/null, else the child shares
+        stdin, stdout and stderr with the caller. The deadline includes the
+        time spent waiting for a free slot.
+
+        :param cmd:     Command and parameters to run
+        :type  cmd:     list
+        :param capture: Capture stdout and stderr of the command
+        :type  capture: bool
+        :param timeout: Number of seconds the command may take, overrides
+                        the default timeout of the executor
+        :type  timeout: float
+        :returns:       Tuple containing the exit code, stdout and stderr, or
+                        None if the command failed to start or timed out
+        :rtype:         tuple, None
+        """
+        if timeout is None:
+            timeout = self.timeout
+        name = self.command_name(cmd)
+        started = time.time()
+        deadline = None
+        if timeout is not None:
+            deadline = started + timeout
+
+        if not self._slots.acquire(timeout=timeout):
+            log.warning('No free slot to run {0}'.format(cmd[0]))
+            self._record(name, 'timeout', time.time() - started,
+                         time.time() - started)
+            return None
+        queued = time.time() - started
+        with self._lock:
+            self.running += 1
+        try:
+            result, outcome = self._run(cmd, capture, deadline)
+        finally:
+            with self._lock:
+                self.running -= 1
+            self._slots.release()
+        self._record(name, outcome, time.time() - started, queued)
+        return result
+
+
+# Global executor used by run() to start all child processes
+EXECUTOR = CommandExecutor()
+
+
+class OpenSSLCoprocess(object):
+    """Class wrapping a single openssl binary running in interactive mode.
+    A command is written to stdin, after which the output is read up to the
+    next prompt. Like run(), only stdout is returned. Declare a new instance
+    as follows:
+
+    >>> proc = OpenSSLCoprocess()
+    >>> proc.start()
+    True
+    >>> proc.execute(['x509', '-in', '/tmp/host.pem', '-noout', '-serial'])
+    'serial=01\n'
+
+    :param binary:  Path to the openssl binary
+    :type  binary:  str
+    :param timeout: Number of seconds a single command may take
+    :type  timeout: float
+    """
+    def __init__(self, binary='openssl', timeout=COPROCESS_TIMEOUT):
+        self.binary = binary
+        self.timeout = timeout
+        self.commands = 0
+        self.last_used = 0
+        self._proc = None
+
+    def start(self):
+        """Start the openssl binary and wait for its first prompt. This will
+        return False if openssl cannot be started or if it does not support
+        interactive mode, which was removed in OpenSSL 3.0
+
+        :returns:   True if the coprocess is ready, else False
+        :rtype:     bool
+        """
+        try:
+            self._proc = subprocess.Popen([self.binary],
+                                          stdin=subprocess.PIPE,
+                                          stdout=subprocess.PIPE,
+                                          stderr=subprocess.DEVNULL)
+        except EnvironmentError as err:
+            log.warning('Failed to start {0}: {1}'.format(self.binary, err))
+            self._proc = None
+            return False
+
+        if self._read(time.time() + self.timeout) is None:
+            self.stop()
+            return False
+        self.commands = 0
+        self.last_used = time.time()
+        return True
+
+    def alive(self):
+        """Check if the openssl binary is still running
+
+        :returns:   True if the coprocess is running, else False
+        :rtype:     bool
+        """
+        return self._proc is not None and self._proc.poll() is None
+
+    def _read(self, deadline):
+        """Read the output of openssl up to the next prompt. This will return
+        None if the deadline passes or openssl exits before that.
+
+        :param deadline:    Time before which the prompt has to be read
+        :type  deadline:    float
+        :returns:           The output before the prompt or None
+        :rtype:             bytes, None
+        """
+        fdesc = self._proc.stdout.fileno()
+        chunks = []
+        tail = b''
+        while not tail.endswith(OPENSSL_PROMPT):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            if not select.select([fdesc], [], [], remaining)[0]:
+                return None
+            chunk = os.read(fdesc, 65536)
+            if not chunk:
+                return None
+            chunks.append(chunk)
+            tail = (tail + chunk)[-len(OPENSSL_PROMPT):]
+        return b''.join(chunks)[:-len(OPENSSL_PROMPT)]
+
+    def execute(self, args, timeout=None):
+        """Run a single openssl command. If the command does not finish in
+        time or openssl crashes, the coprocess is stopped and None is
+        returned.
+
+        :param args:    List containing the command and its arguments
+        :type  args:    list
+        :param timeout: Number of seconds the command may take
+        :type  timeout: float
+        :returns:       Output of the command or None
+        :rtype:         str, None
+        """
+        if not self.alive():
+            return None
+
+        try:
+            self._proc.stdin.write('{0}\n'.format(' '.join(args)).encode())
+            self._proc.stdin.flush()
+        except EnvironmentError:
+            self.stop()
+            return None
+
+        output = self._read(time.time() + (timeout or self.timeout))
+        if output is None:
+            self.stop()
+            return None
+        self.commands += 1
+        self.last_used = time.time()
+        return output.decode('utf-8')
+
+    def check(self):
+        """Perform a health check by asking openssl for its version
+
+        :returns:   True if openssl answered, else False
+        :rtype:     bool
+        """
+        output = self.execute(['version'])
+        return output is not None and len(output.strip()) > 0
+
+    def stop(self):
+        """Stop the openssl binary
+        """
+        if self._proc is None:
+            return
         try:
-            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE)
+            self._proc.kill()
         except EnvironmentError:
+            pass
+        self._proc.wait()
+        self._proc.stdin.close()
+        self._proc.stdout.close()
+        self._proc = None
+
+
+class OpenSSLPool(object):
+    """Class managing a pool of OpenSSLCoprocess instances, which lets
+    inspection commands skip the fork/exec and library initialization of a
+    new openssl binary. Coprocesses are started on demand, health checked
+    when they were idle for a while, and replaced when they crash, time out
+    or ran max_commands commands. Declare a new instance as follows:
+
+    >>> pool = OpenSSLPool(size=4)
+    >>> pool.start()
+    True
+    >>> pkilib.utils.OPENSSL_POOL = pool
+
+    :param size:            Maximum number of coprocesses
+    :type  size:            int
+    :param binary:          Path to the openssl binary
+    :type  binary:          str
+    :param timeout:         Number of seconds a single command may take
+    :type  timeout:         float
+    :param max_commands:    Number of commands after which a coprocess is
+                            replaced
+    :type  max_commands:    int
+    :param check_interval:  Number of idle seconds after which a coprocess
+                            is health checked before it is used
+    :type  check_interval:  float
+    """
+    def __init__(self, size=2, binary='openssl', timeout=COPROCESS_TIMEOUT,
+                 max_commands=COPROCESS_MAX_COMMANDS,
+                 check_interval=COPROCESS_CHECK_INTERVAL):
+        self.size = size
+        self.binary = binary
+        self.timeout = timeout
+        self.max_commands = max_commands
+        self.check_interval = check_interval
+        self.supported = False
+        self.stats = {'commands': 0, 'started': 0, 'failures': 0}
+        self._idle = []
+        self._running = 0
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return self._running
+
+    def _spawn(self):
+        """Start a new coprocess
+
+        :returns:   The new coprocess or None
+        :rtype:     OpenSSLCoprocess, None
+        """
+        proc = OpenSSLCoprocess(binary=self.binary, timeout=self.timeout)
+        if not proc.start():
+            return None
+        with self._cond:
+            self.stats['started'] += 1
+        return proc
+
+    def start(self):
+        """Start the first coprocess, which also checks if the openssl binary
+        supports interactive mode. The pool is not used if this fails.
+
+        :returns:   True if the pool can be used, else False
+        :rtype:     bool
+        """
+        proc = self._spawn()
+        if proc is None:
+            log.warning('{0} does not support interactive mode'.format(
+                self.binary
+            ))
+            self.supported = False
+            return False
+        with self._cond:
+            self._idle.append(proc)
+            self._running += 1
+        self.supported = True
+        return True
+
+    def usable(self, cmd):
+        """Check if a command can be sent to a coprocess. Only inspection
+        commands reading an absolute path with -in qualify, since the
+        coprocess reads its commands from stdin and does not share the
+        current directory of the caller. Arguments containing whitespace or
+        quotes are not supported by interactive mode.
+
+        :param cmd: List containing the command and its arguments
+        :type  cmd: list
+        :returns:   True if the command can be sent to a coprocess
+        :rtype:     bool
+        """
+        if not self.supported or len(cmd) < 4:
+            return False
+        if os.path.basename(cmd[0]) != 'openssl':
+            return False
+        if cmd[1] not in COPROCESS_COMMANDS or '-noout' not in cmd:
+            return False
+        if '-in' not in cmd[:-1] or \
+                not os.path.isabs(cmd[cmd.index('-in') + 1]):
+            return False
+        for arg in cmd:
+            if arg.startswith('-pass') or arg == '-new':
+                return False
+            for char in ' \t\n\'"':
+                if char in arg:
+                    return False
+        return True
+
+    def _acquire(self):
+        """Get an idle coprocess, or start a new one if the pool is not full
+
+        :returns:   A coprocess or None
+        :rtype:     OpenSSLCoprocess, None
+        """
+        with self._cond:
+            while not self._idle and self._running >= self.size:
+                self._cond.wait()
+            proc = None
+            if self._idle:
+                proc = self._idle.pop()
+            else:
+                self._running += 1
+
+        if proc is not None:
+            idle = time.time() - proc.last_used
+            if idle < self.check_interval or proc.check():
+                return proc
+            log.warning('openssl coprocess failed its health check')
+            proc.stop()
+
+        proc = self._spawn()
+        if proc is None:
+            with self._cond:
+                self._running -= 1
+                self.stats['failures'] += 1
+                self._cond.notify()
+        return proc
+
+    def _release(self, proc):
+        """Return a coprocess to the pool, or stop it if it crashed or has
+        run too many commands
+
+        :param proc:    Coprocess to return
+        :type  proc:    OpenSSLCoprocess
+        """
+        if proc.alive() and proc.commands < self.max_commands:
+            with self._cond:
+                self._idle.append(proc)
+                self._cond.notify()
+            return
+        proc.stop()
+        with self._cond:
+            self._running -= 1
+            self._cond.notify()
+
+    def execute(self, args, timeout=None):
+        """Run an openssl command on one of the coprocesses. A coprocess which
+        times out or crashes is replaced on the next call. This will return
+        None if the command failed.
+
+        :param args:    List containing the command and its arguments
+        :type  args:    list
+        :param timeout: Number of seconds the command may take
+        :type  timeout: float
+        :returns:       Output of the command or None
+        :rtype:         str, None
+        """
+        proc = self._acquire()
+        if proc is None:
             return None
-        proc.wait()
-        output = proc.communicate()[0].decode('utf-8')
-    return output
+        try:
+            output = proc.execute(args, timeout=timeout)
+        finally:
+            self._release(proc)
+
+        with self._cond:
+            if output is None:
+                self.stats['failures'] += 1
+            else:
+                self.stats['commands'] += 1
+        if output is None:
+            log.warning('openssl coprocess failed to run {0}'.format(args[0]))
+        return output
+
+    def close(self):
+        """Stop all idle coprocesses and stop using the pool
+        """
+        self.supported = False
+        with self._cond:
+            idle = self._idle
+            self._idle = []
+            self._running -= len(idle)
+        for proc in idle:
+            proc.stop()
 
 
 def gen_enddate(days):
@@ -161,6 +834,209 @@ def gen_enddate(days):
     return time.strftime('%Y%m%d%H%M%SZ', future_date)
 
 
+def asn1_to_epoch(asn1_time):
+    """Utility function which converts a date in ASN.1 UTCTime format, as
+    used in the OpenSSL database, into seconds since the epoch. Dates in
+    GeneralizedTime format (using a four digit year) are also accepted. It
+    will return None if the date cannot be parsed.
+
+    >>> asn1_to_epoch('150720010135Z')
+    1437354095
+
+    :param asn1_time:   Date in YYMMDDHHMMSSZ or YYYYMMDDHHMMSSZ format
+    :type  asn1_time:   str
+    :returns:           Seconds since the epoch or None
+    :rtype:             int, None
+    """
+    if not isinstance(asn1_time, str):
+        return None
+    if not asn1_time.endswith('Z') or not asn1_time[:-1].isdigit():
+        return None
+
+    # Parsed by hand, since time.strptime is slow enough to dominate the
+    # parsing of large databases. Two digit years are in 1950-2049, like
+    # RFC 5280 and epoch_to_asn1 use
+    if len(asn1_time) == 13:
+        year = int(asn1_time[0:2])
+        year += 2000 if year < 50 else 1900
+        offset = 2
+    elif len(asn1_time) == 15:
+        year = int(asn1_time[0:4])
+        offset = 4
+    else:
+        return None
+
+    month = int(asn1_time[offset:offset + 2])
+    day = int(asn1_time[offset + 2:offset + 4])
+    hour = int(asn1_time[offset + 4:offset + 6])
+    minute = int(asn1_time[offset + 6:offset + 8])
+    second = int(asn1_time[offset + 8:offset + 10])
+    if not 1 <= month <= 12 or hour > 23 or minute > 59 or second > 61:
+        return None
+    leap = year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+    if not 1 <= day <= _DAYS_IN_MONTH[month] + (leap and month == 2):
+        return None
+
+    # Number of days since the epoch in the proleptic Gregorian calendar
+    if month <= 2:
+        year -= 1
+        month += 9
+    else:
+        month -= 3
+    era = year // 400
+    yoe = year - era * 400
+    doy = (153 * month + 2) // 5 + day - 1
+    days = era * 146097 + yoe * 365 + yoe // 4 - yoe // 100 + doy - 719468
+    return days * 86400 + hour * 3600 + minute * 60 + second
+
+
+def epoch_to_asn1(epoch):
+    """Utility function which converts seconds since the epoch into a date
+    in the format used by the OpenSSL database. Like OpenSSL, UTCTime is
+    used for dates before 2050 and GeneralizedTime for later dates.
+
+    >>> epoch_to_asn1(1437354095)
+    '150720010135Z'
+
+    :param epoch:   Seconds since the epoch
+    :type  epoch:   int
+    :returns:       Date in YYMMDDHHMMSSZ or YYYYMMDDHHMMSSZ format or None
+    :rtype:         str, None
+    """
+    if not isinstance(epoch, int):
+        return None
+    date = time.gmtime(epoch)
+    if 1950 <= date.tm_year < 2050:
+        return time.strftime('%y%m%d%H%M%SZ', date)
+    return time.strftime('%Y%m%d%H%M%SZ', date)
+
+
+def cert_shard(serial):
+    """Utility function which determines the subdirectory of a certificate
+    in a sharded certificate directory, based on the SHA1 hash of its serial
+
+    >>> cert_shard('0A')
+    'd4'
+
+    :param serial:  Serial of the certificate in hexadecimal notation
+    :type  serial:  str
+    :returns:       Name of the subdirectory
+    :rtype:         str
+    """
+    digest = hashlib.sha1(serial.upper().encode('utf-8')).hexdigest()
+    return digest[:SHARD_WIDTH]
+
+
+def cert_path(certsdir, serial, sharded=None):
+    """Utility function which determines the path of the certificate with
+    the given serial. If sharded is not given, the path within a sharded
+    directory is returned if it exists, else the path in a flat directory.
+
+    >>> cert_path('/path/to/certs', '0A', sharded=True)
+    '/path/to/certs/d4/0A.pem'
+
+    :param certsdir:    Directory containing the certificates
+    :type  certsdir:    str
+    :param serial:      Serial of the certificate in hexadecimal notation
+    :type  serial:      str
+    :param sharded:     Use the sharded or flat layout
+    :type  sharded:     bool
+    :returns:           Path to the certificate
+    :rtype:             str
+    """
+    serial = serial.upper()
+    shard = '{0}/{1}/{2}.pem'.format(certsdir, cert_shard(serial), serial)
+    if sharded is None:
+        sharded = os.path.exists(shard)
+    if sharded:
+        return shard
+    return '{0}/{1}.pem'.format(certsdir, serial)
+
+
+def cert_files(certsdir):
+    """Utility function which lists the certificates issued by a CA, in both
+    the flat and the sharded layout of the certificate directory
+
+    :param certsdir:    Directory containing the certificates
+    :type  certsdir:    str
+    :returns:           List containing the paths to the certificates
+    :rtype:             list
+    """
+    return cert_files_flat(certsdir) + cert_files_sharded(certsdir)
+
+
+def cert_files_flat(certsdir):
+    """Utility function which lists the certificates in the top level of a
+    certificate directory
+
+    :param certsdir:    Directory containing the certificates
+    :type  certsdir:    str
+    :returns:           List containing the paths to the certificates
+    :rtype:             list
+    """
+    return glob.glob('{0}/[0-9A-Z]*.pem'.format(certsdir))
+
+
+def cert_files_sharded(certsdir):
+    """Utility function which lists the certificates in the subdirectories
+    of a sharded certificate directory
+
+    :param certsdir:    Directory containing the certificates
+    :type  certsdir:    str
+    :returns:           List containing the paths to the certificates
+    :rtype:             list
+    """
+    shards = '[0-9a-f]' * SHARD_WIDTH
+    return glob.glob('{0}/{1}/[0-9A-Z]*.pem'.format(certsdir, shards))
+
+
+def shard_certs(certsdir, sharded=True):
+    """Utility function which moves the certificates issued by a CA into the
+    sharded or the flat layout. Files which are not named after a serial
+    are left alone, and so are certificates which are moved concurrently.
+    Only the top level is listed when sharding, so this is cheap enough to
+    run after every certificate openssl ca writes into the top level.
+
+    >>> shard_certs('/path/to/certs')
+    1234
+
+    :param certsdir:    Directory containing the certificates
+    :type  certsdir:    str
+    :param sharded:     Move the certificates into the sharded layout
+    :type  sharded:     bool
+    :returns:           Number of moved certificates
+    :rtype:             int
+    """
+    if sharded:
+        certs = cert_files_flat(certsdir)
+    else:
+        certs = cert_files_sharded(certsdir)
+
+    moved = 0
+    for crt in certs:
+        serial = os.path.basename(crt)[:-4]
+        try:
+            int(serial, 16)
+        except ValueError:
+            continue
+        dest = cert_path(certsdir, serial, sharded=sharded)
+        try:
+            if not os.path.exists(os.path.dirname(dest)):
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+            os.rename(crt, dest)
+        except OSError as err:
+            log.warning('Failed to move {0}: {1}'.format(crt, err))
+            continue
+        moved += 1
+
+    if not sharded:
+        shards = '[0-9a-f]' * SHARD_WIDTH
+        for shard in glob.glob('{0}/{1}'.format(certsdir, shards)):
+            if os.path.isdir(shard) and not os.listdir(shard):
+                os.rmdir(shard)
+    return moved
+
+
 def gentoken():
     """Utility function which generates a token based on a sha256 hash of
     a random value.